@@ -22,6 +22,11 @@
 from grammar_parser.bootstrap import AstNode, ListNode
 from grammar_parser.gparser import MagicTerminal
 
+def path_key(path):
+    """Returns a hashable key for a path, comparing its elements by kind and
+    name like `AstAnalyser.paths_eq`."""
+    return tuple([(p.kind, p.name) for p in path])
+
 class URI(object):
     def __init__(self):
         self.kind = ""
@@ -53,7 +58,30 @@ class Reference(object):
     def __repr__(self):
         return "Ref(%s/%s)" % (self.kind, self.name)
 
+class ScopeEntry(object):
+    """The URIs found when a scope was last scanned."""
+    def __init__(self, astnode, path, uris, result):
+        self.astnode = astnode
+        self.path = path
+        self.uris = uris
+        self.result = result
+
 class AstAnalyser(object):
+    """Resolves the references of an AST using the rules of a namebinding
+    (.nb) file.
+
+    All definitions and references are stored as URIs in `data`. To resolve
+    names without searching through all URIs of a kind, they are also indexed
+    by (kind, path, name) in `table` and by path in `scope_names`.
+
+    Analysing a tree again only rescans scopes (i.e. subtrees of definitions
+    that scope other definitions) that contain changes, which are passed to
+    `analyse` as the set of parse nodes that changed since the last analysis.
+    URIs of unchanged scopes are taken from the previous analysis, and only
+    references that are either new or refer to names whose definitions were
+    added or removed are resolved again."""
+
+
     def __init__(self, filename):
         self.errors = {}
         self.scope = None
@@ -61,6 +89,7 @@ class AstAnalyser(object):
         self.d = {}
 
         self.data = {}
+        self.uris = []          # all URIs in the order they were added
         self.index = 0
 
         rootnode = self.load_nb_file(filename)
@@ -71,6 +100,14 @@ class AstAnalyser(object):
 
         self.processed_nodes = set()
 
+        self.table = {}         # (kind, path, name) -> first URI
+        self.scope_names = {}   # path -> URIs defined within that path
+        self.node_uris = {}     # id(name node) -> first URI
+        self.def_astnodes = set() # (kind, id(astnode)) of all definitions
+        self.scope_cache = {}   # parse node -> ScopeEntry
+        self.changed = None     # parse nodes changed since the last analysis
+        self.reused = set()     # ids of URIs taken from the scope cache
+
     def load_nb_file(self, filename):
         from jsonmanager import JsonManager
         from grammars.grammars import lang_dict
@@ -127,6 +164,7 @@ class AstAnalyser(object):
         if node is None:
             return
 
+        parsenode = node
         if hasattr(node, 'alternate') and node.alternate:
             node = node.alternate
 
@@ -139,54 +177,75 @@ class AstAnalyser(object):
             if id(node) in self.processed_nodes: # skip nodes that have been processed in parent
                 return
 
-            base = None
             nbrule = self.get_definition(node)
-            uris = []
-            _type = None
-            if nbrule:
+            if nbrule and nbrule.get_scopes() and parsenode is not node and self.new_cache is not None:
+                return self.scan_scope(parsenode, node, nbrule, path)
+            return self.scan_astnode(node, nbrule, path)
 
-                uri = URI()
-                if nbrule.is_reference():
-                    _type = "reference"
-                    uri = self.create_uri(node, nbrule, _type, list(path), path)
-                    uris.extend(uri)
-                    uri = uri[0]
+        else:
+            for c in node.children:
+                self.scan(c, path)
+            return
 
-                if nbrule.is_definition():
-                    _type = nbrule.get_definition()[0]
+    def scan_scope(self, parsenode, astnode, nbrule, path):
+        """Scans a scope, reusing the URIs of the last analysis if neither
+        the scope nor its path have changed since."""
+        key = path_key(path)
+        entry = self.scope_cache.get(parsenode)
+        if (entry is not None and entry.astnode is astnode and entry.path == key
+                and self.changed is not None and parsenode not in self.changed):
+            for uri in entry.uris:
+                uri.index = self.index
+                self.add_uri(uri)
+                self.reused.add(id(uri))
+            self.new_cache[parsenode] = entry
+            return entry.result
+        start = len(self.uris)
+        result = self.scan_astnode(astnode, nbrule, path)
+        self.new_cache[parsenode] = ScopeEntry(astnode, key, self.uris[start:], result)
+        return result
+
+    def scan_astnode(self, node, nbrule, path):
+        base = None
+        uris = []
+        _type = None
+        if nbrule:
 
-                    scoped_path = list(path)
-                    if scoped_path != [] and not self.scopes(scoped_path[-1], _type): #XXX should be while?
-                        # if last parent hasn't scope, delete from path
-                        scoped_path.pop(-1)
+            uri = URI()
+            if nbrule.is_reference():
+                _type = "reference"
+                uri = self.create_uri(node, nbrule, _type, list(path), path)
+                uris.extend(uri)
+                uri = uri[0]
 
-                    uri = self.create_uri(node, nbrule, _type, scoped_path, path)
-                    uris.extend(uri)
-                    uri = uri[0]
+            if nbrule.is_definition():
+                _type = nbrule.get_definition()[0]
 
-                path = list(path)
-                path.append(Reference(_type, uri.name, nbrule))
+                scoped_path = list(path)
+                if scoped_path != [] and not self.scopes(scoped_path[-1], _type): #XXX should be while?
+                    # if last parent hasn't scope, delete from path
+                    scoped_path.pop(-1)
 
-            # scan ASTNodes children
-            for c in node.children:
-                if node.children[c] is base:
-                    continue # don't scan base twice
-                self.scan(node.children[c], path)
+                uri = self.create_uri(node, nbrule, _type, scoped_path, path)
+                uris.extend(uri)
+                uri = uri[0]
 
-            # set index AFTER children have been scanned: XXX not correct. int x = x needs to be treated extra
-            uri = None
-            for uri in uris:
-                uri.index = self.index
-                self.data.setdefault(uri.kind, [])
-                self.data[uri.kind].append(uri)
-                self.index += 1
+            path = list(path)
+            path.append(Reference(_type, uri.name, nbrule))
 
-            return uri # only needed for base
+        # scan ASTNodes children
+        for c in node.children:
+            if node.children[c] is base:
+                continue # don't scan base twice
+            self.scan(node.children[c], path)
 
-        else:
-            for c in node.children:
-                self.scan(c, path)
-            return
+        # set index AFTER children have been scanned: XXX not correct. int x = x needs to be treated extra
+        uri = None
+        for uri in uris:
+            uri.index = self.index
+            self.add_uri(uri)
+
+        return uri # only needed for base
 
     def resolve_name(self, node, dotnames):
         tempnode = node
@@ -282,18 +341,64 @@ class AstAnalyser(object):
     def add_uri(self, uri):
         self.data.setdefault(uri.kind, [])
         self.data[uri.kind].append(uri)
+        self.uris.append(uri)
         self.index += 1
 
-    def analyse(self, node, parsers=None):
-        # scan
+        key = path_key(uri.path)
+        self.table.setdefault((uri.kind, key, uri.name), uri)
+        self.scope_names.setdefault(key, []).append(uri)
+        self.node_uris.setdefault(id(uri.node), uri)
+        self.def_astnodes.add((uri.kind, id(uri.astnode)))
+
+    def analyse(self, node, parsers=None, changed=None):
+        """Analyses the AST of `node`. If `changed` is given, it must contain
+        all parse nodes that changed since the previous analysis, which are
+        used to reanalyse only the scopes containing changes. Language boxes
+        (i.e. `parsers` being given) are always analysed from scratch."""
+        old_uris = self.uris if changed is not None else []
+        old_errors = self.errors
         self.errors = {}
         self.parsers = parsers
+        self.changed = changed
 
         self.data.clear()
+        self.uris = []
+        self.table = {}
+        self.scope_names = {}
+        self.node_uris = {}
+        self.def_astnodes = set()
+        self.reused = set()
         self.processed_nodes.clear()
         self.index = 0
+        # merging language boxes modifies the URIs of other analysers, so
+        # they can't be cached
+        self.new_cache = {} if not parsers else None
+        # scan
         self.scan(node, [])
-        self.analyse_refs()
+        self.scope_cache = self.new_cache or {}
+        self.new_cache = None
+        self.changed = None
+
+        if not self.reused:
+            self.analyse_refs()
+            return
+
+        # names whose definitions were added or removed
+        changed_names = set()
+        for uri in old_uris:
+            if uri.kind != "reference" and id(uri) not in self.reused:
+                changed_names.add(uri.name)
+        for uri in self.uris:
+            if uri.kind != "reference" and id(uri) not in self.reused:
+                changed_names.add(uri.name)
+        for reference in self.data.get("reference", []):
+            if (id(reference) in self.reused and reference.name not in changed_names
+                    and not (reference.path and isinstance(reference.path[0], URI))):
+                # still resolves to the same definition (or error)
+                if reference.node in old_errors:
+                    self.errors[reference.node] = old_errors[reference.node]
+                continue
+            self.find_reference(reference)
 
     def get_lboxanalyser(self, root):
         if not self.parsers:
@@ -342,15 +447,7 @@ class AstAnalyser(object):
         self.errors[reference.node] = "'%s' cannot be resolved to a variable." % (reference.name)
 
     def get_reference(self, kind, path, name):
-        if kind not in self.data:
-            return None
-        for candidate in self.data[kind]:
-            if candidate.name != name:
-                continue
-            if not self.paths_eq(candidate.path, path):
-                continue
-            return candidate
-        return None
+        return self.table.get((kind, path_key(path), name))
 
     def paths_eq(self, path1, path2):
         if len(path1) != len(path2):
@@ -410,41 +507,27 @@ class AstAnalyser(object):
                 # astnode must have a corresponding entry in self.data
                 if nbrule:
                     deftype = nbrule.get_deftype()
-                    if deftype in self.data:
-                        for e in self.data[deftype]:
-                            if e.astnode is astnode:
-                                return astnode
+                    if (deftype, id(astnode)) in self.def_astnodes:
+                        return astnode
             scope = scope.parent
 
     def find_uri_by_astnode(self, node):
-        for key in self.data:
-            for uri in self.data[key]:
-                if uri.node == node:
-                    return uri
-        return None
+        return self.node_uris.get(id(node))
 
     def get_reachable_names_by_path(self, path):
         names = []
         path = list(path)   # copy to not manipulate existing path
         while path != []:
-            for key in self.data:
-                if key in ["reference", "block"]: #XXX needs to be supplied by codecompletion rules
-                    continue
-                for uri in self.data[key]:
-                    if uri.path == path:
-                        names.append(uri)
+            names.extend(self.get_names_within_path(path))
             path.pop()
         return names
 
     def get_names_within_path(self, path):
         names = []
-        path = list(path)   # copy to not manipulate existing path
-        for key in self.data:
-            if key in ["reference", "block"]: #XXX needs to be supplied by codecompletion rules
+        for uri in self.scope_names.get(path_key(path), []):
+            if uri.kind in ["reference", "block"]: #XXX needs to be supplied by codecompletion rules
                 continue
-            for uri in self.data[key]:
-                if uri.path == path:
-                    names.append(uri)
+            names.append(uri)
         return names
 
 class RuleReader(object):
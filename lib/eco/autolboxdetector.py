@@ -1,7 +1,8 @@
 from grammars.grammars import lang_dict
-from incparser.astree import BOS, EOS, TextNode
+from incparser.astree import BOS, EOS, TextNode, MultiTextNode
 from grammar_parser.gparser import MagicTerminal, Terminal, Nonterminal, IndentationTerminal
 from incparser.syntaxtable import Shift, Reduce, Goto, Accept
+from time import time
 import config
 
 ws_tokens = ["<ws>", "<return>", "<slcomment>", "<mlcomment>"]
@@ -18,6 +19,40 @@ def get_lookup(la):
         lookup_symbol = Terminal(lookup_symbol.name)
     return lookup_symbol
 
+class Recognition(object):
+    """The possible ends found by a recogniser, together with all terminals
+    the lexer examined to find them."""
+
+    def __init__(self, lexer, start, last_nodes, ends):
+        self.lexer = lexer
+        self.ends = ends
+        self.terminals = []
+        remaining = set(n for n in last_nodes if n is not None)
+        for node in self.walk(start):
+            self.terminals.append((node, node.symbol.name, node.version))
+            remaining.discard(node)
+            if not remaining:
+                break
+
+    def walk(self, node):
+        """Visits the terminals in the same order as the lexer."""
+        if type(node) is MultiTextNode:
+            node = node.children[0]
+        while True:
+            yield node
+            if type(node) is EOS:
+                return
+            node = self.lexer.next_node(node)
+
+    def is_valid(self):
+        """Checks that none of the terminals have changed since."""
+        walk = self.walk(self.terminals[0][0])
+        for node, name, version in self.terminals:
+            current = next(walk, None)
+            if current is not node or node.symbol.name != name or node.version != version:
+                return False
+        return True
+
 class NewAutoLboxDetector(object):
     """Automatic languagebox detector that runs during parsing when an error
     occurs. Similar to error recovery it uses the current parse stack to
@@ -29,6 +64,13 @@ class NewAutoLboxDetector(object):
         self.olang = None
         self.langs = {}
         self.mode_limit_tokens_new = False
+        self.recognized = {}    # (language, start terminal) -> Recognition
+        # preparsed states depend on the previous version of the tree and
+        # are only kept for the current error
+        self.preparsed = {}     # start terminal -> (states, distance)
+        self.outer = {}         # language -> (syntaxtable, lexer)
+        self.deadline = None
+        self.tokens_left = None
 
     def preload(self, langname):
         if langname in self.langs:
@@ -68,6 +110,9 @@ class NewAutoLboxDetector(object):
         # Try history based heuristic first; if it fails to find an automatic
         # language box, try the stack based one; if that fails, try the
         # line-based heuristic.
+        self.start_budget()
+        self.preparsed.clear()
+
         valid = []
         maxd = 0
         if config.AUTOLBOX_HEURISTIC_HIST:
@@ -82,6 +127,9 @@ class NewAutoLboxDetector(object):
         pv = self.op.prev_version
         maxdist = 0
         for start, end, lang, dist, split, lbox, error in valid:
+            if self.exhausted():
+                # use the candidates checked so far
+                break
             if maxdist == 0:
                 # find the valid candidate with the furthest reach
                 if self.parse_after_lbox_h2(lbox, end, start, pv, error, split):
@@ -119,15 +167,13 @@ class NewAutoLboxDetector(object):
             while True:
                 element = self.op.syntaxtable.lookup(node.state, lbox)
                 if type(element) in [Reduce, Shift]:
-                    r = self.langs[sub]
-                    r.mode_limit_tokens_new = self.mode_limit_tokens_new
+                    if self.exhausted():
+                        break
                     start = node.next_term
-                    result = r.parse(start)
-                    if r.possible_ends:
-                        for e, enddist, split in r.possible_ends:
-                            if e.lookup == "<ws>" or e.lookup == "<return>":
-                                continue
-                            valid.append((start, e, sub, enddist, split, lbox, errornode))
+                    for e, enddist, split in self.recognize(sub, start):
+                        if e.lookup == "<ws>" or e.lookup == "<return>":
+                            continue
+                        valid.append((start, e, sub, enddist, split, lbox, errornode))
                 if node.lookup == "<return>" or type(node) is BOS or node.ismultinode():
                     break
                 node = node.prev_term
@@ -175,28 +221,86 @@ class NewAutoLboxDetector(object):
                                 # valid after all.
                                 parent = parent.get_attr("parent", pv)
                                 continue
-                            r = self.langs[sub]
-                            r.mode_limit_tokens_new = self.mode_limit_tokens_new
-                            result = r.parse(term)
-                            if r.possible_ends:
-                                for e, enddist, split in r.possible_ends:
-                                    if e.lookup in ws:
-                                        continue
-                                    valid.append((term, e, sub, enddist, split, lbox, errornode))
-                                    searched.add(term)
+                            if self.exhausted():
+                                return valid
+                            for e, enddist, split in self.recognize(sub, term):
+                                if e.lookup in ws:
+                                    continue
+                                valid.append((term, e, sub, enddist, split, lbox, errornode))
+                                searched.add(term)
                 parent = parent.get_attr("parent", pv)
         return valid
 
+    def start_budget(self):
+        if config.AUTOLBOX_TIME_BUDGET is None:
+            self.deadline = None
+        else:
+            self.deadline = time() + config.AUTOLBOX_TIME_BUDGET
+        self.tokens_left = config.AUTOLBOX_TOKEN_BUDGET
+
+    def exhausted(self):
+        """Checks if the time or token budget of the current error has been
+        used up."""
+        if self.tokens_left is not None and self.tokens_left <= 0:
+            return True
+        return self.deadline is not None and time() > self.deadline
+
+    def start_parse(self):
+        """Called by the parser before it starts parsing. Drops all
+        recognitions that are no longer valid."""
+        for key, recognition in list(self.recognized.items()):
+            if not recognition.is_valid():
+                del self.recognized[key]
+
+    def recognize(self, sub, start):
+        """Returns the possible ends of a language box of language `sub`
+        starting at `start`. Results are reused as long as the terminals
+        examined by the recogniser stay the same."""
+        key = (sub, start)
+        if key in self.recognized:
+            return self.recognized[key].ends
+        r = self.langs[sub]
+        r.mode_limit_tokens_new = self.mode_limit_tokens_new
+        r.max_tokens = self.tokens_left
+        r.parse(start)
+        ends = list(r.possible_ends)
+        if self.tokens_left is not None:
+            self.tokens_left -= r.tokens_read
+        if not r.out_of_tokens:
+            # only keep complete results
+            self.recognized[key] = Recognition(r.lexer, start, [r.last_node, r.lexer.examined], ends)
+        return ends
+
+    def get_outer(self, langname):
+        try:
+            return self.outer[langname]
+        except KeyError:
+            p, l = lang_dict[langname].load()
+            self.outer[langname] = p.syntaxtable, l.lexer
+            return self.outer[langname]
+
+    def preparse(self, ir, root, parent, version):
+        """Puts the recogniser `ir` into the state before `parent`. Since all
+        candidates of an error are checked against the same version of the
+        tree, the states are only computed once for every `parent`."""
+        try:
+            states, distance = self.preparsed[parent]
+        except KeyError:
+            ir.preparse(root, parent, version)
+            states, distance = ir.state, ir.abs_parse_distance
+            self.preparsed[parent] = list(states), distance
+        ir.state = list(states)
+        ir.abs_parse_distance = distance
+
     def parse_after_lbox_h2(self, lbox, end, parent, version, errornode, split=None, maxdist=0):
-        # XXX Can reuse preparsed ir as long as parent is the same
         root = parent.get_root(version)
-        p, l = lang_dict[root.name].load()
-        ir = IncrementalRecognizer(p.syntaxtable, l.lexer, root.name, None)
+        syntaxtable, lexer = self.get_outer(root.name)
+        ir = IncrementalRecognizer(syntaxtable, lexer, root.name, None)
         ir.errornode = errornode
         if root is not parent:
             # if the parent is already the root we don't need to preparse
             # anything
-            ir.preparse(root, parent, version)
+            self.preparse(ir, root, parent, version)
         # try parsing lbox + one more non-ws terminal
         check = ir.parse_single(TextNode(lbox)) and ir.parse_after(end.next_term, split, maxtoks=PARSE_AFTER_TOKENS, maxdist=maxdist)
         self.abs_parse_distance = ir.abs_parse_distance
@@ -223,18 +327,16 @@ class NewAutoLboxDetector(object):
                         cut = cut - 1
                         continue
                     if term:
+                        if self.exhausted():
+                            return valid
                         n = term
                         # See if we can get a valid language box using the Recogniser
-                        r = self.langs[sub]
-                        r.mode_limit_tokens_new = self.mode_limit_tokens_new
-                        result = r.parse(n)
-                        if r.possible_ends:
-                            # Filter results and test if remaining file can be
-                            # parsed after shifting the language box
-                            for e, enddist, split in r.possible_ends:
-                                if e.lookup == "<ws>" or e.lookup == "<return>":
-                                    continue
-                                valid.append((n, e, sub, enddist, split, lbox, errornode))
+                        # Filter results and test if remaining file can be
+                        # parsed after shifting the language box
+                        for e, enddist, split in self.recognize(sub, n):
+                            if e.lookup == "<ws>" or e.lookup == "<return>":
+                                continue
+                            valid.append((n, e, sub, enddist, split, lbox, errornode))
                 cut = cut - 1
         return valid
 
@@ -334,6 +436,10 @@ class Recognizer(object):
         self.last_token_value = ""
         self.last_split = 0
         self.errornode = None
+        self.max_tokens = None  # stop after reading this many tokens
+        self.tokens_read = 0
+        self.out_of_tokens = False
+        self.last_node = None   # last node of the last token
 
     def reset(self):
         self.state = [0]
@@ -343,6 +449,10 @@ class Recognizer(object):
         self.last_read = None
         self.abs_parse_distance = 0
         self.last_token_value = ""
+        self.tokens_read = 0
+        self.out_of_tokens = False
+        self.last_node = None
+        self.lexer.examined = None
 
     def parse(self, startnode, ppmode=False):
         # as we are reusing recogisers now, reset it
@@ -381,9 +491,18 @@ class Recognizer(object):
             else:
                 return None
 
+    def read_token(self):
+        if self.max_tokens is not None and self.tokens_read >= self.max_tokens:
+            self.out_of_tokens = True
+            raise LexingError("Token budget exceeded")
+        t = self.tokeniter()
+        self.tokens_read += 1
+        self.last_node = t[3][-1]
+        return t
+
     def next_token(self):
         try:
-            t = self.tokeniter()
+            t = self.read_token()
             self.last_read = t[3][-1]
             self.last_token_value = t[0]
             self.last_split = t[4]
@@ -466,7 +585,7 @@ class RecognizerIndent(Recognizer):
 
     def get_token_iter(self):
         try:
-            return self.tokeniter()
+            return self.read_token()
         except StopIteration:
             return None
         except LexingError:
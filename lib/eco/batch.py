@@ -0,0 +1,181 @@
+# Copyright (c) 2013--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Headless batch parsing of Eco files.
+
+Parses and exports a set of Eco files without starting the editor (and
+without importing PyQt), and reports the result of every file as a single
+line of JSON. Files are distributed over a pool of worker processes. Each
+worker caches the grammars it has loaded (see `grammars.grammars`), so every
+grammar is loaded at most once per worker.
+
+Usage: python3 batch.py [options] FILE|DIRECTORY|GLOB..."""
+
+import contextlib, glob, json, logging, multiprocessing, os, sys
+from optparse import OptionParser
+
+from grammar_parser.gparser import MagicTerminal, IndentationTerminal
+from incparser.astree import EOS
+
+def find_files(paths):
+    """Expands directories (recursively) and glob patterns into a sorted list
+    of Eco files."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, _, filenames in os.walk(path):
+                for f in filenames:
+                    if f.endswith(".eco"):
+                        files.append(os.path.join(dirpath, f))
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            files.extend(f for f in glob.glob(path, recursive=True) if os.path.isfile(f))
+    return sorted(set(files))
+
+def iter_terminals(tm):
+    """Iterates over all terminals of the document in textual order,
+    descending into language boxes."""
+    node = tm.get_bos()
+    while True:
+        node = node.next_term
+        if isinstance(node, EOS):
+            lbox = tm.get_languagebox(node)
+            if lbox is None:
+                return
+            node = lbox
+            continue
+        if isinstance(node.symbol, MagicTerminal):
+            node = node.symbol.ast.children[0]
+            continue
+        if isinstance(node.symbol, IndentationTerminal):
+            continue
+        yield node
+
+def find_errors(tm):
+    """Returns the syntax errors of all parsers with their (1-based) line and
+    column."""
+    errors = {}
+    for p in tm.parsers:
+        for node in p[0].error_nodes:
+            errors[id(node)] = (node, p[2])
+    if not errors:
+        return []
+    result = []
+    line = col = 1
+    for node in iter_terminals(tm):
+        if id(node) in errors:
+            _, language = errors.pop(id(node))
+            result.append({"line": line, "column": col, "token": node.symbol.name,
+                           "lookup": node.lookup, "language": language})
+        text = node.symbol.name
+        newlines = text.count("\r")
+        if newlines:
+            line += newlines
+            col = len(text) - text.rfind("\r")
+        else:
+            col += len(text)
+    # errors on nodes that are not part of the document anymore (e.g. EOS)
+    for node, language in errors.values():
+        result.append({"line": line, "column": col, "token": node.symbol.name,
+                       "lookup": node.lookup, "language": language})
+    return result
+
+def process_file(filename, export=True):
+    """Loads, parses and exports a single Eco file and returns the result as a
+    dictionary."""
+    from jsonmanager import JsonManager
+    from treemanager import TreeManager
+
+    result = {"file": filename}
+    # Eco prints warnings to stdout, which is reserved for the results
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            language_boxes = JsonManager().load(filename)
+            tm = TreeManager()
+            tm.load_file(language_boxes)
+        except Exception as e:
+            logging.exception("Failed to load %s", filename)
+            result["status"] = "error"
+            result["message"] = "%s: %s" % (e.__class__.__name__, e)
+            return result
+        result["language"] = tm.parsers[0][2]
+        ok = all(p[0].last_status for p in tm.parsers)
+        result["status"] = "ok" if ok else "syntaxerror"
+        result["errors"] = find_errors(tm)
+        if export:
+            result["text"] = tm.export_as_text()
+    return result
+
+def _process(args):
+    return process_file(*args)
+
+def init_worker(loglevel):
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=loglevel)
+
+def run(files, jobs=None, export=True, loglevel=logging.WARNING):
+    """Processes `files` using `jobs` worker processes and yields the results
+    in the order of `files`."""
+    tasks = [(f, export) for f in files]
+    if jobs == 1:
+        init_worker(loglevel)
+        for t in tasks:
+            yield _process(t)
+        return
+    pool = multiprocessing.Pool(jobs, init_worker, (loglevel,))
+    try:
+        for result in pool.imap(_process, tasks):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+def main(argv=None):
+    parser = OptionParser(usage="usage: %prog batch [options] FILE|DIRECTORY|GLOB...")
+    parser.add_option("-j", "--jobs", type="int", default=None, help="Number of worker processes [default: number of CPUs]")
+    parser.add_option("-o", "--output", default=None, help="Write results to this file instead of stdout")
+    parser.add_option("-n", "--no-export", action="store_true", default=False, help="Don't include the exported text in the results")
+    parser.add_option("-l", "--log", default="WARNING", help="Log level: INFO, WARNING, ERROR, DEBUG [default: %default]")
+    (options, args) = parser.parse_args(argv)
+
+    if not args:
+        parser.error("no input files")
+    if options.log.upper() in ["INFO", "WARNING", "ERROR", "DEBUG"]:
+        loglevel = getattr(logging, options.log.upper())
+    else:
+        loglevel = logging.WARNING
+
+    files = find_files(args)
+    out = open(options.output, "w") if options.output else sys.stdout
+    failed = 0
+    try:
+        for result in run(files, options.jobs, not options.no_export, loglevel):
+            if result["status"] != "ok":
+                failed += 1
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
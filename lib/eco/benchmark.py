@@ -0,0 +1,339 @@
+# Copyright (c) 2013--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Benchmarks typical editing workloads by replaying input logs.
+
+Every workload consists of a language, an initial program, an input log that
+prepares the document (not timed) and the input log that is measured. The
+logs have the same format as the ones recorded by the editor (see
+`TreeManager.apply_inputlog`) and are generated deterministically, so runs
+on different commits are comparable. Besides the total time, the time spent
+in relexing, incremental parsing, top-down reuse, saving versions and
+automatic language box detection is reported (excluding time spent in the
+other phases, e.g. detection triggered while parsing). The results can be
+written to a JSON file and compared against a previous run.
+
+Usage: python3 benchmark.py [options] [WORKLOAD...]"""
+
+import contextlib, json, os, platform, random, sys
+from optparse import OptionParser
+from time import time
+
+import stats
+from grammars.grammars import lang_dict
+from treemanager import TreeManager
+
+VERSION = 2
+
+# the phases timed by `stats`
+PHASES = ["relex", "inc_parse", "top_down_reuse", "save", "autolbox"]
+
+def phase_times(collected):
+    """Returns the time spent in and the number of calls of every phase from
+    the given `stats.Stats`, including the edit in progress."""
+    result = {}
+    for phase in PHASES:
+        result[phase] = {}
+        for key in ["time", "calls"]:
+            name = "%s_%s" % (phase, key)
+            result[phase][key] = collected.totals.get(name, 0) + collected.edit.get(name, 0)
+    return result
+
+class InputLog(object):
+    """Builds an input log in the format recorded by the editor."""
+
+    def __init__(self):
+        self.lines = []
+
+    def call(self, method, *args):
+        self.lines.append("self.%s(%s)" % (method, ", ".join(args)))
+
+    def goto(self, line, x=0):
+        self.lines.append("self.cursor.line = %d" % line)
+        self.call("cursor.move_to_x", str(x))
+
+    def type(self, text):
+        """Types `text` one key at a time. Like a user, this relies on the
+        editor keeping the indentation of the previous line after a
+        newline."""
+        indent = 0
+        for i, line in enumerate(text.split("\n")):
+            stripped = line.lstrip(" ")
+            level = len(line) - len(stripped)
+            if i > 0:
+                self.call("key_normal", repr("\r"))
+                for _ in range(indent - level):
+                    self.call("key_backspace")
+                line = " " * max(0, level - indent) + stripped
+            for c in line:
+                self.call("key_normal", repr(c))
+            indent = level
+
+    def move(self, key, times=1, shift=False):
+        for _ in range(times):
+            self.call("key_cursors", key, str(shift))
+
+    def text(self):
+        return "\n".join(self.lines)
+
+class Workload(object):
+
+    def __init__(self, name, language, program, setup, log, description):
+        self.name = name
+        self.language = language
+        self.program = program
+        self.setup = setup
+        self.log = log
+        self.description = description
+
+def repeat_program(program, times, rename):
+    """Concatenates `times` copies of `program`, replacing `rename` with a
+    unique name in every copy."""
+    return "\n\n".join(program.replace(rename, "%s%d" % (rename, i)) for i in range(times))
+
+python_function = """def checksum(values, start=0):
+    total = start
+    for i, v in enumerate(values):
+        if v % 2 == 0:
+            total += v * i
+        else:
+            total -= v
+    return total
+"""
+
+def python_typing(scale):
+    """Types a function into the middle of a large Python file."""
+    from test.programs import connect4
+    program = repeat_program(connect4, max(1, int(20 * scale)), "Connect4")
+    lines = program.split("\n")
+    middle = len(lines) // 2
+    while lines[middle] != "":
+        middle += 1
+    log = InputLog()
+    log.goto(middle)
+    log.type(python_function)
+    return Workload("python_typing", "Python 2.7.5", program, "", log.text(),
+                    python_typing.__doc__)
+
+java_method = """    public int compute%(n)d(int a, int b) {
+        int result = a * %(n)d;
+        for (int i = 0; i < b; i++) {
+            if (i %% 3 == 0) {
+                result = result + i;
+            } else {
+                result = result - b;
+            }
+        }
+        return result;
+    }
+"""
+
+def java_paste(scale):
+    """Pastes a large Java class (5000 lines) into an empty file."""
+    lines = int(5000 * scale)
+    methods = max(1, lines // java_method.count("\n"))
+    program = "class Benchmark {\n%s}\n" % "\n".join(java_method % {"n": n} for n in range(methods))
+    log = InputLog()
+    log.call("pasteText", repr(program))
+    return Workload("java_paste", "Java", "", "", log.text(), java_paste.__doc__)
+
+def lbox_delete(scale):
+    """Deletes text spanning several Python language boxes embedded in a PHP
+    class, first by selection and then with backspace."""
+    boxes = max(2, int(20 * scale))
+    program = "class PHP {\n\n%s\n}" % "\n".join("    public $x%d = %d;" % (i, i) for i in range(boxes))
+    setup = InputLog()
+    # add a box behind every field, starting at the end so that the line
+    # numbers of the remaining fields don't change
+    for i in reversed(range(boxes)):
+        setup.goto(2 + i, 4 + len("public $x%d = %d;" % (i, i)))
+        setup.call("key_normal", repr("\r"))
+        setup.call("add_languagebox", repr("Python + PHP"))
+        setup.type("def f%d(self): return %d" % (i, i))
+        setup.call("leave_languagebox")
+    log = InputLog()
+    # select from the first box to the middle of the document and delete
+    log.goto(3, 4)
+    log.move("KEY_DOWN", boxes, True)
+    log.call("key_delete")
+    # backspace from the end of the last line through the remaining boxes
+    log.goto(1 + boxes)
+    log.call("key_end")
+    for _ in range(boxes * 12):
+        log.call("key_backspace")
+    return Workload("lbox_delete", "PHP + Python", program, setup.text(), log.text(),
+                    lbox_delete.__doc__)
+
+def undo_redo(scale):
+    """Makes a series of edits in a Python file and repeatedly undoes and
+    redoes all of them."""
+    from test.programs import connect4
+    program = repeat_program(connect4, max(1, int(5 * scale)), "Connect4")
+    lines = program.split("\n")
+    rand = random.Random(0)
+    log = InputLog()
+    edits = max(4, int(40 * scale))
+    for i in range(edits):
+        y = rand.randrange(len(lines))
+        while not lines[y].strip():
+            y = rand.randrange(len(lines))
+        log.goto(y, len(lines[y]))
+        log.type("  # edit %d" % i)
+        log.call("undo_snapshot")
+    for _ in range(3):
+        for _ in range(edits):
+            log.call("key_ctrl_z")
+        for _ in range(edits):
+            log.call("key_shift_ctrl_z")
+    return Workload("undo_redo", "Python 2.7.5", program, "", log.text(),
+                    undo_redo.__doc__)
+
+WORKLOADS = [python_typing, java_paste, lbox_delete, undo_redo]
+
+def workload_from_log(filename):
+    """Creates a workload from an input log recorded by the editor."""
+    with open(filename) as f:
+        log = f.read()
+    language = None
+    for line in log.split("\n"):
+        if line.startswith("# Main language:"):
+            language = line.split(":", 1)[1].strip()
+            break
+    if language is None:
+        raise ValueError("%s: main language missing" % filename)
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return Workload(name, language, "", "", log, "input log %s" % filename)
+
+def create_treemanager(language):
+    parser, lexer = lang_dict[language].load()
+    parser.setup_autolbox(language, lexer)
+    tm = TreeManager()
+    tm.add_parser(parser, lexer, language)
+    tm.set_font_test(7, 17)
+    return tm
+
+def run_workload(workload):
+    """Replays a workload once and returns the total time and the time spent
+    in every phase."""
+    tm = create_treemanager(workload.language)
+    if workload.program:
+        tm.import_file(workload.program)
+    tm.apply_inputlog(workload.setup)
+    collected = stats.enable()
+    try:
+        start = time()
+        tm.apply_inputlog(workload.log)
+        total = time() - start
+    finally:
+        stats.disable()
+    return {"total": total, "phases": phase_times(collected)}
+
+def bench(workload, repeat=1):
+    """Runs a workload `repeat` times and returns the fastest run."""
+    best = None
+    for _ in range(repeat):
+        result = run_workload(workload)
+        if best is None or result["total"] < best["total"]:
+            best = result
+    return best
+
+def compare(old, new, threshold=0.1, minimum=0.01):
+    """Compares two benchmark results and returns a list of (workload,
+    measurement, old time, new time) for all measurements that are more than
+    `threshold` (relative) and `minimum` seconds slower."""
+    regressions = []
+    for name, result in sorted(new["workloads"].items()):
+        previous = old["workloads"].get(name)
+        if previous is None:
+            continue
+        measurements = [("total", previous["total"], result["total"])]
+        for phase, data in sorted(result["phases"].items()):
+            if phase in previous["phases"]:
+                measurements.append((phase, previous["phases"][phase]["time"], data["time"]))
+        for measurement, before, after in measurements:
+            if after > before * (1 + threshold) and after - before > minimum:
+                regressions.append((name, measurement, before, after))
+    return regressions
+
+def print_result(name, result, out=sys.stdout):
+    phases = result["phases"]
+    accounted = sum(p["time"] for p in phases.values())
+    out.write("%-16s %8.3fs" % (name, result["total"]))
+    for phase in sorted(phases):
+        out.write("  %s %.3fs/%d" % (phase, phases[phase]["time"], phases[phase]["calls"]))
+    out.write("  other %.3fs\n" % (result["total"] - accounted))
+    out.flush()
+
+def main(argv=None):
+    parser = OptionParser(usage="usage: %prog [options] [WORKLOAD...]")
+    parser.add_option("-r", "--repeat", type="int", default=1, help="Report the best of REPEAT runs [default: %default]")
+    parser.add_option("-s", "--scale", type="float", default=1.0, help="Scale the size of the workloads [default: %default]")
+    parser.add_option("-i", "--inputlog", action="append", default=[], help="Also replay this input log")
+    parser.add_option("-o", "--output", default=None, help="Write the results as JSON to this file")
+    parser.add_option("-c", "--compare", default=None, help="Compare the results with this JSON file")
+    parser.add_option("-t", "--threshold", type="float", default=0.1, help="Relative slowdown reported as regression [default: %default]")
+    parser.add_option("-l", "--list", action="store_true", default=False, help="List the available workloads")
+    (options, args) = parser.parse_args(argv)
+
+    available = dict((w.__name__, w) for w in WORKLOADS)
+    if options.list:
+        for w in WORKLOADS:
+            print("%-16s %s" % (w.__name__, w.__doc__.split("\n")[0]))
+        return 0
+    for name in args:
+        if name not in available:
+            parser.error("unknown workload: %s" % name)
+    if not args and not options.inputlog:
+        args = [w.__name__ for w in WORKLOADS]
+
+    workloads = [available[name](options.scale) for name in args]
+    workloads.extend(workload_from_log(f) for f in options.inputlog)
+
+    results = {"version": VERSION, "python": platform.python_version(),
+               "scale": options.scale, "workloads": {}}
+    for workload in workloads:
+        # Eco prints debugging output to stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            result = bench(workload, options.repeat)
+        results["workloads"][workload.name] = result
+        print_result(workload.name, result)
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("version") != VERSION or baseline.get("scale") != options.scale:
+            print("%s: incompatible results, not comparing" % options.compare)
+            return 1
+        regressions = compare(baseline, results, options.threshold)
+        for name, measurement, before, after in regressions:
+            print("REGRESSION %s %s: %.3fs -> %.3fs (%+.0f%%)" % (
+                name, measurement, before, after, (after / before - 1) * 100 if before else float("inf")))
+        if regressions:
+            return 1
+        print("no regressions (threshold %.0f%%)" % (options.threshold * 100))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,455 @@
+# Copyright (c) 2013--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Binary file format for Eco documents.
+
+A file starts with `MAGIC` and is followed by one or more segments. Every
+segment starts with `SEGMENT` and ends with `COMMIT`, which names the root
+node and language of the document. Only segments that have been committed
+are used when a file is loaded, so a partially written segment is ignored.
+Each segment is compressed as a separate gzip member, so segments can be
+appended to an existing file.
+
+Segments consist of records, each starting with an opcode followed by
+unsigned LEB128 integers:
+
+    STRING  length bytes          interns a UTF-8 string (referenced by index)
+    NODE    class symbol text lookup flags [image] [lbox] n child*n
+    REPLACE id class symbol text lookup flags [image] [lbox] n child*n
+    COMMIT  root language whitespaces
+
+Nodes are numbered implicitly in the order of their NODE records. The ids
+of children and language box roots are stored as zigzag encoded differences
+to the id of the node referencing them, which keeps them small.
+
+Nodes are written in post-order, so the children of a node (and the root
+of a language box, which is written as a nested section right before its
+language box terminal) always precede the node itself. A REPLACE record
+overwrites a node that was written earlier. This allows appending
+segments that only contain the nodes that changed since the last save,
+which is what autosave uses."""
+
+import gzip, os, tempfile, zlib
+
+from grammar_parser.gparser import Terminal, MagicTerminal, IndentationTerminal, Nonterminal
+from incparser.astree import TextNode, BOS, EOS, FinishSymbol, MultiTextNode
+
+MAGIC = b"ECOBIN\x00\x01"
+
+SEGMENT = 1
+STRING = 2
+NODE = 3
+REPLACE = 4
+COMMIT = 5
+
+FLAG_LOCAL_ERROR = 1
+FLAG_NESTED_ERRORS = 2
+FLAG_IMAGE = 4
+FLAG_LBOX = 8
+
+NODE_CLASSES = [TextNode, BOS, EOS, MultiTextNode]
+SYMBOL_CLASSES = [Terminal, MagicTerminal, IndentationTerminal, Nonterminal, FinishSymbol]
+NODE_CLASS_IDS = dict((c, i) for i, c in enumerate(NODE_CLASSES))
+SYMBOL_CLASS_IDS = dict((c, i) for i, c in enumerate(SYMBOL_CLASSES))
+
+BUFFER_SIZE = 1 << 16
+
+class BinaryFormatError(Exception):
+    pass
+
+def is_binary(filename):
+    try:
+        with gzip.open(str(filename), "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except (IOError, EOFError):
+        return False
+
+def write_varint(buf, value):
+    while value > 0x7f:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+def write_delta(buf, nid, other):
+    delta = nid - other
+    write_varint(buf, delta << 1 if delta >= 0 else (-delta << 1) - 1)
+
+def read_delta(nid, value):
+    if value & 1:
+        return nid + ((value + 1) >> 1)
+    return nid - (value >> 1)
+
+def decompress(f):
+    """Yields the decompressed contents of all gzip members in `f`. Unlike
+    `gzip.GzipFile` this also yields the data of a truncated last member."""
+    d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    while True:
+        raw = f.read(BUFFER_SIZE)
+        if not raw:
+            return
+        while raw:
+            yield d.decompress(raw)
+            raw = b""
+            if d.eof:
+                raw = d.unused_data
+                d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+class Reader(object):
+    """Reads bytes and varints from a stream of chunks."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.data = b""
+        self.pos = 0
+
+    def fill(self, length):
+        data = [self.data[self.pos:]]
+        available = len(data[0])
+        for chunk in self.chunks:
+            data.append(chunk)
+            available += len(chunk)
+            if available >= max(BUFFER_SIZE, length):
+                break
+        self.data = b"".join(data)
+        self.pos = 0
+        if len(self.data) < length:
+            raise EOFError()
+
+    def byte(self):
+        if self.pos >= len(self.data):
+            self.fill(1)
+        b = self.data[self.pos]
+        self.pos += 1
+        return b
+
+    def varint(self):
+        result = 0
+        shift = 0
+        while True:
+            b = self.byte()
+            result |= (b & 0x7f) << shift
+            if b < 0x80:
+                return result
+            shift += 7
+
+    def bytes(self, length):
+        if self.pos + length > len(self.data):
+            self.fill(length)
+        data = self.data[self.pos:self.pos + length]
+        self.pos += length
+        return data
+
+class BinaryManager(object):
+    """Saves and loads Eco documents in the binary format described above.
+
+    A manager remembers which nodes it has written to a file. Saving again
+    with `append=True` then only appends the nodes that changed since. Once
+    the file has grown too much, it is rewritten from scratch."""
+
+    # rewrite the file once appended segments make up this much of it
+    COMPACT_FACTOR = 4
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.filename = None
+        self.ids = {}       # node -> (id, snapshot) at the time it was written
+        self.strings = {}   # interned strings
+        self.size = 0       # size of the file after the last save
+        self.full_size = 0  # size of the last full save
+
+    def save(self, root, language, whitespaces, filename, append=False):
+        filename = str(filename)
+        if append and self.can_append(filename):
+            with open(filename, "ab") as f:
+                with gzip.GzipFile(fileobj=f, mode="wb") as z:
+                    self.write_segment(z, root, language, whitespaces, True)
+                self.size = f.tell()
+            return
+        self.reset()
+        # write to a temporary file first so that an existing file isn't
+        # destroyed if something goes wrong
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                with gzip.GzipFile(fileobj=f, mode="wb") as z:
+                    z.write(MAGIC)
+                    self.write_segment(z, root, language, whitespaces, False)
+                self.size = self.full_size = f.tell()
+            os.replace(tmpname, filename)
+        except:
+            os.remove(tmpname)
+            self.reset()
+            raise
+        self.filename = filename
+
+    def can_append(self, filename):
+        if filename != self.filename:
+            return False
+        try:
+            size = os.path.getsize(filename)
+        except OSError:
+            return False
+        if size != self.size:
+            # file has been modified by someone else
+            return False
+        return size < self.full_size * self.COMPACT_FACTOR
+
+    def write_segment(self, f, root, language, whitespaces, append):
+        buf = bytearray()
+        buf.append(SEGMENT)
+        # Language boxes don't mark their outer tree as changed, so when
+        # appending, the trees of all known language boxes need to be checked
+        # separately
+        roots = [root]
+        if append:
+            for node in list(self.ids):
+                if isinstance(node.symbol, MagicTerminal):
+                    roots.append(node.symbol.ast)
+        for r in reversed(roots):
+            self.write_tree(f, buf, r, append)
+        language = self.intern(buf, language)
+        buf.append(COMMIT)
+        write_varint(buf, self.ids[root][0])
+        write_varint(buf, language)
+        write_varint(buf, 1 if whitespaces else 0)
+        f.write(buf)
+
+    def needs_write(self, node):
+        # Every time a node (or one of its descendants) changes, the tree
+        # manager saves it again, which creates a new snapshot in its history
+        try:
+            _, snapshot = self.ids[node]
+        except KeyError:
+            return True
+        return snapshot is None or snapshot is not node.log.stamp(node.version) or node.has_changes()
+
+    def write_tree(self, f, buf, root, append):
+        stack = [(root, False)]
+        while stack:
+            node, done = stack.pop()
+            if done:
+                self.write_node(buf, node)
+                if len(buf) > BUFFER_SIZE:
+                    f.write(buf)
+                    del buf[:]
+                continue
+            if append and not self.needs_write(node):
+                continue
+            stack.append((node, True))
+            for c in reversed(node.children):
+                stack.append((c, False))
+            if isinstance(node.symbol, MagicTerminal):
+                stack.append((node.symbol.ast, False))
+
+    def intern(self, buf, s):
+        try:
+            return self.strings[s]
+        except KeyError:
+            i = self.strings[s] = len(self.strings)
+            data = s.encode("utf-8")
+            buf.append(STRING)
+            write_varint(buf, len(data))
+            buf.extend(data)
+            return i
+
+    def write_node(self, buf, node):
+        text = self.intern(buf, node.symbol.name)
+        lookup = self.intern(buf, node.lookup)
+        flags = 0
+        if node.local_error:
+            flags |= FLAG_LOCAL_ERROR
+        if node.nested_errors:
+            flags |= FLAG_NESTED_ERRORS
+        if node.image_src is not None:
+            flags |= FLAG_IMAGE
+            image = self.intern(buf, node.image_src)
+        if isinstance(node.symbol, MagicTerminal):
+            flags |= FLAG_LBOX
+        try:
+            nid = self.ids[node][0]
+            buf.append(REPLACE)
+            write_varint(buf, nid)
+        except KeyError:
+            nid = len(self.ids)
+            buf.append(NODE)
+        self.ids[node] = (nid, node.log.stamp(node.version))
+        buf.append(NODE_CLASS_IDS[node.__class__])
+        buf.append(SYMBOL_CLASS_IDS[node.symbol.__class__])
+        write_varint(buf, text)
+        write_varint(buf, lookup)
+        buf.append(flags)
+        if flags & FLAG_IMAGE:
+            write_varint(buf, image)
+        if flags & FLAG_LBOX:
+            write_delta(buf, nid, self.ids[node.symbol.ast][0])
+        write_varint(buf, len(node.children))
+        for c in node.children:
+            write_delta(buf, nid, self.ids[c][0])
+
+    def load(self, filename):
+        """Loads a document and returns its language boxes (as a list of
+        (root, language, whitespaces) with the main document first), like
+        `JsonManager.load`."""
+        with open(str(filename), "rb") as f:
+            reader = Reader(decompress(f))
+            try:
+                if reader.bytes(len(MAGIC)) != MAGIC:
+                    raise EOFError()
+            except EOFError:
+                raise BinaryFormatError("%s is not a binary Eco file" % (filename,))
+            strings = []
+            nodes = {}
+            self.next_id = 0
+            committed = None
+            first = True
+            while True:
+                try:
+                    op = reader.byte()
+                except EOFError:
+                    break
+                if op != SEGMENT:
+                    raise BinaryFormatError("Expected segment, got record type %s" % (op,))
+                try:
+                    # Segments after the first one are only applied once they
+                    # have been read completely, since they replace nodes
+                    result = self.read_segment(reader, strings, nodes, deferred=not first)
+                except EOFError:
+                    # incomplete segment (e.g. interrupted autosave)
+                    break
+                first = False
+                committed = result
+            if committed is None:
+                raise BinaryFormatError("%s doesn't contain a complete document" % (filename,))
+        root, language, whitespaces = committed
+        return self.finish(root, language, whitespaces)
+
+    def read_segment(self, reader, strings, nodes, deferred):
+        pending = []
+        while True:
+            op = reader.byte()
+            if op == STRING:
+                length = reader.varint()
+                strings.append(reader.bytes(length).decode("utf-8"))
+            elif op == NODE or op == REPLACE:
+                if op == NODE:
+                    nid = self.next_id
+                    self.next_id += 1
+                else:
+                    nid = reader.varint()
+                record = self.read_node(reader, nid)
+                if deferred:
+                    pending.append(record)
+                else:
+                    self.apply_node(record, strings, nodes)
+            elif op == COMMIT:
+                root = reader.varint()
+                language = strings[reader.varint()]
+                whitespaces = reader.varint() == 1
+                for record in pending:
+                    self.apply_node(record, strings, nodes)
+                return nodes[root], language, whitespaces
+            else:
+                raise BinaryFormatError("Unknown record type %s" % (op,))
+
+    def read_node(self, reader, nid):
+        node_class = reader.byte()
+        symbol_class = reader.byte()
+        text = reader.varint()
+        lookup = reader.varint()
+        flags = reader.byte()
+        image = reader.varint() if flags & FLAG_IMAGE else None
+        lbox = read_delta(nid, reader.varint()) if flags & FLAG_LBOX else None
+        n = reader.varint()
+        children = [read_delta(nid, reader.varint()) for _ in range(n)]
+        return (nid, node_class, symbol_class, text, lookup, flags, image, lbox, children)
+
+    def apply_node(self, record, strings, nodes):
+        nid, node_class, symbol_class, text, lookup, flags, image, lbox, children = record
+        node_class = NODE_CLASSES[node_class]
+        symbol = SYMBOL_CLASSES[symbol_class]()
+        symbol.name = strings[text]
+        node = nodes.get(nid)
+        if node is not None:
+            # Replaced nodes are updated in place, since unchanged nodes
+            # written earlier may still reference them
+            if node_class is not MultiTextNode:
+                node.symbol = symbol
+        elif node_class is MultiTextNode:
+            node = node_class()
+        else:
+            node = node_class(symbol)
+        node.lookup = strings[lookup]
+        node.local_error = bool(flags & FLAG_LOCAL_ERROR)
+        node.nested_errors = bool(flags & FLAG_NESTED_ERRORS)
+        if image is not None:
+            node.image_src = strings[image]
+            from PyQt5.QtGui import QImage
+            node.image = QImage(node.image_src)
+        if lbox is not None:
+            lbox_root = nodes[lbox]
+            lbox_root.magic_backpointer = node
+            node.symbol.ast = lbox_root
+            node.symbol.parser = lbox_root
+        node.set_children([nodes[c] for c in children])
+        nodes[nid] = node
+
+    def finish(self, root, language, whitespaces):
+        """Links the terminals of all trees, calculates text lengths and saves
+        the initial version of every node. Returns the language boxes of the
+        document."""
+        language_boxes = []
+        postorder = []
+        last_terminals = [None]
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if type(node) is tuple:
+                # finished a language box
+                last_terminals.pop()
+                language_boxes.append(node)
+                continue
+            postorder.append(node)
+            if isinstance(node.symbol, Terminal) or isinstance(node.symbol, FinishSymbol):
+                last = last_terminals[-1]
+                node.prev_term = last
+                if last is not None:
+                    last.next_term = node
+                last_terminals[-1] = node
+            if isinstance(node.symbol, MagicTerminal):
+                lbox_root = node.symbol.ast
+                stack.append((lbox_root, node.symbol.name[1:-1], True))
+                stack.append(lbox_root)
+                last_terminals.append(None)
+            if type(node) is MultiTextNode:
+                # the children of a multi text node are only linked among
+                # themselves
+                node.update_children()
+                postorder.extend(node.children)
+                continue
+            stack.extend(reversed(node.children))
+        for node in reversed(postorder):
+            node.calc_textlength()
+            node.save(0)
+        language_boxes.append((root, language, whitespaces))
+        language_boxes.reverse()
+        return language_boxes
@@ -1,3 +1,17 @@
 AUTOLBOX_HEURISTIC_LINE = True
 AUTOLBOX_HEURISTIC_HIST = True
 AUTOLBOX_HEURISTIC_STACK = True
+
+# Budget of the automatic language box detection for a single parse error.
+# Once used up, only the candidates found so far are considered. Set to None
+# to disable. The time budget is disabled by default, as it makes the
+# detected language boxes depend on the speed and load of the machine.
+AUTOLBOX_TIME_BUDGET = None     # seconds
+AUTOLBOX_TOKEN_BUDGET = 50000   # tokens read by the recognisers
+
+# Limits of the undo history. Once either is exceeded (by more than a
+# quarter, to avoid compacting after every edit), the oldest undo snapshots
+# are dropped and the versions in between snapshots are merged. Set to None
+# to keep the entire history.
+UNDO_MAX_SNAPSHOTS = 1000
+UNDO_MAX_BYTES = 256 * 1024 * 1024  # approximate size of the history
@@ -0,0 +1,444 @@
+# Copyright (c) 2013--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Headless parse daemon.
+
+Keeps a TreeManager alive for every open document and edits it incrementally
+on request, so that editors and tools don't pay for starting Eco, loading
+grammars and rebuilding trees on every change. Like batch mode, the daemon
+doesn't import PyQt.
+
+Requests are JSON-RPC 2.0 messages, one per line, read from stdin (answers
+are written to stdout) or from the connections to a local (Unix domain)
+socket. Documents are identified by an arbitrary string `document`.
+Positions are either offsets into the document's text or objects with a
+(0-based) `line` and `character`; positions returned by the daemon contain
+all three. The methods are:
+
+    languages()                          names of all languages
+    open(document, language, text="")    opens a document
+    close(document)
+    insert(document, at, text)           types `text` at `at`
+    paste(document, at, text)            pastes `text` at `at`
+    delete(document, start, end)
+    undo(document), redo(document)
+    add_languagebox(document, at, language, text="")
+                                         adds a language box and types `text`
+                                         into it
+    text(document)                       the exported text
+    diagnostics(document)                all current diagnostics
+    shutdown()                           stops the daemon
+
+Typing applies auto indentation and language box detection like the editor,
+while pasting inserts the text unchanged. Every edit is a single undo step.
+Editing methods return the document's `version` and the ranges of all tokens
+that changed (`changed`). The `diagnostics` (syntax errors and errors found
+by the name binding analysis) are only included if they differ from the ones
+sent last for that document.
+
+Usage: python3 daemon.py [--socket PATH] [-l LOGLEVEL]"""
+
+import json, logging, os, socketserver, sys, threading
+from bisect import bisect_right
+from optparse import OptionParser
+
+from grammars.grammars import lang_dict, EcoFile
+from grammar_parser.gparser import MagicTerminal, IndentationTerminal, Nonterminal
+from incparser.astree import BOS, EOS, FIELD_INDEX
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+PARENT = FIELD_INDEX["parent"]
+SYMBOL_NAME = FIELD_INDEX["symbol.name"]
+LOOKUP = FIELD_INDEX["lookup"]
+
+class RPCError(Exception):
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+        self.message = message
+
+class Document(object):
+    """An open document and the diagnostics last sent for it."""
+
+    def __init__(self, language, text):
+        from treemanager import TreeManager
+        try:
+            lang = lang_dict[language]
+        except KeyError:
+            raise RPCError(INVALID_PARAMS, "Unknown language '%s'." % language)
+        parser, lexer = lang.load()
+        self.tm = TreeManager()
+        self.tm.add_parser(parser, lexer, lang.name)
+        if text:
+            self.tm.import_file(text)
+        self.diagnostics = None
+        self._text = None           # see text()
+
+    # -------------------------------- text -------------------------------- #
+
+    def text(self):
+        """Returns the exported text and the offsets of all its lines."""
+        if self._text is None:
+            text = self.tm.export_as_text()
+            lines = [0]
+            i = text.find("\n")
+            while i >= 0:
+                lines.append(i + 1)
+                i = text.find("\n", i + 1)
+            self._text = (text, lines)
+        return self._text
+
+    def to_linechar(self, position):
+        """Converts a position given in a request to a line and character."""
+        if isinstance(position, dict):
+            try:
+                return int(position["line"]), int(position["character"])
+            except (KeyError, TypeError, ValueError):
+                raise RPCError(INVALID_PARAMS, "Invalid position %r." % (position,))
+        if not isinstance(position, int) or isinstance(position, bool):
+            raise RPCError(INVALID_PARAMS, "Invalid position %r." % (position,))
+        text, lines = self.text()
+        if not 0 <= position <= len(text):
+            raise RPCError(INVALID_PARAMS, "Offset %d is outside of the document." % position)
+        line = bisect_right(lines, position) - 1
+        return line, position - lines[line]
+
+    def position(self, line, character):
+        _, lines = self.text()
+        return {"line": line, "character": character, "offset": lines[line] + character}
+
+    def move_cursor(self, position):
+        line, character = self.to_linechar(position)
+        tm = self.tm
+        if not 0 <= line < len(tm.lines):
+            raise RPCError(INVALID_PARAMS, "Line %d is outside of the document." % line)
+        tm.cursor.line = line
+        tm.cursor.move_to_x(character)
+        tm.edit_rightnode = False
+        tm.unselect()
+
+    def locate(self, node):
+        """Returns the line and character at which `node` starts."""
+        cursor = self.tm.cursor
+        character = 0
+        prev = cursor.find_previous_visible(node)
+        while prev.symbol.name != "\r" and not isinstance(prev, BOS):
+            character += len(prev.symbol.name)
+            prev = cursor.find_previous_visible(prev)
+        if isinstance(prev, BOS):
+            return 0, character
+        return self.tm.lines.find(prev), character
+
+    def node_range(self, node):
+        """Returns the line and character at which `node` starts and ends."""
+        start = self.locate(node)
+        if isinstance(node, EOS) or isinstance(node.symbol, IndentationTerminal):
+            return start, start
+        if isinstance(node.symbol, MagicTerminal):
+            return start, self.locate(node.symbol.ast.children[-1])
+        text = node.symbol.name.replace("\r\n", "\r")
+        newlines = text.count("\r")
+        if newlines:
+            return start, (start[0] + newlines, len(text) - text.rfind("\r") - 1)
+        return start, (start[0], start[1] + len(text))
+
+    def make_range(self, start, end):
+        return {"start": self.position(*start), "end": self.position(*end)}
+
+    # ---------------------------- notifications --------------------------- #
+
+    def changed_tokens(self, low, high):
+        """Returns the merged ranges of all tokens that changed by going from
+        version `low` to version `high` (or back), i.e. whose text, lookup or
+        parent symbol differ between them."""
+        ranges = []
+        for p in self.tm.parsers:
+            self._find_changed(p[0].previous_version.parent, low, high, ranges)
+        ranges.sort()
+        merged = []
+        for start, end in ranges:
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return [self.make_range(start, end) for start, end in merged]
+
+    def _find_changed(self, node, low, high, ranges):
+        i = node.log.index(high)
+        if i >= 0 and node.log.versions[i] <= low and not node.new:
+            # neither this node nor any of its children have changed (language
+            # boxes are searched separately)
+            return
+        if node.deleted or isinstance(node, BOS) or isinstance(node, EOS):
+            return
+        if node.children:
+            for c in node.children:
+                self._find_changed(c, low, high, ranges)
+        elif not isinstance(node.symbol, (MagicTerminal, IndentationTerminal, Nonterminal)):
+            if self._token_changed(node, low, high):
+                ranges.append(self.node_range(node))
+
+    def _token_changed(self, node, low, high):
+        # Reparsing saves all tokens that were moved to a new parent, even if
+        # nothing about them changed. Like `remember_changed_terminals` in the
+        # TreeManager, only compare what is visible of a token.
+        _, old = node.log.find(low)
+        _, new = node.log.find(high)
+        if old is None or new is None or old[PARENT] is None or new[PARENT] is None:
+            return True
+        return old[SYMBOL_NAME] != new[SYMBOL_NAME] or old[LOOKUP] != new[LOOKUP] or \
+            old[PARENT].symbol.name != new[PARENT].symbol.name
+
+    def get_diagnostics(self):
+        tm = self.tm
+        tm.analyse()
+        diagnostics = []
+        for p in tm.parsers:
+            parser, _, language, analyser = p[:4]
+            for node in parser.error_nodes:
+                message = "Syntax error on token '%s' (%s)." % (node.symbol.name, node.lookup)
+                diagnostics.append(("syntax", language, message, self.node_range(node)))
+            if analyser:
+                for node, message in analyser.errors.items():
+                    diagnostics.append(("namebinding", language, message, self.node_range(node)))
+        diagnostics.sort(key=lambda d: (d[3], d[0], d[2]))
+        return [{"source": source, "language": language, "message": message,
+                 "range": self.make_range(*r)} for source, language, message, r in diagnostics]
+
+    def result(self, version):
+        """Returns the result of an edit that started at `version`."""
+        result = {"version": self.tm.version,
+                  "changed": self.changed_tokens(min(version, self.tm.version), max(version, self.tm.version))}
+        diagnostics = self.get_diagnostics()
+        if diagnostics != self.diagnostics:
+            result["diagnostics"] = self.diagnostics = diagnostics
+        return result
+
+class Daemon(object):
+    """Dispatches JSON-RPC requests to the open documents."""
+
+    def __init__(self):
+        self.documents = {}
+        self.running = True
+        self.lock = threading.Lock()
+
+    def get_document(self, params):
+        try:
+            return self.documents[params["document"]]
+        except KeyError:
+            raise RPCError(INVALID_PARAMS, "Unknown document %r." % params.get("document"))
+
+    def edit(self, params, f, snapshot=True):
+        doc = self.get_document(params)
+        version = doc.tm.version
+        try:
+            f(doc)
+        finally:
+            doc._text = None
+        if snapshot:
+            doc.tm.undo_snapshot()
+        return doc.result(version)
+
+    # ------------------------------- methods ------------------------------ #
+
+    def rpc_languages(self, params):
+        return sorted(lang.name for lang in lang_dict.values() if type(lang) is EcoFile)
+
+    def rpc_open(self, params):
+        name = params.get("document")
+        if not isinstance(name, str):
+            raise RPCError(INVALID_PARAMS, "Missing document name.")
+        doc = Document(params.get("language"), params.get("text", ""))
+        self.documents[name] = doc
+        doc.diagnostics = doc.get_diagnostics()
+        return {"version": doc.tm.version, "diagnostics": doc.diagnostics}
+
+    def rpc_close(self, params):
+        self.get_document(params)
+        del self.documents[params["document"]]
+
+    def rpc_insert(self, params):
+        def insert(doc):
+            doc.move_cursor(params.get("at"))
+            for c in params.get("text", ""):
+                doc.tm.key_normal(c)
+        return self.edit(params, insert)
+
+    def rpc_paste(self, params):
+        def paste(doc):
+            doc.move_cursor(params.get("at"))
+            doc.tm.pasteText(params.get("text", ""))
+        return self.edit(params, paste)
+
+    def rpc_delete(self, params):
+        def delete(doc):
+            doc.move_cursor(params.get("end"))
+            end = doc.tm.cursor.copy()
+            doc.move_cursor(params.get("start"))
+            doc.tm.selection_end = end
+            if doc.tm.hasSelection():
+                doc.tm.deleteSelection()
+        return self.edit(params, delete)
+
+    def rpc_undo(self, params):
+        return self.edit(params, lambda doc: doc.tm.key_ctrl_z(), False)
+
+    def rpc_redo(self, params):
+        return self.edit(params, lambda doc: doc.tm.key_shift_ctrl_z(), False)
+
+    def rpc_add_languagebox(self, params):
+        language = params.get("language")
+        if language not in lang_dict:
+            raise RPCError(INVALID_PARAMS, "Unknown language '%s'." % language)
+        def add(doc):
+            doc.move_cursor(params.get("at"))
+            doc.tm.add_languagebox(lang_dict[language])
+            for c in params.get("text", ""):
+                doc.tm.key_normal(c)
+        return self.edit(params, add)
+
+    def rpc_text(self, params):
+        doc = self.get_document(params)
+        return {"version": doc.tm.version, "text": doc.text()[0]}
+
+    def rpc_diagnostics(self, params):
+        doc = self.get_document(params)
+        doc.diagnostics = doc.get_diagnostics()
+        return {"version": doc.tm.version, "diagnostics": doc.diagnostics}
+
+    def rpc_shutdown(self, params):
+        self.running = False
+
+    # ------------------------------ protocol ------------------------------ #
+
+    def handle(self, request):
+        """Handles a single request (a dictionary) and returns the response,
+        or None for notifications."""
+        if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+            return error_response(None, INVALID_REQUEST, "Invalid request.")
+        rid = request.get("id")
+        params = request.get("params", {})
+        f = getattr(self, "rpc_" + request["method"], None)
+        try:
+            if f is None:
+                raise RPCError(METHOD_NOT_FOUND, "Unknown method '%s'." % request["method"])
+            if not isinstance(params, dict):
+                raise RPCError(INVALID_PARAMS, "Parameters must be an object.")
+            with self.lock:
+                result = f(params)
+        except RPCError as e:
+            response = error_response(rid, e.code, e.message)
+        except Exception as e:
+            logging.exception("Request %r failed", request)
+            response = error_response(rid, INTERNAL_ERROR, "%s: %s" % (e.__class__.__name__, e))
+        else:
+            response = {"jsonrpc": "2.0", "id": rid, "result": result}
+        if "id" not in request:
+            return None
+        return response
+
+    def handle_line(self, line):
+        """Handles a line of input and returns the response as a line of JSON,
+        or None."""
+        try:
+            request = json.loads(line)
+        except ValueError:
+            response = error_response(None, PARSE_ERROR, "Parse error.")
+        else:
+            response = self.handle(request)
+        if response is None:
+            return None
+        return json.dumps(response) + "\n"
+
+    def serve(self, infile, outfile):
+        for line in infile:
+            if not line.strip():
+                continue
+            response = self.handle_line(line)
+            if response is not None:
+                outfile.write(response)
+                outfile.flush()
+            if not self.running:
+                break
+
+def error_response(rid, code, message):
+    return {"jsonrpc": "2.0", "id": rid, "error": {"code": code, "message": message}}
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        daemon = self.server.daemon
+        for line in self.rfile:
+            line = line.decode("utf-8")
+            if not line.strip():
+                continue
+            response = daemon.handle_line(line)
+            if response is not None:
+                self.wfile.write(response.encode("utf-8"))
+                self.wfile.flush()
+            if not daemon.running:
+                # shutdown() waits for serve_forever, so call it from elsewhere
+                threading.Thread(target=self.server.shutdown).start()
+                break
+
+class SocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve_socket(path, daemon=None):
+    """Serves requests on the Unix domain socket `path` until a client sends
+    `shutdown`."""
+    if os.path.exists(path):
+        os.remove(path)
+    server = SocketServer(path, _Handler)
+    server.daemon = daemon or Daemon()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(path)
+
+def main(argv=None):
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-s", "--socket", default=None, help="Listen on this Unix domain socket instead of stdin/stdout")
+    parser.add_option("-l", "--log", default="WARNING", help="Log level: INFO, WARNING, ERROR, DEBUG [default: %default]")
+    (options, args) = parser.parse_args(argv)
+
+    if options.log.upper() in ["INFO", "WARNING", "ERROR", "DEBUG"]:
+        loglevel = getattr(logging, options.log.upper())
+    else:
+        loglevel = logging.WARNING
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=loglevel)
+
+    if options.socket:
+        serve_socket(options.socket)
+        return 0
+    # Eco prints warnings to stdout, which is reserved for the responses
+    out = sys.stdout
+    sys.stdout = sys.stderr
+    Daemon().serve(sys.stdin, out)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -515,9 +515,9 @@ class GraphRenderer:
             commands.append(cmd)
             if node.name in self.highlightwords:
                 realnode = self.highlightwords[node.name]
-                try:
-                    v = int(realnode.get_attr("version", self.graphlayout.pgviewer.version))
-                except AttributeError:
+                # the version in which the node was last saved
+                v, _ = realnode.log.find(self.graphlayout.pgviewer.version)
+                if v is None:
                     v = int(realnode.version)
                 try:
                     changed = int(realnode.get_attr("changed", self.graphlayout.pgviewer.version))
@@ -22,23 +22,10 @@
 
 import re
 from . import helper
+from grammar_parser.gparser import MagicTerminal
 
 
-class Outer_HTML(helper.Generic):
-    def __init__(self):
-        helper.Generic.__init__(self)
-        self.buf_html = []
-
-    def pp(self, node):
-        self.walk(node)
-        self.flush_html()
-        o = "".join(self.buf)
-        # XXX the way we search for a variable and generate a function with a
-        # fixed name is obviously fragile. This should use a name which we know
-        # isn't bound in any other way.
-        m = re.search("([a-zA-Z_][a-zA-Z_0-9]*) = sqlite3.connect", o)
-        if m:
-            o = """
+GEN_EXEC = """
 def gen_exec(query):
     try:
         _c = %s.cursor()
@@ -51,10 +38,40 @@ def gen_exec(query):
     finally:
         _c.close()
 
-%s
-""" % (m.group(1), o)
+"""
+
+
+class Outer_HTML(helper.Generic):
+    def __init__(self, sourcemap=None):
+        helper.Generic.__init__(self, sourcemap=sourcemap)
+        self.buf_html = []
+
+    def pp(self, node):
+        self.walk(node)
+        self.flush_html()
+        o = "".join(self.buf)
+        # XXX the way we search for a variable and generate a function with a
+        # fixed name is obviously fragile. This should use a name which we know
+        # isn't bound in any other way.
+        m = re.search("([a-zA-Z_][a-zA-Z_0-9]*) = sqlite3.connect", o)
+        if m:
+            o = GEN_EXEC % (m.group(1),) + o + "\n"
+        if self.sourcemap is not None:
+            if m:
+                self.sourcemap.add(GEN_EXEC % (m.group(1),))
+            self.map_buffer()
+            if m:
+                self.sourcemap.add("\n")
         return o
 
+    def mark(self, node):
+        # Consecutive HTML is printed by a single statement, which is mapped
+        # to the first of its nodes
+        if isinstance(node.symbol, MagicTerminal):
+            self.flush_html()
+        if not self.buf_html:
+            helper.Generic.mark(self, node)
+
     def language_box(self, name, node):
         self.flush_html()
         if name == "<Python + HTML + SQL>":
@@ -103,5 +120,5 @@ def _escape(s):
     return s.replace("\\", "\\\\").replace("\"", "\\\"").replace("'", "\\'")
 
 
-def export(node):
-    return Outer_HTML().pp(node)
+def export(node, sourcemap=None):
+    return Outer_HTML(sourcemap).pp(node)
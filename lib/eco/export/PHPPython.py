@@ -27,7 +27,7 @@ import logging
 
 class PHP(helper.Generic):
 
-    def __init__(self, source=None):
+    def __init__(self, source=None, sourcemap=None):
         self.nestings = []
         self.variable_assignment = False
         self.bracklvl = 0
@@ -36,6 +36,8 @@ class PHP(helper.Generic):
         self.used_funcs = set()
         self.lineno = 0
         self.source = source
+        self.sourcemap = sourcemap
+        self.marks = []
 
     def language_box(self, name, node):
         if name == "<Python + PHP>":
@@ -84,6 +86,7 @@ class PHP(helper.Generic):
             if isinstance(node, EOS):
                 break
             assert isinstance(node, TextNode)
+            self.mark(node)
             if isinstance(sym, MagicTerminal):
                 if node.parent.parent.symbol.name == "expr_without_variable":
                     self.variable_assignment = True
@@ -189,5 +192,10 @@ def _escapepy(s):
 def _escape(s):
     return s.replace("\\", "\\\\").replace("\"", "\\\"").replace("'", "\\'")
 
-def export(node, source=None):
-    return "<?php{ %s\n}?>" % (PHP(source).pp(node),)
+def export(node, source=None, sourcemap=None):
+    if sourcemap is not None:
+        sourcemap.add("<?php{ ")
+    text = "<?php{ %s\n}?>" % (PHP(source, sourcemap).pp(node),)
+    if sourcemap is not None:
+        sourcemap.add("\n}?>")
+    return text
@@ -20,10 +20,25 @@
 # IN THE SOFTWARE.
 
 from .mocks import MockPopen
+from .sourcemap import SourceMap
 from incparser.annotation import Annotation, Heatmap, Footnote, ToolTip, HUDHeatmap
-import copy, os, os.path, subprocess, tempfile
+import collections, copy, json, os, os.path, subprocess, tempfile
 import sys
 
+# The number of runs kept in the rolling profile
+ROLLING_RUNS = 5
+
+# Converts a stats file written by cProfile into JSON. This is run by the
+# profiled interpreter, since the marshal format of stats files differs
+# between Python versions.
+STATS_TO_JSON = """
+import json, pstats, sys
+def callers(d):
+    return [[list(f), list(c) if isinstance(c, tuple) else c] for f, c in d.items()]
+stats = pstats.Stats(sys.argv[1]).stats
+json.dump([[list(f), list(v[:4]), callers(v[4])] for f, v in stats.items()], sys.stdout)
+"""
+
 class CPythonFuncProfileMsg(Annotation):
     def __init__(self, annotation):
         self._hints = [ToolTip(), Footnote(), HUDHeatmap()]
@@ -52,7 +67,135 @@ class CPythonFuncProfileVal(Annotation):
         return self._hints
 
 
+class FunctionStats(object):
+    """Profile of a single function of the exported file, summed up over one
+    or more runs. Callers and callees are counted by their names."""
+
+    def __init__(self, name, lineno, ncalls=0, primcalls=0, tottime=0.0, cumtime=0.0):
+        self.name = name
+        self.lineno = lineno
+        self.ncalls = ncalls
+        self.primcalls = primcalls
+        self.tottime = tottime
+        self.cumtime = cumtime
+        self.callers = {}
+        self.callees = {}
+        self.runs = 1
+
+    def copy(self):
+        stats = FunctionStats(self.name, self.lineno, self.ncalls, self.primcalls, self.tottime, self.cumtime)
+        stats.callers = dict(self.callers)
+        stats.callees = dict(self.callees)
+        stats.runs = self.runs
+        return stats
+
+    def add(self, other):
+        self.ncalls += other.ncalls
+        self.primcalls += other.primcalls
+        self.tottime += other.tottime
+        self.cumtime += other.cumtime
+        for name, calls in other.callers.items():
+            self.callers[name] = self.callers.get(name, 0) + calls
+        for name, calls in other.callees.items():
+            self.callees[name] = self.callees.get(name, 0) + calls
+        self.runs += other.runs
+
+    def describe(self):
+        runs = float(self.runs)
+        if self.ncalls != self.primcalls:
+            ncalls = "%g/%g" % (self.ncalls / runs, self.primcalls / runs)
+        else:
+            ncalls = "%g" % (self.ncalls / runs)
+        msg = "%s: called %s times ran at %.6fs / call (%.6fs total, %.6fs cumulative)" % (
+            self.name, ncalls, self.tottime / max(self.ncalls, 1), self.tottime / runs, self.cumtime / runs)
+        if self.runs > 1:
+            msg += "\naveraged over %d runs" % self.runs
+        for label, calls in [("called from", self.callers), ("calls", self.callees)]:
+            if calls:
+                msg += "\n%s: %s" % (label, ", ".join("%s (%g)" % (name, calls[name] / runs)
+                                                     for name in sorted(calls)))
+        return msg
+
+
+def load_stats(entries, filename):
+    """Returns the profiles of the functions defined in `filename`, by their
+    line numbers and names. `entries` are the functions of a stats file as
+    converted by `STATS_TO_JSON`. The module itself isn't included."""
+    def is_exported(f):
+        return f[0] == filename or f[0] == os.path.basename(filename)
+    def label(f):
+        if is_exported(f):
+            return f[2]
+        return "%s:%d(%s)" % (os.path.basename(f[0]), f[1], f[2])
+
+    functions = {}
+    callees = []
+    for f, (primcalls, ncalls, tottime, cumtime), callers in entries:
+        # callers map to (ncalls, primcalls, tottime, cumtime), or just the
+        # number of calls in stats files of old Python versions
+        callers = [(caller, calls[0] if isinstance(calls, list) else calls)
+                   for caller, calls in callers]
+        for caller, calls in callers:
+            callees.append((caller, label(f), calls))
+        if not is_exported(f) or f[2] == "<module>":
+            # the module's code starts on the first line, like the first
+            # function that is defined there
+            continue
+        stats = FunctionStats(f[2], f[1], ncalls, primcalls, tottime, cumtime)
+        for caller, calls in callers:
+            stats.callers[label(caller)] = calls
+        functions[(f[1], f[2])] = stats
+    for caller, name, calls in callees:
+        stats = functions.get((caller[1], caller[2]))
+        if stats is not None and is_exported(caller):
+            stats.callees[name] = calls
+    return functions
+
+
+class Profile(object):
+    """The profiles of the last `ROLLING_RUNS` runs of a program, by the nodes
+    their functions are defined at. Since nodes are kept while editing, runs
+    before and after an edit are merged, as long as the function still
+    exists."""
+
+    def __init__(self, maxruns=ROLLING_RUNS):
+        self.runs = collections.deque(maxlen=maxruns)
+        self.annotated = set()
+
+    def add_run(self, functions):
+        """Adds the profile of a run, mapping nodes to `FunctionStats`."""
+        self.runs.append(functions)
+
+    def aggregate(self):
+        """Sums up the profiles of all runs, ignoring deleted functions."""
+        total = {}
+        for run in self.runs:
+            for node, stats in run.items():
+                if node.deleted:
+                    continue
+                if node in total:
+                    total[node].add(stats)
+                else:
+                    total[node] = stats.copy()
+        return total
+
+    def heat(self, total):
+        """Normalises the time spent in each function per run to [0, 1]."""
+        times = dict((node, stats.tottime / stats.runs) for node, stats in total.items())
+        if not times:
+            return {}
+        low = min(times.values())
+        diff = max(times.values()) - low
+        if diff == 0:
+            return dict((node, 1.0) for node in times)
+        return dict((node, (t - low) / diff) for node, t in times.items())
+
+
 class CPythonExporter(object):
+
+    # the interpreter used to run and profile programs
+    python = "python2"
+
     def __init__(self, tm):
         self.tm = tm
 
@@ -112,64 +255,79 @@ RemotePdb('localhost', 8210).set_trace();"""
 
     def _profile(self):
         f = tempfile.mkstemp()
-        self.tm.export_as_text(f[1])
-        # Delete any stale profile info
+        os.close(f[0])
+        sourcemap = SourceMap()
+        self.tm.export_as_text(f[1], sourcemap)
         self.tm.profile_is_dirty = False
-        self.tm.profile_map = dict()
-        self.tm.profile_data = dict()
+        statsfile = tempfile.mkstemp(suffix=".pstats")
+        os.close(statsfile[0])
         # python -m cProfile [-o output_file] [-s sort_order] myscript.py
-        proc = subprocess.Popen(["python2", "-m", "cProfile", f[1]], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0)
+        proc = subprocess.Popen([self.python, "-m", "cProfile", "-o", statsfile[1], f[1]], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0)
         stdout_value, stderr_value = proc.communicate()
         # Mock Popen here, so that we can return a Popen-like object.
-        # This allows Eco to append the output of the profiler
+        # This allows Eco to append the output of the program
         # to the console.
         mock = MockPopen(copy.copy(stdout_value), copy.copy(stderr_value))
-        # Lex profiler output:
-        # ncalls  tottime  percall  cumtime  percall fname:lineno(fn)
-        table = False
-        temp_cursor = self.tm.cursor.copy()
-        ncalls_dict = dict()
-        for line in stdout_value.split('\n'):
-            tokens = line.strip().split()
-            if not tokens:
-                continue
-            elif len(tokens) < 6:
+        try:
+            functions = load_stats(self._read_stats(statsfile[1]), f[1])
+        finally:
+            os.remove(statsfile[1])
+
+        run = {}
+        for (lineno, name), stats in functions.items():
+            node = self._find_line(sourcemap, lineno - 1)
+            if node is None:
                 continue
-            elif not table:
-                if tokens[0] == 'ncalls':
-                    table = True
+            if node in run:
+                # e.g. a lambda on the same line
+                run[node].add(stats)
+                run[node].runs = 1
             else:
-                if not ':' in tokens[5]:
-                    continue
-                fname, loc = tokens[5].split(':')
-                if not (fname == os.path.basename(f[1]) or fname == f[1]):
-                    continue
-                ncalls = tokens[0]
-                lineno = int(loc.split('(')[0])
-                func = loc.split('(')[1][:-1]
-                # Move cursor to correct line and character
-                msg = ('%s: called %s times ran at %ss / call' % (func, ncalls, tokens[2]))
-                temp_cursor.line = lineno - 1
-                temp_cursor.move_to_x(0)
-                node = temp_cursor.find_next_visible(temp_cursor.node)
-                if node.lookup == "<ws>":
-                    node = node.next_term
-                node.remove_annotations_by_class(CPythonFuncProfileMsg)
-                node.add_annotation(CPythonFuncProfileMsg(msg))
-                if '/' in ncalls:
-                    ncalls_dict[node] = float(ncalls.split('/')[0])
-                else:
-                    ncalls_dict[node] = float(ncalls)
-
-        # Normalise profiler information.
-        vals = list(ncalls_dict.values())
-        val_min = float(min(vals))
-        val_max = float(max(vals))
-        val_diff = val_max - val_min
-        for node in ncalls_dict:
-            ncalls_dict[node] = (ncalls_dict[node] - val_min) / val_diff
-        for node in ncalls_dict:
+                run[node] = stats
+        if not run:
+            # the program couldn't be run or profiled
+            return mock
+        if self.tm.profile is None:
+            self.tm.profile = Profile()
+        self._annotate(self.tm.profile, run)
+        return mock
+
+    def _read_stats(self, path):
+        """Returns the functions in the stats file `path`, loaded by the
+        profiled interpreter (see `STATS_TO_JSON`)."""
+        if os.path.getsize(path) == 0:
+            # the program couldn't be run
+            return []
+        proc = subprocess.Popen([self.python, "-c", STATS_TO_JSON, path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout_value, _ = proc.communicate()
+        if proc.returncode != 0:
+            return []
+        return json.loads(stdout_value.decode("utf-8"))
+
+    def _annotate(self, profile, run):
+        """Adds `run` to the rolling `profile` and annotates all of its
+        functions with their messages and normalised heat values at once."""
+        profile.add_run(run)
+        total = profile.aggregate()
+        heat = profile.heat(total)
+        for node in profile.annotated:
+            node.remove_annotations_by_class(CPythonFuncProfileMsg)
             node.remove_annotations_by_class(CPythonFuncProfileVal)
-            node.add_annotation(CPythonFuncProfileVal(ncalls_dict[node]))
+        for node, stats in total.items():
+            node.add_annotation(CPythonFuncProfileMsg(stats.describe()))
+            node.add_annotation(CPythonFuncProfileVal(heat[node]))
+        profile.annotated = set(total)
+        self.tm.profile_map = total
+        self.tm.profile_data = heat
 
-        return mock
+    def _find_line(self, sourcemap, line):
+        """Returns the first node on `line` of the exported file, skipping
+        whitespace."""
+        try:
+            nodes = sourcemap.get_nodes(line)
+        except IndexError:
+            return None
+        for node in nodes:
+            if node.lookup != "<ws>":
+                return node
+        return None
@@ -20,43 +20,213 @@
 # IN THE SOFTWARE.
 
 
-try:
-    import __pypy__
-except ImportError:
-    from PyQt5 import QtGui
+from incparser.astree import BOS, EOS, TextNode, MultiTextNode
+from grammar_parser.gparser import MagicTerminal, IndentationTerminal, Nonterminal
+
+
+# Subtrees with at most this many characters keep a copy of their text, which
+# is reused until one of their nodes changes.
+CHUNK_SIZE = 1024
+
+
+def get_pieces(root):
+    """Returns the text of the parse tree `root` as a list of strings and the
+    language box nodes in between, whose text exporters can splice in as
+    needed. Return terminals are exported as newlines and indentation
+    terminals are left out.
+
+    Unchanged subtrees reuse the text they had in the last export. A subtree
+    is unchanged if its root still has the same snapshot in its history and
+    none of its nodes has been marked as changed since, which also covers
+    undoing and redoing edits. Version numbers alone aren't enough, since
+    editing after an undo saves different trees under the same versions. The
+    only exception are multiline tokens (`MultiTextNode`), whose children are
+    compared separately."""
+    pieces = []
+    _collect(root, pieces, None)
+    return _join(pieces)
+
+
+def get_mapped_pieces(root):
+    """Like `get_pieces`, but returns the text of every terminal separately,
+    as a list of the terminals and their text. Language boxes are returned as
+    pieces of their own, as in `get_pieces`. The text isn't cached, so this
+    is only used if the text has to be mapped back to the tree (see
+    `export.sourcemap`)."""
+    pieces = []
+    todo = [root]
+    while todo:
+        node = todo.pop()
+        if node.deleted:
+            continue
+        if node.children:
+            todo.extend(reversed(node.children))
+            continue
+        piece = _leaf_piece(node)
+        if piece is not None:
+            pieces.append((node, piece))
+    return pieces
+
+
+def export_text(root, sourcemap=None):
+    """Returns the text of the parse tree `root` including the text of all
+    language boxes. If a `SourceMap` is given, the text of every terminal is
+    added to it."""
+    text = []
+    if sourcemap is not None:
+        for node, piece in get_mapped_pieces(root):
+            if isinstance(piece, TextNode):
+                text.append(export_text(piece.symbol.ast, sourcemap))
+            else:
+                text.append(piece)
+                sourcemap.add(piece, node)
+        return "".join(text)
+    for piece in get_pieces(root):
+        if isinstance(piece, TextNode):
+            text.append(export_text(piece.symbol.ast))
+        else:
+            text.append(piece)
+    return "".join(text)
+
+
+def _collect(node, pieces, multis):
+    """Appends the text of `node` to `pieces`. `multis` is None if the text
+    can be taken from or stored in the cache. Otherwise the node is part of a
+    subtree being cached, and the contents of multiline tokens are recorded in
+    `multis`."""
+    if node.deleted:
+        # deleted nodes can remain in the tree until the next parse
+        return
+    if not node.children:
+        piece = _leaf_piece(node)
+        if piece is not None:
+            pieces.append(piece)
+        return
+    cached = node.export_cache
+    if cached is not None:
+        node.export_cache = None
+        if multis is None and _is_valid(node, cached):
+            node.export_cache = cached
+            pieces.extend(cached[1])
+            return
+    if multis is None and 0 <= node.textlen <= CHUNK_SIZE:
+        chunk = []
+        multis = []
+        _collect_children(node, chunk, multis)
+        chunk = _join(chunk)
+        node.export_cache = (node.log.stamp(node.version), chunk, multis)
+        pieces.extend(chunk)
+    else:
+        _collect_children(node, pieces, multis)
 
-from incparser.astree import BOS, EOS, TextNode
-from grammar_parser.gparser import MagicTerminal, IndentationTerminal
+
+def _leaf_piece(node):
+    """Returns the text of a node without children, the node itself if it is
+    a language box, or None if it has no text."""
+    if isinstance(node, BOS) or isinstance(node, EOS):
+        return None
+    sym = node.symbol
+    if isinstance(sym, Nonterminal):
+        return None
+    elif isinstance(sym, MagicTerminal):
+        return node
+    elif isinstance(sym, IndentationTerminal):
+        return None
+    elif sym.name == "\r":
+        return "\n"
+    else:
+        return sym.name
+
+
+def _collect_children(node, pieces, multis):
+    if isinstance(node, MultiTextNode) and multis is not None:
+        # inserting into multiline tokens doesn't mark them as changed
+        multis.append((node, [(c, c.symbol.name) for c in node.children]))
+    for c in node.children:
+        _collect(c, pieces, multis)
+
+
+def _is_valid(node, cached):
+    snapshot, _, multis = cached
+    if node.changed or node.nested_changes or node.new:
+        return False
+    if snapshot is None or node.log.stamp(node.version) is not snapshot:
+        return False
+    for multi, children in multis:
+        if len(multi.children) != len(children):
+            return False
+        for c, (old, name) in zip(multi.children, children):
+            if c is not old or c.symbol.name != name:
+                return False
+    return True
+
+
+def _join(pieces):
+    """Merges consecutive strings in `pieces`."""
+    result = []
+    text = []
+    for piece in pieces:
+        if isinstance(piece, TextNode):
+            if text:
+                result.append("".join(text))
+                text = []
+            result.append(piece)
+        else:
+            text.append(piece)
+    if text:
+        result.append("".join(text))
+    return result
 
 
 class Generic:
-    def __init__(self, source=None, parent_ln = 0):
+    def __init__(self, source=None, parent_ln = 0, sourcemap=None):
         self.buf = []
         self.lineno = 1
         self.source = source
         self.parent_ln = parent_ln
+        self.sourcemap = sourcemap
+        self.marks = []
 
     def pp(self, node):
         self.walk(node)
+        self.map_buffer()
         return "".join(self.buf)
 
     def walk(self, node):
-        while True:
-            if node.lookup == "<return>":
-                self.lineno += 1
-            node = node.next_term
-            sym = node.symbol
-            if isinstance(node, EOS):
-                break
-            assert isinstance(node, TextNode)
-            if isinstance(sym, MagicTerminal):
-                self.language_box(sym.name, node.symbol.ast.children[0])
-            elif isinstance(sym, IndentationTerminal):
-                pass
-            elif sym.name == "\r":
-                self.text("\n")
-            else:
-                self.text(sym.name)
+        if self.sourcemap is None:
+            for piece in get_pieces(node.parent):
+                self.piece(piece)
+        else:
+            for n, piece in get_mapped_pieces(node.parent):
+                self.mark(n)
+                self.piece(piece)
+
+    def piece(self, piece):
+        if isinstance(piece, TextNode):
+            self.language_box(piece.symbol.name, piece.symbol.ast.children[0])
+        else:
+            self.text(piece)
+            self.lineno += piece.count("\n")
+
+    def mark(self, node):
+        """Records that the text appended to the buffer from now on was
+        generated from `node`. Language boxes are mapped as a whole, since
+        their text is usually transformed by the exporter."""
+        if self.sourcemap is not None:
+            self.marks.append((len(self.buf), node))
+
+    def map_buffer(self):
+        """Adds the text in the buffer to the source map, if there is one."""
+        if self.sourcemap is None:
+            return
+        node = None
+        marks = iter(self.marks)
+        mark = next(marks, None)
+        for i, text in enumerate(self.buf):
+            while mark is not None and mark[0] <= i:
+                node = mark[1]
+                mark = next(marks, None)
+            self.sourcemap.add(text, node)
 
     def language_box(self, name, node):
         error("Incorrectly nested language box '%s'." % name)
@@ -66,6 +236,7 @@ class Generic:
 
 
 def error(msg):
+    from PyQt5 import QtGui
     d = QtGui.QMessageBox(QtGui.QMessageBox.Warning, "Warning", "Unexpected node type: %s" % msg,
       QtGui.QMessageBox.NoButton)
     d.addButton("&Abort", QtGui.QMessageBox.RejectRole)
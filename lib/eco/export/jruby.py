@@ -21,6 +21,7 @@
 
 import logging
 import os
+from array import array
 import os.path
 import tempfile
 import subprocess
@@ -28,8 +29,9 @@ import subprocess
 from incparser.annotation import Annotation, Footnote, ToolTip, Railroad
 from incparser.annotation import HUDEval, HUDTypes, HUDCallgraph
 
-from incparser.astree import EOS
-from grammar_parser.gparser import MagicTerminal, IndentationTerminal
+from incparser.astree import EOS, TextNode
+from export.helper import get_pieces, get_mapped_pieces
+from export.sourcemap import SourceMap
 
 from PyQt5.QtCore import QSettings
 
@@ -98,127 +100,172 @@ class JRubyEvalStrings(Annotation):
         return self._hints
 
 
-class Source(object):
-    """JRuby source file (needed by callgraph profiler)."""
-
-    def __init__(self, file, line_start, line_end):
-        self.file = file
-        self.line_start = int(line_start)
-        self.line_end = int(line_end)
-
-
-class Method(object):
-    """JRuby method (needed by callgraph profiler)."""
-
-    def __init__(self, id_, name, source):
-        self.id = int(id_)
-        self.name = name
-        self.source = source
-        self.versions = []
-        self.callsites = []
-        self.is_mega = False
-
-    def is_library(self):
-        return "jruby/lib/" in self.source.file
-
-    def is_core(self):
-        return ("/core/" in self.source.file or "core.rb" in self.source.file
-                or self.source.file == "(unknown)")
-
-    def is_hidden(self):
-        return (self.source.file == "run_jruby_root" or
-                self.source.file == "context" or
-                self.name == "Truffle::Boot#run_jruby_root" or
-                self.name == "Truffle::Boot#context")
-
-    def reachable(self):
-        return self.callsites
-
-    def __str__(self):
-        return ("Method: %s id=%g callsites=[ %s ]" %
-                (self.name, self.id, " ".join([str(cs) for cs in self.callsites])))
-
-
-class MethodVersion(object):
-
-    def __init__(self, id_, method):
-        self.id = int(id_)
-        self.method = method
-        self.callsite_versions = []
-        self.called_from = []
-        self.eval_code = []
+# Flags of methods
+CORE = 1        # defined by JRuby
+LOCAL = 2       # defined in the profiled file
+ANNOTATE = 4    # defined by the programmer in the profiled file
+EVAL = 8        # an eval method
+MEGA = 16       # has a megamorphic callsite
+
+# Targets of calls that aren't method versions
+CALLS_MEGA = -1
+CALLS_FOREIGN = -2
+
+
+class CallgraphLog(object):
+    """JRuby callgraph log (written with -Xtruffle.callgraph.write), parsed a
+    line at a time.
+
+    The ids in the log are interned to consecutive indices, and every object
+    is described by the object it belongs to (the method of a method version
+    or callsite, the callsite of a callsite version, -1 for a method) and an
+    extra value (the flags of a method, the line of a callsite, the method
+    version of a callsite version), which are kept in arrays. Calls are kept
+    in two more arrays, holding the callsite versions and the ids of the
+    method versions they call, which may not have been seen yet. Names, types
+    and eval strings are only kept for the methods that are annotated, i.e.
+    those defined in `filename`, and eval strings for eval methods, since
+    they are passed on to their callers."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.ids = {}
+        self.owners = array("l")
+        self.extras = array("l")
+        self.call_sites = array("l")
+        self.call_targets = array("l")
+        # names, first lines and versions of the annotated methods
+        self.names = {}
+        self.lines = {}
+        self.versions = {}
+        # argument types and eval strings of the versions of annotated and
+        # eval methods
         self.arg_types = {}
+        self.eval_code = {}
+        # callsite versions calling the versions of annotated and eval methods
+        self.called_from = {}
+
+    def _add(self, log_id, owner, extra):
+        index = len(self.owners)
+        self.ids[int(log_id)] = index
+        self.owners.append(owner)
+        self.extras.append(extra)
+        return index
+
+    def _is_kept(self, version):
+        return self.extras[self.owners[version]] & (ANNOTATE | EVAL)
+
+    def parse(self, lines):
+        """Parses the lines of a log, and returns False if there is a line
+        that can't be parsed."""
+        ids = self.ids
+        owners, extras = self.owners, self.extras
+        call_sites, call_targets = self.call_sites, self.call_targets
+        for line in lines:
+            tokens = line.split()
+            if len(tokens) == 0:
+                continue
+            kind = tokens[0]
+            if kind == "calls":
+                call_sites.append(ids[int(tokens[1])])
+                if tokens[2] == "mega":
+                    call_targets.append(CALLS_MEGA)
+                elif tokens[2] == "foreign":
+                    call_targets.append(CALLS_FOREIGN)
+                else:
+                    # We just store the method id here for now as we may not have seen all methods yet
+                    call_targets.append(int(tokens[2]))
+            elif kind == "callsite-version":
+                ids[int(tokens[3])] = len(owners)
+                owners.append(ids[int(tokens[1])])
+                extras.append(ids[int(tokens[2])])
+            elif kind == "callsite":
+                self._add(tokens[2], ids[int(tokens[1])], int(tokens[3]))
+            elif kind == "method":
+                self._add_method(tokens)
+            elif kind == "method-version":
+                method = ids[int(tokens[1])]
+                version = self._add(tokens[2], method, 0)
+                if extras[method] & ANNOTATE:
+                    self.versions[method].append(version)
+            elif kind == "local":
+                version = ids[int(tokens[1])]
+                if extras[owners[version]] & ANNOTATE:
+                    types = self.arg_types.setdefault(version, {})
+                    types.setdefault(tokens[2], []).append(tokens[3])
+            elif kind == "eval":
+                version = ids[int(tokens[1])]
+                if self._is_kept(version):
+                    self.eval_code.setdefault(version, []).append(" ".join(tokens[2:]))
+            else:
+                logging.debug("Cannot parse the following: %s" % line)
+                return False
+        return True
+
+    def _add_method(self, tokens):
+        name = " ".join(tokens[2:-3])
+        source, line_start = tokens[-3], int(tokens[-2])
+        flags = 0
+        if "/core/" in source or "core.rb" in source or source == "(unknown)":
+            flags |= CORE
+        if "#eval" in name:
+            flags |= EVAL
+        if source == self.filename:
+            flags |= LOCAL
+            # Ignore methods like <main> or times which were inserted by
+            # the interpreter.
+            hidden = name in ("Truffle::Boot#run_jruby_root", "Truffle::Boot#context")
+            if not (flags & CORE or hidden or "jruby/lib/" in source or
+                    name.startswith("<") or line_start < 0):
+                flags |= ANNOTATE
+        method = self._add(tokens[1], -1, flags)
+        if flags & ANNOTATE:
+            self.names[method] = name
+            self.lines[method] = line_start
+            self.versions[method] = []
+
+    def resolve(self):
+        """Resolves the targets of calls and propagates eval strings to the
+        callers of eval methods."""
+        owners, extras = self.owners, self.extras
+        ids, called_from = self.ids, self.called_from
+        for site, target in zip(self.call_sites, self.call_targets):
+            if target == CALLS_FOREIGN:
+                continue
+            if target == CALLS_MEGA:
+                extras[owners[extras[site]]] |= MEGA
+                continue
+            target = ids[target]
+            if extras[owners[target]] & (ANNOTATE | EVAL):
+                called_from.setdefault(target, []).append(site)
+        # Resolve eval() strings. This must be done after resolving method
+        # ids, because we need to walk eval strings back up the callgraph.
+        # The strings are extended in place and in the order of the log, so
+        # that they are passed on through eval methods calling each other.
+        for version in sorted(called_from):
+            code = self.eval_code.get(version)
+            if not code or not extras[owners[version]] & EVAL:
+                continue
+            for site in called_from[version]:
+                caller = extras[site]
+                if self._is_kept(caller):
+                    self.eval_code.setdefault(caller, []).extend(code)
 
-    def reachable(self):
-        # called_from isn't reachable
-        return [self.method] + self.callsite_versions
-
-    def __str__(self):
-        types = "Arguments had types:" if len(self.arg_types) > 0 else ""
-        for name in self.arg_types:
-            types += "%s : %s\n" % (name, ", ".join(self.arg_types[name]))
-        evals = ""
-        if len(self.eval_code) > 0:
-            evals = "Evaluated from:" + "\n\t".join(self.eval_code)
-        return ("Method Version: %s id=%g called_from=[ %s ] %s" %
-                (self.method.name, self.id,
-                 ", ".join([str(cs) for cs in self.called_from]),
-                 types, evals))
-
-class CallSite(object):
-    """JRuby callsite (needed by callgraph profiler)."""
-
-    def __init__(self, id_, method, line):
-        self.id = int(id_)
-        self.method = method
-        self.line = int(line)
-        self.versions = []
-
-    def reachable(self):
-        return [self.method] + self.versions
-
-    def __str__(self):
-        return ("Callsite: %s id=%g line=%g" %
-                (self.method.name, self.id, self.line))
-
-
-class CallSiteVersion(object):
-    """JRuby callsite version (needed by callgraph profiler)."""
-
-    def __init__(self, id_, callsite, method_version):
-        self.id = int(id_)
-        self.callsite = callsite
-        self.method_version = method_version
-        self.calls = []
-
-    def reachable(self):
-        """Method_version isn't reachable - find it through calls."""
-        return [self.callsite] + self.calls
-
-    def __str__(self):
-        return ("Callsite Version: %s id=%g" %
-                (self.callsite.method.name, self.id))
-
-
-class Mega(object):
-    """Class used to indicate that a method is megamorphic."""
-
-    def __str__(self):
-        return "Megamorphic"
-
-
-class Foreign(object):
-    """Indicate that a method was defined in a language other than JRuby."""
-
-    def __str__(self):
-        return "Foreign function"
+    def annotated_methods(self):
+        """Returns the indices of the methods to annotate, in the order of the
+        log. Only reachable methods are annotated, where the methods not
+        defined by JRuby and the versions of the main program are reachable,
+        as well as everything they call. Since this includes all methods that
+        are annotated, the callgraph doesn't need to be walked."""
+        return sorted(self.names)
 
 
 class JRubyExporter(object):
     """Export, run or profile a JRuby file."""
 
-    def __init__(self, tm):
+    def __init__(self, tm, sourcemap=None):
         self.tm = tm  # TreeManager object.
+        self.sourcemap = sourcemap
         self.sl_functions = {}
         self._sl_output = []
         self._wrappers = []
@@ -239,19 +286,19 @@ class JRubyExporter(object):
             self._walk_rb(node)
 
     def _walk_rb(self, node):
-        while True:
-            node = node.next_term
-            sym = node.symbol
-            if isinstance(node, EOS):
-                break
-            if isinstance(sym, MagicTerminal):
-                self._language_box(sym.name, node.symbol.ast.children[0])
-            elif isinstance(sym, IndentationTerminal):
-                self._output.append(sym)
-            elif sym.name == "\r":
-                self._output.append("\n")
+        if self.sourcemap is not None:
+            for n, piece in get_mapped_pieces(node.parent):
+                if isinstance(piece, TextNode):
+                    self._language_box(piece.symbol.name, piece.symbol.ast.children[0])
+                else:
+                    self._output.append(piece)
+                    self.sourcemap.add(piece, n)
+            return
+        for piece in get_pieces(node.parent):
+            if isinstance(piece, TextNode):
+                self._language_box(piece.symbol.name, piece.symbol.ast.children[0])
             else:
-                self._output.append(sym.name)
+                self._output.append(piece)
 
     def _export_as_text(self, path):
         node = self.tm.lines[0].node # first node
@@ -271,10 +318,12 @@ class JRubyExporter(object):
                                 bufsize=0)
 
     def _profile(self, path):
-        callgraph_processor = JRubyCallgraphProcessor(self.tm)
+        if self.sourcemap is None:
+            self.sourcemap = SourceMap()
+        callgraph_processor = JRubyCallgraphProcessor(self.tm, self.sourcemap)
 
         _, src_file_name = tempfile.mkstemp(suffix=".rb")
-        self.tm.export_as_text(src_file_name).split("\n")
+        self.tm.export_as_text(src_file_name, self.sourcemap).split("\n")
 
         log_file_name = os.path.join("/", "tmp",
                                      next(tempfile._get_candidate_names()) + ".txt")
@@ -302,10 +351,13 @@ class JRubyExporter(object):
 
 
 class JRubyCallgraphProcessor(object):
-    """Process a JRuby callgraph log and annotate the current parse tree."""
+    """Process a JRuby callgraph log and annotate the current parse tree.
+    Line numbers in the log are mapped to the tree with the source map of the
+    exported file, if there is one."""
 
-    def __init__(self, tm):
+    def __init__(self, tm, sourcemap=None):
         self.tm = tm
+        self.sourcemap = sourcemap
 
     def remove_all_annotations(self):
         temp_cursor = self.tm.cursor.copy()
@@ -323,197 +375,103 @@ class JRubyCallgraphProcessor(object):
         """Run JRuby and dump a callgraph to disk.
         Parse the callgraph and annotate the syntax tree.
         """
-        objects = dict()
+        log = CallgraphLog(src_file_name)
         with open(log_file_name) as fd:
-            output = fd.read()
-            lines = output.split("\n")
-            i = 0
-            while i < len(lines):
-                line = lines[i]
-                tokens = line.split()
-                if len(tokens) == 0:
-                    pass
-                elif tokens[0] == "method":
-                    method = Method(tokens[1], " ".join(tokens[2:-3]), Source(*tokens[-3:]))
-                    objects[method.id] = method
-                elif tokens[0] == "method-version":
-                    method = objects[int(tokens[1])]
-                    method_version = MethodVersion(tokens[2], method)
-                    objects[method_version.id] = method_version
-                    method.versions.append(method_version)
-                elif tokens[0] == "local":
-                    method_version = objects[int(tokens[1])]
-                    if tokens[2] not in method_version.arg_types:
-                        method_version.arg_types[tokens[2]] = []
-                    method_version.arg_types[tokens[2]].append(tokens[3])
-                elif tokens[0] == "eval":
-                    method_version = objects[int(tokens[1])]
-                    eval_code = " ".join(tokens[2:])
-                    method_version.eval_code.append(eval_code)
-                elif tokens[0] == "callsite":
-                    method = objects[int(tokens[1])]
-                    callsite = CallSite(tokens[2], method, tokens[3])
-                    objects[callsite.id] = callsite
-                    method.callsites.append(callsite)
-                elif tokens[0] == "callsite-version":
-                    callsite = objects[int(tokens[1])]
-                    method_version = objects[int(tokens[2])]
-                    callsite_version = CallSiteVersion(tokens[3], callsite, method_version)
-                    objects[callsite_version.id] = callsite_version
-                    callsite.versions.append(callsite_version)
-                    method_version.callsite_versions.append(callsite_version)
-                elif tokens[0] == "calls":
-                    callsite_version = objects[int(tokens[1])]
-                    if tokens[2] == "mega":
-                        callsite_version.calls.append(Mega())
-                    elif tokens[2] == "foreign":
-                        callsite_version.calls.append(Foreign())
-                    else:
-                        # We just store the method id here for now as we may not have seen all methods yet
-                        callsite_version.calls.append(int(tokens[2]))
-                else:
-                    logging.debug("Cannot parse the following: %s" % line)
-                    return
-                i += 1
-
-        # Resolve method ids to point to the actual object
-        for obj in objects.values():
-            if isinstance(obj, CallSiteVersion):
-                callsite_version = obj
-                new_calls = []
-                for call in callsite_version.calls:
-                    if isinstance(call, Mega):
-                        new_calls.append(Mega())
-                        callsite_version.method_version.method.is_mega = True
-                    elif isinstance(call, Foreign):
-                        callsite_version.method_version.method.is_foreign = True
-                    else:
-                        called = objects[call]
-                        called.called_from.append(callsite_version)
-                        new_calls.append(called)
-                callsite_version.calls = new_calls
-        # Resolve eval() strings. This must be done after resolving method
-        # ids, because we need to walk eval strings back up the callgraph.
-        for obj in objects.values():
-            if isinstance(obj, MethodVersion) and "#eval" in obj.method.name:
-                version = obj
-                if version.eval_code:
-                    for caller in version.called_from:
-                        caller.method_version.eval_code.extend(version.eval_code)
-
-        # Find which objects were actually used
-        reachable_objects = set()
-        reachable_worklist = set()
-        for obj in objects.values():
-            if ((isinstance(obj, Method) and not obj.is_core()) or
-                (isinstance(obj, MethodVersion) and
-                 obj.method.name == "<main>" and
-                 not obj.method.is_core())):
-                reachable_worklist.add(obj)
-
-        while len(reachable_worklist) > 0:
-            obj = reachable_worklist.pop()
-            if isinstance(obj, Mega):
-                continue
-            elif obj in reachable_objects:
-                continue
-            else:
-                reachable_objects.add(obj)
-                reachable_worklist.update(obj.reachable())
+            if not log.parse(fd):
+                return
+        log.resolve()
 
         # Process graph of reachable objects and annotate parse tree.
         self.remove_all_annotations()
 
-        for obj in reachable_objects:
-            if (isinstance(obj, Method) and obj.source.file != "(unknown)" and
-                not obj.is_hidden() and not obj.is_core()
-                and not "jruby/lib/" in obj.source.file
-                and obj.source.file != "(eval)"):
-                method = obj
-                def_msg = method.name
-                if method.is_mega:
-                    def_msg += " is megamorphic."
-                num_versions = len(method.versions)
-                def_lineno = method.source.line_start
-                def_filename = method.source.file
-                # For now, if a method is not defined in the currently open
-                # file, we ignore it. We also ignore methods like <main>
-                # or times which were inserted by the interpreter.
-                if (def_filename != src_file_name or
-                      method.name.startswith("<") or
-                      method.source.line_start < 0):
-                    continue
-                def_msg += "\n%s has %d versions" % (method.name, num_versions)
-                def_arg_types = {}  # str -> set (string)
-                def_eval_strings = []
-                num_calls = 0
-                # Find and annotate method calls.
-                for version in method.versions:
-                    for key in version.arg_types:
-                        if key == "(self)":
-                            continue
-                        if key in def_arg_types:
-                            def_arg_types[key].update(version.arg_types[key])
-                        else:
-                            def_arg_types[key] = set(version.arg_types[key])
-                    for eval_code in version.eval_code:
-                        def_eval_strings.append("eval(%s)" % eval_code)
-                    if len(version.called_from) == 0:
+        owners, extras = log.owners, log.extras
+        for method in log.annotated_methods():
+            name = log.names[method]
+            is_mega = bool(extras[method] & MEGA)
+            def_msg = name
+            if is_mega:
+                def_msg += " is megamorphic."
+            versions = log.versions[method]
+            def_lineno = log.lines[method]
+            def_msg += "\n%s has %d versions" % (name, len(versions))
+            def_arg_types = {}  # str -> set (string)
+            def_eval_strings = []
+            num_calls = 0
+            # Find and annotate method calls.
+            for version in versions:
+                arg_types = log.arg_types.get(version, {})
+                for key in arg_types:
+                    if key == "(self)":
                         continue
-                    for caller in version.called_from:
-                        call_filename = caller.callsite.method.source.file
-                        # For now, if a method was called in the currently
-                        # open file, but defined elsewhere, we ignore it.
-                        if (call_filename != src_file_name or
-                              method.source.file != src_file_name or
-                              method.source.line_start < 0):
-                            continue
-                        call_lineno = caller.callsite.line
-                        if method.is_mega:
-                            call_msg = ("Call to %s (megamorphic) defined on line %d." %
-                                        (method.name, def_lineno))
-                        else:
-                            call_msg = ("Call to %s defined on line %d." %
-                                        (method.name, def_lineno))
-                        call_msg += "\n(line numbers may be inaccurate in polyglot programs)"
-                        self._annotate_text(call_lineno, call_filename,
-                                            method.name, call_msg,
-                                            JRubyMorphismMsg)
-                        self._annotate_text(call_lineno, call_filename,
-                                            method.name,
-                                            { method.name : method.is_mega },
-                                            JRubyCallGraph)
-                        num_calls += 1
-                # We can't visualise definitions which are never called.
-                if num_calls > 0:
-                    def_msg += " and is called %d times." % num_calls
-                    self._annotate_text(def_lineno, def_filename,
-                                        method.name, def_msg, JRubyMorphismMsg)
-                    self._annotate_text(def_lineno, def_filename,
-                                        method.name,
-                                        { method.name : method.is_mega },
+                    if key in def_arg_types:
+                        def_arg_types[key].update(arg_types[key])
+                    else:
+                        def_arg_types[key] = set(arg_types[key])
+                for eval_code in log.eval_code.get(version, []):
+                    def_eval_strings.append("eval(%s)" % eval_code)
+                for caller in log.called_from.get(version, []):
+                    callsite = owners[caller]
+                    # For now, if a method was called in the currently
+                    # open file, but defined elsewhere, we ignore it.
+                    if not extras[owners[callsite]] & LOCAL:
+                        continue
+                    call_lineno = extras[callsite]
+                    if is_mega:
+                        call_msg = ("Call to %s (megamorphic) defined on line %d." %
+                                    (name, def_lineno))
+                    else:
+                        call_msg = ("Call to %s defined on line %d." %
+                                    (name, def_lineno))
+                    call_msg += "\n(line numbers may be inaccurate in polyglot programs)"
+                    self._annotate_text(call_lineno, src_file_name,
+                                        name, call_msg,
+                                        JRubyMorphismMsg)
+                    self._annotate_text(call_lineno, src_file_name,
+                                        name,
+                                        { name : is_mega },
                                         JRubyCallGraph)
-                    # Eval strings interpreted at runtime.
-                    if def_eval_strings:
-                        self._annotate_text(def_lineno, def_filename,
-                                            method.name, ("%s" %
-                                                 ", ".join(def_eval_strings)),
-                                            JRubyEvalStrings)
-                    # Argument types used at runtime
-                    def_types_list = []
-                    for name in sorted(def_arg_types.keys()):
-                        types = ", ".join(def_arg_types[name])
-                        def_types_list.append("%s in {%s}" % (name, types))
-                    if def_arg_types:
-                        self._annotate_text(def_lineno, def_filename,
-                                            method.name,
-                                            ", ".join(def_types_list),
-                                            JRubyArgumentTypes)
+                    num_calls += 1
+            # We can't visualise definitions which are never called.
+            if num_calls > 0:
+                def_msg += " and is called %d times." % num_calls
+                self._annotate_text(def_lineno, src_file_name,
+                                    name, def_msg, JRubyMorphismMsg)
+                self._annotate_text(def_lineno, src_file_name,
+                                    name,
+                                    { name : is_mega },
+                                    JRubyCallGraph)
+                # Eval strings interpreted at runtime.
+                if def_eval_strings:
+                    self._annotate_text(def_lineno, src_file_name,
+                                        name, ("%s" %
+                                             ", ".join(def_eval_strings)),
+                                        JRubyEvalStrings)
+                # Argument types used at runtime
+                def_types_list = []
+                for key in sorted(def_arg_types.keys()):
+                    types = ", ".join(def_arg_types[key])
+                    def_types_list.append("%s in {%s}" % (key, types))
+                if def_arg_types:
+                    self._annotate_text(def_lineno, src_file_name,
+                                        name,
+                                        ", ".join(def_types_list),
+                                        JRubyArgumentTypes)
 
     def _annotate_text(self, lineno, filename, text, annotation, klass):
         """Annotate a node on a given line with a given symbol name."""
         if lineno < 0:  # Method not defined by the programmer (e.g. <main>)
             return
+        if self.sourcemap is not None:
+            try:
+                node = self.sourcemap.find(lineno - 1, text)
+            except IndexError:
+                node = None
+            if node is None:
+                logging.error("Failed to annotate '%s' on line %g" % \
+                              (text, lineno))
+            else:
+                node.add_annotation(klass(annotation))
+            return
         # Attempt to find 'text' on 'lineno'.
         try:
             temp_cursor = self.tm.cursor.copy()
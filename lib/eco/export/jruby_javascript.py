@@ -28,12 +28,16 @@ import subprocess
 from PyQt5.QtCore import QSettings
 from incparser.astree import EOS
 from export.jruby import JRubyCallgraphProcessor
+from export.sourcemap import SourceMap
 from grammar_parser.gparser import MagicTerminal, IndentationTerminal
 
 
 class JRubyJavaScriptExporter(object):
-    def __init__(self, tm):
+    def __init__(self, tm, sourcemap=None):
         self.tm = tm  # TreeManager object.
+        self.sourcemap = sourcemap
+        self._js_map = SourceMap()
+        self._map = SourceMap()
         self.js_functions = dict()
         self._js_output = list()
         self._wrappers = list()
@@ -64,14 +68,14 @@ class JRubyJavaScriptExporter(object):
             if isinstance(sym, MagicTerminal):
                 self._language_box(sym.name, node.symbol.ast.children[0])
             elif isinstance(sym, IndentationTerminal):
-                self._js_output.append(sym)
+                pass
             elif sym.name == "function":
                 self._js_functions.append(node.next_term.next_term.symbol.name)
-                self._js_output.append(sym.name)
+                self._append(self._js_output, self._js_map, sym.name, node)
             elif sym.name == "\r":
-                self._js_output.append("\n")
+                self._append(self._js_output, self._js_map, "\n", node)
             else:
-                self._js_output.append(sym.name)
+                self._append(self._js_output, self._js_map, sym.name, node)
 
     def _walk_rb(self, node):
         while True:
@@ -82,11 +86,15 @@ class JRubyJavaScriptExporter(object):
             if isinstance(sym, MagicTerminal):
                 self._language_box(sym.name, node.symbol.ast.children[0])
             elif isinstance(sym, IndentationTerminal):
-                self._output.append(sym)
+                pass
             elif sym.name == "\r":
-                self._output.append("\n")
+                self._append(self._output, self._map, "\n", node)
             else:
-                self._output.append(sym.name)
+                self._append(self._output, self._map, sym.name, node)
+
+    def _append(self, output, sourcemap, text, node):
+        output.append(text)
+        sourcemap.add(text, node)
 
     def _apply_template(self, name):
         return "Truffle::Interop.import_method(:%s)" % name
@@ -96,15 +104,21 @@ class JRubyJavaScriptExporter(object):
         self._walk_rb(node)
         for func in self._js_functions:
             self._wrappers.append(self._apply_template(func))
-        output = "Truffle::Interop.eval('application/javascript', %{\n"
-        output += "".join(self._js_output)
+        header = "Truffle::Interop.eval('application/javascript', %{\n"
+        wrappers = ""
         for func in self._js_functions:
-            output += "Interop.export('%s', %s.bind(this));\n" % (func, func)
-        output += "})\n\n"
-        output += "\n".join(self._wrappers)
-        output += "\n\n"
+            wrappers += "Interop.export('%s', %s.bind(this));\n" % (func, func)
+        wrappers += "})\n\n"
+        wrappers += "\n".join(self._wrappers)
+        wrappers += "\n\n"
+        output = header + "".join(self._js_output) + wrappers
         rb_code = "".join(self._output)
         output += rb_code
+        if self.sourcemap is not None:
+            self.sourcemap.add(header)
+            self.sourcemap.extend(self._js_map)
+            self.sourcemap.add(wrappers)
+            self.sourcemap.extend(self._map)
         with open(path, "w") as fp:
             fp.write("".join(output))
 
@@ -133,7 +147,9 @@ class JRubyJavaScriptExporter(object):
                                     bufsize=0)
 
     def _profile(self):
-        callgraph_processor = JRubyCallgraphProcessor(self.tm)
+        if self.sourcemap is None:
+            self.sourcemap = SourceMap()
+        callgraph_processor = JRubyCallgraphProcessor(self.tm, self.sourcemap)
 
         _, src_file_name = tempfile.mkstemp(suffix=".rb")
         self._export_as_text(src_file_name)
@@ -30,6 +30,7 @@ from incparser.annotation import Annotation, ToolTip, Heatmap
 from PyQt5.QtCore import QSettings
 from incparser.astree import EOS
 from export.jruby import JRubyCallgraphProcessor
+from export.sourcemap import SourceMap
 from grammar_parser.gparser import MagicTerminal, IndentationTerminal
 
 
@@ -52,8 +53,11 @@ class JRubyCoverageCounterVal(Annotation):
 
 
 class JRubySimpleLanguageExporter(object):
-    def __init__(self, tm):
+    def __init__(self, tm, sourcemap=None):
         self.tm = tm  # TreeManager object.
+        self.sourcemap = sourcemap
+        self._sl_map = SourceMap()
+        self._map = SourceMap()
         self.sl_functions = dict()
         self._sl_output = list()
         self._wrappers = list()
@@ -84,14 +88,14 @@ class JRubySimpleLanguageExporter(object):
             if isinstance(sym, MagicTerminal):
                 self._language_box(sym.name, node.symbol.ast.children[0])
             elif isinstance(sym, IndentationTerminal):
-                self._sl_output.append(sym)
+                pass
             elif sym.name == "function":
                 self._sl_functions.append(node.next_term.next_term.symbol.name)
-                self._sl_output.append(sym.name)
+                self._append(self._sl_output, self._sl_map, sym.name, node)
             elif sym.name == "\r":
-                self._sl_output.append("\n")
+                self._append(self._sl_output, self._sl_map, "\n", node)
             else:
-                self._sl_output.append(sym.name)
+                self._append(self._sl_output, self._sl_map, sym.name, node)
 
     def _walk_rb(self, node):
         while True:
@@ -102,11 +106,15 @@ class JRubySimpleLanguageExporter(object):
             if isinstance(sym, MagicTerminal):
                 self._language_box(sym.name, node.symbol.ast.children[0])
             elif isinstance(sym, IndentationTerminal):
-                self._output.append(sym)
+                pass
             elif sym.name == "\r":
-                self._output.append("\n")
+                self._append(self._output, self._map, "\n", node)
             else:
-                self._output.append(sym.name)
+                self._append(self._output, self._map, sym.name, node)
+
+    def _append(self, output, sourcemap, text, node):
+        output.append(text)
+        sourcemap.add(text, node)
 
     def _apply_template(self, name):
         return "Truffle::Interop.import_method(:%s)" % name
@@ -116,13 +124,18 @@ class JRubySimpleLanguageExporter(object):
         self._walk_rb(node)
         for func in self._sl_functions:
             self._wrappers.append(self._apply_template(func))
-        output = "Truffle::Interop.eval('application/x-sl', %{\n"
-        output += "".join(self._sl_output)
-        output += "})\n\n"
-        output += "\n".join(self._wrappers)
-        output += "\n\n"
+        header = "Truffle::Interop.eval('application/x-sl', %{\n"
+        wrappers = "})\n\n"
+        wrappers += "\n".join(self._wrappers)
+        wrappers += "\n\n"
+        output = header + "".join(self._sl_output) + wrappers
         rb_code = "".join(self._output)
         output += rb_code
+        if self.sourcemap is not None:
+            self.sourcemap.add(header)
+            self.sourcemap.extend(self._sl_map)
+            self.sourcemap.add(wrappers)
+            self.sourcemap.extend(self._map)
         with open(path, "w") as fp:
             fp.write("".join(output))
 
@@ -151,7 +164,9 @@ class JRubySimpleLanguageExporter(object):
                                     bufsize=0)
 
     def _profile(self):
-        callgraph_processor = JRubyCallgraphProcessor(self.tm)
+        if self.sourcemap is None:
+            self.sourcemap = SourceMap()
+        callgraph_processor = JRubyCallgraphProcessor(self.tm, self.sourcemap)
 
         _, src_file_name = tempfile.mkstemp(suffix=".rb")
         self._export_as_text(src_file_name)
@@ -0,0 +1,108 @@
+# Copyright (c) 2013--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+class SourceMap(object):
+    """Maps the text generated by an exporter back to the nodes it was
+    generated from.
+
+    The text is added piece by piece with the node it belongs to, and the map
+    stores the offsets at which these pieces start in one sorted array, next
+    to a list of their nodes. A piece extends until the next piece starts, so
+    text that wasn't generated from any node (e.g. wrappers added by an
+    exporter) is added without a node and maps to None. The offsets at which
+    lines start are kept in a second array, so that positions given as lines
+    and columns (as reported by compilers and profilers) can be looked up by
+    bisection. Lines and columns are counted from 0."""
+
+    def __init__(self):
+        self.offsets = array("l")
+        self.nodes = []
+        self.lines = array("l", [0])
+        self.length = 0
+
+    def add(self, text, node=None):
+        """Appends `text`, generated from `node`."""
+        if not text:
+            return
+        self._add_range(len(text), node)
+        i = text.find("\n")
+        while i != -1:
+            self.lines.append(self.length - len(text) + i + 1)
+            i = text.find("\n", i + 1)
+
+    def extend(self, other):
+        """Appends the text of the source map `other` with its nodes."""
+        start = self.length
+        for i in range(len(other.nodes)):
+            if i + 1 < len(other.nodes):
+                end = other.offsets[i + 1]
+            else:
+                end = other.length
+            self._add_range(end - other.offsets[i], other.nodes[i])
+        self.lines.extend(start + offset for offset in other.lines[1:])
+
+    def _add_range(self, length, node):
+        if not self.nodes or self.nodes[-1] is not node:
+            self.offsets.append(self.length)
+            self.nodes.append(node)
+        self.length += length
+
+    def offset(self, line, col=0):
+        """Returns the offset of the position `line` and `col`."""
+        if line < 0 or line >= len(self.lines):
+            raise IndexError("line %s out of range" % line)
+        return self.lines[line] + col
+
+    def position(self, offset):
+        """Returns the line and column of `offset`."""
+        line = bisect_right(self.lines, offset) - 1
+        return line, offset - self.lines[line]
+
+    def lookup(self, line, col=0):
+        """Returns the node the text at `line` and `col` was generated from,
+        or None."""
+        offset = self.offset(line, col)
+        i = bisect_right(self.offsets, offset) - 1
+        if i < 0 or offset >= self.length:
+            return None
+        return self.nodes[i]
+
+    def get_nodes(self, line):
+        """Returns the nodes whose text starts on `line`, in the order they
+        appear in the generated text."""
+        start = self.offset(line)
+        if line + 1 < len(self.lines):
+            end = self.lines[line + 1]
+        else:
+            end = self.length
+        nodes = self.nodes[bisect_left(self.offsets, start):bisect_left(self.offsets, end)]
+        return [n for n in nodes if n is not None]
+
+    def find(self, line, name):
+        """Returns the first node on `line` whose symbol is `name`, or None."""
+        for node in self.get_nodes(line):
+            if node.symbol.name == name:
+                return node
+        return None
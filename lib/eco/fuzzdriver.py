@@ -0,0 +1,270 @@
+# Copyright (c) 2013--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Parallel fuzzing of all grammars.
+
+Runs seeded `FuzzyTester`s on every combination of grammar and program in
+`test/programs.py` that parses without errors, distributed over a pool of
+worker processes. Every run executes one of the tester's phases (random
+deletion, insertion or both) with its own seed, so any run can be repeated
+with the same language, program, phase and seed. Crashes are deduplicated by
+their signature (the type of the exception and the innermost frames of its
+traceback) and the first run of every new crash is minimised with
+`minimiser.DeltaMinimiser` in the pool, while fuzzing continues.
+
+For every crash, its description and the minimised program and log are
+written to the output directory (the latter two in the format expected by
+`minimiser.py`), and a line of JSON is printed to stdout.
+
+Usage: python3 fuzzdriver.py [options] [LANGUAGE...]"""
+
+import contextlib, json, logging, multiprocessing, os, sys, time, traceback
+from optparse import OptionParser
+
+from grammars.grammars import lang_dict, EcoFile
+from test import programs
+
+PHASES = ["random_deletion", "random_insertion", "random_insertdelete"]
+
+# number of traceback frames used to identify a crash
+SIGNATURE_FRAMES = 3
+
+# functions that execute the edits, which differ between fuzzing and replaying
+# a log (where every edit is run by `exec`)
+HARNESS = set(PHASES + ["replay", "<module>"])
+
+def signature(e):
+    """Identifies a crash by the type of the exception `e` and the innermost
+    frames of its traceback below the harness running the edits. The message
+    is ignored, since it often contains node ids or program text."""
+    frames = traceback.extract_tb(e.__traceback__)
+    for i in range(len(frames) - 1, -1, -1):
+        if frames[i].name in HARNESS:
+            frames = frames[i + 1:]
+            break
+    return (type(e).__name__,) + tuple("%s:%s:%d" % (os.path.basename(f.filename), f.name, f.lineno)
+                                       for f in frames[-SIGNATURE_FRAMES:])
+
+def find_programs():
+    """Returns the names of all programs in `test/programs.py`."""
+    return sorted(name for name, value in vars(programs).items()
+                  if isinstance(value, str) and not name.startswith("_"))
+
+def find_languages(names=None):
+    """Returns the names of all languages with a grammar (or the ones in
+    `names`)."""
+    return sorted(lang.name for lang in lang_dict.values()
+                  if type(lang) is EcoFile and (not names or lang.name in names))
+
+def make_tester(lang, program, seed=None):
+    from fuzzytester import FuzzyTester
+    return FuzzyTester("<%s>" % lang, lang, program, seed)
+
+@contextlib.contextmanager
+def _quiet():
+    # FuzzyTester and the parsers print progress to stdout
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            yield
+
+def parses(target):
+    """Returns whether the program of `target` (a language and program name)
+    can be parsed in its language."""
+    lang, name = target
+    with _quiet():
+        try:
+            tester = make_tester(lang, getattr(programs, name))
+            tester.treemanager.import_file(tester.program)
+            return tester.parser.last_status == True
+        except Exception:
+            logging.debug("Can't import %s as %s", name, lang, exc_info=True)
+            return False
+
+def fuzz(task):
+    """Runs a single phase of a FuzzyTester and returns a description of the
+    crash, or None if the phase passed."""
+    lang, name, phase, seed = task
+    with _quiet():
+        tester = make_tester(lang, getattr(programs, name), seed)
+        try:
+            tester.reset()
+            getattr(tester, phase)()
+        except Exception as e:
+            return {"language": lang, "program": name, "phase": phase, "seed": seed,
+                    "signature": signature(e), "traceback": traceback.format_exc(),
+                    "log": tester.log}
+    return None
+
+def minimise(crash):
+    """Minimises the program and log of `crash` and returns them together
+    with the number of runs and the time needed. The program and log are None
+    if replaying the log doesn't reproduce the crash."""
+    from minimiser import DeltaMinimiser
+    lang = crash["language"]
+    start = time.time()
+    with _quiet():
+        m = DeltaMinimiser(lambda program: make_tester(lang, program), getattr(programs, crash["program"]),
+                           crash["log"], signature)
+        if m.expected != tuple(crash["signature"]):
+            # not reproducible by replaying the log
+            return None, None, m.runs, time.time() - start
+        program, log = m.minimise()
+    return program, log, m.runs, time.time() - start
+
+def init_worker(loglevel):
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=loglevel)
+
+def generate_tasks(targets, seed):
+    """Yields the tasks of all targets and phases for increasing seeds."""
+    while True:
+        for lang, name in targets:
+            for phase in PHASES:
+                yield (lang, name, phase, seed)
+        seed += 1
+
+def write_crash(outdir, number, crash):
+    """Writes a crash to `outdir` and returns the paths of its files."""
+    base = os.path.join(outdir, "crash-%d" % number)
+    paths = {"description": base + ".txt"}
+    with open(paths["description"], "w") as f:
+        for key in ["language", "program", "phase", "seed"]:
+            f.write("%s: %s\n" % (key, crash[key]))
+        f.write("signature: %s\n\n" % " ".join(crash["signature"]))
+        f.write(crash["traceback"])
+    if crash.get("minimised_log") is not None:
+        paths["program"] = base + ".program"
+        paths["log"] = base + ".log"
+        with open(paths["program"], "w") as f:
+            # minimiser.py strips the trailing newline
+            f.write(crash["minimised_program"] + "\n")
+        with open(paths["log"], "w") as f:
+            for l in crash["minimised_log"]:
+                f.write(l)
+                f.write("\n")
+    return paths
+
+def run(languages=None, jobs=None, seed=0, runs=None, duration=None, minimise_crashes=True,
+        loglevel=logging.WARNING, report=None):
+    """Fuzzes until `runs` phases have been run or `duration` seconds have
+    passed (or forever), and returns a dictionary mapping the signatures of
+    all crashes found to their descriptions. `report` is called with every
+    new crash once it has been minimised."""
+    jobs = jobs or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(jobs, init_worker, (loglevel,))
+    crashes = {}
+    try:
+        candidates = [(lang, name) for lang in find_languages(languages) for name in find_programs()]
+        targets = [t for t, ok in zip(candidates, pool.map(parses, candidates)) if ok]
+        if not targets:
+            raise ValueError("None of the programs can be parsed by the selected languages.")
+        logging.info("Fuzzing %s", ", ".join("%s/%s" % t for t in targets))
+
+        tasks = generate_tasks(targets, seed)
+        deadline = None if duration is None else time.time() + duration
+        started = 0
+        pending = []        # fuzzing runs
+        minimising = []     # (crash, result)
+
+        def finished():
+            return (runs is not None and started >= runs) or \
+                   (deadline is not None and time.time() >= deadline)
+
+        while True:
+            # keep every worker busy, but don't queue up more tasks than
+            # necessary, so that the driver stops in time
+            while not finished() and len(pending) < 2 * jobs:
+                pending.append(pool.apply_async(fuzz, (next(tasks),)))
+                started += 1
+            if not pending and not minimising:
+                break
+            for result in [r for r in pending if r.ready()]:
+                pending.remove(result)
+                crash = result.get()
+                if crash is None:
+                    continue
+                sig = tuple(crash["signature"])
+                if sig in crashes:
+                    crashes[sig]["count"] += 1
+                    continue
+                crash["count"] = 1
+                crashes[sig] = crash
+                logging.info("New crash %s in %s/%s", " ".join(sig), crash["language"], crash["program"])
+                if minimise_crashes:
+                    minimising.append((crash, pool.apply_async(minimise, (crash,))))
+                elif report:
+                    report(crash)
+            for crash, result in [m for m in minimising if m[1].ready()]:
+                minimising.remove((crash, result))
+                program, log, tests, seconds = result.get()
+                crash["minimised_program"] = program
+                crash["minimised_log"] = log
+                crash["minimise_runs"] = tests
+                crash["minimise_time"] = seconds
+                if report:
+                    report(crash)
+            time.sleep(0.05)
+    finally:
+        pool.terminate()
+        pool.join()
+    return crashes
+
+def main(argv=None):
+    parser = OptionParser(usage="usage: %prog [options] [LANGUAGE...]")
+    parser.add_option("-j", "--jobs", type="int", default=None, help="Number of worker processes [default: number of CPUs]")
+    parser.add_option("-s", "--seed", type="int", default=0, help="First seed [default: %default]")
+    parser.add_option("-n", "--runs", type="int", default=None, help="Stop after this many runs")
+    parser.add_option("-t", "--time", type="float", default=None, help="Stop after this many seconds")
+    parser.add_option("-o", "--output", default="fuzz-results", help="Directory for the crash reports [default: %default]")
+    parser.add_option("--no-minimise", action="store_true", default=False, help="Don't minimise crashes")
+    parser.add_option("-l", "--log", default="WARNING", help="Log level: INFO, WARNING, ERROR, DEBUG [default: %default]")
+    (options, args) = parser.parse_args(argv)
+
+    if options.log.upper() in ["INFO", "WARNING", "ERROR", "DEBUG"]:
+        loglevel = getattr(logging, options.log.upper())
+    else:
+        loglevel = logging.WARNING
+    init_worker(loglevel)
+    if not os.path.isdir(options.output):
+        os.makedirs(options.output)
+
+    def report(crash):
+        report.number += 1
+        paths = write_crash(options.output, report.number, crash)
+        summary = dict((k, crash[k]) for k in ["language", "program", "phase", "seed", "signature"])
+        summary["files"] = paths
+        if crash.get("minimised_log") is not None:
+            summary["minimised"] = {"log_lines": len(crash["minimised_log"]),
+                                    "characters": len(crash["minimised_program"]),
+                                    "runs": crash["minimise_runs"],
+                                    "seconds": round(crash["minimise_time"], 2)}
+        sys.stdout.write(json.dumps(summary) + "\n")
+        sys.stdout.flush()
+    report.number = 0
+
+    try:
+        crashes = run(args, options.jobs, options.seed, options.runs, options.time,
+                      not options.no_minimise, loglevel, report)
+    except KeyboardInterrupt:
+        return 1
+    return 1 if crashes else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
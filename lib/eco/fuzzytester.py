@@ -18,13 +18,20 @@ class FuzzyTester():
     If an exception occurs, or the modifications had unwanted side-effects, a
     log is saved which can be used to create a stand-alone test."""
 
-    def __init__(self, filename):
-        _, ext = os.path.splitext(filename)
-        self.setlang(ext_to_lang[ext])
-        with open(filename) as f:
-            self.program = f.read()
+    def __init__(self, filename, lang=None, program=None, seed=None):
+        if lang is None:
+            _, ext = os.path.splitext(filename)
+            lang = ext_to_lang[ext]
+        self.setlang(lang)
+        if program is None:
+            with open(filename) as f:
+                program = f.read()
+        self.program = program
         self.log = []
         self.filename = filename
+        # all random decisions are taken from this generator, so a run can
+        # be repeated by using the same seed
+        self.random = random.Random(seed)
 
     def reset(self):
         self.parser.reset()
@@ -73,12 +80,13 @@ class FuzzyTester():
 
     def get_random_key(self):
         keys = list("abcdefghijklmnopqrstuvwxyz0123456789 \r:,.[]{}()!$%^&*()_+=")
-        return random.choice(keys)
+        return self.random.choice(keys)
 
     def random_deletion(self):
         """Delete random characters within a program."""
         print("Running random_deletion on {}".format(self.filename))
         program = self.program
+        self.log = []
 
         self.treemanager.import_file(program)
         assert self.parser.last_status == True
@@ -87,13 +95,13 @@ class FuzzyTester():
 
         line_count = len(self.treemanager.lines)
         random_lines = list(range(line_count))
-        random.shuffle(random_lines)
+        self.random.shuffle(random_lines)
         random_lines = random_lines[:20] # restrict to 20 lines to reduce runtime
 
         start_version = self.treemanager.version
         for linenr in random_lines:
             cols = list(range(20))
-            random.shuffle(cols)
+            self.random.shuffle(cols)
             for col in cols:
                 self.treemanager.cursor_reset()
                 self.log.append("self.treemanager.cursor_reset()")
@@ -108,40 +116,13 @@ class FuzzyTester():
             self.treemanager.undo_snapshot()
             self.log.append("self.treemanager.undo_snapshot()")
 
-        end_version = self.treemanager.version
-        broken = self.treemanager.export_as_text()
-
-        # undo all and compare with original
-        while self.treemanager.version > start_version:
-            self.treemanager.key_ctrl_z()
-        self.text_compare(program)
-
-        # redo all and compare with broken
-        while self.treemanager.version < end_version:
-            self.treemanager.key_shift_ctrl_z()
-        self.text_compare(broken)
-
-        # undo again and compare with original
-        while self.treemanager.version > start_version:
-            self.treemanager.key_ctrl_z()
-        self.text_compare(program)
-
-        t1 = TreeManager()
-        parser, lexer = self.lang.load()
-        parser.init_ast()
-        t1.add_parser(parser, lexer, self.lang.name)
-        t1.set_font_test(7, 17)
-        t1.import_file(self.program)
-
-        assert self.parser.last_status == True
-        assert parser.last_status == True
-
-        self.tree_compare(self.parser.previous_version.parent, parser.previous_version.parent)
+        self.check(start_version)
 
     def random_insertion(self):
         """Insert random characters at random locations within a program."""
         print("Running random_insert on {}".format(self.filename))
         self.reset()
+        self.log = []
 
         self.treemanager.import_file(self.program)
         assert self.parser.last_status == True
@@ -150,12 +131,12 @@ class FuzzyTester():
 
         line_count = len(self.treemanager.lines)
         random_lines = list(range(line_count))
-        random.shuffle(random_lines)
+        self.random.shuffle(random_lines)
 
         start_version = self.treemanager.version
         for linenr in random_lines:
             cols = list(range(20))
-            random.shuffle(cols)
+            self.random.shuffle(cols)
             for col in cols:
                 self.log.append("self.treemanager.cursor_reset()")
                 self.log.append("self.move(DOWN, %s)" % linenr)
@@ -171,36 +152,14 @@ class FuzzyTester():
             self.log.append("self.treemanager.undo_snapshot()")
             self.treemanager.undo_snapshot()
 
-        end_version = self.treemanager.version
-        broken = self.treemanager.export_as_text()
-
-        # undo all and compare with original
-        while self.treemanager.version > start_version:
-            self.treemanager.key_ctrl_z()
-        self.text_compare(self.program)
-
-        # redo all and compare with broken
-        while self.treemanager.version < end_version:
-            self.treemanager.key_shift_ctrl_z()
-        self.text_compare(broken)
-
-        # undo again and compare with original
-        while self.treemanager.version > start_version:
-            self.treemanager.key_ctrl_z()
-        self.text_compare(self.program)
-
-        t1 = TreeManager()
-        parser, lexer = self.lang.load()
-        t1.add_parser(parser, lexer, self.lang.name)
-        t1.import_file(self.program)
-
-        self.tree_compare(self.parser.previous_version.parent, parser.previous_version.parent)
+        self.check(start_version)
 
     def random_insertdelete(self):
         """Insert and delete random characters at random locations within a
         program."""
         print("Running random_insertdelete on {}".format(self.filename))
         self.reset()
+        self.log = []
 
         self.treemanager.import_file(self.program)
         assert self.parser.last_status == True
@@ -209,17 +168,17 @@ class FuzzyTester():
 
         line_count = len(self.treemanager.lines)
         random_lines = list(range(line_count))
-        random.shuffle(random_lines)
+        self.random.shuffle(random_lines)
         random_lines = random_lines[:20] # restrict to 20 lines to reduce runtime
 
         start_version = self.treemanager.version
         for linenr in random_lines:
             cols = list(range(20))
-            random.shuffle(cols)
+            self.random.shuffle(cols)
             for col in cols:
                 self.log.append("self.treemanager.cursor_reset()")
-                self.log.append("self.move(%s, %s)" % (DOWN, linenr))
-                self.log.append("self.move(%s, %s)" % (RIGHT, col))
+                self.log.append("self.move(DOWN, %s)" % linenr)
+                self.log.append("self.move(RIGHT, %s)" % col)
                 self.treemanager.cursor_reset()
                 self.move(DOWN, linenr)
                 self.move(RIGHT, col)
@@ -230,13 +189,19 @@ class FuzzyTester():
                     x = self.treemanager.key_delete()
                 else:
                     rk = self.get_random_key()
-                    self.log.append("self.treemanager.key_normal(%s)" % rk)
+                    self.log.append("self.treemanager.key_normal(%s)" % repr(rk))
                     x = self.treemanager.key_normal(rk)
                 if x == "eos":
                     continue
             self.log.append("self.treemanager.undo_snapshot()")
             self.treemanager.undo_snapshot()
 
+        self.check(start_version)
+
+    def check(self, start_version):
+        """Undoes and redoes all edits made since `start_version` and compares
+        the result with the original program, and the final tree with the one
+        of a freshly imported program."""
         end_version = self.treemanager.version
         broken = self.treemanager.export_as_text()
 
@@ -257,18 +222,35 @@ class FuzzyTester():
 
         t1 = TreeManager()
         parser, lexer = self.lang.load()
+        parser.init_ast()
         t1.add_parser(parser, lexer, self.lang.name)
+        t1.set_font_test(7, 17)
         t1.import_file(self.program)
 
+        assert self.parser.last_status == True
+        assert parser.last_status == True
+
         self.tree_compare(self.parser.previous_version.parent, parser.previous_version.parent)
 
+    def replay(self, log):
+        """Runs a logged test again: imports the program, executes the lines
+        of `log` and checks the result like the random tests do."""
+        self.reset()
+        self.log = log
+        self.treemanager.import_file(self.program)
+        assert self.parser.last_status == True
+        start_version = self.treemanager.version
+        for l in log:
+            exec(l)
+        self.check(start_version)
+
     def run(self):
         try:
-            ft.random_deletion()
+            self.random_deletion()
             self.reset()
-            ft.random_insertion()
+            self.random_insertion()
             self.reset()
-            ft.random_insertdelete()
+            self.random_insertdelete()
         except Exception as e:
             traceback.print_exc()
             print("Written log to 'fuzzy.log'.")
@@ -194,6 +194,15 @@ class BootstrapParser(object):
         return s
 
     def create_parser(self, pickle_id = None):
+        self.finish_rules()
+        incparser = IncParser()
+        incparser.from_dict(self.rules, self.start_symbol, self.lr_type, self.implicit_ws(), pickle_id, self.precedences, self.prod_ids)
+        incparser.init_ast()
+        self.incparser = incparser
+
+    def finish_rules(self):
+        """Adds the rules generated from grammar functions and the implicit
+        whitespace rules to the parsed grammar."""
         self.all_terminals.update(self.terminals)
 
         for fname, terminals, parentrule in self.functions:
@@ -243,11 +252,6 @@ class BootstrapParser(object):
             self.prod_ids[Production(start_rule.symbol, start_rule.alternatives[0])] = len(self.prod_ids)
             self.start_symbol = start_rule.symbol
 
-        incparser = IncParser()
-        incparser.from_dict(self.rules, self.start_symbol, self.lr_type, self.implicit_ws(), pickle_id, self.precedences, self.prod_ids)
-        incparser.init_ast()
-        self.incparser = incparser
-
     def parse_rules(self, node):
         if node.children[0].symbol.name == "parser":
             self.parse_rules(node.children[0])
@@ -447,7 +451,7 @@ class BootstrapParser(object):
         elif node.symbol.name == "astnode":
             return self.parse_astnode(node)
 
-    def create_lexer(self, buildlexer=True):
+    def create_lexer(self, buildlexer=True, pickle_id=None):
         names = []
         regexs = []
         for name, regex in self.lrules:
@@ -464,7 +468,7 @@ class BootstrapParser(object):
             self.inclexer = (names, regexs)
             return
         self.inclexer = IncrementalLexerCF()
-        self.inclexer.from_name_and_regex(names, regexs)
+        self.inclexer.from_name_and_regex(names, regexs, pickle_id)
         if self.indentation_based():
             self.inclexer.indentation_based = True
 
@@ -51,9 +51,22 @@ class Rule(object):
         return "Rule(%s => %s)" % (self.symbol, self.alternatives)
 
 class Symbol(object):
+    # every terminal in a parse tree has its own symbol, so they should be
+    # small (see membench.py)
+    __slots__ = ["name"]
+
     def __init__(self, name=""):
         self.name = name
 
+    def __setstate__(self, state):
+        # syntax tables pickled before symbols had slots contain a dictionary
+        # instead of a (dictionary, slots) pair
+        if not isinstance(state, tuple):
+            state = (state, None)
+        for values in state:
+            for key, value in (values or {}).items():
+                setattr(self, key, value)
+
     def __eq__(self, other):
         if other.__class__ != self.__class__:
             return False
@@ -71,11 +84,15 @@ class Symbol(object):
 
 class Terminal(Symbol):
     """Literal symbol produced by the lexer."""
+    __slots__ = []
+
     def __repr__(self):
         return "Terminal('%s')" % (repr(self.name),)
 
 class MagicTerminal(Terminal):
     """Special terminal representing language boxes."""
+    # no __slots__: the language box's `parser` and `ast` are stored here
+
     def __repr__(self):
         return "MagicTerminal('%s')" % (repr(self.name),)
 
@@ -84,6 +101,8 @@ class IndentationTerminal(Terminal):
 
     Used by indentation based languages.
     """
+    __slots__ = []
+
     def __repr__(self):
         return "IndentationTerminal('%s')" % (repr(self.name),)
 
@@ -93,11 +112,14 @@ class Nonterminal(Symbol):
     When appearing on the right-hand side of a production, they will be replaced
     with one of their alternatives by the parser.
     """
+    __slots__ = []
+
     def __repr__(self):
         return "Nonterminal('%s')" % (self.name,)
 
 class Epsilon(Symbol):
     """Describes the empty terminal."""
+    __slots__ = []
 
     def __eq__(self, other):
         return isinstance(other, Epsilon)
@@ -0,0 +1,119 @@
+# Copyright (c) 2013--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Benchmarks building the state graphs and syntax tables of the shipped
+grammars from scratch, i.e. bypassing all caches. For every grammar the time
+needed to build the state graph (using one process and, if -j is given, the
+given number of processes) and the syntax table is reported.
+
+Usage: python3 grammarbench.py [-j JOBS] [-r REPEAT] [LANGUAGE...]"""
+
+import contextlib, os, sys
+from optparse import OptionParser
+from time import time
+
+from grammars.grammars import lang_dict, EcoFile
+from incparser.constants import LR1
+from incparser.stategraph import StateGraph
+from incparser.syntaxtable import SyntaxTable
+
+def find_grammars(names=None):
+    """Returns all shipped grammars (or the ones named in `names`), skipping
+    languages that share the same grammar."""
+    grammars = []
+    seen = set()
+    for lang in lang_dict.values():
+        if type(lang) is not EcoFile:
+            continue
+        if names and lang.name not in names:
+            continue
+        key = (lang.filename, repr(lang.alts), lang.extract)
+        if key not in seen:
+            seen.add(key)
+            grammars.append(lang)
+    return grammars
+
+def measure(f, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time()
+        result = f()
+        duration = time() - start
+        if best is None or duration < best:
+            best = duration
+    return result, best
+
+def bench(grammar, jobs=1, repeat=1):
+    bootstrap = grammar.bootstrap()
+    bootstrap.parse_both()
+    bootstrap.finish_rules()
+
+    def build_graph(jobs):
+        graph = StateGraph(bootstrap.start_symbol, bootstrap.rules, LR1, jobs)
+        graph.build()
+        return graph
+
+    def build_table():
+        syntaxtable = SyntaxTable(bootstrap.prod_ids, LR1)
+        with open(os.devnull, "w") as devnull:
+            # don't report conflicts
+            with contextlib.redirect_stdout(devnull):
+                syntaxtable.build(graph, bootstrap.precedences)
+        return syntaxtable
+
+    graph, graph_time = measure(lambda: build_graph(1), repeat)
+    result = {"states": len(graph.state_sets), "graph": graph_time}
+    if jobs > 1:
+        _, result["parallel"] = measure(lambda: build_graph(jobs), repeat)
+    _, result["table"] = measure(build_table, repeat)
+    return result
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options] [LANGUAGE...]")
+    parser.add_option("-j", "--jobs", type="int", default=1,
+                      help="also build the state graphs using JOBS processes")
+    parser.add_option("-r", "--repeat", type="int", default=1,
+                      help="report the best of REPEAT runs")
+    options, args = parser.parse_args()
+
+    header = "%-30s %7s %9s" % ("grammar", "states", "graph")
+    if options.jobs > 1:
+        header += " %9s" % ("-j %d" % options.jobs)
+    header += " %9s" % "table"
+    print(header)
+    total = 0
+    for grammar in find_grammars(args):
+        try:
+            result = bench(grammar, options.jobs, options.repeat)
+        except Exception as e:
+            print("%-30s failed: %r" % (grammar.name, e))
+            continue
+        line = "%-30s %7d %8.2fs" % (grammar.name, result["states"], result["graph"])
+        if options.jobs > 1:
+            line += " %8.2fs" % result["parallel"]
+        line += " %8.2fs" % result["table"]
+        print(line)
+        sys.stdout.flush()
+        total += result["graph"] + result["table"]
+    print("total %.2fs" % total)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# Copyright (c) 2013--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Persistent cache of loaded grammars.
+
+Loading a grammar from its `.eco` file requires parsing the grammar and
+building its syntax table and lexer, which can take seconds. `EcoFile.load`
+stores everything it produces (syntax table, whitespace setting and the
+incremental lexer including its compiled automaton) in a single pickle,
+named after a hash of the grammar source and the options that influence
+the result. Since the same tables are used by the automatic language box
+recognizers, these are covered as well.
+
+The cache directory contains the cache format version, so incompatible
+entries are never read. Entries are written to a temporary file first and
+then moved into place, so processes running concurrently either see a
+complete entry or none at all. Unreadable entries are treated as missing
+and are overwritten after the grammar has been rebuilt."""
+
+import hashlib, os, pickle, tempfile
+
+VERSION = 1
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         "pickle", "grammars-v{}".format(VERSION))
+
+def get_key(filename, *options):
+    """Returns the cache key for the grammar in `filename`. Besides the
+    grammar source, the key includes `options` and the versions of the
+    syntax table and lexer formats."""
+    from incparser.syntaxtable import SyntaxTable
+    from treelexer.dfa import DFA
+    m = hashlib.sha1()
+    with open(filename, "rb") as f:
+        m.update(f.read())
+    m.update(repr((SyntaxTable.VERSION, DFA.VERSION) + options).encode("utf-8"))
+    return m.hexdigest()
+
+def get_filename(key):
+    return os.path.join(CACHE_DIR, key + ".pcl")
+
+def load(key):
+    """Returns the cached entry for `key` or None if there is none."""
+    try:
+        with open(get_filename(key), "rb") as f:
+            version, entry = pickle.load(f)
+    except (IOError, OSError, EOFError, ValueError, AttributeError,
+            ImportError, pickle.UnpicklingError):
+        return None
+    if version != VERSION:
+        return None
+    return entry
+
+def store(key, entry):
+    """Stores `entry` under `key`. Failing to write the cache (e.g. because
+    the directory is read-only) is not an error."""
+    try:
+        if not os.path.isdir(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+    except OSError:
+        # another process may have created it in the meantime
+        if not os.path.isdir(CACHE_DIR):
+            return
+    try:
+        fd, tmpname = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((VERSION, entry), f, pickle.HIGHEST_PROTOCOL)
+        os.chmod(tmpname, 0o644)
+        os.replace(tmpname, get_filename(key))
+    except (IOError, OSError, pickle.PicklingError):
+        try:
+            os.remove(tmpname)
+        except OSError:
+            pass
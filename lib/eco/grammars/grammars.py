@@ -62,49 +62,63 @@ class EcoFile(object):
         self.auto_limit_new = False
 
     def load(self, buildlexer=True):
-        from grammar_parser.bootstrap import BootstrapParser
-        from jsonmanager import JsonManager
         from incparser.incparser import IncParser
 
-        if self.name + "::parser" in _cache:
+        if self.name + "::parser" not in _cache:
+            self.build(buildlexer)
 
-            syntaxtable, whitespaces = _cache[self.name + "::parser"]
-            incparser = IncParser()
-            incparser.syntaxtable = syntaxtable
-            incparser.whitespaces = whitespaces
-            incparser.init_ast()
-            incparser.lang = self.name
+        syntaxtable, whitespaces = _cache[self.name + "::parser"]
+        incparser = IncParser()
+        incparser.syntaxtable = syntaxtable
+        incparser.whitespaces = whitespaces
+        incparser.init_ast()
+        incparser.lang = self.name
 
-            inclexer = _cache[self.name + "::lexer"]
-            incparser.lexer = inclexer # give parser a reference to its lexer (needed for multiline comments)
-            incparser.previous_version.parent.name = self.name
+        inclexer = _cache[self.name + "::lexer"]
+        incparser.lexer = inclexer # give parser a reference to its lexer (needed for multiline comments)
+        incparser.previous_version.parent.name = self.name
 
-            return (incparser, inclexer)
-        else:
-            manager = JsonManager(unescape=True)
-            root, language, whitespaces = manager.load(self.filename)[0]
-
-            bootstrap = BootstrapParser(lr_type=1, whitespaces=whitespaces)
-            bootstrap.ast = root
-            bootstrap.extra_alternatives = self.alts
-            bootstrap.change_startrule = self.extract
-            bootstrap.read_options()
+        return (incparser, inclexer)
+
+    def bootstrap(self):
+        """Returns a `BootstrapParser` that has read the options of this
+        grammar."""
+        from grammar_parser.bootstrap import BootstrapParser
+        from jsonmanager import JsonManager
+
+        manager = JsonManager(unescape=True)
+        root, language, whitespaces = manager.load(self.filename)[0]
+
+        bootstrap = BootstrapParser(lr_type=1, whitespaces=whitespaces)
+        bootstrap.ast = root
+        bootstrap.extra_alternatives = self.alts
+        bootstrap.change_startrule = self.extract
+        bootstrap.read_options()
+        return bootstrap
+
+    def build(self, buildlexer=True):
+        """Builds syntax table and lexer of this grammar, unless they can be
+        found in the persistent grammar cache."""
+        from grammars import cache
+
+        key = cache.get_key(self.filename, self.alts, self.extract, buildlexer)
+        entry = cache.load(key)
+        if entry is None:
+            bootstrap = self.bootstrap()
             whitespace = bootstrap.implicit_ws()
 
             pickle_id = self.pickleid(whitespace)
 
             bootstrap.parse_both()
             bootstrap.create_parser(pickle_id)
-            bootstrap.create_lexer(buildlexer)
+            bootstrap.create_lexer(buildlexer, pickle_id)
 
-            _cache[self.name + "::lexer"] = bootstrap.inclexer
-            _cache[self.name + "::json"] = (root, language, whitespaces)
-            _cache[self.name + "::parser"] = (bootstrap.incparser.syntaxtable, whitespace)
+            entry = (bootstrap.incparser.syntaxtable, whitespace, bootstrap.inclexer)
+            cache.store(key, entry)
 
-            bootstrap.incparser.lang = self.name
-            bootstrap.incparser.previous_version.parent.name = self.name
-            bootstrap.incparser.lexer = bootstrap.inclexer
-            return (bootstrap.incparser, bootstrap.inclexer)
+        syntaxtable, whitespace, inclexer = entry
+        _cache[self.name + "::lexer"] = inclexer
+        _cache[self.name + "::parser"] = (syntaxtable, whitespace)
 
     def add_alternative(self, nonterminal, language):
         if isinstance(language, EcoFile):
@@ -22,12 +22,13 @@
 from grammar_parser.plexer import PriorityLexer
 from grammar_parser.gparser import MagicTerminal, Terminal, IndentationTerminal
 from incparser.astree import BOS, EOS, TextNode, ImageNode, MultiTextNode
-try:
-    import __pypy__
-except ImportError:
-    from PyQt5.QtGui import QImage
 import re, os
 
+def load_image(filename):
+    # Imported lazily so the lexer can be used without PyQt (e.g. in batch mode)
+    from PyQt5.QtGui import QImage
+    return QImage(filename)
+
 class IncrementalLexer(object):
     """Deprecated incremental lexer."""
     # XXX needs to be replaced by a lexing automaton to avoid unnecessary
@@ -169,7 +170,7 @@ class IncrementalLexer(object):
                     filename = "chemicals/" + node.symbol.name + ".png"
                     if os.path.isfile(filename):
                         additional_node = ImageNode(node, 0)
-                        additional_node.image = QImage(filename)
+                        additional_node.image = load_image(filename)
                         old_node.image_src = filename
                     else:
                         additional_node.image = None
@@ -193,7 +194,7 @@ class IncrementalLexer(object):
                 if self.language == "Chemicals":
                     filename = "chemicals/" + old_node.symbol.name + ".png"
                     if os.path.isfile(filename):
-                        old_node.image = QImage(filename)
+                        old_node.image = load_image(filename)
                         old_node.image_src = filename
                     else:
                         old_node.image = None
@@ -288,7 +289,7 @@ class IncrementalLexer(object):
                     filename = "chemicals/" + node.symbol.name + ".png"
                     if os.path.isfile(filename):
                         additional_node = ImageNode(node, 0)
-                        additional_node.image = QImage(filename)
+                        additional_node.image = load_image(filename)
                         old_node.image_src = filename
                     else:
                         additional_node.image = None
@@ -312,7 +313,7 @@ class IncrementalLexer(object):
                 if self.language == "Chemicals":
                     filename = "chemicals/" + old_node.symbol.name + ".png"
                     if os.path.isfile(filename):
-                        old_node.image = QImage(filename)
+                        old_node.image = load_image(filename)
                         old_node.image_src = filename
                     else:
                         old_node.image = None
@@ -394,8 +395,8 @@ class IncrementalLexerCF(object):
             if name == "indentation" and value == "true":
                 self.indentation_based = True
 
-    def from_name_and_regex(self, names, regexs):
-        self.lexer = Lexer(list(zip(names, regexs)))
+    def from_name_and_regex(self, names, regexs, pickle_id=None):
+        self.lexer = Lexer(list(zip(names, regexs)), pickle_id)
 
     def createDFA(self, rules):
         # lex lexing rules
@@ -424,38 +425,70 @@ class IncrementalLexerCF(object):
             l.append((t[0], t[1]))
         return l
 
-    def relex_import(self, startnode, version = 0):
-        """Optimised relex for freshly imported files."""
-        success = self.lex(startnode.symbol.name)
-        bos = startnode.prev_term # bos
-        parent = bos.parent
-        eos = parent.children.pop()
-        last_node = bos
-        for match in success:
-            if match is success[0]:
-                # reuse old node for fist node to mimic the behaviour of a
-                # normal relex
-                node = startnode
-                node.symbol.name = match[0]
+    def relex_import(self, startnode):
+        """Optimised relex for freshly imported files. `startnode` must be the
+        only terminal between BOS and EOS and contain the entire text, which is
+        lexed in a single pass. The resulting nodes (including multitext nodes
+        for tokens spanning multiple lines and their lookbacks) are the same
+        ones `relex` would create, but are built without merging them into the
+        existing tree one by one. Returns False without changing anything if
+        the text contains a lexing error, in which case `relex` needs to be
+        used instead."""
+        tokens = self.lexer.lex(startnode.symbol.name)
+        if not tokens or tokens[-1][1] is None:
+            return False
+        bos = startnode.prev_term
+        eos = startnode.next_term
+        parent = startnode.parent
+        index = parent.children.index(startnode)
+
+        self.relexed = set()
+        nodes = []
+        last = bos
+        reuse = startnode
+        for text, lookup, lookahead in tokens:
+            if "\r" in text and text != "\r":
+                # split tokens spanning multiple lines like `Lexer.get_token`
+                parts = [x for x in re.split("(\r)", text) if x != ""]
+                node = MultiTextNode()
+                subnodes = []
+                for part in parts:
+                    if reuse is not None:
+                        sub, reuse = reuse, None
+                        sub.symbol.name = part
+                    else:
+                        sub = TextNode(Terminal(part))
+                    sub.lookup = lookup
+                    sub.lookahead = lookahead
+                    subnodes.append(sub)
+                    self.relexed.add(sub)
+                node.set_children(subnodes)
+                node.update_children()
+            elif reuse is not None:
+                # reuse the imported node for the first token to mimic the
+                # behaviour of a normal relex
+                node, reuse = reuse, None
+                node.symbol.name = text
             else:
-                node = TextNode(Terminal(match[0]))
-            node.lookup = match[1]
-            parent.children.append(node)
-            last_node.next_term = node
-            last_node.right = node
-            node.left = last_node
-            node.prev_term = last_node
-            node.parent = parent
-            last_node = node
-            node.mark_changed()
-        parent.children.append(eos)
-        last_node.right = eos # link to eos
-        last_node.next_term = eos
-        eos.left = last_node
-        eos.prev_term = last_node
-        bos.mark_changed()
-        eos.mark_changed()
+                node = TextNode(Terminal(text))
+            node.lookup = lookup
+            node.lookahead = lookahead
+            node.changed = True
+            node.magic_parent = bos.magic_parent
+            node.prev_term = last
+            last.next_term = node
+            last = node
+            nodes.append(node)
+            self.relexed.add(node)
+        last.next_term = eos
+        eos.prev_term = last
+        # keep the (empty) nonterminals of the previous parse
+        parent.set_children(parent.children[:index] + nodes + parent.children[index+1:])
         parent.mark_changed()
+        eos.mark_changed()
+
+        self.update_lookback(bos.next_term, bos.next_term)
+        return True
 
     def relex(self, node):
         # find farthest node that has lookahead into node
@@ -20,8 +20,10 @@
 # IN THE SOFTWARE.
 
 import re
-from grammar_parser.gparser import Nonterminal, Terminal, IndentationTerminal
+from bisect import bisect_left, bisect_right, insort
+from grammar_parser.gparser import Nonterminal, Terminal, MagicTerminal, IndentationTerminal
 from .syntaxtable import FinishSymbol
+import stats, sys
 
 class AST(object):
     def __init__(self, parent=None):
@@ -40,31 +42,41 @@ class AST(object):
     def get_bos(self):
         return self.parent.children[0]
 
-    def find_node_at_pos(self, pos, node=None): #recursive
-        if node is None:
-           node = self.parent.children[1]
-
-        if isinstance(node.symbol, Nonterminal):
+    def find_node_at_pos(self, pos):
+        """Returns the terminal that ends at or contains the offset `pos`, or BOS
+        if `pos` is at the beginning of the tree and EOS if it is past its end.
+
+        The `exportlen` of every node (which the TreeManager updates after each
+        parse) is used as an index, so only the nodes along a single path from
+        the root need to be visited. Offsets are relative to the text this tree
+        is exported as (see `TreeManager.export_as_text`): indentation
+        terminals are skipped and a language box counts with the length of its
+        content, but is returned as a single terminal."""
+        node = self.parent
+        offset = 0
+        while node.children:
             for child in node.children:
-                result = self.find_node_at_pos(pos, child)
-                if result:
-                    return result
-
-        if node.pos + len(node.symbol.name) >= pos:
-            return node
-
+                if offset < pos <= offset + child.exportlen:
+                    node = child
+                    break
+                offset += child.exportlen
+            else:
+                if pos <= 0:
+                    return self.get_bos()
+                return self.parent.children[-1]
+        return node
 
-    def find_node_at_pos_iterative(self, pos): #not working
-        stack = []
-        stack.append(self.parent.children[1]) # skip bos
-        #XXX speed things up later by having a list/dict of all terminal nodes
-        while stack != []:
-            e = stack.pop(0)
-            if isinstance(e.symbol, Nonterminal):
-                stack.extend(e.children)
-                continue
-            if e.pos + len(e.symbol.name) >= pos:
-                return e
+    def get_node_offset(self, node):
+        """Returns the offset at which `node` starts within this tree. This is
+        the inverse of `find_node_at_pos`."""
+        offset = 0
+        while node.parent is not None:
+            sibling = node.left
+            while sibling is not None:
+                offset += sibling.exportlen
+                sibling = sibling.left
+            node = node.parent
+        return offset
 
     def find_common_parent(self, start, end):
         start_parents = []
@@ -85,17 +97,6 @@ class AST(object):
                     return p1
         return None
 
-    def adjust_nodes_after_node(self, node, change):
-        stack = []
-        stack.append(self.parent.children[1]) # skip bos
-        found = False
-        for e in stack:
-            if e is node:
-                found = True
-                continue
-            if found:
-                e.pos += change
-
     def pprint(self):
         self.parent.pprint()
 
@@ -103,8 +104,335 @@ class AST(object):
         self.parent.cprint(output)
         return "\n".join(output)
 
+# Attributes of a node that are versioned. `History` stores the values of these
+# fields in this order for each saved version (see `Delta`).
+FIELDS = ("parent", "children", "left", "right", "next_term", "prev_term",
+          "deleted", "indent", "changed", "nested_changes", "nested_errors",
+          "local_error", "textlen", "position", "isolated", "symbol.name",
+          "lookup", "new")
+FIELD_INDEX = dict((name, i) for i, name in enumerate(FIELDS))
+CHILDREN = FIELD_INDEX["children"]
+NEW = FIELD_INDEX["new"]
+
+def compact_versions(items, keep, limit):
+    """Merges versions into the nearest version that is kept.
+
+    `items` is a list of (version, value) pairs sorted by version, where each
+    value is valid from its version until the next one. Of all versions up to
+    `limit`, only those in the sorted list `keep` (which must contain `limit`)
+    remain: the latest value saved at or before a kept version is moved to
+    that version and all others are dropped. Versions newer than `limit` are
+    left alone. This preserves the values at all kept versions and after
+    `limit`."""
+    result = []
+    for version, value in items:
+        if version <= limit:
+            version = keep[bisect_left(keep, version)]
+            if result and result[-1][0] == version:
+                result[-1] = (version, value)
+                continue
+        result.append((version, value))
+    return result
+
+class VersionLog(dict):
+    """A dictionary mapping versions to values, which keeps a sorted list of
+    its versions for `find_version`. Only item assignment and deletion keep
+    that list up to date."""
+
+    __slots__ = ["versions"]
+
+    def __init__(self, items=()):
+        dict.__init__(self, items)
+        self.versions = sorted(self)
+
+    def __setitem__(self, version, value):
+        if version not in self:
+            insort(self.versions, version)
+        dict.__setitem__(self, version, value)
+
+    def __delitem__(self, version):
+        dict.__delitem__(self, version)
+        del self.versions[bisect_left(self.versions, version)]
+
+def find_version(log, version):
+    """Returns the value that the VersionLog `log` holds at `version`: the
+    value of the latest version at or before it. Raises KeyError if there is
+    no such version."""
+    try:
+        return log[version]
+    except KeyError:
+        # the version was compacted (see `compact_versions`)
+        i = bisect_right(log.versions, version) - 1
+        if i < 0:
+            raise
+        return log[log.versions[i]]
+
+class Delta(tuple):
+    """A snapshot stored as the fields in which it differs from the preceding
+    keyframe (a full snapshot) in the same `History`. The first item is the
+    delta's layout (see `delta_layout`), followed by the values of the stored fields
+    in the order of `FIELDS`."""
+
+    __slots__ = ()
+
+    def distance(self):
+        return self[0][DISTANCE]
+
+    def lookup(self, field, default=None):
+        """Returns the value of `field` if this delta stores it, otherwise
+        `default`."""
+        position = self[0][field]
+        if position:
+            return self[position]
+        return default
+
+# Indices into a layout after the positions of the fields
+DISTANCE = len(FIELDS)
+STORED = DISTANCE + 1
+LAYOUTS = {}
+
+def delta_layout(stored, distance):
+    """Returns the layout of deltas storing the fields `stored` (a tuple of
+    field indices) at `distance` from their keyframe: for each field its
+    position in the delta or 0 if it isn't stored, then the distance and the
+    pairs of stored fields and their positions. Layouts are shared, since only
+    a few combinations occur."""
+    key = (stored, distance)
+    try:
+        return LAYOUTS[key]
+    except KeyError:
+        positions = [0] * len(FIELDS)
+        for position, field in enumerate(stored, 1):
+            positions[field] = position
+        pairs = tuple((field, positions[field]) for field in stored)
+        result = LAYOUTS[key] = tuple(positions) + (distance, pairs)
+        return result
+
+# A keyframe is stored at least this often, which bounds the number of deltas
+# that need to be rewritten when a version is inserted or deleted (see
+# `History.splice`), and whenever a delta would hold more than `MAX_DELTA`
+# fields, in which case it saves hardly any memory
+KEYFRAME_INTERVAL = 32
+MAX_DELTA = len(FIELDS) // 2
+# Values that may be equal without being identical. Everything else (nodes in
+# particular, whose `__eq__` compares whole subtrees) is compared by identity.
+VALUE_TYPES = (int, str)
+
+class History(object):
+    """Versioned attributes of a node.
+
+    `versions` is a sorted list of all versions in which the node has been
+    saved and `snapshots` contains the corresponding field values (see
+    `FIELDS`). Finding the state of a node at any version is a binary search
+    over `versions`. Most saves only change one or two fields, so snapshots
+    are either keyframes, holding all fields, or a `Delta` holding the fields
+    that differ from the preceding keyframe. Rebuilding a snapshot therefore
+    never needs more than two entries. Snapshots only hold references, so
+    values that didn't change between two versions (most importantly the list
+    of children) are shared instead of being copied. Lists of children are
+    stored as tuples, so that the children of all terminals share the empty
+    tuple."""
+
+    __slots__ = ["versions", "snapshots"]
+
+    def __init__(self):
+        self.versions = []
+        self.snapshots = []
+
+    def __len__(self):
+        return len(self.versions)
+
+    def index(self, version):
+        """Returns the index of the latest snapshot saved at or before
+        `version`, or -1 if there is none."""
+        return bisect_right(self.versions, version) - 1
+
+    def snapshot(self, i):
+        """Returns the full snapshot at index `i`."""
+        entry = self.snapshots[i]
+        if type(entry) is not Delta:
+            return entry
+        layout = entry[0]
+        values = list(self.snapshots[i - layout[DISTANCE]])
+        for field, position in layout[STORED]:
+            values[field] = entry[position]
+        return tuple(values)
+
+    def find(self, version):
+        """Returns the version and snapshot the node had at `version`."""
+        i = bisect_right(self.versions, version) - 1
+        if i < 0:
+            return None, None
+        if type(self.snapshots[i]) is Delta:
+            return self.versions[i], self.snapshot(i)
+        return self.versions[i], self.snapshots[i]
+
+    def exact(self, version):
+        i = self.index(version)
+        if i >= 0 and self.versions[i] == version:
+            return self.snapshot(i)
+        return None
+
+    def contains(self, version):
+        i = self.index(version)
+        return i >= 0 and self.versions[i] == version
+
+    def stamp(self, version):
+        """Returns the object stored for the snapshot the node had at
+        `version`, or None. Unlike the tuples returned by `find`, it stays the
+        same until that snapshot is overwritten, so it can be used to check
+        whether a node has been saved again."""
+        i = self.index(version)
+        if i < 0:
+            return None
+        return self.snapshots[i]
+
+    def get(self, attr, version):
+        i = bisect_right(self.versions, version) - 1
+        if i < 0:
+            raise KeyError((attr, version))
+        field = FIELD_INDEX[attr]
+        entry = self.snapshots[i]
+        if type(entry) is Delta:
+            # inlined `Delta.lookup`, since this is called for every node
+            # when undoing
+            layout = entry[0]
+            position = layout[field]
+            if position:
+                return entry[position]
+            entry = self.snapshots[i - layout[DISTANCE]]
+        return entry[field]
+
+    def encode(self, i, snapshot):
+        """Returns the entry to store for the full `snapshot` at index `i`,
+        given the entries before it."""
+        if i == 0:
+            return snapshot
+        previous = self.snapshots[i - 1]
+        distance = 1
+        if type(previous) is Delta:
+            distance += previous.distance()
+        if distance >= KEYFRAME_INTERVAL:
+            return snapshot
+        keyframe = self.snapshots[i - distance]
+        stored = []
+        values = [None]
+        for field, (value, old) in enumerate(zip(snapshot, keyframe)):
+            if value is not old and not (type(value) is type(old) and
+                    type(value) in VALUE_TYPES and value == old):
+                stored.append(field)
+                values.append(value)
+        if len(stored) > MAX_DELTA:
+            return snapshot
+        values[0] = delta_layout(tuple(stored), distance)
+        return Delta(values)
+
+    def splice(self, start, stop, snapshots):
+        """Replaces the entries from index `start` to `stop` with the full
+        `snapshots`. The deltas following them are encoded again up to the
+        next keyframe, since they depend on the entries before them."""
+        while stop < len(self.snapshots) and type(self.snapshots[stop]) is Delta:
+            snapshots.append(self.snapshot(stop))
+            stop += 1
+        del self.snapshots[start:stop]
+        for i, snapshot in enumerate(snapshots, start):
+            self.snapshots.insert(i, self.encode(i, snapshot))
+
+    def record(self, version, snapshot):
+        if self is NO_HISTORY:
+            raise ValueError("Can't record a version in the shared empty history.")
+        if not self.versions:
+            # avoid the overallocation of `insert`: most nodes are only
+            # saved once
+            self.versions = [version]
+            self.snapshots = [snapshot]
+            return
+        i = self.index(version)
+        if i >= 0 and self.versions[i] == version:
+            self.splice(i, i + 1, [snapshot])
+        else:
+            self.versions.insert(i + 1, version)
+            self.splice(i + 1, i + 1, [snapshot])
+
+    def set(self, attr, version, value):
+        """Overwrites a single attribute at `version`. If the node hasn't been
+        saved at that version, a new snapshot based on the preceding one is
+        created."""
+        _, snapshot = self.find(version)
+        if snapshot is None:
+            values = [None] * len(FIELDS)
+            values[CHILDREN] = ()
+        else:
+            values = list(snapshot)
+        values[FIELD_INDEX[attr]] = value
+        self.record(version, tuple(values))
+
+    def delete(self, version):
+        i = self.index(version)
+        if i >= 0 and self.versions[i] == version:
+            del self.versions[i]
+            self.splice(i, i + 1, [])
+
+    def truncate(self, version):
+        """Removes all versions newer than `version`."""
+        i = self.index(version) + 1
+        del self.versions[i:]
+        del self.snapshots[i:]
+
+    def max_version(self):
+        if self.versions:
+            return self.versions[-1]
+        return None
+
+    def compact(self, keep, limit):
+        """See `compact_versions`."""
+        if not self.versions:
+            return
+        snapshots = [self.snapshot(i) for i in range(len(self.snapshots))]
+        first = snapshots[0]
+        items = compact_versions(list(zip(self.versions, snapshots)), keep, limit)
+        self.versions = [v for v, _ in items]
+        snapshots = [s for _, s in items]
+        if first[NEW] and not snapshots[0][NEW]:
+            # the node still needs to be recognised as new in its first
+            # version, so that undoing doesn't try to restore it
+            values = list(snapshots[0])
+            values[NEW] = True
+            snapshots[0] = tuple(values)
+        self.snapshots = []
+        for i, snapshot in enumerate(snapshots):
+            self.snapshots.append(self.encode(i, snapshot))
+
+    def children(self):
+        """Yields the lists of children stored in this history."""
+        for entry in self.snapshots:
+            if type(entry) is Delta:
+                children = entry.lookup(CHILDREN)
+                if children is not None:
+                    yield children
+            else:
+                yield entry[CHILDREN]
+
+    def sizeof(self, seen):
+        """Returns the approximate number of bytes used by this history.
+        Lists of children shared with other snapshots are only counted once,
+        using the set of ids `seen`."""
+        size = sys.getsizeof(self.versions) + sys.getsizeof(self.snapshots)
+        for entry in self.snapshots:
+            if id(entry) not in seen:
+                seen.add(id(entry))
+                size += sys.getsizeof(entry)
+        for children in self.children():
+            if id(children) not in seen:
+                seen.add(id(children))
+                size += sys.getsizeof(children)
+        return size
+
+# Shared by all nodes that haven't been saved yet (see `Node.save`)
+NO_HISTORY = History()
+
 class Node(object):
-    __slots__ = ["symbol", "state", "parent", "left", "right", "prev_term", "next_term", "magic_parent", "children", "annotations", "log", "max_version"]
+    __slots__ = ["symbol", "state", "parent", "left", "right", "prev_term", "next_term", "magic_parent", "children", "annotations", "log"]
     def __init__(self, symbol, state, children):
         self.symbol = symbol
         self.state = state
@@ -117,11 +445,13 @@ class Node(object):
         if children is None:
             children = []
         self.set_children(children)
-        self.log = {}
-        self.max_version = None
-        self.annotations = []
+        self.log = NO_HISTORY
+        self.annotations = ()
 
     def add_annotation(self, annotation):
+        if not self.annotations:
+            # allocated on first use, since most nodes have no annotations
+            self.annotations = []
         self.annotations.append(annotation)
 
     def remove_annotations_by_class(self, klass):
@@ -187,81 +517,59 @@ class Node(object):
                 break
 
     def save(self, version):
-        # XXX version set, e.g. set(0,1,5,6,9) that contains all versions in
-        # which this node has been saved. this way we can easily check if a
-        # the node has changes in that version and quickly get the closest
-        # versions to it if not
-        self.log[("children", version)] = list(self.children)
-        self.log[("parent", version)] = self.parent
-        self.log[("left", version)] = self.left
-        self.log[("right", version)] = self.right
-        self.log[("next_term", version)] = self.next_term
-        self.log[("prev_term", version)] = self.prev_term
-        self.log[("deleted", version)] = self.deleted
-        self.log[("indent", version)] = self.indent
-        self.log[("changed", version)] = self.changed
-        self.log[("nested_changes", version)] = self.nested_changes
-        self.log[("nested_errors", version)] = self.nested_errors
-        self.log[("local_error", version)] = self.local_error
-        self.log[("textlen", version)] = self.textlen
-        self.log[("position", version)] = self.position
-        self.log[("isolated", version)] = self.isolated
-        self.log[("version", version)] = version
-        if self.new:
-            self.log[("new", version)] = True
-            self.new = False
+        _, previous = self.log.find(version)
+        children = self.children
+        if previous is not None:
+            # share the list of children with the previous version if it
+            # hasn't changed
+            old = previous[CHILDREN]
+            if len(old) == len(children) and all(a is b for a, b in zip(old, children)):
+                children = old
+            else:
+                children = tuple(children)
+        else:
+            if self.log is NO_HISTORY:
+                self.log = History()
+            children = tuple(children)
+        snapshot = (self.parent, children, self.left, self.right,
+            self.next_term, self.prev_term, self.deleted, self.indent,
+            self.changed, self.nested_changes, self.nested_errors,
+            self.local_error, self.textlen, self.position, self.isolated,
+            self.symbol.name, self.lookup, self.new)
+        self.log.record(version, snapshot)
+        size = sys.getsizeof(self.log.stamp(version))
+        if children and (previous is None or children is not previous[CHILDREN]):
+            size += sys.getsizeof(children)
+        if stats.current:
+            stats.current.count("saved_nodes")
+            stats.current.count("saved_bytes", size)
+        self.new = False
         # XXX save lookback
         self.version = version
+        return size
 
     def load(self, version):
-        while version >= 0:
-            if ("parent", version) in self.log:
-                self.parent = self.log[("parent", version)]
-                self.children = list(self.log[("children", version)])
-                self.left = self.log[("left", version)]
-                self.right = self.log[("right", version)]
-                self.next_term = self.log[("next_term", version)]
-                self.prev_term = self.log[("prev_term", version)]
-                self.deleted = self.log[("deleted", version)]
-                self.indent = self.log[("indent", version)]
-                self.changed = self.log[("changed", version)]
-                self.nested_changes = self.log[("nested_changes", version)]
-                self.local_error = self.log[("local_error", version)]
-                self.nested_errors = self.log[("nested_errors", version)]
-                self.textlen = self.log[("textlen", version)]
-                self.position = self.log[("position", version)]
-                self.isolated = self.log[("isolated", version)]
-                self.version = version
-                return
-            version -= 1
+        version, snapshot = self.log.find(version)
+        if snapshot is None:
+            return
+        (self.parent, children, self.left, self.right, self.next_term,
+            self.prev_term, self.deleted, self.indent, self.changed,
+            self.nested_changes, self.nested_errors, self.local_error,
+            self.textlen, self.position, self.isolated, _, _, _) = snapshot
+        self.children = list(children)
+        self.version = version
+        return snapshot
 
     def delete_version(self, version):
-        if not ("parent", version) in self.log:
-            return
-        assert version <= self.max_version
-        for attr in ["parent", "children", "left", "right", "next_term", "prev_term", "deleted", "indent",\
-                "changed", "nested_changes", "local_error", "nested_errors", "symbol.name", "lookup", "version"]:
-            if (attr, version) in self.log:
-                self.log.pop((attr, version))
-        # reset max_version
-        new_max = version - 1
-        while not ("parent", new_max) in self.log:
-            if new_max == 0:
-                break
-            new_max -= 1
-        self.max_version = new_max
+        self.log.delete(version)
 
     def get_attr(self, attr, version):
         if version is None:
             return getattr(self, attr)
-        if self.max_version and version > self.max_version:
-            return self.log[(attr, self.max_version)]
-        while version >= 0:
-            try:
-                return self.log[(attr, version)]
-            except KeyError:
-                version -= 1
-        raise AttributeError("Attribute %s for version %s not found." % (attr, version))
+        try:
+            return self.log.get(attr, version)
+        except KeyError:
+            raise AttributeError("Attribute %s for version %s not found." % (attr, version))
 
     def remove_child(self, child, remove=False):
         for i in range(len(self.children)):
@@ -355,7 +663,7 @@ class Node(object):
     def find_first_terminal(self, version):
         node = self
         while isinstance(node.symbol, Nonterminal):
-            if node.get_attr("children", version) == []:
+            if not node.get_attr("children", version):
                 while node.right_sibling(version) is None:
                     node = node.get_attr("parent", version)
                 node = node.right_sibling(version)
@@ -462,8 +770,35 @@ lowercase = set(list(string.ascii_lowercase))
 uppercase = set(list(string.ascii_uppercase))
 digits = set(list(string.digits))
 
+def side_data(name, default=None):
+    """Returns a property storing the attribute `name` in the `extra`
+    dictionary of a node, which is only allocated once the attribute is set to
+    something other than `default`. Used for attributes that only a few nodes
+    need, e.g. those of language boxes or images."""
+    def get(self):
+        if self.extra is None:
+            return default
+        return self.extra.get(name, default)
+    def set(self, value):
+        if self.extra is None:
+            if value is default:
+                return
+            self.extra = {}
+        self.extra[name] = value
+    return property(get, set)
+
 class TextNode(Node):
-    __slots__ = ["autobox", "tbd", "name", "log", "max_version", "version", "position", "changed", "exists", "isolated", "textlen", "local_error", "nested_errors", "nested_changes", "new", "deleted", "image", "image_src", "plain_mode", "alternate", "lookahead", "lookback", "lookup", "parent_lbox", "magic_backpointer", "indent"]
+    __slots__ = ["version", "position", "changed", "exists", "isolated", "textlen", "exportlen", "local_error", "nested_errors", "nested_changes", "new", "deleted", "alternate", "lookahead", "lookback", "lookup", "indent", "export_cache", "extra"]
+
+    autobox = side_data("autobox")
+    tbd = side_data("tbd", False)
+    name = side_data("name")
+    image = side_data("image")
+    image_src = side_data("image_src")
+    plain_mode = side_data("plain_mode", False)
+    parent_lbox = side_data("parent_lbox")
+    magic_backpointer = side_data("magic_backpointer")
+
     def __init__(self, symbol, state=-1, children=None, pos=-1, lookahead=0):
         if children is None:
             children = []
@@ -475,28 +810,21 @@ class TextNode(Node):
         self.local_error = False
         self.nested_errors = False
         self.deleted = False
-        self.image = None
-        self.image_src = None
-        self.plain_mode = False
         self.alternate = None
         self.lookahead = lookahead
         self.lookup = ""
-        self.log = {}
         self.version = 0
         self.indent = None
         self.textlen = -1
+        self.exportlen = 0
         self.isolated = None
         self.lookback = -1
         self.exists = False
-        self.name = None
-        self.tbd = False
-        self.autobox = None
+        self.extra = None
+        self.export_cache = None # see export.helper.get_pieces
 
     def get_magicterminal(self):
-        try:
-            return self.magic_backpointer
-        except AttributeError:
-            return None
+        return self.magic_backpointer
 
     def get_root(self, version=None):
         if version:
@@ -553,30 +881,23 @@ class TextNode(Node):
         else:
             self.lookup = ""
 
-    def save(self, version):
-        Node.save(self, version)
-        self.log[("symbol.name", version)] = self.symbol.name
-        self.log[("lookup", version)] = self.lookup
-        self.max_version = version
-
     def load(self, version):
-        Node.load(self, version)
-        while version >= 0:
-            if ("parent", version) in self.log:
-                self.lookup = self.log[("lookup", version)]
-                break
-            version -= 1
+        snapshot = Node.load(self, version)
+        if snapshot is None:
+            return
+        self.lookup = snapshot[FIELD_INDEX["lookup"]]
 
         if not isinstance(self.symbol, Terminal):
             return
-        text = self.get_text(version)
+        text = snapshot[FIELD_INDEX["symbol.name"]]
         if text:
             self.symbol.name = text
         else:
             pass
 
     def is_new(self, version):
-        return ("new", version) in self.log
+        snapshot = self.log.exact(version)
+        return snapshot is not None and snapshot[FIELD_INDEX["new"]]
 
     def textlength(self, version = None):
         if version is not None:
@@ -590,11 +911,27 @@ class TextNode(Node):
             self.textlen = 0
         else:
             self.textlen = len(self.symbol.name)
+        self.calc_exportlen()
+
+    def calc_exportlen(self):
+        """Calculates `exportlen`, the length of the text this subtree is
+        exported as (see `export.helper`). Unlike `textlen`, indentation
+        terminals don't count and language boxes count with the length of
+        their content. Isn't versioned, so it is recalculated when undoing."""
+        if self.children:
+            self.exportlen = sum([c.exportlen for c in self.children])
+        elif self.deleted or isinstance(self, BOS) or isinstance(self.symbol, (FinishSymbol, Nonterminal, IndentationTerminal)):
+            self.exportlen = 0
+        elif isinstance(self.symbol, MagicTerminal):
+            ast = getattr(self.symbol, "ast", None)
+            self.exportlen = ast.exportlen if ast is not None else 0
+        else:
+            self.exportlen = len(self.symbol.name)
 
     def has_unsaved_changes(self):
-        if self.changed != self.log[("changed", self.version)]:
+        if self.changed != self.log.get("changed", self.version):
             return True
-        if self.nested_changes != self.log[("nested_changes", self.version)]:
+        if self.nested_changes != self.log.get("nested_changes", self.version):
             return True
         return False
 
@@ -607,10 +944,9 @@ class TextNode(Node):
         return self.nested_errors or self.local_error
 
     def get_text(self, version):
-        while version >= 0:
-            if ("symbol.name", version) in self.log:
-                return self.log[("symbol.name", version)]
-            version -= 1
+        _, snapshot = self.log.find(version)
+        if snapshot is not None:
+            return snapshot[FIELD_INDEX["symbol.name"]]
         return self.symbol.name
 
     def insert(self, char, pos):
@@ -1,5 +1,6 @@
 from .astree import FinishSymbol, BOS, EOS, Nonterminal
 from .syntaxtable import Goto
+from bisect import bisect_left
 import logging
 
 class RecoveryManager(object):
@@ -11,6 +12,16 @@ class RecoveryManager(object):
         self.syntaxtable = syntaxtable
         self.rejects = set()
 
+        # The character offsets at which the nodes on the stack end, i.e. the
+        # running total of their text lengths. Computed when recovery starts
+        # and kept in sync with the stack while recovering, so that cut points
+        # can be found by bisection.
+        self.stack_offsets = []
+        # Offsets of nodes in the previous version, cached while recovering.
+        # They can't be kept across recoveries, since out-of-context analysis
+        # temporarily changes the previous version.
+        self.offsets = {}
+
         self.new_state = None
         self.iso_node = None
 
@@ -33,6 +44,9 @@ class RecoveryManager(object):
             # Can't recover if EOS caused the error. But why?
             return False
 
+        self.offsets = {}
+        self.update_stack_offsets()
+
         # Get the character offset of the top node on the stack
         error_offset = self.stack_offset(len(self.stack))
 
@@ -40,7 +54,7 @@ class RecoveryManager(object):
         while not isinstance(node, EOS):
             if node.new:
                 # Can't recover a newly created subtree
-                self.stack.pop()
+                self.pop()
                 node = self.stack[-1]
                 continue
 
@@ -64,10 +78,14 @@ class RecoveryManager(object):
 
             # Couldn't find elegible parent. Now try more previously parsed subtrees
             # on the stack
-            self.stack.pop()
+            self.pop()
             node = self.stack[-1]
         return False
 
+    def pop(self):
+        self.stack.pop()
+        self.stack_offsets.pop()
+
     def is_valid_iso_subtree(self, node, error_offset):
         if node in self.rejects:
             # Node has already been rejected as a candidate for recovery
@@ -86,22 +104,16 @@ class RecoveryManager(object):
         if len(node.children) == 0:
             return False
 
-        cut = self.get_cut(node)
-        if cut == -1:
-            return False
-
-        left_offset = self.stack_offset(cut) # offset of the stack node at position `cut`
-        if left_offset > error_offset:
+        last_offset = self.offset(node, self.previous_version) # character offset of the isolation node
+        if last_offset > error_offset:
             # The node offset is after the error
             return False
 
-        last_offset = self.offset(node, self.previous_version) # character offset of the isolation node
-
-        # because I am using get_cut on all nodes, get_cut would fail before
-        # this check. Wagner doesn't use get_cut on stack nodes which is why he
-        # needed this check
-        if left_offset != last_offset:
-            # Offsets don't align
+        # Find the stack node ending at the offset of the isolation node. Wagner
+        # doesn't use get_cut on stack nodes which is why he needed to check
+        # that their offsets align. Here this is implied by finding a cut.
+        cut = self.find_cut(last_offset)
+        if cut == -1:
             return False
 
         # Get the subtrees character length as in the previous version
@@ -140,6 +152,7 @@ class RecoveryManager(object):
             # position where we can push the subtree and setup the parser so
             # parsing can continue.
             self.stack[:] = self.stack[:cut+1]
+            del self.stack_offsets[cut+1:]
             self.new_state = element.action
             self.iso_node = node
             self.iso_node.state = self.new_state
@@ -150,64 +163,71 @@ class RecoveryManager(object):
 
         return False
 
+    def update_stack_offsets(self):
+        """Computes the offsets at which the nodes on the stack end."""
+        self.stack_offsets = offsets = []
+        offset = 0
+        for n in self.stack:
+            offset += n.textlength()
+            offsets.append(offset)
+
     def get_cut(self, node):
         """Get the stack index at which the character offset is equal to the
         character offset of `node` in the previous version of the tree."""
-        old_offset = self.offset(node, self.previous_version)
-        index = 0
-        length = 0
-        last_index = -1
-        for n in self.stack:
-            length += n.textlength()
-            if length == old_offset:
-                return index
-            if length > old_offset:
-                return -1
-            index += 1
+        return self.find_cut(self.offset(node, self.previous_version))
+
+    def find_cut(self, offset):
+        """Get the lowest stack index at which the character offset is equal
+        to `offset`, or -1 if there is none. Since text lengths can't be
+        negative, the offsets on the stack are sorted."""
+        index = bisect_left(self.stack_offsets, offset)
+        if index < len(self.stack_offsets) and self.stack_offsets[index] == offset:
+            return index
         return -1
 
     def find_cut_point(self, offset):
         """Finds the position on the stack to which we need to reset the parser
         to to continue parsing after isolating a subtree."""
-        cut_point = 0
-        length = 0
-        while cut_point < len(self.stack):
-            cur_node = self.stack[cut_point]
-            length += cur_node.textlength()
-            if length == offset:
-                last_valid_cutpoint = cut_point
-                return cut_point
-            if length > offset:
-                # We are already past the target offset. Abort!
-                break
-            cut_point += 1
-        assert False
+        cut_point = self.find_cut(offset)
+        assert cut_point != -1
+        return cut_point
 
     def stack_offset(self, cut):
         """Get the character offset of the stack node at the position `cut`."""
-        offset = 0
-        i = 0
-        for n in self.stack:
-            offset += n.textlength()
-            if i == cut:
-                break
-            i += 1
-        return offset
+        if not self.stack_offsets:
+            return 0
+        return self.stack_offsets[min(cut, len(self.stack_offsets) - 1)]
 
     def offset(self, node, version = None):
         """Calculates the character offset of `node`. This is an optimised
         version that goes backwards through the tree starting at the node,
         instead of starting at BOS which requires looking into each subtree to
-        find `node`."""
+        find `node`. Offsets in the previous version are cached, so that
+        finding the offsets of the ancestors of a node (or of its siblings)
+        stops as soon as it reaches a node whose offset is already known."""
+        if version == self.previous_version:
+            cache = self.offsets
+        else:
+            cache = {}
+        # the nodes visited on the way back, and the lengths that separate
+        # them from the next node
+        path = []
         offset = 0
         while True:
+            if node in cache:
+                offset = cache[node]
+                break
             if isinstance(node, BOS):
                 # Reached the beginning of the parse tree
                 break
             left = node.get_attr("left", version)
             if left:
+                path.append((node, left.textlength(version = version)))
                 node = left
-                offset += node.textlength(version = version)
             else:
+                path.append((node, 0))
                 node = node.get_attr("parent", version)
+        for node, length in reversed(path):
+            offset += length
+            cache[node] = offset
         return offset
@@ -32,10 +32,11 @@ from grammar_parser.gparser import Parser, Nonterminal, Terminal, Epsilon, Inden
 from .syntaxtable import SyntaxTable, FinishSymbol, Reduce, Accept, Shift
 from .stategraph import StateGraph
 from .constants import LR0, LALR
-from .astree import AST, TextNode, BOS, EOS
+from .astree import AST, TextNode, BOS, EOS, find_version, VersionLog
 from ip_plugins.plugin import PluginManager
 from .error_recovery import RecoveryManager
 from autolboxdetector import NewAutoLboxDetector
+import stats
 
 import logging
 
@@ -95,8 +96,8 @@ class IncParser(object):
         self.validating = False
         self.last_status = False
         self.whitespaces = whitespaces
-        self.status_by_version = {}
-        self.errornodes_by_version = {}
+        self.status_by_version = VersionLog()
+        self.errornodes_by_version = VersionLog()
         self.indentation_based = False
 
         self.previous_version = None
@@ -122,6 +123,9 @@ class IncParser(object):
                     self.syntaxtable = pickle.load(f)
             except IOError:
                 pass
+            if getattr(self.syntaxtable, "version", None) != SyntaxTable.VERSION:
+                # outdated table format: rebuild it
+                self.syntaxtable = None
         if self.syntaxtable is None:
             self.graph = StateGraph(startsymbol, rules, lr_type)
             self.graph.build()
@@ -151,7 +155,152 @@ class IncParser(object):
         eos.save(0)
 
     def reparse(self):
-        self.inc_parse([], True)
+        if not self.batch_parse():
+            self.inc_parse([], True)
+
+    def batch_parse(self):
+        """Parses the entire tree from scratch using a plain LR parser, i.e.
+        without traversing the previous version, breaking down subtrees or
+        reusing nodes. The resulting tree is the same as the one created by
+        `inc_parse` with `needs_reparse` set, but building it is considerably
+        faster, which matters when files are imported or loaded.
+
+        The input is first run through the automaton without touching the
+        tree. If it contains a syntax error, the tree is left unchanged and
+        False is returned, so the caller can fall back to `inc_parse` which
+        knows how to recover from errors."""
+        if self.ooc:
+            return False
+        root = self.previous_version.parent
+        bos = root.children[0]
+        eos = root.children[-1]
+
+        # collect terminals in the same order `pop_lookahead` and
+        # `left_breakdown` would visit them
+        terminals = []
+        nonterminals = []
+        epsilon = Epsilon()
+        todo = list(reversed(root.children[1:-1]))
+        while todo:
+            node = todo.pop()
+            symbol = node.symbol
+            if isinstance(symbol, Terminal) or isinstance(symbol, FinishSymbol) or symbol == epsilon:
+                terminals.append(node)
+            else:
+                nonterminals.append(node)
+                todo.extend(reversed(node.children))
+        tokens = [t for t in terminals if not t.deleted]
+        tokens.append(eos)
+
+        # run the automaton to see if the input can be parsed
+        syntaxtable = self.syntaxtable
+        lookup = syntaxtable.lookup
+        eos_id = syntaxtable.eos_terminal_id
+        actions = []
+        states = [0]
+        state = 0
+        i = 0
+        while True:
+            la = tokens[i]
+            element = None
+            if la is eos:
+                # see `parse_terminal`
+                element = lookup(state, eos_id)
+                if isinstance(element, Shift):
+                    state = element.action
+                    actions.append(element)
+                    continue
+            if element is None:
+                element = lookup(state, self.get_lookup(la))
+            if isinstance(element, Shift):
+                if la is eos:
+                    return False
+                state = element.action
+                states.append(state)
+                i += 1
+            elif isinstance(element, Reduce):
+                amount = element.amount()
+                if amount:
+                    del states[-amount:]
+                goto = lookup(states[-1], element.lhs_id)
+                if goto is None:
+                    return False
+                state = goto.action
+                states.append(state)
+            elif isinstance(element, Accept):
+                break
+            else:
+                return False
+            actions.append(element)
+
+        # build the tree
+        self.validating = False
+        self.reused_nodes = set()
+        self.needs_reparse = True
+        self.error_nodes = []
+        self.error_pres = []
+        self.loopcount = len(actions)
+        root.isolated = None
+        for node in nonterminals:
+            node.exists = False
+        for node in terminals:
+            if node.deleted:
+                node.exists = False
+        eos.state = 0
+        stack = self.stack = [eos]
+        counts = stats.current
+        i = 0
+        for element in actions:
+            if type(element) is Shift:
+                if tokens[i] is eos:
+                    self.current_state = element.action
+                    continue
+                la = tokens[i]
+                i += 1
+                la.state = element.action
+                la.exists = True
+                la.position = stack[-1].position + stack[-1].textlen
+                la.autobox = None
+                la.local_error = la.nested_errors = False
+                stack.append(la)
+                if la.lookup != "<ws>":
+                    self.last_shift_state = element.action
+                if counts:
+                    counts.count("shifts")
+            else:
+                amount = element.amount()
+                if amount:
+                    children = stack[-amount:]
+                    del stack[-amount:]
+                else:
+                    children = []
+                has_errors = False
+                for c in children:
+                    if c.has_errors() or c.isolated:
+                        has_errors = True
+                    if not c.new:
+                        c.mark_changed()
+                goto = lookup(stack[-1].state, element.lhs_id)
+                new_node = Node(element.action.left.copy(), goto.action, children)
+                new_node.nested_errors = has_errors
+                new_node.calc_textlength()
+                new_node.position = stack[-1].position + stack[-1].textlen
+                new_node.exists = True
+                stack.append(new_node)
+                if getattr(element.action.annotation, "interpret", None):
+                    self.interpret_annotation(new_node, element.action)
+                if counts:
+                    counts.count("reductions")
+                    counts.count("new_nodes")
+            self.current_state = stack[-1].state
+
+        bos.changed = False
+        eos.changed = False
+        root.set_children([bos, stack[1], eos])
+        root.changed = True
+        eos.autobox = None
+        self.last_status = True
+        return True
 
     def inc_parse(self, line_indents=[], needs_reparse=False, state=0, stack = []):
         logging.debug("============ NEW %s PARSE ================= ", "OOC" if self.ooc else "INCREMENTAL")
@@ -171,6 +320,8 @@ class IncParser(object):
         self.needs_reparse = needs_reparse
         self.error_nodes = []
         self.error_pres = []
+        if self.autodetector:
+            self.autodetector.start_parse()
         if self.ooc:
             rmroot = self.ooc[1]
         else:
@@ -252,12 +403,14 @@ class IncParser(object):
                             # skip this node immediately.
                             la = self.left_breakdown(la)
                             continue
-                        goto = self.syntaxtable.lookup(self.current_state, la.symbol)
+                        goto = self.syntaxtable.lookup(self.current_state, self.get_lookup(la))
                         # Only opt-shift if the nonterminal has children to
                         # avoid a bug in the retainability algorithm. See
                         # test/test_eco.py::Test_RetainSubtree::test_bug1
                         if goto and la.children: # can we shift this Nonterminal in the current state?
                             logging.debug("OPTShift: %s in state %s -> %s", la.symbol, self.current_state, goto)
+                            if stats.current:
+                                stats.current.count("optimistic_shifts")
                             follow_id = goto.action
                             self.stack.append(la)
                             la.deleted = False
@@ -318,7 +471,7 @@ class IncParser(object):
         if isinstance(la, EOS):
             # This is needed so we can finish single line comments at the end of
             # the file
-            element = self.syntaxtable.lookup(self.current_state, Terminal("<eos>"))
+            element = self.syntaxtable.lookup(self.current_state, self.syntaxtable.eos_terminal_id)
             if isinstance(element, Shift):
                 self.current_state = element.action
                 return la
@@ -359,7 +512,8 @@ class IncParser(object):
                     if type(la.symbol) is MagicTerminal and la.tbd:
                         self.autodetector.check_remove_lbox(la)
                     else:
-                        self.autodetector.detect_lbox(la)
+                        with stats.timer("autolbox"):
+                            self.autodetector.detect_lbox(la)
                 self.error_nodes.append(la)
                 if self.rm.recover(la):
                     # recovered, continue parsing
@@ -381,15 +535,9 @@ class IncParser(object):
                 return "Error"
 
     def get_lookup(self, la):
-        """Get the lookup symbol of a node. If no such lookup symbol exists use the nodes symbol instead."""
-        if la.lookup != "":
-            lookup_symbol = Terminal(la.lookup)
-        else:
-            lookup_symbol = la.symbol
-        if isinstance(lookup_symbol, IndentationTerminal):
-            #XXX hack: change parsing table to accept IndentationTerminals
-            lookup_symbol = Terminal(lookup_symbol.name)
-        return lookup_symbol
+        """Get the id of the lookup symbol of a node within the syntax table. If
+        no such lookup symbol exists use the nodes symbol instead."""
+        return self.syntaxtable.get_lookup_id(la)
 
     def isolate(self, node):
         if node.has_changes():# or node.has_errors():
@@ -467,6 +615,8 @@ class IncParser(object):
     def find_retainable_subtrees(self, node, retain_set, poffset):
         if self.is_retainable_subtree(node, poffset):
             retain_set.add(node)
+            if stats.current:
+                stats.current.count("retained_subtrees")
             return
         for child in node.get_attr("children", self.prev_version):
             self.find_retainable_subtrees(child, retain_set, poffset)
@@ -572,12 +722,12 @@ class IncParser(object):
         # isolation nodes. Without this change we would calculate the offset
         # within the original parse tree and not the offset within the temporary
         # parse tree
-        node.log[("left", self.prev_version)] = temp_bos
-        node.log[("right", self.prev_version)] = temp_eos
+        node.log.set("left", self.prev_version, temp_bos)
+        node.log.set("right", self.prev_version, temp_eos)
 
         logging.debug("    TempEOS: %s", temp_eos)
         temp_root = Node(Nonterminal("TempRoot"), 0, [temp_bos, node, temp_eos])
-        node.log[("parent", self.prev_version)] = temp_root
+        node.log.set("parent", self.prev_version, temp_root)
         temp_root.save(self.prev_version)
         temp_bos.next_term = node
         temp_bos.state = oldleft.state
@@ -601,9 +751,9 @@ class IncParser(object):
         if temp_parser.last_status == False:
               # isolate
               logging.debug("OOC analysis of %s failed. Error on %s.", node, temp_parser.error_nodes)
-              node.log[("left", self.prev_version)] = saved_left
-              node.log[("right", self.prev_version)] = saved_right
-              node.log[("parent", self.prev_version)] = saved_parent
+              node.log.set("left", self.prev_version, saved_left)
+              node.log.set("right", self.prev_version, saved_right)
+              node.log.set("parent", self.prev_version, saved_parent)
               self.isolate(node) # revert changes done during OOC
               if temp_parser.previous_version.parent.isolated:
                   # if during OOC parsing error recovery isolated the entire
@@ -618,16 +768,16 @@ class IncParser(object):
         if newnode.symbol.name != oldname:
             logging.debug("OOC analysis resulted in different symbol: %s", newnode.symbol.name)
             # node is not the same: revert all changes!
-            node.log[("left", self.prev_version)] = saved_left
-            node.log[("right", self.prev_version)] = saved_right
-            node.log[("parent", self.prev_version)] = saved_parent
+            node.log.set("left", self.prev_version, saved_left)
+            node.log.set("right", self.prev_version, saved_right)
+            node.log.set("parent", self.prev_version, saved_parent)
             self.isolate(node)
             return
 
         if newnode is not node:
-            node.log[("left", self.prev_version)] = saved_left
-            node.log[("right", self.prev_version)] = saved_right
-            node.log[("parent", self.prev_version)] = saved_parent
+            node.log.set("left", self.prev_version, saved_left)
+            node.log.set("right", self.prev_version, saved_right)
+            node.log.set("parent", self.prev_version, saved_parent)
             logging.debug("OOC analysis resulted in different node but same symbol: %s", newnode.symbol.name)
             assert len(temp_parser.stack) == 2 # should only contain [EOS, node]
             i = oldparent.children.index(node)
@@ -649,9 +799,9 @@ class IncParser(object):
         node.parent = oldparent
         node.left = oldleft
         node.right = oldright
-        node.log[("left", self.prev_version)] = saved_left
-        node.log[("right", self.prev_version)] = saved_right
-        node.log[("parent", self.prev_version)] = saved_parent
+        node.log.set("left", self.prev_version, saved_left)
+        node.log.set("right", self.prev_version, saved_right)
+        node.log.set("parent", self.prev_version, saved_parent)
 
     def reduce(self, element):
         """Reduce elements on the stack to a non-terminal."""
@@ -667,7 +817,7 @@ class IncParser(object):
         self.current_state = self.stack[-1].state #XXX don't store on nodes, but on stack
         logging.debug("   Reduce: set state to %s (%s)", self.current_state, self.stack[-1].symbol)
 
-        goto = self.syntaxtable.lookup(self.current_state, element.action.left)
+        goto = self.syntaxtable.lookup(self.current_state, element.lhs_id)
         if goto is None:
             raise Exception("Reduction error on %s in state %s: goto is None" % (element, self.current_state))
         assert goto is not None
@@ -694,9 +844,15 @@ class IncParser(object):
             new_node.set_children(children)
             new_node.state = goto.action # XXX need to save state using hisotry service
             new_node.mark_changed()
+            if stats.current:
+                stats.current.count("reused_nodes")
         else:
             new_node = Node(element.action.left.copy(), goto.action, children)
             logging.debug("   No reuse parent. Make new %s (%s)", new_node, id(new_node))
+            if stats.current:
+                stats.current.count("new_nodes")
+        if stats.current:
+            stats.current.count("reductions")
         new_node.nested_errors = has_errors
         new_node.calc_textlength()
         new_node.position = self.stack[-1].position + self.stack[-1].textlen
@@ -828,6 +984,8 @@ class IncParser(object):
     def right_breakdown(self):
         node = self.stack.pop() # optimistically shifted Nonterminal
         node.exists = False
+        if stats.current:
+            stats.current.count("right_breakdowns")
         # after the breakdown, we need to properly shift the left over terminal
         # using the (correct) current state from before the optimistic shift of
         # it's parent tree
@@ -885,6 +1043,8 @@ class IncParser(object):
         la.autobox = None
         self.stack.append(la)
         self.current_state = la.state
+        if stats.current:
+            stats.current.count("shifts")
 
         if not la.lookup == "<ws>":
             # last_shift_state is used to predict next symbol
@@ -924,7 +1084,7 @@ class IncParser(object):
         return AST(root)
 
     def get_next_possible_symbols(self, state_id):
-        return iter(self.syntaxtable.table[state_id].keys())
+        return iter(self.syntaxtable.get_symbols(state_id))
 
     def get_next_symbols_list(self, state = -1):
         if state == -1:
@@ -963,11 +1123,11 @@ class IncParser(object):
 
     def load_status(self, version):
         try:
-            self.last_status = self.status_by_version[version]
+            self.last_status = find_version(self.status_by_version, version)
         except KeyError:
             logging.warning("Could not find status for version %s", version)
         try:
-            self.error_nodes = list(self.errornodes_by_version[version])
+            self.error_nodes = list(find_version(self.errornodes_by_version, version))
         except KeyError:
             logging.warning("Could not find errornodes for version %s", version)
 
@@ -0,0 +1,331 @@
+# Copyright (c) 2012--2013 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Construction of LR(1) state graphs using Pager's weak compatibility test
+(the same algorithm `StateGraph` used to implement on top of `StateSet`).
+
+All LR(0) items of the grammar are numbered, so that the item following item
+`i` (i.e. with the dot moved one symbol to the right) is `i + 1`. A state is
+represented by its kernel, a sorted tuple of items (its core), together with
+a list of lookaheads, which are stored as bitsets over the grammar's
+terminals. FIRST sets of everything to the right of the symbol following the
+dot are computed once for every item. Since all initial items of a
+nonterminal receive the same lookahead within a closure, lookaheads are
+propagated between nonterminals, which turns the closure of a state into a
+few integer operations per nonterminal.
+
+Computing the closure and the successors of a state only depends on the
+grammar, so states waiting to be expanded can optionally be handed to a pool
+of worker processes. States are always expanded in rounds and the successors
+are added in a fixed order, so the resulting graph does not depend on the
+number of processes used."""
+
+import logging, multiprocessing
+from time import time
+
+from .production import Production
+from .syntaxtable import FinishSymbol
+from grammar_parser.gparser import Nonterminal, Epsilon
+
+# builder used by worker processes
+_builder = None
+
+def _init_worker(builder):
+    global _builder
+    _builder = builder
+
+def _expand(state):
+    return _builder.expand(*state)
+
+class LR1Builder(object):
+
+    # minimum number of states per round before a process pool is used
+    PARALLEL_THRESHOLD = 64
+
+    def __init__(self, start_symbol, grammar, lookaheads=True):
+        self.symbols = []       # symbol id -> symbol
+        self.symbol_ids = {}
+        self.terminal_bits = {} # terminal -> lookahead bit
+        self.terminals = []     # lookahead bit -> symbol
+        self.productions = []
+        self.item_prod = []     # production of every item
+        self.item_dot = []      # position of the dot within the production
+        self.item_symbol = []   # id of the symbol after the dot or -1
+        self.item_nonterminal = [] # id of the nonterminal after the dot or -1
+        self.nt_items = {}      # nonterminal id -> initial items of its productions
+
+        self.add_terminal(FinishSymbol())
+        self.add_production(Production(None, [start_symbol]))
+        for symbol, rule in grammar.items():
+            items = self.nt_items.setdefault(self.add_symbol(symbol), [])
+            for i, a in enumerate(rule.alternatives):
+                if a == []:
+                    a = [Epsilon()]
+                p = Production(symbol, a, rule.annotations[i], rule.precs[i])
+                if i in rule.inserts:
+                    insert = rule.inserts[i]
+                    p.inserts[insert[0]] = insert[1]
+                item = self.add_production(p)
+                if a == [Epsilon()]:
+                    item += 1
+                items.append(item)
+        self.calculate_first()
+        if not lookaheads:
+            # LR(0): without lookaheads all states with the same core are
+            # weakly compatible
+            self.item_first = [0] * len(self.item_prod)
+        self.calculate_nt_edges()
+        self.start_lookahead = self.terminal_bits[FinishSymbol()] if lookaheads else 0
+
+    def add_symbol(self, symbol):
+        sid = self.symbol_ids.get(symbol)
+        if sid is None:
+            sid = self.symbol_ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+            if not isinstance(symbol, (Nonterminal, Epsilon)):
+                self.add_terminal(symbol)
+        return sid
+
+    def add_terminal(self, symbol):
+        if symbol not in self.terminal_bits:
+            self.terminal_bits[symbol] = 1 << len(self.terminals)
+            self.terminals.append(symbol)
+
+    def add_production(self, p):
+        """Numbers the items of production `p` and returns its first item."""
+        start = len(self.item_prod)
+        self.productions.append(p)
+        for d, symbol in enumerate(p.right):
+            self.item_prod.append(p)
+            self.item_dot.append(d)
+            sid = self.add_symbol(symbol)
+            self.item_symbol.append(sid)
+            self.item_nonterminal.append(sid if isinstance(symbol, Nonterminal) else -1)
+        # final item
+        self.item_prod.append(p)
+        self.item_dot.append(len(p.right))
+        self.item_symbol.append(-1)
+        self.item_nonterminal.append(-1)
+        return start
+
+    def calculate_first(self):
+        first = {}
+        nullable = set()
+        def first_of(symbols):
+            bits = 0
+            for symbol in symbols:
+                if isinstance(symbol, Nonterminal):
+                    bits |= first.get(symbol, 0)
+                    if symbol not in nullable:
+                        return bits, False
+                elif isinstance(symbol, Epsilon):
+                    continue
+                else:
+                    return bits | self.terminal_bits[symbol], False
+            return bits, True
+
+        changed = True
+        while changed:
+            changed = False
+            for p in self.productions[1:]:
+                bits, empty = first_of(p.right)
+                old = first.get(p.left, 0)
+                if bits | old != old:
+                    first[p.left] = bits | old
+                    changed = True
+                if empty and p.left not in nullable:
+                    nullable.add(p.left)
+                    changed = True
+
+        # FIRST set of the remainder of every item that is followed by a
+        # nonterminal, and whether that remainder can be empty
+        self.item_first = [0] * len(self.item_prod)
+        self.item_nullable = [False] * len(self.item_prod)
+        item = 0
+        for p in self.productions:
+            for d in range(len(p.right)):
+                if self.item_nonterminal[item] >= 0:
+                    self.item_first[item], self.item_nullable[item] = first_of(p.right[d+1:])
+                item += 1
+            item += 1
+
+    def calculate_nt_edges(self):
+        """Within a closure, all initial items of a nonterminal have the same
+        lookahead. For every nonterminal, collect the nonterminals following
+        the dot in its initial items, together with the lookahead they
+        receive: their FIRST bits, plus the lookahead of the nonterminal
+        itself if the remainder of the item is nullable."""
+        self.nt_edges = {}
+        for nt, items in self.nt_items.items():
+            edges = {}
+            for item in items:
+                target = self.item_nonterminal[item]
+                if target < 0:
+                    continue
+                first, nullable = edges.get(target, (0, False))
+                edges[target] = (first | self.item_first[item], nullable or self.item_nullable[item])
+            self.nt_edges[nt] = [(target, first, nullable) for target, (first, nullable) in edges.items()]
+
+    def closure(self, core, lookaheads):
+        """Returns a dictionary mapping all items of the closure of a kernel to
+        their lookaheads."""
+        item_nonterminal = self.item_nonterminal
+        item_first = self.item_first
+        item_nullable = self.item_nullable
+        nt_edges = self.nt_edges
+        # propagate lookaheads between nonterminals instead of items
+        nt_la = {}
+        todo = []
+        for item, la in zip(core, lookaheads):
+            nt = item_nonterminal[item]
+            if nt < 0:
+                continue
+            f = item_first[item]
+            if item_nullable[item]:
+                f |= la
+            old = nt_la.get(nt)
+            if old is None:
+                nt_la[nt] = f
+                todo.append(nt)
+            elif f & ~old:
+                nt_la[nt] = old | f
+                todo.append(nt)
+        while todo:
+            source = todo.pop()
+            la = nt_la[source]
+            for nt, f, nullable in nt_edges[source]:
+                if nullable:
+                    f |= la
+                old = nt_la.get(nt)
+                if old is None:
+                    nt_la[nt] = f
+                    todo.append(nt)
+                elif f & ~old:
+                    nt_la[nt] = old | f
+                    todo.append(nt)
+        result = dict(zip(core, lookaheads))
+        nt_items = self.nt_items
+        for nt, la in nt_la.items():
+            for item in nt_items[nt]:
+                result[item] = la
+        return result
+
+    def expand(self, core, lookaheads):
+        """Computes the kernels of all successors of a state. Returns a list of
+        (symbol, core, lookaheads) sorted by symbol id."""
+        item_symbol = self.item_symbol
+        gotos = {}
+        for item, la in self.closure(core, lookaheads).items():
+            symbol = item_symbol[item]
+            if symbol >= 0:
+                gotos.setdefault(symbol, []).append((item + 1, la))
+        result = []
+        for symbol in sorted(gotos):
+            kernel = sorted(gotos[symbol])
+            result.append((symbol, tuple([k[0] for k in kernel]), [k[1] for k in kernel]))
+        return result
+
+    def build(self, jobs=1):
+        """Builds the state graph. Returns the kernels (core, lookaheads) of
+        all states and a dictionary mapping (state, symbol id) to the
+        following state."""
+        start = time()
+        self.cores = [(0,)]
+        self.lookaheads = [[self.start_lookahead]]
+        self.core_index = {(0,): [0]}
+        self.edges = {}
+        self.done = set()
+        self.todo = [0]
+        self.merges = 0
+
+        pool = None
+        if jobs > 1:
+            pool = multiprocessing.Pool(jobs, _init_worker, (self,))
+        try:
+            while self.todo:
+                batch = self.todo
+                self.todo = []
+                self.done.update(batch)
+                states = [(self.cores[i], list(self.lookaheads[i])) for i in batch]
+                if pool and len(states) >= self.PARALLEL_THRESHOLD:
+                    chunksize = max(1, len(states) // (jobs * 4))
+                    results = pool.map(_expand, states, chunksize)
+                else:
+                    results = [self.expand(*s) for s in states]
+                for i, successors in zip(batch, results):
+                    for symbol, core, lookaheads in successors:
+                        self.add(i, symbol, core, lookaheads)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        logging.info("Built %s states in %s (%s merges)", len(self.cores), time() - start, self.merges)
+        return list(zip(self.cores, self.lookaheads)), self.edges
+
+    def add(self, from_id, symbol, core, lookaheads):
+        merged = False
+        candidates = self.core_index.setdefault(core, [])
+        for i in candidates:
+            old = self.lookaheads[i]
+            if old == lookaheads or self.weakly_compatible(lookaheads, old):
+                merged = True
+                self.merges += 1
+                changed = False
+                for j in range(len(core)):
+                    if lookaheads[j] & ~old[j]:
+                        old[j] |= lookaheads[j]
+                        changed = True
+                self.edges[(from_id, symbol)] = i
+                if changed and i in self.done:
+                    self.todo.append(i)
+                    self.done.remove(i)
+
+        if not merged:
+            i = len(self.cores)
+            self.cores.append(core)
+            self.lookaheads.append(list(lookaheads))
+            self.edges[(from_id, symbol)] = i
+            self.todo.append(i)
+            candidates.append(i)
+
+    def weakly_compatible(self, l1, l2):
+        """Pager's weak compatibility test for two states with the same core."""
+        n = len(l1)
+        for i in range(n - 1):
+            a1 = l1[i]
+            a2 = l2[i]
+            for j in range(i + 1, n):
+                b1 = l1[j]
+                b2 = l2[j]
+                if (a1 & b2 or b1 & a2) and not a1 & b1 and not a2 & b2:
+                    return False
+        return True
+
+    def get_terminals(self, bits):
+        """Converts a lookahead bitset into a set of symbols."""
+        result = set()
+        terminals = self.terminals
+        while bits:
+            lowest = bits & -bits
+            result.add(terminals[lowest.bit_length() - 1])
+            bits ^= lowest
+        return result
@@ -21,217 +21,55 @@
 
 
 
-from .state import StateSet, State, LR0Element
-from .production import Production
-from .helpers import Helper
-from .syntaxtable import FinishSymbol
-from grammar_parser.gparser import Terminal
+from .state import StateSet, LR0Element
+from .lrbuilder import LR1Builder
 from .constants import LR0, LR1, LALR
 from time import time
 import logging
 
 class StateGraph(object):
+    """LR(1) state graph of a grammar, built by `LR1Builder` and converted
+    into `StateSet`s containing the closures of all states. If `jobs` is
+    greater than one, a pool of processes is used to build the graph."""
 
-    def __init__(self, start_symbol, grammar, lr_type=0):
+    def __init__(self, start_symbol, grammar, lr_type=0, jobs=1):
         self.grammar = grammar
         self.start_symbol = start_symbol
+        self.lr_type = lr_type
+        self.jobs = jobs
         self.state_sets = []
         self.edges = {}
         self.ids = {}
-        self.todo = []
-        self.done = set()
-        self.maybe_compatible = {}
-
-        self.goto_time = 0
-        self.add_time = 0
-        self.closure_time = 0
-        self.closure_count = 0
-        self.addcount = 0
-        self.weakly = 0
-        self.weakly_count = 0
-        self.mergetime = 0
-
-        helper = Helper(grammar)
-        self.helper = helper
-        if lr_type == LR0:
-            self.closure = helper.closure_0
-            self.goto = helper.goto_0
-            self.start_set = StateSet([LR0Element(Production(None, [self.start_symbol]), 0)])
-        elif lr_type == LR1 or lr_type == LALR:
-            self.closure = helper.closure_1
-            self.goto = helper.goto_1
-            self.start_set = StateSet()
-            self.start_set.add(LR0Element(Production(None, [self.start_symbol]), 0), set([FinishSymbol()]))
+        self.outgoing = None
 
     def build(self):
-        State._hashtime = 0
         start = time()
-        start_set = self.start_set
-        closure = start_set
-        self.state_sets.append(closure)
-        self.ids[closure] = 0
-        _id = 0
-        self.todo.append(_id)
-        while self.todo:
-            self.addcount += 1
-            _id = self.todo.pop()
-            self.done.add(_id)
-            closure_start = time()
-            state_set = self.closure(self.state_sets[_id])
-            self.closure_count += 1
-            closure_end = time()
-            self.closure_time += closure_end - closure_start
-            new_gotos = {}
-            goto_start = time()
-            # create new sets first, then calculate closure
-            for lrelement in state_set.elements:
-                symbol = lrelement.next_symbol()
-                if not symbol: # state is final
-                    continue
-                #XXX optimisation: create all configurations before building
-                new_element = lrelement.clone()
-                new_element.d += 1
-                new_element_la = state_set.get_lookahead(lrelement)
-                stateset = new_gotos.setdefault(symbol, StateSet())
-                stateset.add(new_element, new_element_la)
-
-            # now calculate closure and add result to state_sets
-            goto_end = time()
-            self.goto_time += goto_end - goto_start
-
-            for ss in new_gotos:
-                new_state_set = new_gotos[ss]
-                add_start = time()
-                self.add(_id, ss, new_state_set)
-                add_end = time()
-                self.add_time += add_end - add_start
-
-        end = time()
-        logging.info("add time %s", self.add_time)
-        logging.info("closure time %s", self.closure_time)
-        logging.info("closure time helper %s", self.helper.closure_time)
-        logging.info("goto time %s", self.goto_time)
-        logging.info("hashtime %s", StateSet._hashtime)
-        logging.info("addcount %s", self.addcount)
-        logging.info("states %s", len(self.state_sets))
-        logging.info("weakly %s", self.weakly)
-        logging.info("weakly count %s", self.weakly_count)
-        logging.info("mergetime %s", self.mergetime)
+        builder = LR1Builder(self.start_symbol, self.grammar, self.lr_type != LR0)
+        kernels, edges = builder.build(self.jobs)
 
         # apply closure
-        logging.info("Apply closure to states")
         clstart = time()
-        new_state_sets = []
-        new_ids = {}
-        for state in self.state_sets:
-            _id = self.ids[state]
-            new_state = self.closure(state)
-            new_state_sets.append(new_state)
-            new_ids[new_state] = new_state
-        self.state_sets = new_state_sets
-        logging.info("after closure %s", len(new_state_sets))
-        logging.info("edges %s", len(set(self.edges.values())))
-        self.ids = new_ids
-        logging.info(time() - clstart)
-
-        logging.info("Finished building Stategraph in %s", end-start)
-        self.closure = None
-        self.goto = None
-
-    def weakly_compatible(self, s1, s2):
-        self.weakly_count += 1
-        core = s1.elements
-        if core != s2.elements:
-            return False
-        if len(core) == 1:
-            return True
-        self.weakly -= time()
-        core = list(core)
-        for i in range(0, len(core)-1):
-            I = core[i]
-            for j in range(i+1, len(core)):
-                J = core[j]
-                if ((s1.lookaheads[I] & s2.lookaheads[J] or s1.lookaheads[J] & s2.lookaheads[I])
-                    and not s1.lookaheads[I] & s1.lookaheads[J]
-                    and not s2.lookaheads[I] & s2.lookaheads[J]):
-                    self.weakly += time()
-                    return False
-        self.weakly += time()
-        return True
-
-    def find_stateset_without_lookahead(self, state_set):
-        for ss in self.state_sets:
-            if state_set.equals(ss, True):
-                return ss
-        return None
-
-    def merge_lookahead(self, old, new):
-        self.mergetime -= time()
-        changed = False
-        for element in new.elements:
-            la1 = new.get_lookahead(element)
-            la2 = old.get_lookahead(element)
-            if la1 - la2:
-                changed = True
-                new_la = la2 | la1
-                old.lookaheads[element] = new_la
-
-        self.mergetime += time()
-        return changed
-
-    def add(self, from_id, symbol, state_set):
-        merged = False
-        #for candidate in self.state_sets: # only check states that can be reached by symbol
-        for _id in self.maybe_compatible.setdefault(symbol,set()):
-            candidate = self.state_sets[_id]
-            if self.weakly_compatible(state_set, candidate):
-                # merge them
-                merged = True
-                changed = self.merge_lookahead(candidate, state_set)
-                self.edges[(from_id, symbol)] = _id
-                if changed and _id in self.done:
-                    # move state to todo list
-                    self.todo.append(_id) #XXX only need to to that if this state is already done (moving not necessary if it hasn't been looked at anyway (e.g. state at the end of list)
-                    self.done.remove(_id)
-
-        if not merged:
-            # add normally and put on todo list
-            self.state_sets.append(state_set)
-            _id = len(self.state_sets)-1
-            self.edges[(from_id, symbol)] = _id
-            self.ids[state_set] = _id
-            self.todo.append(_id)
-
-            # add to maybe compatible
-            mc = self.maybe_compatible.setdefault(symbol, set())
-            mc.add(_id)
-
-    def oldadd(self, from_id, symbol, state_set):
-        # LALR way
-       #ss = self.find_stateset_without_lookahead(state_set)
-       #if ss:
-       #    #print("found existing stateset -> merging")
-       #    #print(ss)
-       #    #print(state_set)
-       #    self.merge_lookahead(ss, state_set)
-       #    _id = self.state_sets.index(ss)
-       #else:
-       #    self.state_sets.append(state_set)
-       #    _id = len(self.state_sets)-1
-       #self.edges[(from_id, symbol)] = _id
-
-        # normal LR(1) way
-        add_start = time()
-        _id = self.ids.get(state_set)
-        if _id is None: # new state
-            self.addcount += 1
+        elements = {}
+        terminals = {}
+        for core, lookaheads in kernels:
+            state_set = StateSet()
+            for item, bits in builder.closure(core, lookaheads).items():
+                element = elements.get(item)
+                if element is None:
+                    element = LR0Element(builder.item_prod[item], builder.item_dot[item])
+                    elements[item] = element
+                if self.lr_type == LR0:
+                    state_set.add(element)
+                    continue
+                if bits not in terminals:
+                    terminals[bits] = builder.get_terminals(bits)
+                state_set.add(element, set(terminals[bits]))
+            self.ids[state_set] = len(self.state_sets)
             self.state_sets.append(state_set)
-            _id = len(self.state_sets)-1
-            self.ids[state_set] = _id
-            self.todo.append(_id)
-        self.edges[(from_id, symbol)] = _id
-        add_end = time()
-        self.add_time += add_end - add_start
+        for (from_id, symbol), to in edges.items():
+            self.edges[(from_id, builder.symbols[symbol])] = to
+        logging.info("Apply closure to states %s", time() - clstart)
+        logging.info("Finished building Stategraph in %s", time() - start)
 
     def follow(self, from_id, symbol):
         try:
@@ -240,6 +78,15 @@ class StateGraph(object):
         except KeyError:
             return None
 
+    def get_edges(self, from_id):
+        """Returns a list of (symbol, state) pairs of all edges leaving state
+        `from_id`."""
+        if self.outgoing is None:
+            self.outgoing = [[] for _ in self.state_sets]
+            for (i, symbol), to in self.edges.items():
+                self.outgoing[i].append((symbol, to))
+        return self.outgoing[from_id]
+
     def get_symbols(self):
         s = set()
         for _, symbol in list(self.edges.keys()):
@@ -279,3 +126,4 @@ class StateGraph(object):
         l.reverse()
         for j in l:
             self.state_sets.pop(j)
+        self.outgoing = None
@@ -20,8 +20,9 @@
 # IN THE SOFTWARE.
 
 from .production import Production
-from grammar_parser.gparser import Terminal, Nonterminal, Epsilon
+from grammar_parser.gparser import Terminal, Nonterminal, Epsilon, IndentationTerminal
 from .constants import LR0, LR1, LALR
+from array import array
 
 class SyntaxTableElement(object):
 
@@ -54,6 +55,7 @@ class Shift(SyntaxTableElement): pass
 class Reduce(SyntaxTableElement):
     def __init__(self, action):
         self.action = action
+        self.lhs_id = -1 # id of the left-hand side within a compiled table
 
     def amount(self):
         if len(self.action.right) > 0 and self.action.right[-1] == Terminal("<eos>"):
@@ -67,10 +69,27 @@ class Accept(SyntaxTableElement):
         self.action = None
 
 class SyntaxTable(object):
+    """LR parse table.
+
+    The table is first built as a list of dictionaries mapping symbols to
+    actions, which is then compiled into a compact representation: symbols are
+    interned to small integers (terminals first, followed by nonterminals) and
+    actions are encoded as integers (0: error, n > 0: shift/goto into state
+    n - 1, n < 0: reduction -n - 1, where reduction 0 is Accept). The rows of
+    all states are then packed into a single row-displaced (comb) table.
+
+    To keep rows small, the most common reduction of each state is stored as
+    its default reduction and removed from the row. Unlike in a traditional LR
+    parser the default reduction is only applied to terminals that are valid in
+    that state (stored as a bitset), so the incremental parser and the error
+    recovery still detect errors at exactly the same positions."""
+
+    VERSION = 1
 
     def __init__(self, prod_ids, lr_type=LR0):
         self.lr_type = lr_type
         self.prod_ids = prod_ids
+        self.version = SyntaxTable.VERSION
 
     def build(self, graph, precedences=[]):
         self.table = [{} for _ in range(len(graph.state_sets))]
@@ -98,8 +117,7 @@ class SyntaxTable(object):
                             else:
                                 del self.table[i][s]
             # shift, goto
-            for s in symbols:
-                dest = graph.follow(i, s)
+            for s, dest in graph.get_edges(i):
                 if dest:
                     if isinstance(s, Terminal):
                         action = Shift(dest)
@@ -111,6 +129,132 @@ class SyntaxTable(object):
                         self.table[i][s] = action
                     else:
                         del self.table[i][s]
+        self.compile(self.table)
+        # only needed while building the table
+        del self.table
+        self.prod_ids = None
+
+    def compile(self, table):
+        terminals = set()
+        nonterminals = set()
+        for row in table:
+            for s in row:
+                if isinstance(s, Nonterminal):
+                    nonterminals.add(s)
+                else:
+                    terminals.add(s)
+        key = lambda s: (s.__class__.__name__, s.name)
+        self.symbols = sorted(terminals, key=key) + sorted(nonterminals, key=key)
+        self.num_terminals = len(terminals)
+        self.symbol_ids = {}
+        self.terminal_ids = {}
+        for i, s in enumerate(self.symbols):
+            self.symbol_ids[(s.__class__, s.name)] = i
+            if type(s) is Terminal:
+                self.terminal_ids[s.name] = i
+        self.eos_terminal_id = self.terminal_ids.get("<eos>", -1)
+
+        # reduction 0 is used to encode Accept
+        self.reductions = [Accept()]
+        prod_codes = {}
+        self.stride = (self.num_terminals + 7) // 8
+        self.valid = array("B", bytes(len(table) * self.stride))
+        self.default = array("i", [0] * len(table))
+        rows = []
+        for state, row in enumerate(table):
+            entries = {}
+            reduce_counts = {}
+            for s, action in row.items():
+                sid = self.symbol_ids[(s.__class__, s.name)]
+                if isinstance(action, Reduce):
+                    if action.action not in prod_codes:
+                        reduction = Reduce(action.action)
+                        reduction.lhs_id = self.symbol_ids.get((Nonterminal, action.action.left.name), -1)
+                        self.reductions.append(reduction)
+                        prod_codes[action.action] = -len(self.reductions)
+                    code = prod_codes[action.action]
+                    reduce_counts[code] = reduce_counts.get(code, 0) + 1
+                elif isinstance(action, Accept):
+                    code = -1
+                else:
+                    code = action.action + 1
+                entries[sid] = code
+                if sid < self.num_terminals:
+                    self.valid[state * self.stride + sid // 8] |= 1 << (sid % 8)
+            if reduce_counts:
+                default = max(sorted(reduce_counts), key=lambda c: reduce_counts[c])
+                self.default[state] = default
+                for sid in [sid for sid, code in entries.items() if code == default]:
+                    del entries[sid]
+            rows.append(entries)
+        self.pack(rows)
+        self.init_elements()
+
+    def pack(self, rows):
+        """Packs all rows into a single table using first-fit row
+        displacement. Larger rows are placed first, as they are harder to
+        fit."""
+        self.base = array("i", [0] * len(rows))
+        check = []
+        value = []
+        # bitset of the occupied entries
+        occupied = 0
+        first_free = 0
+        for state in sorted(range(len(rows)), key=lambda s: -len(rows[s])):
+            row = rows[state]
+            if not row:
+                continue
+            sids = sorted(row)
+            # bit i of `conflicts` is set if the row collides with an occupied
+            # entry when placed at base i
+            conflicts = 0
+            mask = 0
+            for sid in sids:
+                conflicts |= occupied >> sid
+                mask |= 1 << sid
+            start = max(0, first_free - sids[0])
+            free = ~(conflicts >> start)
+            base = start + (free & -free).bit_length() - 1
+            end = base + sids[-1] + 1
+            if end > len(check):
+                check.extend([-1] * (end - len(check)))
+                value.extend([0] * (end - len(value)))
+            for sid in sids:
+                check[base + sid] = state
+                value[base + sid] = row[sid]
+            self.base[state] = base
+            occupied |= mask << base
+            free = ~occupied
+            first_free = (free & -free).bit_length() - 1
+        # pad the table so lookups never need to check the bounds
+        padding = len(self.base) and max(self.base) + len(self.symbols) - len(check)
+        if padding > 0:
+            check.extend([-1] * padding)
+            value.extend([0] * padding)
+        self.check = array(self.typecode(check), check)
+        self.value = array(self.typecode(value), value)
+
+    def typecode(self, l):
+        if l and max(max(l), -min(l)) >= 2**15:
+            return "i"
+        return "h"
+
+    def init_elements(self):
+        # Shift/Goto elements are cheap to recreate and are therefore not
+        # pickled
+        self.shifts = [Shift(i) for i in range(len(self.base))]
+        self.gotos = [Goto(i) for i in range(len(self.base))]
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["shifts"]
+        del state["gotos"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if "base" in state:
+            self.init_elements()
 
     def resolve_conflict(self, state, symbol, oldaction, newaction, precedences):
         # input: old_action, lookup_symbol, new_action
@@ -195,8 +339,41 @@ class SyntaxTable(object):
                 return symbol
         return None
 
+    def get_symbol_id(self, symbol):
+        return self.symbol_ids.get((symbol.__class__, symbol.name), -1)
+
+    def get_lookup_id(self, node):
+        """Get the id of the lookup symbol of a node. If the node has no lookup
+        symbol use the id of the node's symbol instead."""
+        if node.lookup != "":
+            return self.terminal_ids.get(node.lookup, -1)
+        symbol = node.symbol
+        cls = symbol.__class__
+        if cls is IndentationTerminal:
+            cls = Terminal
+        return self.symbol_ids.get((cls, symbol.name), -1)
+
     def lookup(self, state_id, symbol):
-        try:
-            return self.table[state_id][symbol]
-        except KeyError:
+        """Returns the action for `symbol` in state `state_id` or None. The
+        symbol can either be given as a symbol id or as a symbol object."""
+        if type(symbol) is not int:
+            symbol = self.get_symbol_id(symbol)
+        if symbol < 0:
+            return None
+        i = self.base[state_id] + symbol
+        if self.check[i] == state_id:
+            code = self.value[i]
+        elif symbol < self.num_terminals and \
+                self.valid[state_id * self.stride + (symbol >> 3)] & (1 << (symbol & 7)):
+            code = self.default[state_id]
+        else:
             return None
+        if code < 0:
+            return self.reductions[-code - 1]
+        if symbol < self.num_terminals:
+            return self.shifts[code - 1]
+        return self.gotos[code - 1]
+
+    def get_symbols(self, state_id):
+        """Returns all symbols that have an action in the given state."""
+        return [s for i, s in enumerate(self.symbols) if self.lookup(state_id, i) is not None]
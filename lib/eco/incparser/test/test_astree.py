@@ -0,0 +1,198 @@
+# Copyright (c) 2012--2013 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+from incparser.astree import TextNode, NO_HISTORY, Delta, KEYFRAME_INTERVAL
+from grammar_parser.gparser import Terminal, Nonterminal, MagicTerminal
+import pickle
+import pytest
+
+class Test_History(object):
+
+    def setup_method(self, method):
+        self.a = TextNode(Terminal("a"))
+        self.b = TextNode(Terminal("b"))
+        self.root = TextNode(Nonterminal("Root"), 0, [self.a, self.b])
+
+    def test_get_attr(self):
+        self.a.save(1)
+        self.a.symbol.name = "aa"
+        self.a.save(4)
+        assert self.a.get_attr("symbol.name", 1) == "a"
+        assert self.a.get_attr("symbol.name", 3) == "a"
+        assert self.a.get_attr("symbol.name", 4) == "aa"
+        assert self.a.get_attr("symbol.name", 10) == "aa"
+        assert self.a.get_attr("parent", 2) is self.root
+        with pytest.raises(AttributeError):
+            self.a.get_attr("symbol.name", 0)
+
+    def test_load(self):
+        self.root.save(1)
+        self.root.children = [self.a]
+        self.root.changed = True
+        self.root.save(3)
+        self.root.load(2)
+        assert self.root.version == 1
+        assert self.root.children == [self.a, self.b]
+        assert self.root.changed is False
+        self.root.load(5)
+        assert self.root.version == 3
+        assert self.root.children == [self.a]
+        assert self.root.changed is True
+
+    def test_shared_children(self):
+        self.root.save(1)
+        self.root.changed = True
+        self.root.save(2)
+        self.root.children.append(TextNode(Terminal("c")))
+        self.root.save(3)
+        log = self.root.log
+        assert log.get("children", 1) is log.get("children", 2)
+        assert log.get("children", 2) is not log.get("children", 3)
+        assert len(log.get("children", 1)) == 2
+        # loading a version must not allow modifications of the history
+        self.root.load(1)
+        self.root.children.pop()
+        assert len(log.get("children", 1)) == 2
+
+    def test_is_new(self):
+        self.a.save(1)
+        self.a.save(2)
+        assert self.a.is_new(1)
+        assert not self.a.is_new(2)
+        assert not self.a.is_new(3)
+
+    def test_delete_version(self):
+        self.a.save(1)
+        self.a.symbol.name = "aa"
+        self.a.save(2)
+        self.a.delete_version(2)
+        assert self.a.log.max_version() == 1
+        assert self.a.get_attr("symbol.name", 2) == "a"
+        self.a.delete_version(5) # never saved
+        assert len(self.a.log) == 1
+
+    def test_set(self):
+        self.a.save(1)
+        self.a.save(5)
+        self.a.log.set("left", 3, self.b)
+        assert self.a.get_attr("left", 2) is None
+        assert self.a.get_attr("left", 3) is self.b
+        assert self.a.get_attr("parent", 3) is self.root
+        assert self.a.get_attr("left", 5) is None
+
+    def test_truncate(self):
+        for v in range(1, 6):
+            self.a.position = v
+            self.a.save(v)
+        self.a.log.truncate(3)
+        assert self.a.log.versions == [1, 2, 3]
+        assert self.a.get_attr("position", 5) == 3
+
+    def test_lazy_history(self):
+        assert self.a.log is NO_HISTORY
+        assert self.a.log.find(1) == (None, None)
+        self.a.save(1)
+        assert self.a.log is not NO_HISTORY
+        assert self.b.log is NO_HISTORY
+        assert len(NO_HISTORY) == 0
+        with pytest.raises(ValueError):
+            NO_HISTORY.set("left", 1, self.b)
+        # terminals share the empty tuple of children
+        self.b.save(1)
+        assert self.a.log.get("children", 1) is self.b.log.get("children", 1) == ()
+
+    def save_positions(self, versions):
+        for v in versions:
+            self.a.position = v * 1000
+            self.a.save(v)
+
+    def check_positions(self, versions):
+        log = self.a.log
+        assert log.versions == versions
+        for v in versions:
+            assert log.get("position", v) == v * 1000
+            _, snapshot = log.find(v)
+            assert snapshot[13] == v * 1000 and snapshot[0] is self.root
+
+    def test_deltas(self):
+        versions = list(range(1, 2 * KEYFRAME_INTERVAL + 2))
+        self.save_positions(versions)
+        log = self.a.log
+        keyframes = [i for i, entry in enumerate(log.snapshots) if type(entry) is not Delta]
+        assert keyframes == [0, KEYFRAME_INTERVAL, 2 * KEYFRAME_INTERVAL]
+        # only the position and the cleared `new` flag are stored
+        assert len(log.snapshots[1]) == 3
+        self.check_positions(versions)
+        # a delta without changes still needs its own object for `stamp`
+        self.a.save(100)
+        self.a.save(101)
+        assert log.stamp(100) is not log.stamp(101)
+        assert log.find(100)[1] == log.find(101)[1]
+
+    def test_deltas_modified(self):
+        self.save_positions(range(2, 80, 2))
+        self.save_positions([1, 3, 50])
+        self.a.delete_version(2)
+        self.a.delete_version(2 * KEYFRAME_INTERVAL)
+        versions = [1, 3] + [v for v in range(4, 80, 2) if v != 2 * KEYFRAME_INTERVAL]
+        self.check_positions(versions)
+        self.a.log.compact([10, 40], 40)
+        assert self.a.log.versions[:2] == [10, 40]
+        assert self.a.get_attr("position", 10) == 10000
+        assert self.a.get_attr("position", 40) == 40000
+
+class Test_SideData(object):
+
+    def test_side_data(self):
+        node = TextNode(Terminal("a"))
+        assert node.extra is None
+        assert node.image is None and node.plain_mode is False and node.tbd is False
+        assert node.get_magicterminal() is None
+        # setting the default doesn't allocate anything
+        node.autobox = None
+        node.tbd = False
+        assert node.extra is None
+        node.plain_mode = True
+        node.parent_lbox = node
+        assert node.plain_mode is True and node.parent_lbox is node
+        assert node.image is None
+        node.plain_mode = False
+        assert node.plain_mode is False
+
+    def test_annotations(self):
+        node = TextNode(Terminal("a"))
+        other = TextNode(Terminal("b"))
+        assert not node.annotations
+        node.add_annotation(1)
+        assert node.annotations == [1]
+        assert not other.annotations
+
+    def test_pickle_symbols(self):
+        for symbol in [Terminal("a"), Nonterminal("A")]:
+            copy = pickle.loads(pickle.dumps(symbol))
+            assert copy == symbol and not hasattr(copy, "__dict__")
+        lbox = MagicTerminal("<Python>")
+        lbox.parser = "parser"
+        assert pickle.loads(pickle.dumps(lbox)).parser == "parser"
+        # symbols pickled before they had slots
+        symbol = Terminal.__new__(Terminal)
+        symbol.__setstate__({"name": "a"})
+        assert symbol == Terminal("a")
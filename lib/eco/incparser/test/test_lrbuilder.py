@@ -0,0 +1,71 @@
+# Copyright (c) 2012--2013 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+from incparser.lrbuilder import LR1Builder
+from incparser.syntaxtable import FinishSymbol
+from grammar_parser.gparser import Parser, Terminal, Nonterminal
+
+grammar = """
+    S ::= A A
+    A ::= "a" A
+        | "b"
+        |
+"""
+
+p = Parser(grammar)
+p.parse()
+
+a = Terminal("a")
+b = Terminal("b")
+A = Nonterminal("A")
+
+def test_closure():
+    builder = LR1Builder(p.start_symbol, p.rules)
+    bits = builder.terminal_bits
+    eos = bits[FinishSymbol()]
+    la = builder.closure((0,), [eos])
+    # Z ::= .S, S ::= .A A, A ::= .a A, A ::= .b, A ::= .
+    assert len(la) == 5
+    for item, lookahead in la.items():
+        production = builder.item_prod[item]
+        if production.left == A:
+            assert builder.get_terminals(lookahead) == set([a, b, FinishSymbol()])
+        else:
+            assert lookahead == eos
+
+def test_merge():
+    builder = LR1Builder(p.start_symbol, p.rules)
+    kernels, edges = builder.build()
+    # states reached by "a" after the first and second A have the same core
+    # and are merged into one
+    cores = [core for core, _ in kernels]
+    assert len(cores) == len(set(cores))
+
+def test_deterministic():
+    result1 = LR1Builder(p.start_symbol, p.rules).build()
+    result2 = LR1Builder(p.start_symbol, p.rules).build()
+    assert result1 == result2
+
+def test_parallel(monkeypatch):
+    monkeypatch.setattr(LR1Builder, "PARALLEL_THRESHOLD", 1)
+    result1 = LR1Builder(p.start_symbol, p.rules).build()
+    result2 = LR1Builder(p.start_symbol, p.rules).build(jobs=2)
+    assert result1 == result2
@@ -38,11 +38,20 @@ class IndentationManager:
         self.eos = root.children[-1]
         self.whitespaces = {}
         self.indentation = {}
+        # indent stack of every logical line, i.e. the whitespace and
+        # indentation of the lines that following lines can dedent to. The
+        # tokens of a line only depend on the stack of the previous logical
+        # line and the line itself, so once a line's stack stays the same,
+        # the lines after it don't need to be repaired. None if the stacks
+        # need to be rebuilt (see `invalidate`).
+        self.stacks = {}
         self.changed = False
 
     def repair(self, node):
         self.changed = False
         """Repair indentation in the line given by node."""
+        if self.stacks is None:
+            self.repair_full()
         bol = self.get_line_start(node)
         # if line is not logical, skip ahead to next logical line
         if not self.is_logical_line(bol):
@@ -85,8 +94,14 @@ class IndentationManager:
             if ws < current_ws:
                 self.calculate_indentation(bol)
 
+            stack = self.stacks.get(bol)
             self.fix_tokens(bol)
 
+            if stack is not None and self.stacks.get(bol) == stack:
+                # the indent stack of this line didn't change, so neither
+                # did the indentation of the lines after it
+                break
+
             if self.get_whitespace(bol) <= search_threshold:
                 # repair everything up to the line that has smaller indentation/whitespace
                 # than the changed line
@@ -100,12 +115,18 @@ class IndentationManager:
     def repair_full(self):
         self.whitespaces = {}
         self.indentation = {}
+        self.stacks = {}
         bol = self.bos
         while bol is not None:
             self.calculate_indentation(bol)
             self.fix_tokens(bol)
             bol = self.next_line(bol)
 
+    def invalidate(self):
+        """Forgets the cached indent stacks, e.g. after undo or redo changed
+        the tree underneath them. They are rebuilt on the next repair."""
+        self.stacks = None
+
     def calculate_indentation(self, bol):
         """Scans whitespaces in previous lines and sets the indentation of the
         line given by bol accordingly."""
@@ -140,6 +161,7 @@ class IndentationManager:
             if this_ws is None:
                 this_ws = 0
             self.indentation[bol] = this_ws
+            self.stacks[bol] = self.next_stack((), this_ws, this_ws)
         elif self.is_logical_line(bol):
             this_ws = self.count_whitespace(bol)
             self.whitespaces[bol] = this_ws
@@ -152,25 +174,40 @@ class IndentationManager:
 
             if prev_ws == this_ws:
                 self.indentation[temp] = self.get_indentation(bol) # this is only needed when calling fix_tokens separately (e.g. import)
-                new_tokens.append(self.create_token("newline"))
+                new_tokens.append("NEWLINE")
             elif prev_ws < this_ws:
                 self.indentation[temp] = self.get_indentation(bol) + 1
-                new_tokens.append(self.create_token("indent"))
-                new_tokens.append(self.create_token("newline"))
+                new_tokens.append("INDENT")
+                new_tokens.append("NEWLINE")
             elif prev_ws > this_ws:
                 this_indent = self.find_indentation(temp)
                 if this_indent is None:
-                    new_tokens.append(self.create_token("unbalanced"))
+                    new_tokens.append("UNBALANCED")
                 else:
                     self.indentation[temp] = this_indent
                     prev_indent = self.get_indentation(bol)
                     indent_diff = prev_indent - this_indent
                     for i in range(indent_diff):
-                        new_tokens.append(self.create_token("dedent"))
-                    new_tokens.append(self.create_token("newline"))
+                        new_tokens.append("DEDENT")
+                    new_tokens.append("NEWLINE")
+
+            prev_stack = self.stacks.get(bol)
+            if prev_stack is None:
+                self.stacks.pop(temp, None)
+            else:
+                self.stacks[temp] = self.next_stack(prev_stack, this_ws, self.get_indentation(temp))
+        else:
+            self.stacks.pop(temp, None)
 
         self.apply_nodes(new_tokens, temp)
 
+    def next_stack(self, stack, ws, indent):
+        """Returns the indent stack of a line with whitespace `ws` and
+        indentation `indent` following a line with the indent stack `stack`."""
+        while stack and stack[-1][0] >= ws:
+            stack = stack[:-1]
+        return stack + ((ws, indent),)
+
     def apply_nodes(self, new, bol):
         """Insert generated indentation tokens into the token stream if they
         differ from current tokens"""
@@ -194,14 +231,15 @@ class IndentationManager:
                 # logical
                 return
 
-            new = []
-            for i in range(this_indent):
-                new.append(self.create_token("dedent"))
-            new.append(self.create_token("newline"))
+            new = ["DEDENT"] * this_indent
+            new.append("NEWLINE")
 
             self.merge_nodes(node, new)
 
     def merge_nodes(self, bol, newnodes):
+        """Updates the indentation tokens after `bol` to the given token
+        names. Existing tokens are reused where possible and new ones are
+        only created for names that don't match."""
         previous_nodes = []
         last_node = bol
         node = bol.next_term
@@ -212,15 +250,16 @@ class IndentationManager:
 
         for i in range(len(previous_nodes)):
             if len(newnodes) > 0:
-                newnode = newnodes.pop()
+                name = newnodes.pop()
             else:
                 # remove leftover previous_nodes
                 previous_nodes[i].remove()
                 continue
 
             oldnode = previous_nodes[i]
-            if newnode.symbol != oldnode.symbol:
+            if name != oldnode.symbol.name:
                 # remove old, insert new
+                newnode = self.create_token(name)
                 oldnode.replace(newnode)
                 last_node = newnode
             else:
@@ -228,9 +267,9 @@ class IndentationManager:
                     oldnode.deleted = False
                 last_node = oldnode
 
-        for n in newnodes:
+        for name in newnodes:
             # insert remaining newnodes
-            last_node.insert_after(n)
+            last_node.insert_after(self.create_token(name))
 
     def remove_indentation_nodes(self, bol):
         if bol is None:
@@ -256,14 +295,7 @@ class IndentationManager:
         return None
 
     def create_token(self, name):
-        if name == "newline":
-            return TextNode(IndentationTerminal("NEWLINE"))
-        if name == "indent":
-            return TextNode(IndentationTerminal("INDENT"))
-        if name == "dedent":
-            return TextNode(IndentationTerminal("DEDENT"))
-        if name == "unbalanced":
-            return TextNode(IndentationTerminal("UNBALANCED"))
+        return TextNode(IndentationTerminal(name))
 
     def count_whitespace(self, bol):
         # indentation whitespaces
@@ -3,6 +3,15 @@ from incparser.astree import BOS, EOS, TextNode
 
 Node = TextNode
 
+# Indentation tokens needed by a line are compared against the tokens already
+# in the tree using these symbols. They are shared and must never be put into
+# the tree themselves, as existing indentation nodes are repaired by renaming
+# their symbol (see `repair_indents`).
+NEWLINE = IndentationTerminal("NEWLINE")
+INDENT = IndentationTerminal("INDENT")
+DEDENT = IndentationTerminal("DEDENT")
+UNBALANCED = IndentationTerminal("UNBALANCED")
+
 class PythonIndent(object):
 
     def __init__(self, incparser):
@@ -12,6 +21,7 @@ class PythonIndent(object):
     def incparse_init(self):
         self.comment_tokens = []
         self.indent_stack = None
+        self.indentation_cache = {}
 
     def right_sibling(self, node):
         """Checks if a new indentation token was added or removed during the
@@ -67,8 +77,9 @@ class PythonIndent(object):
         oldnode.mark_changed()
 
     def incparse_inc_parse_top(self):
-        self.incparser.stack[0].indent = [0] # init bos with indent
-        self.last_indent = [0]
+        self.incparser.stack[0].indent = (0,) # init bos with indent
+        self.last_indent = (0,)
+        self.indentation_cache = {}
         self.multimode = None
         self.multinewlines = []
 
@@ -100,7 +111,7 @@ class PythonIndent(object):
 
     def incparse_optshift(self, la):
         if la.indent:
-            self.last_indent = list(la.indent)
+            self.last_indent = la.indent
 
     def incparse_shift(self, la, rb):
         self.toggle_multimode(la)
@@ -122,7 +133,7 @@ class PythonIndent(object):
                     n.parent.remove_child(n)
                     n = n.next_term
                 n.indent = None
-                self.update_succeeding_lines(n, self.last_indent[-1], list(self.last_indent))
+                self.update_succeeding_lines(n, self.last_indent[-1], self.last_indent)
 
     def incparse_from_dict(self, rules):
         if not rules:
@@ -161,29 +172,30 @@ class PythonIndent(object):
         if len(this) != len(other):
             return True
         for i in range(len(this)):
-            if this[i].symbol != other[i].symbol:
+            if this[i].symbol != other[i]:
                 return True
         return False
 
     def repair_indents(self, node, there, needed):
         """Updates the indentation tokens of a line, given a list of needed
-        tokens and tokens already there"""
+        symbols and tokens already there"""
         it = iter(there)
         last = node
         # update indentation tokens with new values or insert new ones
         for e in needed:
             try:
                 ne = next(it)
-                if e.symbol == ne.symbol:
+                if e == ne.symbol:
                     last = ne
                     continue
                 else:
-                    ne.symbol.name = e.symbol.name
+                    ne.symbol.name = e.name
                     ne.deleted = False # when reusing nodes, erase deleted flag
                     ne.mark_changed()
                     continue
             except StopIteration:
                 pass
+            e = Node(e.copy())
             self.pseudo_insert(last, e)
             last = e
         # delete all leftovers
@@ -244,7 +256,7 @@ class PythonIndent(object):
                     n.mark_changed()
                     n = n.next_term
                 la.indent = None
-                newindent = list(self.get_last_indent(la))
+                newindent = self.get_last_indent(la)
                 ws = self.get_previous_ws(la)
             else:
                 there = []
@@ -258,12 +270,12 @@ class PythonIndent(object):
                 else:
                     ws = 0
 
-                last_indent = list(self.get_last_indent(la))
+                last_indent = self.get_last_indent(la)
                 needed, newindent = self.get_indentation_tokens_and_indent(last_indent, ws)
                 indent_stack_eq = newindent == la.indent
                 if la is not self.last_token_before_eos:
-                    la.indent = list(newindent)
-                    self.last_indent = list(la.indent)
+                    la.indent = newindent
+                    self.last_indent = newindent
 
                 if self.indents_differ(there, needed):
                     self.repair_indents(la, there, needed)
@@ -272,10 +284,11 @@ class PythonIndent(object):
             self.update_succeeding_lines(la, ws, newindent)
 
     def update_succeeding_lines(self, la, ws, newindent):
-        # update succeeding lines
-        # XXX this causes a chain reaction iterating over some lines
-        # multiple times. we might only have to do this for the <return>
-        # that has actually changed during the parse
+        """Marks the lines following `la` whose indentation tokens or indent
+        stack no longer match the given indent stack. The indent stack of a
+        line only depends on the stack of the previous logical line and its
+        own whitespace, so once a line's recomputed stack matches the one
+        cached on its <return>, all lines after it are up to date."""
         next_r = la.next_term
         while True:
             if isinstance(next_r, EOS):
@@ -286,7 +299,7 @@ class PythonIndent(object):
                 while isinstance(d.symbol, IndentationTerminal):
                     eos_there.insert(0, d)
                     d = d.prev_term
-                eos_needed, _ = self.get_indentation_tokens_and_indent(list(self.get_last_indent(d)), 0)
+                eos_needed, _ = self.get_indentation_tokens_and_indent(self.get_last_indent(d), 0)
                 if self.indents_differ(eos_there, eos_needed):
                     self.last_token_before_eos.mark_changed() # don't repair here, only mark and repair just before last token is parsed
                 break
@@ -302,8 +315,13 @@ class PythonIndent(object):
                 next_r = next_r.next_term
                 continue
             needed, newindent = self.get_indentation_tokens_and_indent(newindent, next_ws)
-            if not self.indents_match(next_r, needed) or next_r.indent != newindent:
-                next_r.mark_changed()
+            if next_r.indent == newindent:
+                # this line's indent stack didn't change, so neither did the
+                # stacks of the lines after it
+                if not self.indents_match(next_r, needed):
+                    next_r.mark_changed()
+                break
+            next_r.mark_changed()
             if next_ws < ws:
                 # if newline has smaller whitespace -> mark and break
                 break
@@ -311,25 +329,33 @@ class PythonIndent(object):
             next_r = next_r.next_term
 
     def get_indentation_tokens_and_indent(self, indent, ws):
-        needed = []
-        newindent = []
+        """Returns the indentation symbols needed by a line with `ws`
+        whitespace following a line with the indent stack `indent`, together
+        with the indent stack of that line. Stacks are tuples and results are
+        cached, so lines with the same indentation share their stack."""
+        key = (indent, ws)
+        try:
+            return self.indentation_cache[key]
+        except KeyError:
+            pass
         if ws > indent[-1]:
-            needed.append(Node(IndentationTerminal("NEWLINE")))
-            needed.append(Node(IndentationTerminal("INDENT")))
-            newindent = indent + [ws]
+            needed = (NEWLINE, INDENT)
+            newindent = indent + (ws,)
         elif ws < indent[-1]:
-            needed.append(Node(IndentationTerminal("NEWLINE")))
-            while ws < indent[-1]:
-                indent.pop()
-                needed.append(Node(IndentationTerminal("DEDENT")))
-            newindent = list(indent)
-            if ws != indent[-1]:
+            needed = [NEWLINE]
+            newindent = indent
+            while ws < newindent[-1]:
+                newindent = newindent[:-1]
+                needed.append(DEDENT)
+            if ws != newindent[-1]:
                 # XXX in future, just ERROR here
-                needed.append(Node(IndentationTerminal("UNBALANCED")))
+                needed.append(UNBALANCED)
+            needed = tuple(needed)
         else:
-            needed.append(Node(IndentationTerminal("NEWLINE")))
-            newindent = list(indent)
-        return needed, newindent
+            needed = (NEWLINE,)
+            newindent = indent
+        result = self.indentation_cache[key] = (needed, newindent)
+        return result
 
     def indents_match(self, node, needed):
         there = []
@@ -341,7 +367,7 @@ class PythonIndent(object):
         if len(there) != len(needed):
             return False
         for i in range(len(there)):
-            if there[i].symbol != needed[i].symbol:
+            if there[i].symbol != needed[i]:
                 return False
         return True
 
@@ -24,10 +24,6 @@ sys.setrecursionlimit(2000)
 
 from grammar_parser.gparser import Terminal, MagicTerminal, IndentationTerminal, Nonterminal
 from incparser.astree import TextNode, BOS, EOS, ImageNode, FinishSymbol, MultiTextNode
-try:
-    import __pypy__
-except ImportError:
-    from PyQt5.QtGui import QImage
 
 class JsonManager(object):
     def __init__(self, unescape=False):
@@ -47,6 +43,9 @@ class JsonManager(object):
         z.close()
 
     def load(self, filename):
+        from binarymanager import BinaryManager, is_binary
+        if is_binary(filename):
+            return BinaryManager().load(filename)
         try:
             z = gzip.open(str(filename), "rb")
             main = json.loads(z.read())
@@ -112,6 +111,7 @@ class JsonManager(object):
             pass # Backwards compatibility for old Eco files
         node.image_src = jsnode["image_src"]
         if node.image_src is not None:
+            from PyQt5.QtGui import QImage
             node.image = QImage(node.image_src)
 
         if isinstance(symbol, Terminal) or isinstance(symbol, FinishSymbol):
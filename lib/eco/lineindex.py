@@ -0,0 +1,260 @@
+# Copyright (c) 2013--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+"""Persistent sequence of lines.
+
+`LineIndex` stores the `Line` objects of a document in a treap ordered by
+line number. Every node caches the size of its subtree, so lines can be
+looked up, inserted and deleted by line number in O(log n). Nodes are never
+modified once created: an update copies the O(log n) nodes on the path to the
+changed position and shares all other nodes with the previous tree. This
+makes taking a snapshot of the lines (e.g. for undo) an O(1) operation, and
+a snapshot can be restored at any later point.
+
+Additionally, the nodes of the current tree point to their parent and are
+indexed by the newline node of their line, allowing to look up the line
+number of a newline node in O(log n)."""
+
+import random, sys
+
+# priorities are drawn from a private, seeded generator to keep the tree
+# layout reproducible
+_random = random.Random(0)
+
+class _Node(object):
+    __slots__ = ("line", "priority", "left", "right", "size", "parent")
+
+    def __init__(self, line, priority, left, right):
+        self.line = line
+        self.priority = priority
+        self.left = left
+        self.right = right
+        self.size = 1
+        self.parent = None
+        if left is not None:
+            self.size += left.size
+            left.parent = self
+        if right is not None:
+            self.size += right.size
+            right.parent = self
+
+def _size(node):
+    if node is None:
+        return 0
+    return node.size
+
+class LineIndex(object):
+
+    def __init__(self, lines=None):
+        self.root = None
+        self.nodes = {}     # newline node -> _Node in the current tree
+        if lines:
+            for line in lines:
+                self.append(line)
+
+    def _make(self, node, left, right):
+        """Creates a copy of `node` with the given children."""
+        new = _Node(node.line, node.priority, left, right)
+        if self.nodes is not None:
+            self.nodes[node.line.node] = new
+        return new
+
+    def _split(self, node, i):
+        """Splits the tree into the first `i` lines and the rest."""
+        if node is None:
+            return None, None
+        leftsize = _size(node.left)
+        if i <= leftsize:
+            a, b = self._split(node.left, i)
+            return a, self._make(node, b, node.right)
+        a, b = self._split(node.right, i - leftsize - 1)
+        return self._make(node, node.left, a), b
+
+    def _merge(self, a, b):
+        if a is None:
+            return b
+        if b is None:
+            return a
+        if a.priority > b.priority:
+            return self._make(a, a.left, self._merge(a.right, b))
+        return self._make(b, self._merge(a, b.left), b.right)
+
+    def _set_root(self, root):
+        if root is not None:
+            root.parent = None
+        self.root = root
+
+    def _index(self, i):
+        if i < 0:
+            i += _size(self.root)
+        if i < 0 or i >= _size(self.root):
+            raise IndexError("line index out of range")
+        return i
+
+    def _range(self, s):
+        start, stop, step = s.indices(_size(self.root))
+        if step != 1:
+            raise ValueError("slices of lines don't support steps")
+        return start, max(start, stop)
+
+    def __len__(self):
+        return _size(self.root)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop = self._range(i)
+            result = []
+            for line in self.iter_from(start):
+                if len(result) == stop - start:
+                    break
+                result.append(line)
+            return result
+        i = self._index(i)
+        node = self.root
+        while True:
+            leftsize = _size(node.left)
+            if i < leftsize:
+                node = node.left
+            elif i == leftsize:
+                return node.line
+            else:
+                i -= leftsize + 1
+                node = node.right
+
+    def __delitem__(self, i):
+        if isinstance(i, slice):
+            start, stop = self._range(i)
+        else:
+            start = self._index(i)
+            stop = start + 1
+        a, rest = self._split(self.root, start)
+        deleted, b = self._split(rest, stop - start)
+        if self.nodes is not None:
+            for line in self._iter(deleted):
+                del self.nodes[line.node]
+        self._set_root(self._merge(a, b))
+
+    def __iter__(self):
+        return self._iter(self.root)
+
+    def _iter(self, node):
+        stack = []
+        while stack or node is not None:
+            if node is not None:
+                stack.append(node)
+                node = node.left
+            else:
+                node = stack.pop()
+                yield node.line
+                node = node.right
+
+    def iter_from(self, i):
+        """Iterates over the lines starting at line number `i`."""
+        stack = []
+        node = self.root
+        while node is not None:
+            leftsize = _size(node.left)
+            if i <= leftsize:
+                stack.append(node)
+                node = node.left
+            else:
+                i -= leftsize + 1
+                node = node.right
+        while stack:
+            node = stack.pop()
+            yield node.line
+            node = node.right
+            while node is not None:
+                stack.append(node)
+                node = node.left
+
+    def insert(self, i, line):
+        size = _size(self.root)
+        if i < 0:
+            i = max(0, i + size)
+        i = min(i, size)
+        a, b = self._split(self.root, i)
+        new = _Node(line, _random.random(), None, None)
+        if self.nodes is not None:
+            self.nodes[line.node] = new
+        self._set_root(self._merge(self._merge(a, new), b))
+
+    def append(self, line):
+        self.insert(len(self), line)
+
+    def find(self, node):
+        """Returns the number of the line starting with the newline node
+        `node`, or None if there is no such line."""
+        if self.nodes is None:
+            self._reindex()
+        try:
+            tnode = self.nodes[node]
+        except KeyError:
+            return None
+        i = _size(tnode.left)
+        while tnode.parent is not None:
+            if tnode is tnode.parent.right:
+                i += _size(tnode.parent.left) + 1
+            tnode = tnode.parent
+        return i
+
+    def _reindex(self):
+        """Rebuilds the parent pointers and the node index after another
+        version of the tree was loaded."""
+        self.nodes = {}
+        if self.root is None:
+            return
+        self.root.parent = None
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            self.nodes[node.line.node] = node
+            for child in (node.left, node.right):
+                if child is not None:
+                    child.parent = node
+                    stack.append(child)
+
+    def snapshot(self):
+        """Returns the current state of the lines, which can be restored
+        later using `load`."""
+        return self.root
+
+    def load(self, snapshot):
+        self.root = snapshot
+        # the parent pointers may belong to another version of the tree
+        self.nodes = None
+
+def snapshot_size(snapshot, seen):
+    """Returns the approximate number of bytes used by a snapshot, not
+    counting the nodes whose ids are in `seen` (i.e. that are shared with
+    snapshots measured before)."""
+    size = 0
+    stack = [snapshot]
+    while stack:
+        node = stack.pop()
+        if node is None or id(node) in seen:
+            continue
+        seen.add(id(node))
+        size += sys.getsizeof(node)
+        stack.append(node.left)
+        stack.append(node.right)
+    return size
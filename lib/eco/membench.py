@@ -0,0 +1,157 @@
+# Copyright (c) 2013--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Benchmarks the memory used by parse trees.
+
+Every program in `test/programs.py` is parsed (optionally repeated to get a
+larger file) and the memory owned by each node of the resulting tree is
+summed up: the node itself, its symbol, its list of children, its
+annotations, its side data and its history (see `History.sizeof`). Objects
+that are shared between nodes (e.g. interned strings, lists of children
+shared between versions) are only counted once. The average number of bytes
+per terminal and per nonterminal is reported, together with the total number
+of bytes allocated while importing the program, as measured by tracemalloc.
+
+Usage: python3 membench.py [options] [PROGRAM...]"""
+
+import contextlib, os, sys, tracemalloc
+from optparse import OptionParser
+
+from grammars.grammars import lang_dict
+from treemanager import TreeManager
+from incparser.astree import Node, History
+from grammar_parser.gparser import Nonterminal, Symbol
+from test import programs
+
+# the language of every program; programs not listed here are tried with all
+# languages until one of them can parse them
+LANGUAGES = {
+    "connect4": "Python 2.7.5",
+    "pythonsmall": "Python 2.7.5",
+    "phpclass": "PHP",
+}
+
+def find_programs(names=None):
+    from fuzzdriver import find_programs
+    return [name for name in find_programs() if not names or name in names]
+
+def find_language(name):
+    if name in LANGUAGES:
+        return LANGUAGES[name]
+    from fuzzdriver import find_languages, parses
+    for lang in find_languages():
+        if parses((lang, name)):
+            return lang
+    return None
+
+def slots(node):
+    """Returns the names of all slots of `node`."""
+    names = []
+    for cls in type(node).__mro__:
+        names.extend(getattr(cls, "__slots__", []))
+    return names
+
+def owned_size(value, seen):
+    """Returns the size of `value` if it hasn't been counted yet. Nodes are
+    counted separately and never included."""
+    if value is None or isinstance(value, (Node, bool)) or id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, History):
+        return sys.getsizeof(value) + value.sizeof(seen)
+    size = sys.getsizeof(value)
+    if isinstance(value, Symbol):
+        size += owned_size(value.name, seen)
+        if hasattr(value, "__dict__"):
+            size += sys.getsizeof(value.__dict__)
+    elif isinstance(value, dict):
+        for v in value.values():
+            size += owned_size(v, seen)
+    return size
+
+def node_size(node, seen):
+    """Returns the number of bytes used by `node` and the objects it owns."""
+    size = sys.getsizeof(node)
+    if hasattr(node, "__dict__"):
+        size += sys.getsizeof(node.__dict__)
+    for name in slots(node):
+        size += owned_size(getattr(node, name, None), seen)
+    return size
+
+def measure_tree(root):
+    """Returns the number of terminals and nonterminals in the tree `root` and
+    the bytes used by each kind of node."""
+    # small integers and the empty string are shared by the interpreter
+    seen = set(id(i) for i in range(-5, 257))
+    seen.add(id(""))
+    counts = {"terminal": [0, 0], "nonterminal": [0, 0]}
+    todo = [root]
+    while todo:
+        node = todo.pop()
+        kind = "nonterminal" if type(node.symbol) is Nonterminal else "terminal"
+        counts[kind][0] += 1
+        counts[kind][1] += node_size(node, seen)
+        todo.extend(node.children)
+    return counts
+
+def bench(lang, program):
+    parser, lexer = lang_dict[lang].load()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        tm = TreeManager()
+        tm.add_parser(parser, lexer, lang)
+        with open(os.devnull, "w") as devnull:
+            with contextlib.redirect_stdout(devnull):
+                tm.import_file(program)
+        allocated = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    counts = measure_tree(tm.get_bos().get_root())
+    return {"terminals": counts["terminal"][0], "nonterminals": counts["nonterminal"][0],
+            "terminal_bytes": counts["terminal"][1], "nonterminal_bytes": counts["nonterminal"][1],
+            "allocated": allocated}
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options] [PROGRAM...]")
+    parser.add_option("-r", "--repeat", type="int", default=1,
+                      help="parse REPEAT concatenated copies of every program")
+    options, args = parser.parse_args()
+
+    print("%-20s %-15s %8s %8s %8s %8s %10s" % ("program", "language", "terms", "b/term",
+                                                "nonterms", "b/nonterm", "allocated"))
+    for name in find_programs(args):
+        lang = find_language(name)
+        if lang is None:
+            print("%-20s no language can parse this program" % name)
+            continue
+        program = getattr(programs, name)
+        if not program.endswith("\n"):
+            program += "\n"
+        result = bench(lang, program * options.repeat)
+        print("%-20s %-15s %8d %8.1f %8d %8.1f %9.1fk" % (name, lang,
+              result["terminals"], result["terminal_bytes"] / float(result["terminals"]),
+              result["nonterminals"], result["nonterminal_bytes"] / float(result["nonterminals"]),
+              result["allocated"] / 1024.0))
+        sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
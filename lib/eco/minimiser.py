@@ -3,12 +3,122 @@ from treemanager import TreeManager
 from utils import KEY_UP as UP, KEY_DOWN as DOWN, KEY_LEFT as LEFT, KEY_RIGHT as RIGHT
 from optparse import OptionParser
 import logging
+import re
 import sys, os
 
+def ddmin(items, fails):
+    """Delta debugging: returns a 1-minimal subsequence of `items` for which
+    `fails` (called with a list of items) still returns True, i.e. removing
+    any single item from the result makes the failure go away. The failure is
+    first searched in halves of the input, then in complements of smaller and
+    smaller chunks, so a short cause in a long input is found in a
+    logarithmic number of tests."""
+    items = list(items)
+    results = {}
+    def test(indices):
+        key = tuple(indices)
+        if key not in results:
+            results[key] = fails([items[i] for i in indices])
+        return results[key]
+
+    if test([]):
+        return []
+    indices = list(range(len(items)))
+    n = 2
+    while len(indices) >= 2:
+        n = min(n, len(indices))
+        size = len(indices) / n
+        chunks = [indices[int(i * size):int((i + 1) * size)] for i in range(n)]
+        for chunk in chunks:
+            if test(chunk):
+                indices = chunk
+                n = 2
+                break
+        else:
+            for i in range(n):
+                complement = [j for chunk in chunks[:i] + chunks[i+1:] for j in chunk]
+                if n > 2 and test(complement):
+                    indices = complement
+                    n = max(n - 1, 2)
+                    break
+            else:
+                if n == len(indices):
+                    break
+                n = min(n * 2, len(indices))
+    return [items[i] for i in indices]
+
+def split_steps(log):
+    """Splits a FuzzyTester log into steps, each ending with a key press or an
+    undo snapshot, so that minimising never separates a key press from the
+    cursor movements leading up to it."""
+    steps = []
+    step = []
+    for l in log:
+        step.append(l)
+        if l.startswith("self.treemanager.key_") or l.startswith("self.treemanager.undo_snapshot"):
+            steps.append(step)
+            step = []
+    if step:
+        steps.append(step)
+    return steps
+
+def split_tokens(program):
+    """Splits a program into words, runs of spaces, newlines and single
+    characters."""
+    return re.findall(r"\w+|[ \t]+|\r\n|\r|\n|.", program)
+
+class DeltaMinimiser(object):
+    """Minimises a failing FuzzyTester run using delta debugging, alternately
+    reducing the logged edits (see `split_steps`) and the tokens of the
+    program until neither can be reduced any further. A reduction is kept only if the run still
+    fails with the same exception, as identified by `signature` (a function
+    of the exception). `make_tester(program)` returns a FuzzyTester for the
+    given program."""
+
+    def __init__(self, make_tester, program, log, signature):
+        self.make_tester = make_tester
+        self.program = program
+        self.log = log
+        self.signature = signature
+        self.expected = self.run(program, log)
+        self.runs = 0
+
+    def run(self, program, log):
+        """Replays `log` on `program` and returns the signature of the
+        exception it raises, or None."""
+        tester = self.make_tester(program)
+        try:
+            tester.replay(list(log))
+        except Exception as e:
+            return self.signature(e)
+        return None
+
+    def fails(self, program, log):
+        self.runs += 1
+        return self.run(program, log) == self.expected
+
+    def minimise(self):
+        if self.expected is None:
+            raise ValueError("The test doesn't fail.")
+        while True:
+            # remove whole steps first, then single cursor movements
+            steps = split_steps(self.log)
+            steps = ddmin(steps, lambda s: self.fails(self.program, [l for step in s for l in step]))
+            log = [l for step in steps for l in step]
+            log = ddmin(log, lambda l: self.fails(self.program, l))
+            tokens = ddmin(split_tokens(self.program), lambda t: self.fails("".join(t), log))
+            program = "".join(tokens)
+            if log == self.log and program == self.program:
+                break
+            logging.info("Reduced to {} log lines and {} characters".format(len(log), len(program)))
+            self.log = log
+            self.program = program
+        return self.program, self.log
+
 class FuzzyMinimiser(object):
 
     def __init__(self, lang, program, test):
-        grm = lang_dict[language]
+        grm = lang_dict[lang]
         parser, lexer = grm.load()
         parser.init_ast()
         self.parser = parser
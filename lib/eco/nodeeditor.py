@@ -34,6 +34,7 @@ from grammar_parser.gparser import MagicTerminal, IndentationTerminal
 from grammar_parser.bootstrap import ListNode, AstNode
 from incparser.astree import BOS, EOS, MultiTextNode
 from jsonmanager import JsonManager
+from binarymanager import BinaryManager
 from utils import KeyPress
 from overlay import Overlay
 from incparser.annotation import Footnote, Heatmap, Railroad, ToolTip
@@ -81,6 +82,7 @@ class NodeEditor(QFrame):
         self.timer.timeout.connect(self.analysis_timer)
         self.backuptimer.timeout.connect(self.backup_timer)
         self.backuptimer.start(30000)
+        self.autosave_managers = {}
         self.undotimer = QTimer(self)
         self.undotimer.timeout.connect(self.trigger_undotimer)
 
@@ -407,7 +409,9 @@ class NodeEditor(QFrame):
 
         self.lines = self.tm.lines
         self.cursor = self.tm.cursor
+        self.update_line_styles()
         self.lines[line].height = 1 # reset height
+        styles = self.get_line_styles(line, highlighter)
         draw_cursor = True
         show_namebinding = self.getWindow().show_namebinding()
         while y < max_y:
@@ -443,7 +447,7 @@ class NodeEditor(QFrame):
                 else:
                     draw_lbox = False
                 node = lbnode.children[0]
-                highlighter = self.get_highlighter(node)
+                highlighter = styles.highlighter = self.get_highlighter(node)
                 renderer = self.get_renderer(node)
                 continue
 
@@ -456,7 +460,7 @@ class NodeEditor(QFrame):
                     if lbox > 0:
                         lbox -= 1
                     node = lbnode.next_terminal()
-                    highlighter = self.get_highlighter(node)
+                    highlighter = styles.highlighter = self.get_highlighter(node)
                     renderer = self.get_renderer(node)
                     if self.selected_lbox is lbnode:
                         # draw bracket
@@ -505,7 +509,7 @@ class NodeEditor(QFrame):
 
 
             # draw node
-            dx, dy = renderer.paint_node(paint, node, x, y, highlighter)
+            dx, dy = renderer.paint_node(paint, node, x, y, styles)
             x += dx
             self.lines[line].height = max(self.lines[line].height, dy)
 
@@ -551,6 +555,7 @@ class NodeEditor(QFrame):
                 y += self.lines[line].height
                 line += 1
                 self.lines[line].height = 1 # reset height
+                styles = self.get_line_styles(line, highlighter)
 
             if self.show_highlight_line:
                 if node.lookup == "<return>" or isinstance(node, BOS):
@@ -743,6 +748,24 @@ class NodeEditor(QFrame):
         s = syntaxhighlighter.get_highlighter(base, self.palette())
         return s
 
+    def update_line_styles(self):
+        """Drops the cached highlighting of all lines that changed since the
+        last repaint."""
+        changed = self.tm.pop_changed_lines()
+        if changed is None:
+            changed = self.tm.lines
+        for line in changed:
+            line.styles = None
+
+    def get_line_styles(self, line, highlighter):
+        """Returns the cached highlighting of a line, which uses `highlighter`
+        for nodes that haven't been painted yet."""
+        line = self.lines[line]
+        if line.styles is None:
+            line.styles = syntaxhighlighter.LineStyles()
+        line.styles.highlighter = highlighter
+        return line.styles
+
     def get_languagebox(self, node):
         root = node.get_root()
         lbox = root.get_magicterminal()
@@ -1128,8 +1151,16 @@ class NodeEditor(QFrame):
         whitespaces = self.tm.get_mainparser().whitespaces
         root = self.tm.parsers[0][0].previous_version.parent
         language = self.tm.parsers[0][2]
-        manager = JsonManager()
-        manager.save(root, language, whitespaces, filename)
+        if swap:
+            # Swap and backup files are saved repeatedly, so only append the
+            # changes since the last save
+            if filename not in self.autosave_managers:
+                self.autosave_managers[filename] = BinaryManager()
+            manager = self.autosave_managers[filename]
+            manager.save(root, language, whitespaces, filename, append=True)
+        else:
+            manager = BinaryManager()
+            manager.save(root, language, whitespaces, filename)
         if not swap:
             self.tm.changed = False
             self.sig_painted.emit()
@@ -1139,6 +1170,7 @@ class NodeEditor(QFrame):
         language_boxes = manager.load(filename)
 
         self.tm = TreeManager()
+        self.autosave_managers = {}
 
         self.tm.load_file(language_boxes)
         self.reset()
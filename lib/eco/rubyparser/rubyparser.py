@@ -1,9 +1,7 @@
-from export.jruby import JRubyExporter
 from incparser.astree import AST, BOS, EOS, TextNode
 from incparser.syntaxtable import FinishSymbol
 from grammars.grammars import EcoFile
 from grammar_parser.gparser import Terminal, Nonterminal
-from PyQt5.QtCore import QSettings
 
 import subprocess
 import tempfile
@@ -111,6 +109,8 @@ class RubyParser(object):
                 return node
 
     def inc_parse(self, line_indents = [], reparse=False):
+        from PyQt5.QtCore import QSettings
+        from export.jruby import JRubyExporter
         settings = QSettings("softdev", "Eco")
         ruby_parser = str(settings.value("env_ruby_parser", "").toString())
         if ruby_parser == "":
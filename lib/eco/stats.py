@@ -0,0 +1,149 @@
+# Copyright (c) 2013--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Counters and timers for the lexer, parser and tree manager.
+
+Collecting statistics is disabled by default. Instrumented code checks
+`stats.current` before counting anything, so the overhead while disabled is
+a single attribute lookup. After calling `enable`, the following counters
+are collected:
+
+    shifts, reductions, optimistic_shifts, right_breakdowns
+        parser actions (`right_breakdowns` counts reverted optimistic shifts)
+    reused_nodes, new_nodes
+        nonterminals reused from the previous parse tree or newly created
+        during reductions
+    retained_subtrees
+        subtrees retained during error recovery
+    relexed_nodes
+        tokens created or updated by the incremental lexer
+    saved_nodes, saved_bytes
+        snapshots recorded in the node histories and their (approximate)
+        size in bytes
+
+as well as the time (in seconds) spent in the phases `relex`, `inc_parse`,
+`top_down_reuse`, `save` and `autolbox`, named `<phase>_time`, and the
+number of times each phase was entered, named `<phase>_calls`. Phases are
+exclusive: time spent in a nested phase (e.g. detecting language boxes
+while parsing) only counts for the nested phase.
+
+Counts are collected per edit, i.e. per call of `TreeManager.reparse`.
+`Stats.last` holds the counts of the most recent edit and `Stats.totals`
+the sum of all edits. If a stream is given, every edit is written to it as
+one line of JSON. Statistics can also be enabled by setting the
+environment variable ECO_STATS to a file name (or `-` for stderr). The file
+is opened when the first edit is written and closed at exit."""
+
+import atexit, json, os, sys
+from contextlib import contextmanager
+from time import time
+
+# the active Stats object, or None if statistics are disabled
+current = None
+
+class Stats(object):
+
+    def __init__(self, stream=None, filename=None):
+        self.stream = stream
+        self.filename = filename    # appended to if no stream is given
+        self.edit = {}      # counts of the edit in progress
+        self.last = {}      # counts of the last finished edit
+        self.totals = {}
+        self.edits = 0
+        self.nested = []    # time spent in nested phases of running timers
+
+    def count(self, name, n=1):
+        self.edit[name] = self.edit.get(name, 0) + n
+
+    @contextmanager
+    def timer(self, phase):
+        start = time()
+        self.nested.append(0.0)
+        try:
+            yield
+        finally:
+            duration = time() - start
+            self.count(phase + "_time", duration - self.nested.pop())
+            self.count(phase + "_calls")
+            if self.nested:
+                self.nested[-1] += duration
+
+    def end_edit(self):
+        """Finishes the current edit: adds its counts to the totals and
+        writes them to the stream, if any."""
+        for name, n in self.edit.items():
+            self.totals[name] = self.totals.get(name, 0) + n
+        self.edits += 1
+        self.last = self.edit
+        self.edit = {}
+        if self.stream is None and self.filename:
+            self.stream = open(self.filename, "a")
+            atexit.register(self.stream.close)
+        if self.stream:
+            self.stream.write(json.dumps(self.last, sort_keys=True) + "\n")
+            self.stream.flush()
+
+    def reset(self):
+        self.edit = {}
+        self.last = {}
+        self.totals = {}
+        self.edits = 0
+
+class _NullTimer(object):
+    def __enter__(self):
+        pass
+    def __exit__(self, *args):
+        pass
+
+_null_timer = _NullTimer()
+
+def timer(phase):
+    """Returns a context manager measuring the time spent in `phase` if
+    statistics are enabled."""
+    if current is None:
+        return _null_timer
+    return current.timer(phase)
+
+def enable(stream=None, filename=None):
+    """Starts collecting statistics and returns the Stats object. Every edit
+    is written to `stream`, or appended to the file `filename`."""
+    global current
+    current = Stats(stream, filename)
+    return current
+
+def disable():
+    """Stops collecting statistics and returns the collected Stats (or None
+    if they weren't enabled)."""
+    global current
+    result = current
+    current = None
+    return result
+
+def _enable_from_environment():
+    filename = os.environ.get("ECO_STATS")
+    if not filename:
+        return
+    if filename == "-":
+        enable(sys.stderr)
+    else:
+        enable(filename=filename)
+
+_enable_from_environment()
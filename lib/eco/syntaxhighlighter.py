@@ -22,6 +22,51 @@
 from PyQt5.Qt import QPalette
 from PyQt5.QtCore import QSettings
 
+class HighlightTable(object):
+    """The highlighting rules of a grammar, compiled for fast lookups.
+
+    The colour and style of a terminal only depend on its lookup, the name of
+    its parent's symbol (if its lookup appears in a (lookup, parent) rule) and
+    its own name (if a rule names it). `get` reduces a terminal to these, so
+    that e.g. all identifiers share the same entry, and resolves each
+    combination only once."""
+
+    def __init__(self, colors, styles):
+        self.colors = colors
+        self.styles = styles
+        self.parent_lookups = set(key[0] for key in colors if type(key) is tuple)
+        self.names = set(key for key in list(colors) + list(styles) if type(key) is not tuple)
+        self.resolved = {}
+
+    def get(self, lookup, parent, name):
+        """Returns the names of the colour and style of a terminal."""
+        if lookup not in self.parent_lookups:
+            parent = None
+        if type(name) is not str or name not in self.names:
+            name = None
+        key = (lookup, parent, name)
+        try:
+            return self.resolved[key]
+        except KeyError:
+            result = self.resolved[key] = (self.resolve_color(*key), self.resolve_style(lookup, name))
+            return result
+
+    def resolve_color(self, lookup, parent, name):
+        if (lookup, parent) in self.colors:
+            return self.colors[(lookup, parent)]
+        elif name in self.colors:
+            return self.colors[name]
+        elif lookup in self.colors:
+            return self.colors[lookup]
+        return "default"
+
+    def resolve_style(self, lookup, name):
+        if name in self.styles:
+            return self.styles[name]
+        elif lookup in self.styles:
+            return self.styles[lookup]
+        return "normal"
+
 class SyntaxHighlighter(object):
     colors = {
         "green": "#859900",
@@ -52,33 +97,65 @@ class SyntaxHighlighter(object):
         theme = settings.value("app_theme", "Light (Default)")
         if theme == "Gruvbox":
             self.colors = self.gb_colors
+        self.table = self.get_table()
+
+    @classmethod
+    def get_table(cls):
+        """Returns the compiled rules of this highlighter, which are shared by
+        all its instances."""
+        table = cls.__dict__.get("_table")
+        if table is None:
+            table = cls._table = HighlightTable(cls.keyword_colors, cls.keyword_style)
+        return table
+
+    def get_highlight(self, node):
+        """Returns the names of the colour and style of `node`."""
+        return self.table.get(node.lookup, node.parent.symbol.name, node.symbol.name)
 
     def get_color(self, node):
-        parent = node.parent
-        if (node.lookup, parent.symbol.name) in self.keyword_colors:
-            color = self.keyword_colors[(node.lookup, parent.symbol.name)]
-        elif node.symbol.name in self.keyword_colors:
-            color = self.keyword_colors[node.symbol.name]
-        elif node.lookup in self.keyword_colors:
-            color = self.keyword_colors[node.lookup]
-        else:
-            color = "default"
-
-        if color == "default":
-            hexcode = self.palette.color(QPalette.Text)
-        else:
-            hexcode = self.colors[color]
-        return hexcode
+        return self.to_color(self.get_highlight(node)[0])
+
+    def to_color(self, name):
+        if name == "default":
+            return self.palette.color(QPalette.Text)
+        return self.colors[name]
 
     def get_default_color(self):
         return self.palette.color(QPalette.Text)
 
     def get_style(self, node):
-        if not isinstance(node.symbol.name, list) and node.symbol.name in self.keyword_style:
-            return self.keyword_style[node.symbol.name]
-        elif node.lookup in self.keyword_style:
-            return self.keyword_style[node.lookup]
-        return "normal"
+        return self.get_highlight(node)[1]
+
+class LineStyles(object):
+    """The highlighting of the nodes on a line, cached between repaints.
+
+    Can be used in place of a highlighter (see `Renderer.paint_node`), but
+    only asks `highlighter` (which must be set to the highlighter of the
+    current language box) for nodes it hasn't seen before. Colours are cached
+    by name, so that they follow changes of the theme. `NodeEditor` drops the
+    cache of a line once any of its nodes changed."""
+
+    __slots__ = ["highlighter", "highlights"]
+
+    def __init__(self):
+        self.highlighter = None
+        self.highlights = {}
+
+    def get_highlight(self, node):
+        try:
+            return self.highlights[id(node)]
+        except KeyError:
+            highlight = self.highlights[id(node)] = self.highlighter.get_highlight(node)
+            return highlight
+
+    def get_color(self, node):
+        return self.highlighter.to_color(self.get_highlight(node)[0])
+
+    def get_default_color(self):
+        return self.highlighter.get_default_color()
+
+    def get_style(self, node):
+        return self.get_highlight(node)[1]
 
 class PythonHighlighter(SyntaxHighlighter):
 
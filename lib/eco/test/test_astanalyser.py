@@ -0,0 +1,95 @@
+from grammars.grammars import lang_dict
+from treemanager import TreeManager
+from astanalyser import AstAnalyser
+
+java = lang_dict["Java"]
+
+program = """class Foo {
+    int x = 1;
+    public int get(int a) {
+        int b = a + x;
+        return b;
+    }
+    public void set(int v) {
+        z = v;
+    }
+}
+class Bar {
+    int run() {
+        int q = 2;
+        return q + w;
+    }
+}"""
+
+def create_treemanager(text):
+    parser, lexer = java.load()
+    tm = TreeManager()
+    tm.add_parser(parser, lexer, java.name)
+    tm.import_file(text)
+    return tm
+
+def errors(analyser):
+    return sorted(n.symbol.name for n in analyser.errors)
+
+def summary(analyser):
+    return [(u.kind, u.name, tuple((p.kind, p.name) for p in u.path), u.index) for u in analyser.uris]
+
+class Test_AstAnalyser:
+
+    def setup_method(self, method):
+        self.tm = create_treemanager(program)
+        self.parser = self.tm.parsers[0][0]
+        self.analyser = self.tm.parsers[0][3]
+        self.tm.analyse()
+
+    def compare_full(self):
+        """Checks that analysing incrementally gives the same result as
+        analysing from scratch."""
+        full = AstAnalyser(java.nb_file)
+        full.analyse(self.parser.previous_version.parent)
+        assert summary(self.analyser) == summary(full)
+        assert errors(self.analyser) == errors(full)
+
+    def type_at(self, line, text):
+        self.tm.cursor.line = line
+        self.tm.key_end()
+        for c in text:
+            self.tm.key_normal(c)
+        assert self.parser.last_status
+
+    def test_errors(self):
+        assert errors(self.analyser) == ["w", "z"]
+        self.compare_full()
+
+    def test_index(self):
+        assert self.analyser.get_reference("variable", [], "x") is None
+        for uri in self.analyser.uris:
+            found = self.analyser.get_reference(uri.kind, uri.path, uri.name)
+            assert found.name == uri.name and found.kind == uri.kind
+            assert self.analyser.paths_eq(found.path, uri.path)
+
+    def test_reuse_unchanged_scopes(self):
+        self.type_at(12, "\rint w = 3;")
+        self.tm.analyse()
+        assert errors(self.analyser) == ["z"]
+        # the scopes of Foo were taken from the previous analysis
+        assert self.analyser.reused
+        self.compare_full()
+
+    def test_rename_definition(self):
+        self.tm.cursor.line = 1
+        self.tm.cursor.move_to_x(9)
+        self.tm.key_backspace()
+        self.tm.key_normal("y") # int y = 1;
+        self.tm.analyse()
+        assert errors(self.analyser) == ["w", "x", "z"]
+        self.compare_full()
+
+    def test_undo(self):
+        self.type_at(1, "\rint z = 0;")
+        self.tm.analyse()
+        assert errors(self.analyser) == ["w"]
+        while self.tm.export_as_text() != program:
+            self.tm.key_ctrl_z()
+        self.tm.analyse()
+        self.compare_full()
@@ -0,0 +1,44 @@
+import batch
+
+import json, subprocess, sys
+
+class Test_Batch:
+
+    def test_find_files(self):
+        files = batch.find_files(["test", "test/calcerror.eco", "test/retain*.eco"])
+        assert "test/calcerror.eco" in files
+        assert "test/retaincalc2.eco" in files
+        assert len(files) == len(set(files))
+        assert all(f.endswith(".eco") for f in files)
+
+    def test_syntaxerror(self):
+        result = batch.process_file("test/calcerror.eco")
+        assert result["status"] == "syntaxerror"
+        assert result["language"] == "Basic Calculator"
+        assert result["text"] == "1+*2+*3"
+        assert result["errors"] == [{"line": 1, "column": 3, "token": "*", "lookup": "mul",
+                                     "language": "Basic Calculator"}]
+
+    def test_ok(self):
+        result = batch.process_file("test/range_lex_bug.eco", export=False)
+        assert result["status"] == "ok"
+        assert result["errors"] == []
+        assert "text" not in result
+
+    def test_missing_file(self):
+        result = batch.process_file("test/doesnotexist.eco")
+        assert result["status"] == "error"
+
+    def test_pool(self):
+        files = ["test/calcerror.eco", "test/range_lex_bug.eco"]
+        results = list(batch.run(files, jobs=2))
+        assert [r["file"] for r in results] == files
+        assert [r["status"] for r in results] == ["syntaxerror", "ok"]
+
+    def test_no_pyqt(self):
+        code = "import sys, batch; batch.main(['-j', '1', 'test/calcerror.eco']); " \
+               "assert not [m for m in sys.modules if m.startswith('PyQt5')]"
+        p = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        assert p.returncode == 0, p.stderr
+        result = json.loads(p.stdout.decode("utf-8"))
+        assert result["file"] == "test/calcerror.eco"
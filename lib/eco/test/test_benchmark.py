@@ -0,0 +1,42 @@
+import benchmark
+import stats
+
+class Test_Benchmark:
+
+    def test_phase_times(self):
+        log = benchmark.InputLog()
+        log.type("1+2")
+        w = benchmark.Workload("calc", "Basic Calculator", "", "", log.text(), "")
+        result = benchmark.run_workload(w)
+        phases = result["phases"]
+        assert sorted(phases) == sorted(benchmark.PHASES)
+        assert phases["relex"]["calls"] == 3
+        assert phases["inc_parse"]["calls"] == 3
+        assert phases["save"]["calls"] >= 6
+        assert all(p["time"] >= 0 for p in phases.values())
+        # collecting statistics is switched off again
+        assert stats.current is None
+
+    def test_type(self):
+        log = benchmark.InputLog()
+        log.type(benchmark.python_function)
+        tm = benchmark.create_treemanager("Python 2.7.5")
+        tm.apply_inputlog(log.text())
+        assert tm.export_as_text() == benchmark.python_function
+        assert tm.parsers[0][0].last_status
+
+    def test_workloads(self):
+        for workload in benchmark.WORKLOADS:
+            w = workload(0.1)
+            result = benchmark.bench(w)
+            assert result["total"] > 0
+            assert sum(p["time"] for p in result["phases"].values()) <= result["total"]
+
+    def test_compare(self):
+        def result(total, parse):
+            return {"workloads": {"w": {"total": total, "phases": {"inc_parse": {"time": parse, "calls": 1}}}}}
+        assert benchmark.compare(result(1.0, 0.5), result(1.05, 0.5)) == []
+        assert benchmark.compare(result(1.0, 0.5), result(1.2, 0.7)) == [("w", "total", 1.0, 1.2),
+                                                                       ("w", "inc_parse", 0.5, 0.7)]
+        # tiny absolute differences are noise
+        assert benchmark.compare(result(0.001, 0.0), result(0.002, 0.001)) == []
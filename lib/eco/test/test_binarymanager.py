@@ -0,0 +1,121 @@
+from grammars.grammars import lang_dict
+from treemanager import TreeManager
+from jsonmanager import JsonManager
+from binarymanager import BinaryManager, BinaryFormatError, is_binary
+from grammar_parser.gparser import MagicTerminal
+
+import os
+import pytest
+
+python = lang_dict["Python 2.7.5"]
+
+def walk(root):
+    nodes = []
+    stack = [root]
+    while stack:
+        n = stack.pop()
+        nodes.append((n.__class__, n.symbol.__class__, n.symbol.name, n.lookup,
+                      n.textlen, n.local_error, n.nested_errors, len(n.children),
+                      n.next_term.symbol.name if n.next_term else None))
+        if isinstance(n.symbol, MagicTerminal):
+            stack.append(n.symbol.ast)
+        stack.extend(reversed(n.children))
+    return nodes
+
+class Test_BinaryManager:
+
+    def setup_method(self, method):
+        self.filename = "test/binarymanager_test.eco"
+
+    def teardown_method(self, method):
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def compare(self, boxes1, boxes2):
+        assert len(boxes1) == len(boxes2)
+        for (root1, lang1, ws1), (root2, lang2, ws2) in zip(boxes1, boxes2):
+            assert lang1 == lang2
+            assert ws1 == ws2
+            assert walk(root1) == walk(root2)
+
+    @pytest.mark.parametrize("filename", ["test/calcerror.eco", "test/range_lex_bug.eco", "grammars/python275.eco"])
+    def test_roundtrip(self, filename):
+        boxes = JsonManager().load(filename)
+        root, language, whitespaces = boxes[0]
+        BinaryManager().save(root, language, whitespaces, self.filename)
+        assert is_binary(self.filename)
+        assert not is_binary(filename)
+        self.compare(boxes, BinaryManager().load(self.filename))
+        # JsonManager detects binary files
+        self.compare(boxes, JsonManager().load(self.filename))
+
+    def create_treemanager(self):
+        parser, lexer = python.load()
+        parser.init_ast()
+        tm = TreeManager()
+        tm.add_parser(parser, lexer, python.name)
+        tm.set_font_test(7, 17)
+        return tm
+
+    def save(self, tm, manager, append=True):
+        root = tm.parsers[0][0].previous_version.parent
+        manager.save(root, tm.parsers[0][2], tm.get_mainparser().whitespaces, self.filename, append=append)
+
+    def test_append(self):
+        tm = self.create_treemanager()
+        tm.import_file("def x():\n    return 1\n" * 20)
+        manager = BinaryManager()
+        self.save(tm, manager)
+        full = os.path.getsize(self.filename)
+        tm.key_end()
+        tm.key_normal("2")
+        self.save(tm, manager)
+        assert os.path.getsize(self.filename) - full < full / 2
+        root = tm.parsers[0][0].previous_version.parent
+        boxes = BinaryManager().load(self.filename)
+        assert walk(boxes[0][0]) == walk(root)
+
+        # appending to a file modified by someone else rewrites it
+        BinaryManager().save(root, python.name, True, self.filename)
+        size = os.path.getsize(self.filename)
+        tm.key_normal("3")
+        self.save(tm, manager)
+        assert os.path.getsize(self.filename) != size
+        assert manager.size == manager.full_size
+
+    def test_append_languagebox(self):
+        tm = self.create_treemanager()
+        tm.import_file("x = 1\n")
+        tm.key_end()
+        tm.add_languagebox(lang_dict["Python 2.7.5"])
+        tm.key_normal("y")
+        manager = BinaryManager()
+        self.save(tm, manager)
+        # change only the contents of the language box
+        tm.key_normal("z")
+        self.save(tm, manager)
+        assert manager.size > manager.full_size
+        boxes = BinaryManager().load(self.filename)
+        assert len(boxes) == 2
+        lbox_root = boxes[1][0]
+        assert lbox_root.magic_backpointer.symbol.ast is lbox_root
+        assert walk(boxes[0][0]) == walk(tm.parsers[0][0].previous_version.parent)
+
+    def test_incomplete_segment(self):
+        tm = self.create_treemanager()
+        tm.import_file("x = 1\n")
+        manager = BinaryManager()
+        self.save(tm, manager)
+        size = os.path.getsize(self.filename)
+        old = walk(BinaryManager().load(self.filename)[0][0])
+        tm.key_end()
+        tm.key_normal("2")
+        self.save(tm, manager)
+        # simulate an interrupted autosave
+        with open(self.filename, "r+b") as f:
+            f.truncate(os.path.getsize(self.filename) - 10)
+        assert walk(BinaryManager().load(self.filename)[0][0]) == old
+
+    def test_not_binary(self):
+        with pytest.raises(BinaryFormatError):
+            BinaryManager().load("test/calcerror.eco")
@@ -0,0 +1,83 @@
+from grammars.grammars import lang_dict
+from treemanager import TreeManager
+from test.programs import connect4
+
+calc = lang_dict["Basic Calculator"]
+python = lang_dict["Python 2.7.5"]
+
+def import_file(lang, text, bulk=True):
+    parser, lexer = lang.load()
+    tm = TreeManager()
+    tm.add_parser(parser, lexer, lang.name)
+    if not bulk:
+        tm.relex_import = lambda node: False
+        tm.reparse_import = lambda parser: False
+    tm.import_file(text)
+    return tm
+
+def dump(node):
+    """Returns everything about a subtree that the bulk path must get right."""
+    result = [(type(node).__name__, node.symbol.name, node.lookup, node.lookahead,
+               node.lookback, node.state, node.textlen, node.position,
+               node.changed, node.local_error, node.nested_errors)]
+    for c in node.children:
+        result.extend(dump(c))
+    return result
+
+def root(tm):
+    return tm.parsers[0][0].previous_version.parent
+
+class Test_BulkImport:
+
+    def compare(self, lang, text):
+        expected = import_file(lang, text, bulk=False)
+        tm = import_file(lang, text)
+        assert dump(root(tm)) == dump(root(expected))
+        assert tm.version == expected.version
+        assert tm.undo_snapshots == expected.undo_snapshots
+        assert len(tm.lines) == len(expected.lines)
+        assert tm.parsers[0][0].last_status == expected.parsers[0][0].last_status
+        return tm
+
+    def test_python(self):
+        tm = self.compare(python, connect4)
+        assert tm.export_as_text() == connect4
+
+    def test_multitextnode(self):
+        tm = self.compare(python, 'x = """a\nb\n\nc"""\ny = 1 # c\n')
+        assert "MultiTextNode" in [d[0] for d in dump(root(tm))]
+
+    def test_calc(self):
+        self.compare(calc, "1+2*3")
+
+    def test_syntax_error(self):
+        tm = self.compare(calc, "1+*2")
+        assert tm.parsers[0][0].last_status is False
+
+    def test_edit_after_import(self):
+        tm = import_file(calc, "1+2")
+        tm.key_end()
+        tm.key_normal("*")
+        tm.key_normal("3")
+        assert tm.export_as_text() == "1+2*3"
+        assert tm.parsers[0][0].last_status is True
+        tm.key_ctrl_z()
+        assert tm.export_as_text() == "1+2"
+
+class Test_BatchParse:
+
+    def test_reparse(self):
+        tm = import_file(calc, "1+2")
+        parser = tm.parsers[0][0]
+        before = dump(root(tm))
+        assert parser.batch_parse() is True
+        # ignore the changed flags
+        strip = lambda d: [x[:8] + x[9:] for x in d]
+        assert strip(dump(root(tm))) == strip(before)
+
+    def test_fallback(self):
+        tm = import_file(calc, "1+*2")
+        parser = tm.parsers[0][0]
+        before = dump(root(tm))
+        assert parser.batch_parse() is False
+        assert dump(root(tm)) == before
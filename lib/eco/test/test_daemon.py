@@ -0,0 +1,127 @@
+import daemon
+
+import json, os, socket, subprocess, sys, tempfile, threading, time
+
+class Test_Daemon:
+
+    def setup_method(self, method):
+        self.daemon = daemon.Daemon()
+
+    def call(self, method, **params):
+        response = self.daemon.handle({"jsonrpc": "2.0", "id": 7, "method": method, "params": params})
+        assert response["id"] == 7
+        assert "error" not in response, response["error"]
+        return response["result"]
+
+    def error(self, method, **params):
+        response = self.daemon.handle({"jsonrpc": "2.0", "id": 1, "method": method, "params": params})
+        return response["error"]["code"]
+
+    def text(self, document="a"):
+        return self.call("text", document=document)["text"]
+
+    def test_edits(self):
+        result = self.call("open", document="a", language="Python 2.7.5", text="x = 1\ny = x\n")
+        assert result["diagnostics"] == []
+        result = self.call("insert", document="a", at=5, text="+")
+        assert self.text() == "x = 1+\ny = x\n"
+        assert result["diagnostics"][0]["source"] == "syntax"
+        assert result["changed"][0]["start"]["offset"] <= 5 < result["changed"][-1]["end"]["offset"]
+        result = self.call("insert", document="a", at={"line": 0, "character": 6}, text="2")
+        assert self.text() == "x = 1+2\ny = x\n"
+        assert result["diagnostics"] == []
+        # diagnostics are only sent if they changed
+        result = self.call("insert", document="a", at={"line": 1, "character": 5}, text="+x")
+        assert self.text() == "x = 1+2\ny = x+x\n"
+        assert "diagnostics" not in result
+        assert result["changed"][0]["start"]["offset"] <= 13 <= 15 <= result["changed"][-1]["end"]["offset"]
+
+    def test_changed_tokens(self):
+        self.call("open", document="a", language="Python 2.7.5", text="def f():\n    return 1\n")
+        result = self.call("insert", document="a", at=21, text="2")
+        assert self.text() == "def f():\n    return 12\n"
+        [changed] = result["changed"]
+        assert (changed["start"]["offset"], changed["end"]["offset"]) == (20, 22)
+        result = self.call("undo", document="a")
+        [changed] = result["changed"]
+        assert (changed["start"]["offset"], changed["end"]["offset"]) == (20, 21)
+
+    def test_paste_delete_undo(self):
+        self.call("open", document="a", language="Python 2.7.5", text="x = 1\n")
+        self.call("paste", document="a", at=0, text="if x:\n    pass\n")
+        assert self.text() == "if x:\n    pass\nx = 1\n"
+        self.call("delete", document="a", start=0, end={"line": 2, "character": 0})
+        assert self.text() == "x = 1\n"
+        result = self.call("undo", document="a")
+        assert self.text() == "if x:\n    pass\nx = 1\n"
+        assert result["changed"][0]["start"]["offset"] == 0
+        self.call("redo", document="a")
+        assert self.text() == "x = 1\n"
+
+    def test_languagebox(self):
+        self.call("open", document="c", language="Basic Calculator", text="1+")
+        self.call("add_languagebox", document="c", at=2, language="Python 2.7.5", text="x")
+        assert self.text("c") == "1+x"
+        assert self.daemon.documents["c"].tm.parsers[1][2] == "Python 2.7.5"
+
+    def test_namebinding(self):
+        result = self.call("open", document="j", language="Java", text="class A { int f() { return z; } }")
+        [error] = result["diagnostics"]
+        assert error["source"] == "namebinding"
+        assert error["range"]["start"]["offset"] == 27
+        result = self.call("insert", document="j", at=10, text="int z = 1; ")
+        assert result["diagnostics"] == []
+
+    def test_errors(self):
+        assert self.error("bogus") == daemon.METHOD_NOT_FOUND
+        assert self.error("text", document="a") == daemon.INVALID_PARAMS
+        assert self.error("open", document="a", language="Bogus") == daemon.INVALID_PARAMS
+        self.call("open", document="a", language="Basic Calculator", text="1")
+        assert self.error("insert", document="a", at=5, text="1") == daemon.INVALID_PARAMS
+        assert self.error("insert", document="a", at={"line": 3, "character": 0}, text="1") == daemon.INVALID_PARAMS
+        assert json.loads(self.daemon.handle_line("{"))["error"]["code"] == daemon.PARSE_ERROR
+        # notifications aren't answered
+        assert self.daemon.handle({"jsonrpc": "2.0", "method": "close", "params": {"document": "a"}}) is None
+        assert "a" not in self.daemon.documents
+
+    def test_stdio(self):
+        requests = [{"jsonrpc": "2.0", "id": 1, "method": "open",
+                     "params": {"document": "a", "language": "Basic Calculator", "text": "1+2"}},
+                    {"jsonrpc": "2.0", "id": 2, "method": "insert", "params": {"document": "a", "at": 3, "text": "*3"}},
+                    {"jsonrpc": "2.0", "id": 3, "method": "text", "params": {"document": "a"}},
+                    {"jsonrpc": "2.0", "id": 4, "method": "shutdown"}]
+        code = "import sys, daemon; daemon.main([]); " \
+               "assert not [m for m in sys.modules if m.startswith('PyQt5')]"
+        p = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                           input="".join(json.dumps(r) + "\n" for r in requests).encode("utf-8"))
+        assert p.returncode == 0, p.stderr
+        responses = [json.loads(l) for l in p.stdout.decode("utf-8").splitlines()]
+        assert [r["id"] for r in responses] == [1, 2, 3, 4]
+        assert responses[2]["result"]["text"] == "1+2*3"
+
+    def test_socket(self):
+        path = os.path.join(tempfile.mkdtemp(), "eco.sock")
+        server = threading.Thread(target=daemon.serve_socket, args=(path,))
+        server.start()
+        try:
+            deadline = time.time() + 10
+            while not os.path.exists(path):
+                assert server.is_alive(), "the server stopped before listening"
+                assert time.time() < deadline, "the server didn't start listening"
+                time.sleep(0.01)
+            s = socket.socket(socket.AF_UNIX)
+            s.connect(path)
+            f = s.makefile("rw")
+            def call(rid, method, **params):
+                f.write(json.dumps({"jsonrpc": "2.0", "id": rid, "method": method, "params": params}) + "\n")
+                f.flush()
+                return json.loads(f.readline())
+            call(1, "open", document="a", language="Basic Calculator", text="1")
+            call(2, "insert", document="a", at=1, text="+2")
+            assert call(3, "text", document="a")["result"]["text"] == "1+2"
+            call(4, "shutdown")
+            s.close()
+        finally:
+            server.join(10)
+        assert not server.is_alive()
+        assert not os.path.exists(path)
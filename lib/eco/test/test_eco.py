@@ -24,7 +24,8 @@ from treemanager import TreeManager
 from incparser.incparser import IncParser
 from inclexer.inclexer import IncrementalLexer, IncrementalLexerCF
 from incparser.astree import BOS, EOS, TextNode, MultiTextNode
-from grammar_parser.gparser import MagicTerminal, Terminal
+from export.helper import export_text
+from grammar_parser.gparser import MagicTerminal, Terminal, IndentationTerminal
 from utils import KEY_UP as UP, KEY_DOWN as DOWN, KEY_LEFT as LEFT, KEY_RIGHT as RIGHT
 
 from PyQt5 import QtCore
@@ -1160,6 +1161,115 @@ def z():
 
         assert newline is newline2
 
+    def test_indentation_stacks(self):
+        self.reset()
+        inputstring = """class X:
+    def x():
+        a = 1
+        pass
+    def y():
+        pass
+z = 1"""
+        self.treemanager.import_file(inputstring)
+        assert self.parser.last_status == True
+
+        lines = self.treemanager.lines
+        im = self.treemanager.get_indentmanager(self.treemanager.get_bos().get_root())
+        assert [im.stacks[lines[i].node] for i in range(7)] == \
+            [((0, 0),), ((0, 0), (4, 1)), ((0, 0), (4, 1), (8, 2)), ((0, 0), (4, 1), (8, 2)),
+             ((0, 0), (4, 1)), ((0, 0), (4, 1), (8, 2)), ((0, 0),)]
+
+        # renaming the first def doesn't change the stack of its first
+        # statement, so the rest of its body is left alone
+        stack = im.stacks[lines[3].node]
+        self.move(DOWN, 1)
+        self.move(RIGHT, 9)
+        self.treemanager.key_normal("y")
+        assert self.parser.last_status == True
+        assert im.stacks[lines[3].node] is stack
+
+        # indenting it changes the stack of its body, but not the one of the
+        # second def
+        stack = im.stacks[lines[6].node]
+        self.treemanager.key_home()
+        self.treemanager.key_normal(" ")
+        assert [im.stacks[lines[i].node] for i in range(1, 4)] == \
+            [((0, 0), (5, 1)), ((0, 0), (5, 1), (8, 2)), ((0, 0), (5, 1), (8, 2))]
+        assert im.stacks[lines[6].node] is stack
+        self.treemanager.key_backspace()
+        assert self.parser.last_status == True
+        assert im.stacks[lines[1].node] == ((0, 0), (4, 1))
+
+        from ip_plugins.pythonindentation import PythonIndent, NEWLINE, INDENT, DEDENT
+        plugin = PythonIndent(self.parser)
+        plugin.incparse_init()
+        needed, stack = plugin.get_indentation_tokens_and_indent((0, 4, 8), 4)
+        assert needed == (NEWLINE, DEDENT)
+        assert stack == (0, 4)
+        assert plugin.get_indentation_tokens_and_indent((0, 4), 8) == ((NEWLINE, INDENT), (0, 4, 8))
+        # results are cached, so lines with the same indentation share their stack
+        assert plugin.get_indentation_tokens_and_indent((0, 4, 8), 4)[1] is stack
+
+    def test_indentation_stable_line(self):
+        def check_next_nodes(node, l):
+            for name in l:
+                node = node.next_term
+                assert node.symbol.name == name
+
+        self.reset()
+        inputstring = """def x():
+    if x:
+        y = 2
+        for i in z:
+            pass
+    return x
+z = 1"""
+        self.treemanager.import_file(inputstring)
+        assert self.parser.last_status == True
+
+        # dedent the for loop one space at a time. The repair stops at the
+        # return whose indentation doesn't change, but its tokens still need
+        # to be updated after the loop's body becomes unbalanced
+        self.move(DOWN, 3)
+        for i in range(4):
+            self.treemanager.key_delete()
+        assert self.parser.last_status == True
+        check_next_nodes(self.treemanager.lines[3].node, ["NEWLINE", "DEDENT", "    ", "for"])
+        check_next_nodes(self.treemanager.lines[4].node, ["NEWLINE", "INDENT", "            ", "pass"])
+        check_next_nodes(self.treemanager.lines[5].node, ["NEWLINE", "DEDENT", "    ", "return"])
+        check_next_nodes(self.treemanager.lines[6].node, ["NEWLINE", "DEDENT", "z"])
+
+    def test_indentation_stacks_undo(self):
+        def check_next_nodes(node, l):
+            for name in l:
+                node = node.next_term
+                assert node.symbol.name == name
+
+        self.reset()
+        inputstring = """class X:
+    def x():
+        a = 1
+        pass
+    def y():
+        pass
+z = 1"""
+        self.treemanager.import_file(inputstring)
+        assert self.parser.last_status == True
+
+        # the stacks cached for an undone edit mustn't stop the repair when
+        # the edit is made again
+        self.move(DOWN, 1)
+        self.treemanager.key_normal(" ")
+        assert self.parser.last_status == False
+        self.treemanager.key_ctrl_z()
+        assert self.parser.last_status == True
+        check_next_nodes(self.treemanager.lines[4].node, ["NEWLINE", "DEDENT", "    ", "def"])
+        self.treemanager.cursor.line = 1
+        self.treemanager.key_home()
+        self.treemanager.key_normal(" ")
+        check_next_nodes(self.treemanager.lines[4].node, ["UNBALANCED", "    ", "def"])
+        assert self.parser.last_status == False
+
 class Test_Incremental_AST(Test_Python):
 
     def test_simple(self):
@@ -1186,6 +1296,92 @@ class Test_Incremental_AST(Test_Python):
         assert newfuncdef is funcdef
         assert newfuncdef.alternate is oldastnode
 
+class Test_PositionIndex(Test_Python):
+
+    def check_offsets(self, tm=None):
+        """Checks that the offset of every terminal is where its text is found
+        in the exported text and maps back to the terminal."""
+        tm = tm or self.treemanager
+        text = tm.export_as_text()
+        ast = tm.parsers[0][0].previous_version
+        offset = 0
+        node = ast.get_bos().next_term
+        while not isinstance(node, EOS):
+            assert ast.get_node_offset(node) == offset
+            if isinstance(node.symbol, MagicTerminal):
+                piece = export_text(node.symbol.ast)
+            elif isinstance(node.symbol, IndentationTerminal):
+                piece = ""
+            else:
+                piece = node.symbol.name.replace("\r", "\n")
+            assert node.exportlen == len(piece)
+            assert text[offset:offset + len(piece)] == piece
+            for i in range(1, len(piece) + 1):
+                assert ast.find_node_at_pos(offset + i) is node
+            offset += len(piece)
+            node = node.next_term
+        assert offset == ast.parent.exportlen == len(text)
+        assert isinstance(ast.find_node_at_pos(0), BOS)
+        assert isinstance(ast.find_node_at_pos(offset + 1), EOS)
+
+    def test_simple(self):
+        self.reset()
+        self.treemanager.import_file("def x():\n    return 1\n\ny = x() + 22")
+        self.check_offsets()
+        ast = self.parser.previous_version
+        node = ast.find_node_at_pos(3)
+        assert node.symbol.name == "def"
+        node = ast.find_node_at_pos(4)
+        assert node.symbol.name == " "
+
+    def test_indentation(self):
+        self.reset()
+        self.treemanager.import_file("if x:\n    y = 1\nz = 2\n")
+        self.check_offsets()
+        ast = self.parser.previous_version
+        node = ast.find_node_at_pos(17)
+        assert node.symbol.name == "z"
+        assert ast.get_node_offset(node) == 16
+
+    def test_program(self):
+        self.reset()
+        self.treemanager.import_file(programs.connect4)
+        self.check_offsets()
+
+    def test_incremental(self):
+        self.reset()
+        self.treemanager.import_file("x = 1\ny = 2")
+        self.treemanager.key_end()
+        self.treemanager.key_normal("3")
+        self.check_offsets()
+        self.move(DOWN, 1)
+        self.treemanager.key_home()
+        self.treemanager.key_normal("z")
+        self.check_offsets()
+        self.treemanager.key_ctrl_z()
+        self.check_offsets()
+
+    def test_languagebox(self):
+        tm = TreeManager()
+        parser, lexer = calc.load()
+        tm.add_parser(parser, lexer, calc.name)
+        for c in "1+":
+            tm.key_normal(c)
+        tm.add_languagebox(lang_dict["Basic Calculator"])
+        for c in "2*3":
+            tm.key_normal(c)
+        tm.undo_snapshot()
+        self.check_offsets(tm)
+        tm.key_normal("4")
+        tm.undo_snapshot()
+        assert tm.export_as_text() == "1+2*34"
+        self.check_offsets(tm)
+        tm.key_ctrl_z()
+        assert tm.export_as_text() == "1+2*3"
+        self.check_offsets(tm)
+        tm.key_shift_ctrl_z()
+        self.check_offsets(tm)
+
 class Test_Relexing(Test_Python):
 
     def test_dont_stop_relexing_after_first_error(self):
@@ -4363,6 +4559,41 @@ class Test_ErrorRecoveryPython(Test_Python):
         assert t.cursor.node.parent.parent is T
         assert t.cursor.node.parent.parent.parent is E
 
+    def test_offsets_and_cuts(self):
+        from incparser.error_recovery import RecoveryManager
+        self.reset()
+        self.treemanager.import_file(programs.connect4)
+        version = self.treemanager.version
+
+        # use the terminals as the stack, so every terminal is a cut point
+        stack = []
+        expected = {}
+        offset = 0
+        node = self.treemanager.get_bos()
+        while node is not None:
+            expected[node] = offset
+            stack.append(node)
+            offset += node.textlength()
+            node = node.next_term
+        rm = RecoveryManager(version, None, stack, self.parser.syntaxtable)
+        rm.update_stack_offsets()
+        end = offset
+        assert rm.stack_offset(len(stack)) == end
+
+        for node, offset in expected.items():
+            assert rm.offset(node, version) == offset
+            # stack nodes with a length of zero end at the same offset, and
+            # the cut is the first of them
+            cut = rm.get_cut(node)
+            assert cut != -1 and rm.stack_offset(cut) == offset
+            assert cut == 0 or rm.stack_offset(cut - 1) < offset
+            # nonterminals start at the offset of their first terminal
+            parent = node.parent
+            while parent.parent is not None and parent.children[0] is node:
+                assert rm.offset(parent, version) == offset
+                node, parent = parent, parent.parent
+        assert rm.find_cut(end + 1) == -1
+
 class Test_ErrorRecoveryJava(Test_Java):
     def test_delete(self):
         self.reset()
@@ -4775,6 +5006,40 @@ class Test_AutoLanguageBoxDetection():
         assert len(parser.error_nodes) == 1
         assert len(parser.error_nodes[0].autobox) == 4
 
+    def test_recognizer_memoization(self):
+        parser, lexer = phppython.load()
+        parser.setup_autolbox(phppython.name, lexer)
+        treemanager = TreeManager()
+        treemanager.add_parser(parser, lexer, "")
+
+        for c in "$x = 1 or not 2;":
+            treemanager.key_normal(c)
+        detector = parser.autodetector
+        assert len(detector.recognized) > 0
+        # all heuristics share the results of the recognisers
+        calls = []
+        for r in detector.langs.values():
+            r.parse = lambda node, parse=r.parse: calls.append(node) or parse(node)
+        detector.detect_lbox(parser.error_nodes[0])
+        assert calls == []
+        assert len(parser.error_nodes[0].autobox) == 4
+
+    def test_budget(self):
+        import config
+        budget = config.AUTOLBOX_TOKEN_BUDGET
+        config.AUTOLBOX_TOKEN_BUDGET = 0
+        try:
+            parser, lexer = phppython.load()
+            parser.setup_autolbox(phppython.name, lexer)
+            treemanager = TreeManager()
+            treemanager.add_parser(parser, lexer, "")
+            for c in "$x = 1 or not 2;":
+                treemanager.key_normal(c)
+            assert len(parser.error_nodes) == 1
+            assert parser.error_nodes[0].autobox is None
+        finally:
+            config.AUTOLBOX_TOKEN_BUDGET = budget
+
     def test_include_rules(self):
         grm = EcoFile("Python + HTML (Include)", "grammars/python275.eco", "Python")
         grm.add_alternative("atom", html)
@@ -0,0 +1,269 @@
+from grammars.grammars import lang_dict
+from treemanager import TreeManager
+from export.helper import Generic, export_text, get_pieces
+from export.sourcemap import SourceMap
+from export import PHPPython, HTMLPythonSQL
+from grammar_parser.gparser import IndentationTerminal
+from test.programs import connect4
+
+calc = lang_dict["Basic Calculator"]
+python = lang_dict["Python 2.7.5"]
+
+def create_treemanager(lang, text=None):
+    parser, lexer = lang.load()
+    tm = TreeManager()
+    tm.add_parser(parser, lexer, lang.name)
+    if text:
+        tm.import_file(text)
+    return tm
+
+def clear_cache(node):
+    node.export_cache = None
+    for c in node.children:
+        clear_cache(c)
+
+def uncached(tm):
+    root = tm.lines[0].node.parent
+    clear_cache(root)
+    return export_text(root)
+
+class Test_ExportCache:
+
+    def setup_method(self, method):
+        self.tm = create_treemanager(python, connect4)
+
+    def type_at(self, line, text):
+        self.tm.cursor.line = line
+        self.tm.key_end()
+        for c in text:
+            self.tm.key_normal(c)
+
+    def test_unchanged(self):
+        assert self.tm.export_as_text() == connect4
+        assert self.tm.export_as_text() == connect4
+
+    def test_edits(self):
+        self.tm.export_as_text()
+        for line in [2, 10, 20, 2]:
+            self.type_at(line, " # x")
+            assert self.tm.export_as_text() == uncached(self.tm)
+        self.type_at(5, "\rx = 1")
+        text = self.tm.export_as_text()
+        assert text == uncached(self.tm)
+        assert "x = 1\n" in text
+
+    def test_reuse(self):
+        self.tm.export_as_text()
+        # the innermost cached subtree containing the last line
+        last = self.tm.lines[len(self.tm.lines) - 1].node.next_term
+        while last.export_cache is None:
+            last = last.parent
+        cache = last.export_cache
+        self.type_at(0, " # x")
+        self.tm.export_as_text()
+        assert last.export_cache is cache
+
+    def test_undo(self):
+        self.tm.export_as_text()
+        self.type_at(3, "\rx = 1")
+        assert self.tm.export_as_text() != connect4
+        while self.tm.undo_snapshots and self.tm.export_as_text() != connect4:
+            self.tm.key_ctrl_z()
+        assert self.tm.export_as_text() == connect4 == uncached(self.tm)
+        self.tm.key_shift_ctrl_z()
+        assert self.tm.export_as_text() == uncached(self.tm)
+
+    def test_edit_after_undo(self):
+        # the new edits are saved under the versions of the undone ones
+        self.type_at(3, "\ry = 2")
+        self.tm.export_as_text()
+        self.tm.key_ctrl_z()
+        self.tm.export_as_text()
+        self.type_at(3, "\rz = 3")
+        assert self.tm.export_as_text() == uncached(self.tm)
+        self.tm.key_ctrl_z()
+        assert self.tm.export_as_text() == uncached(self.tm)
+
+class Test_ExportPieces:
+
+    def test_multiline_string(self):
+        program = 'x = """a\nb\n\nc"""\ny = 1\n'
+        tm = create_treemanager(python, program)
+        assert tm.export_as_text() == program
+        tm.cursor.line = 1
+        tm.key_end()
+        tm.key_normal("d")
+        assert tm.export_as_text() == 'x = """a\nbd\n\nc"""\ny = 1\n'
+
+    def test_languagebox(self):
+        tm = create_treemanager(calc)
+        tm.key_normal("1")
+        tm.key_normal("+")
+        tm.export_as_text()
+        tm.add_languagebox(lang_dict["Python 2.7.5"])
+        for c in "def x():\r    pass":
+            tm.key_normal(c)
+        assert tm.export_as_text() == "1+def x():\n    pass" == uncached(tm)
+        pieces = get_pieces(tm.lines[0].node.parent)
+        assert pieces[0] == "1+"
+        assert pieces[1].symbol.name == "<Python 2.7.5>"
+
+    def test_generic_lineno(self):
+        tm = create_treemanager(python, connect4)
+        generic = Generic()
+        assert generic.pp(tm.lines[0].node) == connect4
+        assert generic.lineno == connect4.count("\n") + 1
+
+class Test_SourceMap:
+
+    def test_add_and_extend(self):
+        a, b, c = object(), object(), object()
+        inner = SourceMap()
+        inner.add("x\ny", b)
+        inner.add("z\n", c)
+        sm = SourceMap()
+        sm.add("ab", a)
+        sm.add("c\n", a)
+        sm.add("# wrapper\n")
+        sm.extend(inner)
+        assert sm.length == len("abc\n# wrapper\nx\nyz\n")
+        assert list(sm.offsets) == [0, 4, 14, 17]
+        assert list(sm.lines) == [0, 4, 14, 16, 19]
+        assert sm.lookup(0, 2) is a
+        assert sm.lookup(1, 3) is None
+        assert sm.lookup(2) is b
+        assert sm.lookup(3, 0) is b
+        assert sm.lookup(3, 1) is c
+        assert sm.lookup(4) is None
+        assert sm.position(17) == (3, 1)
+        assert sm.get_nodes(3) == [c]
+        assert sm.get_nodes(1) == []
+
+    def test_export_as_text(self):
+        tm = create_treemanager(python, connect4)
+        sm = SourceMap()
+        assert tm.export_as_text(sourcemap=sm) == connect4
+        lines = connect4.split("\n")
+        node = tm.get_bos().next_term
+        offset = 0
+        while node is not tm.get_eos():
+            if isinstance(node.symbol, IndentationTerminal):
+                text = ""
+            elif node.symbol.name == "\r":
+                text = "\n"
+            else:
+                text = node.symbol.name
+            if text:
+                line, col = sm.position(offset)
+                assert sm.lookup(line, col) is node
+                assert lines[line][col:col + len(text)] == text.split("\n")[0]
+            offset += len(text)
+            node = node.next_term
+        assert sm.find(3, "__init__").symbol.name == "__init__"
+        assert [n.symbol.name for n in sm.get_nodes(1)][:3] == ["    ", "UI_DEPTH", " "]
+
+    def test_languagebox(self):
+        tm = create_treemanager(calc)
+        tm.key_normal("1")
+        tm.key_normal("+")
+        tm.add_languagebox(lang_dict["Python 2.7.5"])
+        for c in "x = 1\ry":
+            tm.key_normal(c)
+        sm = SourceMap()
+        assert tm.export_as_text(sourcemap=sm) == "1+x = 1\ny"
+        assert sm.lookup(0, 1).symbol.name == "+"
+        assert sm.lookup(0, 2).symbol.name == "x"
+        assert sm.lookup(1, 0).symbol.name == "y"
+
+    def test_php_python(self):
+        tm = create_treemanager(lang_dict["PHP + Python"], "$x = 1;\n$y = 2;\n")
+        tm.key_end()
+        tm.add_languagebox(lang_dict["Python + PHP"])
+        for c in "def f():\r    return 1":
+            tm.key_normal(c)
+        sm = SourceMap()
+        text = PHPPython.export(tm.get_bos(), "a.php", sm)
+        assert text == PHPPython.export(tm.get_bos(), "a.php")
+        assert sm.length == len(text)
+        assert sm.lookup(0, 0) is None
+        assert sm.lookup(0, 7).symbol.name == "$x"
+        # the language box is compiled from a string and is mapped as a whole
+        lbox = sm.lookup(0, text.index("compile_py_func_global"))
+        assert lbox.symbol.name == "<Python + PHP>"
+        assert sm.find(2, "$y").symbol.name == "$y"
+
+    def test_html_python_sql(self):
+        tm = create_treemanager(lang_dict["HTML + Python + SQL"], "<html>\n<p>x</p>\n")
+        tm.key_end()
+        tm.add_languagebox(lang_dict["Python + HTML + SQL"])
+        for c in "x = 1":
+            tm.key_normal(c)
+        sm = SourceMap()
+        text = HTMLPythonSQL.export(tm.get_bos(), sm)
+        assert text == HTMLPythonSQL.export(tm.get_bos())
+        assert sm.length == len(text)
+        # consecutive HTML is printed at once and mapped to its first node
+        assert sm.lookup(0).symbol.name == "<html"
+        assert sm.lookup(1).symbol.name == "<Python + HTML + SQL>"
+        assert sm.lookup(3).symbol.name == "\r"
+
+class Test_CPythonProfile:
+
+    program = "def f(n):\n    return g(n) * 2\n\ndef g(n):\n    return n + 1\n\nfor i in range(100):\n    f(i)\n"
+
+    def test_load_stats(self):
+        from export.cpython import load_stats
+        # recursive calls are only counted by the first value of a caller
+        entries = [[["/tmp/x", 1, "f"], [3, 6, 0.5, 1.0], [[["/tmp/x", 0, "<module>"], [3, 3, 0.25, 1.0]],
+                                                          [["/tmp/x", 1, "f"], [3, 0, 0.25, 0.5]]]],
+                   [["/tmp/x", 4, "g"], [3, 3, 0.25, 0.25], [[["/tmp/x", 1, "f"], 3]]],
+                   [["/tmp/x", 0, "<module>"], [1, 1, 0.0, 1.0], []],
+                   [["/usr/lib/os.py", 10, "h"], [1, 1, 0.0, 0.0], [[["/tmp/x", 4, "g"], 1]]]]
+        functions = load_stats(entries, "/tmp/x")
+        assert sorted(functions) == [(1, "f"), (4, "g")]
+        f, g = functions[(1, "f")], functions[(4, "g")]
+        assert (f.ncalls, f.primcalls, f.tottime, f.cumtime) == (6, 3, 0.5, 1.0)
+        assert f.callers == {"<module>": 3, "f": 3}
+        assert f.callees == {"f": 3, "g": 3}
+        assert g.callees == {"os.py:10(h)": 1}
+        assert "f: called 6/3 times" in f.describe()
+
+    def test_rolling_profile(self):
+        from export.cpython import FunctionStats, Profile
+        from incparser.astree import TextNode
+        from grammar_parser.gparser import Terminal
+        a, b = TextNode(Terminal("a")), TextNode(Terminal("b"))
+        profile = Profile(maxruns=2)
+        profile.add_run({a: FunctionStats("a", 1, 1, 1, 1.0, 1.0)})
+        profile.add_run({a: FunctionStats("a", 1, 1, 1, 3.0, 3.0), b: FunctionStats("b", 2, 1, 1, 1.0, 1.0)})
+        total = profile.aggregate()
+        assert (total[a].runs, total[a].tottime) == (2, 4.0)
+        assert profile.heat(total) == {a: 1.0, b: 0.0}
+        # the first run is dropped
+        profile.add_run({b: FunctionStats("b", 2, 1, 1, 1.0, 1.0)})
+        total = profile.aggregate()
+        assert (total[a].runs, total[b].runs) == (1, 2)
+        b.deleted = True
+        assert list(profile.aggregate()) == [a]
+
+    def test_profile(self):
+        import sys
+        from export.cpython import CPythonExporter, CPythonFuncProfileMsg, CPythonFuncProfileVal
+        tm = create_treemanager(python, self.program)
+        exporter = CPythonExporter(tm)
+        exporter.python = sys.executable
+        exporter._profile()
+        exporter._profile()
+        names = dict((stats.name, node) for node, stats in tm.profile_map.items())
+        assert sorted(names) == ["f", "g"]
+        f, g = names["f"], names["g"]
+        assert f.symbol.name == "def" and f is tm.get_bos().next_term
+        assert tm.profile_map[f].runs == 2
+        assert tm.profile_map[f].ncalls == 200
+        assert tm.profile_map[f].callees == {"g": 200}
+        assert sorted(tm.profile_data.values()) == [0.0, 1.0]
+        for node in [f, g]:
+            [msg, heat] = node.annotations
+            assert isinstance(msg, CPythonFuncProfileMsg)
+            assert isinstance(heat, CPythonFuncProfileVal)
+            assert heat.annotation == tm.profile_data[node]
@@ -0,0 +1,67 @@
+import fuzzdriver
+from fuzzytester import FuzzyTester
+from minimiser import ddmin, split_steps, split_tokens
+from treemanager import TreeManager
+from test.programs import pythonsmall
+
+def test_ddmin():
+    calls = []
+    def fails(items):
+        calls.append(items)
+        return 3 in items and 17 in items
+    assert ddmin(range(40), fails) == [3, 17]
+    assert len(calls) < 40
+    assert ddmin(range(10), lambda items: True) == []
+    assert ddmin(range(10), lambda items: 5 in items) == [5]
+
+def test_split():
+    log = ["self.treemanager.cursor_reset()", "self.move(DOWN, 1)", "self.treemanager.key_delete()",
+           "self.treemanager.undo_snapshot()", "self.move(RIGHT, 2)"]
+    assert split_steps(log) == [log[:3], log[3:4], log[4:]]
+    assert split_tokens("x = foo(1)\n  y") == ["x", " ", "=", " ", "foo", "(", "1", ")", "\n", "  ", "y"]
+
+def test_signature():
+    def fail():
+        raise ValueError("node 1234")
+    try:
+        fail()
+    except ValueError as e:
+        sig = fuzzdriver.signature(e)
+    assert sig[0] == "ValueError"
+    assert sig[-1].startswith("test_fuzzdriver.py:fail:")
+
+class Test_FuzzDriver:
+
+    def test_seeded(self):
+        logs = []
+        for i in range(2):
+            ft = FuzzyTester("<test>", "Python 2.7.5", pythonsmall, seed=4)
+            ft.random_deletion()
+            logs.append(ft.log)
+        assert logs[0] == logs[1]
+        ft = FuzzyTester("<test>", "Python 2.7.5", pythonsmall, seed=5)
+        ft.random_deletion()
+        assert ft.log != logs[0]
+        # the log can be replayed
+        ft.replay(logs[0])
+
+    def test_fuzz(self):
+        assert fuzzdriver.parses(("Python 2.7.5", "pythonsmall"))
+        assert not fuzzdriver.parses(("Basic Calculator", "pythonsmall"))
+        assert fuzzdriver.fuzz(("Python 2.7.5", "pythonsmall", "random_deletion", 0)) is None
+
+    def test_crash(self, monkeypatch):
+        key_normal = TreeManager.key_normal
+        def broken(self, text):
+            if text == "q":
+                raise IndexError("broken")
+            return key_normal(self, text)
+        monkeypatch.setattr(TreeManager, "key_normal", broken)
+        crash = fuzzdriver.fuzz(("Python 2.7.5", "pythonsmall", "random_insertion", 3))
+        assert crash["signature"][0] == "IndexError"
+        assert crash["log"][-1] == "self.treemanager.key_normal('q')"
+
+        crash["program"] = "pythonsmall"
+        program, log, runs, _ = fuzzdriver.minimise(crash)
+        assert log == ["self.treemanager.key_normal('q')"]
+        assert len(program) < 5
@@ -35,3 +35,55 @@ class Test_Java:
 }"""
         self.treemanager.import_file(program)
         assert self.parser.last_status == True
+
+class Test_GrammarCache:
+
+    def setup_method(self, method):
+        from grammars import grammars
+        self.calc = lang_dict["Basic Calculator"]
+        self.saved = dict(grammars._cache)
+        grammars._cache.clear()
+
+    def teardown_method(self, method):
+        from grammars import grammars
+        grammars._cache.clear()
+        grammars._cache.update(self.saved)
+
+    def load_fresh(self):
+        from grammars import grammars
+        grammars._cache.clear()
+        return self.calc.load()
+
+    def test_roundtrip(self, tmp_path, monkeypatch):
+        from grammars import cache
+        monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path))
+        parser1, lexer1 = self.load_fresh()
+        assert len(list(tmp_path.iterdir())) == 1
+
+        parser2, lexer2 = self.load_fresh()
+        assert lexer2 is not lexer1
+        assert parser2.syntaxtable.value == parser1.syntaxtable.value
+        assert parser2.whitespaces == parser1.whitespaces
+        assert lexer2.lexer.dfa.transitions == lexer1.lexer.dfa.transitions
+
+        treemanager = TreeManager()
+        treemanager.add_parser(parser2, lexer2, self.calc.name)
+        treemanager.import_file("1 + 2 * 3")
+        assert parser2.last_status == True
+
+    def test_corrupt_entry(self, tmp_path, monkeypatch):
+        from grammars import cache
+        monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path))
+        self.load_fresh()
+        entry, = tmp_path.iterdir()
+        entry.write_bytes(b"garbage")
+        parser, lexer = self.load_fresh()
+        assert parser.syntaxtable is not None
+        assert cache.load(entry.stem) is not None
+
+    def test_key(self):
+        from grammars import cache
+        filename = self.calc.filename
+        assert cache.get_key(filename, {}, None) == cache.get_key(filename, {}, None)
+        assert cache.get_key(filename, {}, None) != cache.get_key(filename, {}, "expr")
+        assert cache.get_key(filename, {}, None) != cache.get_key(filename, {"a": ["<b>"]}, None)
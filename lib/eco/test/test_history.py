@@ -0,0 +1,109 @@
+import config
+from grammars.grammars import lang_dict
+from treemanager import TreeManager
+from incparser.astree import compact_versions, find_version, VersionLog
+
+python = lang_dict["Python 2.7.5"]
+
+def test_compact_versions():
+    items = [(1, "a"), (2, "b"), (4, "c"), (5, "d"), (7, "e"), (9, "f")]
+    assert compact_versions(items, [3, 5, 7], 7) == [(3, "b"), (5, "d"), (7, "e"), (9, "f")]
+    assert compact_versions(items, [5], 5) == [(5, "d"), (7, "e"), (9, "f")]
+
+def test_find_version():
+    log = VersionLog([(5, "a"), (2, "b")])
+    log[9] = "c"
+    log[5] = "d"
+    assert log.versions == [2, 5, 9]
+    assert [find_version(log, v) for v in [2, 4, 5, 8, 100]] == ["b", "b", "d", "d", "c"]
+    del log[5]
+    assert log.versions == [2, 9]
+    assert find_version(log, 8) == "b"
+    try:
+        find_version(log, 1)
+        assert False
+    except KeyError:
+        pass
+
+class Test_History:
+
+    def setup_method(self, method):
+        parser, lexer = python.load()
+        self.tm = TreeManager()
+        self.tm.add_parser(parser, lexer, python.name)
+        self.tm.import_file("x = 1\n")
+        self.texts = [self.tm.export_as_text()]
+
+    def edit(self, count):
+        for i in range(count):
+            self.tm.key_end()
+            self.tm.key_normal("\r")
+            for c in "y%s = %s" % (i, i):
+                self.tm.key_normal(c)
+            self.tm.undo_snapshot()
+            self.texts.append(self.tm.export_as_text())
+
+    def history_versions(self):
+        versions = set()
+        for node in self.tm.get_history_nodes():
+            versions.update(node.log.versions)
+        return versions
+
+    def check_undo_redo(self, count):
+        """Undoes and redoes the last `count` edits and checks the text."""
+        for text in reversed(self.texts[-count - 1:-1]):
+            self.tm.key_ctrl_z()
+            assert self.tm.export_as_text() == text
+        assert self.tm.version == self.tm.min_version
+        # can't undo any further
+        self.tm.key_ctrl_z()
+        assert self.tm.export_as_text() == self.texts[-count - 1]
+        for text in self.texts[-count:]:
+            self.tm.key_shift_ctrl_z()
+            assert self.tm.export_as_text() == text
+        assert self.tm.parsers[0][0].last_status
+
+    def test_merge_versions(self):
+        self.edit(5)
+        before = self.tm.measure_history()
+        self.tm.compact_history()
+        assert self.tm.measure_history() < before
+        versions = self.history_versions()
+        parser = self.tm.parsers[0][0]
+        # the versions the parser refers to are kept for the next parse
+        assert versions <= set(self.tm.undo_snapshots) | set([
+            self.tm.reference_version, self.tm.previous_version,
+            parser.reference_version, parser.prev_version])
+        self.check_undo_redo(5)
+
+    def test_drop_snapshots(self):
+        self.edit(6)
+        self.tm.compact_history(3)
+        assert len(self.tm.undo_snapshots) == 3
+        assert self.tm.min_version == self.tm.undo_snapshots[0]
+        assert min(self.history_versions()) == self.tm.min_version
+        assert min(self.tm.saved_parsers) == self.tm.min_version
+        assert min(self.tm.parsers[0][0].status_by_version) == self.tm.min_version
+        self.check_undo_redo(2)
+
+    def test_edit_after_undo(self):
+        self.edit(4)
+        self.tm.compact_history(3)
+        self.tm.key_ctrl_z()
+        self.texts.pop()
+        self.edit(2)
+        self.check_undo_redo(3)
+
+    def test_limits(self, monkeypatch):
+        monkeypatch.setattr(config, "UNDO_MAX_SNAPSHOTS", 4)
+        self.edit(12)
+        assert len(self.tm.undo_snapshots) <= 5
+        self.check_undo_redo(len(self.tm.undo_snapshots) - 1)
+
+    def test_byte_limit(self, monkeypatch):
+        self.edit(4)
+        size = self.tm.measure_history()
+        monkeypatch.setattr(config, "UNDO_MAX_BYTES", size)
+        self.edit(8)
+        assert self.tm.history_bytes < 2 * size
+        self.check_undo_redo(len(self.tm.undo_snapshots) - 1)
@@ -0,0 +1,78 @@
+from export.jruby import CallgraphLog, JRubyCallgraphProcessor, ANNOTATE, EVAL, LOCAL, MEGA
+from export.jruby import JRubyMorphismMsg, JRubyCallGraph, JRubyArgumentTypes, JRubyEvalStrings
+
+import os, tempfile
+
+SRC = "/tmp/prog.rb"
+
+LOG = """method 1 <main> %(src)s 1 9
+method 2 Object#add %(src)s 2 4
+method 3 Kernel#eval /jruby/core/kernel.rb 10 20
+method 4 Array#each /jruby/core/array.rb 1 5
+method-version 1 11
+method-version 2 12
+method-version 2 13
+method-version 3 14
+local 12 a Fixnum
+local 13 a String
+local 12 (self) Object
+eval 14 1 + 1
+callsite 1 21 6
+callsite 1 22 7
+callsite 2 23 3
+callsite-version 21 11 31
+callsite-version 22 11 32
+callsite-version 23 12 33
+calls 31 12
+calls 32 13
+calls 33 14
+calls 33 mega
+calls 31 foreign
+""" % {"src": SRC}
+
+def test_parse():
+    log = CallgraphLog(SRC)
+    assert log.parse(LOG.splitlines())
+    log.resolve()
+    main, add, ev = log.ids[1], log.ids[2], log.ids[3]
+    assert log.extras[main] & (LOCAL | ANNOTATE) == LOCAL
+    assert log.extras[add] & ANNOTATE
+    assert log.extras[ev] & EVAL
+    # the callsite calling eval is megamorphic, and marks its caller's method
+    assert log.extras[add] & MEGA
+    assert log.annotated_methods() == [add]
+    assert log.names[add] == "Object#add"
+    assert log.versions[add] == [log.ids[12], log.ids[13]]
+    assert log.called_from[log.ids[12]] == [log.ids[31]]
+    # eval strings are passed on to the callers of eval methods
+    assert log.eval_code[log.ids[12]] == ["1 + 1"]
+    assert log.arg_types[log.ids[12]] == {"a": ["Fixnum"], "(self)": ["Object"]}
+    # nothing is kept for methods that aren't annotated
+    assert log.ids[11] not in log.arg_types and main not in log.names
+
+def test_parse_error():
+    log = CallgraphLog(SRC)
+    assert not log.parse(["method 1 x %s 1 2" % SRC, "bogus 1 2"])
+
+def test_annotate_tree():
+    annotations = []
+    class Processor(JRubyCallgraphProcessor):
+        def remove_all_annotations(self):
+            pass
+        def _annotate_text(self, lineno, filename, text, annotation, klass):
+            annotations.append((lineno, text, klass, annotation))
+    fd, path = tempfile.mkstemp()
+    with os.fdopen(fd, "w") as f:
+        f.write(LOG)
+    try:
+        Processor(None).annotate_tree(SRC, path)
+    finally:
+        os.remove(path)
+    calls = [(l, k) for l, t, k, a in annotations if k is JRubyMorphismMsg and a.startswith("Call")]
+    assert calls == [(6, JRubyMorphismMsg), (7, JRubyMorphismMsg)]
+    defs = dict((k, a) for l, t, k, a in annotations if l == 2)
+    assert defs[JRubyMorphismMsg] == ("Object#add is megamorphic.\nObject#add has 2 versions"
+                                      " and is called 2 times.")
+    assert defs[JRubyCallGraph] == {"Object#add": True}
+    assert defs[JRubyEvalStrings] == "eval(1 + 1)"
+    assert defs[JRubyArgumentTypes] in ["a in {Fixnum, String}", "a in {String, Fixnum}"]
@@ -0,0 +1,71 @@
+import random
+
+from lineindex import LineIndex
+from treemanager import Line
+from grammars.grammars import lang_dict
+
+class Test_LineIndex:
+
+    def check(self, index, expected):
+        assert len(index) == len(expected)
+        assert list(index) == expected
+        for i, line in enumerate(expected):
+            assert index[i] is line
+            assert index.find(line.node) == i
+
+    def test_list_operations(self):
+        index = LineIndex()
+        expected = []
+        rand = random.Random(1)
+        for i in range(300):
+            line = Line(object())
+            pos = rand.randint(0, len(expected))
+            index.insert(pos, line)
+            expected.insert(pos, line)
+            if rand.random() < 0.3:
+                pos = rand.randrange(len(expected))
+                del index[pos]
+                del expected[pos]
+        self.check(index, expected)
+        assert index[-1] is expected[-1]
+        assert index[5:17] == expected[5:17]
+        assert index[len(expected) - 3:] == expected[-3:]
+        del index[10:40]
+        del expected[10:40]
+        self.check(index, expected)
+        assert index.find(object()) is None
+
+    def test_snapshots(self):
+        lines = [Line(object()) for i in range(50)]
+        index = LineIndex(lines)
+        snapshot = index.snapshot()
+        del index[3:20]
+        index.insert(0, Line(object()))
+        index.append(Line(object()))
+        changed = list(index)
+        self.check(index, changed)
+        index.load(snapshot)
+        self.check(index, lines)
+        index.insert(7, Line(object()))
+        assert len(index) == 51
+        index.load(snapshot)
+        self.check(index, lines)
+
+    def test_treemanager_undo(self):
+        from treemanager import TreeManager
+        python = lang_dict["Python 2.7.5"]
+        parser, lexer = python.load()
+        tm = TreeManager()
+        tm.add_parser(parser, lexer, python.name)
+        tm.import_file("x = 1\ny = 2\nz = 3")
+        tm.key_end()
+        tm.key_normal("\r")
+        tm.key_normal("a")
+        tm.undo_snapshot()
+        assert len(tm.lines) == 4
+        assert tm.lines.find(tm.lines[1].node) == 1
+        tm.key_ctrl_z()
+        assert tm.export_as_text() == "x = 1\ny = 2\nz = 3"
+        assert len(tm.lines) == 3
+        for i, line in enumerate(tm.lines):
+            assert tm.lines.find(line.node) == i
@@ -0,0 +1,9 @@
+import membench
+from test import programs
+
+def test_measure():
+    result = membench.bench("Python 2.7.5", programs.pythonsmall)
+    assert result["terminals"] > 0 and result["nonterminals"] > 0
+    assert 0 < result["terminal_bytes"] < result["allocated"]
+    assert membench.find_language("pythonsmall") == "Python 2.7.5"
+    assert "connect4" in membench.find_programs()
@@ -0,0 +1,81 @@
+import io, json, os, time
+
+import stats
+from grammars.grammars import lang_dict
+from treemanager import TreeManager
+
+calc = lang_dict["Basic Calculator"]
+python = lang_dict["Python 2.7.5"]
+
+def create_treemanager(lang):
+    parser, lexer = lang.load()
+    tm = TreeManager()
+    tm.add_parser(parser, lexer, lang.name)
+    return tm
+
+class Test_Stats:
+
+    def teardown_method(self, method):
+        stats.disable()
+
+    def test_disabled(self):
+        assert stats.current is None
+        tm = create_treemanager(calc)
+        tm.key_normal("1")
+        assert stats.disable() is None
+
+    def test_counters(self):
+        tm = create_treemanager(calc)
+        s = stats.enable()
+        for c in "1+2":
+            tm.key_normal(c)
+        assert s.edits == 3
+        assert s.totals["shifts"] > 0
+        assert s.totals["reductions"] == s.totals["reused_nodes"] + s.totals["new_nodes"]
+        assert s.totals["relexed_nodes"] >= 3
+        assert s.totals["saved_nodes"] > 0
+        assert s.totals["saved_bytes"] > 0
+        for phase in ["relex", "inc_parse", "top_down_reuse", "save"]:
+            assert s.totals[phase + "_time"] >= 0
+        assert s.last["relexed_nodes"] >= 1
+        assert stats.disable() is s
+
+    def test_reuse(self):
+        tm = create_treemanager(python)
+        tm.import_file("def f():\n    x = 1\n    return x\n")
+        s = stats.enable()
+        tm.key_end()
+        tm.key_normal("2")
+        assert s.last["reused_nodes"] > 0
+        assert s.last["optimistic_shifts"] > 0
+
+    def test_stream(self):
+        tm = create_treemanager(calc)
+        out = io.StringIO()
+        stats.enable(out)
+        tm.key_normal("1")
+        tm.key_normal("*")
+        lines = out.getvalue().splitlines()
+        assert len(lines) == 2
+        assert json.loads(lines[1]) == stats.current.last
+
+    def test_nested_timers(self):
+        s = stats.enable()
+        with stats.timer("inc_parse"):
+            with stats.timer("autolbox"):
+                time.sleep(0.02)
+        assert s.edit["autolbox_time"] >= 0.02
+        assert s.edit["inc_parse_time"] < 0.02
+        assert s.edit["inc_parse_calls"] == s.edit["autolbox_calls"] == 1
+
+    def test_filename(self, tmp_path):
+        filename = str(tmp_path / "stats.json")
+        tm = create_treemanager(calc)
+        s = stats.enable(filename=filename)
+        # the file isn't created before an edit is written
+        assert not os.path.exists(filename)
+        tm.key_normal("1")
+        s.stream.flush()
+        with open(filename) as f:
+            assert json.loads(f.read()) == s.last
+        s.stream.close()
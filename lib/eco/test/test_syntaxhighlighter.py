@@ -0,0 +1,102 @@
+from PyQt5.QtGui import QPalette
+
+from grammars.grammars import lang_dict
+from treemanager import TreeManager
+from incparser.astree import BOS, EOS
+from grammar_parser.gparser import Nonterminal
+from syntaxhighlighter import HighlightTable, LineStyles, PythonHighlighter, JavaHighlighter
+from test.programs import connect4
+
+def create_treemanager(lang, text):
+    parser, lexer = lang_dict[lang].load()
+    tm = TreeManager()
+    tm.add_parser(parser, lexer, lang)
+    tm.import_file(text)
+    return tm
+
+def terminals(tm):
+    node = tm.get_bos().next_term
+    while not isinstance(node, EOS):
+        yield node
+        node = node.next_term
+
+def uncompiled(highlighter, node):
+    # the rules as they were applied before being compiled
+    colors, styles = highlighter.keyword_colors, highlighter.keyword_style
+    if (node.lookup, node.parent.symbol.name) in colors:
+        color = colors[(node.lookup, node.parent.symbol.name)]
+    elif node.symbol.name in colors:
+        color = colors[node.symbol.name]
+    elif node.lookup in colors:
+        color = colors[node.lookup]
+    else:
+        color = "default"
+    if node.symbol.name in styles:
+        style = styles[node.symbol.name]
+    elif node.lookup in styles:
+        style = styles[node.lookup]
+    else:
+        style = "normal"
+    return color, style
+
+class Test_SyntaxHighlighter:
+
+    def test_table(self):
+        table = HighlightTable({("NAME", "funcdef"): "red", "def": "green", "NAME": "blue", "x": "cyan"},
+                               {"def": "bold"})
+        assert table.get("NAME", "funcdef", "f") == ("red", "normal")
+        assert table.get("NAME", "atom", "f") == ("blue", "normal")
+        assert table.get("NAME", "atom", "x") == ("cyan", "normal")
+        assert table.get("def", "funcdef", "def") == ("green", "bold")
+        assert table.get("<ws>", "WS", " ") == ("default", "normal")
+        # identifiers with the same parent share an entry
+        table.get("NAME", "atom", "g")
+        assert len([k for k in table.resolved if k[:2] == ("NAME", "atom")]) == 2
+        assert table.resolved[("NAME", "atom", None)] == ("blue", "normal")
+
+    def test_compiled(self):
+        for lang, text, highlighter in [("Python 2.7.5", connect4, PythonHighlighter),
+                                        ("Java", "class A { static int f() { return 1; } }", JavaHighlighter)]:
+            tm = create_treemanager(lang, text)
+            h = highlighter(QPalette())
+            for node in terminals(tm):
+                assert h.get_highlight(node) == uncompiled(h, node)
+            assert h.table is highlighter(QPalette()).table
+
+    def test_line_styles(self):
+        tm = create_treemanager("Python 2.7.5", connect4)
+        h = PythonHighlighter(QPalette())
+        calls = []
+        class Counting(object):
+            def get_highlight(self, node):
+                calls.append(node)
+                return h.get_highlight(node)
+            to_color = h.to_color
+        styles = LineStyles()
+        styles.highlighter = Counting()
+        node = tm.lines[0].node.next_term
+        assert styles.get_color(node) == h.get_color(node) == h.colors["green"]
+        assert styles.get_style(node) == "normal"
+        assert calls == [node]
+
+    def test_changed_lines(self):
+        tm = create_treemanager("Python 2.7.5", connect4)
+        assert tm.pop_changed_lines() is None
+        assert tm.pop_changed_lines() == []
+        tm.cursor.line = 10
+        tm.key_end()
+        tm.key_normal("x")
+        assert tm.pop_changed_lines() == [tm.lines[10]]
+        # commenting out a function definition
+        tm.cursor.line = 3
+        tm.key_home()
+        tm.key_normal("#")
+        lines = tm.pop_changed_lines()
+        assert tm.lines[3] in lines and tm.lines[10] not in lines
+        tm.key_ctrl_z()
+        assert tm.pop_changed_lines() is None
+
+    def test_find_line(self):
+        tm = create_treemanager("Python 2.7.5", "x = 1\ny = 2\n")
+        nodes = [n for n in terminals(tm) if n.symbol.name in ("x", "y", "2")]
+        assert [tm.find_line(n) for n in nodes] == [0, 1, 1]
@@ -0,0 +1,29 @@
+import pytest
+
+from grammars.grammars import lang_dict
+from treemanager import TreeManager
+
+pydot = pytest.importorskip("pydot")
+import viewer
+
+calc = lang_dict["Basic Calculator"]
+
+def test_tree_graph(tmp_path, monkeypatch):
+    parser, lexer = calc.load()
+    tm = TreeManager()
+    tm.add_parser(parser, lexer, calc.name)
+    tm.import_file("1+2")
+    version = tm.version
+    tm.key_end()
+    tm.key_normal("*")
+    tm.key_normal("3")
+    tm.undo_snapshot()
+    root = tm.get_bos().parent
+    graph = pydot.Dot(graph_type='graph')
+    # the viewer creates a temporary directory for its images
+    monkeypatch.chdir(tmp_path)
+    v = viewer.Viewer("pydot")
+    v.add_node_to_tree(root, graph, True, None, False, version)
+    for child in root.get_attr("children", version):
+        assert graph.get_node('"%s"' % id(child))
+    assert len(graph.get_nodes()) == v.countnodes
@@ -0,0 +1,242 @@
+from .lexer import RE_OR, RE_CHAR, RE_STAR, RE_PLUS, RE_QUESTION, RE_RANGE
+
+class CharSet(object):
+    """Set of characters matched by a single leaf of a regular expression.
+    Negated sets also match language boxes, mirroring the behaviour of the
+    `PatternMatcher`."""
+
+    def __init__(self, chars, neg=False):
+        self.chars = frozenset(chars)
+        self.neg = neg
+
+    def contains(self, c):
+        return (c in self.chars) != self.neg
+
+class RegexNode(object):
+    """Annotated regular expression node used to compute the position
+    automaton (nullable, firstpos, lastpos) of a pattern."""
+
+    def __init__(self, nullable, first, last):
+        self.nullable = nullable
+        self.first = first
+        self.last = last
+
+class DFA(object):
+    """A combined, minimised lexing automaton for all rules of a grammar.
+
+    Characters are mapped to equivalence classes via `classes` (characters
+    not contained in the map, as well as language boxes, belong to class 0).
+    `transitions[state][cls]` is the following state or -1 if the automaton
+    gets stuck. `accept[state]` is the index of the rule accepted in that
+    state (rules defined earlier have priority) or -1."""
+
+    VERSION = 1
+
+    def __init__(self, names, classes, transitions, accept, start):
+        self.names = names
+        self.classes = classes
+        self.transitions = transitions
+        self.accept = accept
+        self.start = start
+        # states without any outgoing transitions don't need to look at the
+        # next character to know that the token is finished
+        self.final = [max(row) < 0 for row in transitions]
+        self.version = DFA.VERSION
+
+class DFABuilder(object):
+    """Builds a `DFA` from the regex ASTs created by `RegexParser` using the
+    followpos construction, followed by partition refinement to minimise the
+    resulting automaton.
+
+    Non-greedy operators are supported on the level of whole rules: as soon as
+    a rule containing a non-greedy operator reaches an accepting state, all
+    other items of that rule are discarded, resulting in the shortest
+    possible match for that rule."""
+
+    def __init__(self, patterns):
+        self.patterns = patterns # list of (pattern, name)
+        self.leaves = []
+        self.followpos = []
+        self.lazy = False
+
+    def build(self):
+        rule_bits = []
+        end_bits = []
+        lazy_rules = []
+        start = 0
+        for pattern, _ in self.patterns:
+            self.lazy = False
+            startpos = len(self.leaves)
+            node = self.visit(pattern)
+            end = self.new_position(None)
+            for p in self.iter_bits(node.last):
+                self.followpos[p] |= 1 << end
+            start |= node.first
+            if node.nullable:
+                start |= 1 << end
+            rule_bits.append(((1 << (end + 1)) - 1) ^ ((1 << startpos) - 1))
+            end_bits.append(1 << end)
+            lazy_rules.append(self.lazy)
+        self.rule_bits = rule_bits
+        self.end_bits = end_bits
+        self.lazy_rules = lazy_rules
+
+        classes, class_masks = self.compute_classes()
+        states, transitions = self.subset_construction(start, class_masks)
+        accept = [self.get_accept(s) for s in states]
+        transitions, accept, start = self.minimise(transitions, accept, 0)
+        names = [name for _, name in self.patterns]
+        return DFA(names, classes, transitions, accept, start)
+
+    def new_position(self, charset):
+        self.leaves.append(charset)
+        self.followpos.append(0)
+        return len(self.leaves) - 1
+
+    def iter_bits(self, bits):
+        while bits:
+            lowest = bits & -bits
+            yield lowest.bit_length() - 1
+            bits ^= lowest
+
+    def visit(self, pattern):
+        if type(pattern) is list:
+            return self.visit_list(pattern)
+        if type(pattern) is RE_OR:
+            lhs = self.visit(pattern.lhs)
+            rhs = self.visit(pattern.rhs)
+            return RegexNode(lhs.nullable or rhs.nullable,
+                             lhs.first | rhs.first, lhs.last | rhs.last)
+        if type(pattern) is RE_STAR:
+            if pattern.ng:
+                self.lazy = True
+            node = self.visit(pattern.c)
+            self.add_follow(node.last, node.first)
+            return RegexNode(True, node.first, node.last)
+        if type(pattern) is RE_PLUS:
+            if pattern.ng:
+                self.lazy = True
+            node = self.visit(pattern.c)
+            self.add_follow(node.last, node.first)
+            return RegexNode(node.nullable, node.first, node.last)
+        if type(pattern) is RE_QUESTION:
+            node = self.visit(pattern.c)
+            return RegexNode(True, node.first, node.last)
+        if type(pattern) is RE_CHAR:
+            if pattern.c == ".":
+                charset = CharSet([], True)
+            elif len(pattern.c) == 2 and pattern.c[0] == "\\":
+                charset = CharSet([pattern.c[1]])
+            else:
+                charset = CharSet([pattern.c])
+            bit = 1 << self.new_position(charset)
+            return RegexNode(False, bit, bit)
+        if type(pattern) is RE_RANGE:
+            charset = CharSet([chr(c) for c in pattern.c], pattern.neg)
+            bit = 1 << self.new_position(charset)
+            return RegexNode(False, bit, bit)
+        raise NotImplementedError(pattern)
+
+    def visit_list(self, patterns):
+        result = RegexNode(True, 0, 0)
+        for p in patterns:
+            node = self.visit(p)
+            self.add_follow(result.last, node.first)
+            first = result.first | node.first if result.nullable else result.first
+            last = result.last | node.last if node.nullable else node.last
+            result = RegexNode(result.nullable and node.nullable, first, last)
+        return result
+
+    def add_follow(self, positions, follow):
+        for p in self.iter_bits(positions):
+            self.followpos[p] |= follow
+
+    def compute_classes(self):
+        """Partitions all characters mentioned in the rules into equivalence
+        classes, i.e. characters that are matched by exactly the same leaves.
+        Class 0 contains all characters not mentioned by any rule, as well as
+        language boxes."""
+        leaves = [(i, l) for i, l in enumerate(self.leaves) if l is not None]
+        chars = set()
+        for _, l in leaves:
+            chars.update(l.chars)
+        default = 0
+        for i, l in leaves:
+            if l.neg:
+                default |= 1 << i
+        signatures = {default: 0}
+        class_masks = [default]
+        classes = {}
+        for c in sorted(chars):
+            sig = 0
+            for i, l in leaves:
+                if l.contains(c):
+                    sig |= 1 << i
+            if sig not in signatures:
+                signatures[sig] = len(class_masks)
+                class_masks.append(sig)
+            if signatures[sig] != 0:
+                classes[c] = signatures[sig]
+        return classes, class_masks
+
+    def prune_lazy(self, state):
+        for i in range(len(self.lazy_rules)):
+            if self.lazy_rules[i] and state & self.end_bits[i]:
+                state &= ~self.rule_bits[i] | self.end_bits[i]
+        return state
+
+    def get_accept(self, state):
+        for i in range(len(self.end_bits)):
+            if state & self.end_bits[i]:
+                return i
+        return -1
+
+    def subset_construction(self, start, class_masks):
+        start = self.prune_lazy(start)
+        states = [start]
+        ids = {start: 0}
+        transitions = []
+        todo = 0
+        while todo < len(states):
+            state = states[todo]
+            row = []
+            for mask in class_masks:
+                target = 0
+                for p in self.iter_bits(state & mask):
+                    target |= self.followpos[p]
+                target = self.prune_lazy(target)
+                if target == 0:
+                    row.append(-1)
+                    continue
+                if target not in ids:
+                    ids[target] = len(states)
+                    states.append(target)
+                row.append(ids[target])
+            transitions.append(row)
+            todo += 1
+        return states, transitions
+
+    def minimise(self, transitions, accept, start):
+        """Moore-style partition refinement. States are initially grouped by
+        the rule they accept and then split until all states within a group
+        have transitions into the same groups."""
+        blocks = {}
+        partition = [blocks.setdefault(a, len(blocks)) for a in accept]
+        while True:
+            blocks = {}
+            new = []
+            for s, row in enumerate(transitions):
+                sig = (partition[s], tuple([partition[t] if t >= 0 else -1 for t in row]))
+                new.append(blocks.setdefault(sig, len(blocks)))
+            if len(blocks) == len(set(partition)):
+                break
+            partition = new
+        size = len(set(partition))
+        new_transitions = [None] * size
+        new_accept = [-1] * size
+        for s, row in enumerate(transitions):
+            b = partition[s]
+            if new_transitions[b] is None:
+                new_transitions[b] = [partition[t] if t >= 0 else -1 for t in row]
+                new_accept[b] = accept[s]
+        return new_transitions, new_accept, partition[start]
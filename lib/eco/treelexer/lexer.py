@@ -204,6 +204,7 @@ class PatternMatcher(object):
 from incparser.astree import TextNode, BOS, EOS, MultiTextNode
 from grammar_parser.gparser import MagicTerminal, Terminal, IndentationTerminal
 from grammars.grammars import regex
+import os, pickle
 
 class LBPH(object):
     # Placeholder for language boxes to be used within the generated tokens.
@@ -463,50 +464,112 @@ class LexingError(Exception):
     pass
 
 class Lexer(object):
-
-    def __init__(self, rules):
-        rp = RegexParser()
-        self.patterns = []
-        for name, rule in rules:
-            pattern = rp.compile(rule)
-            self.patterns.append((pattern, name))
+    """Lexes strings or chains of nodes using a single DFA that combines all
+    lexing rules of a grammar. Rules that are defined earlier have a higher
+    priority if two rules match a token of the same length.
+
+    Building the DFA requires parsing every rule with the `RegexParser`, so if
+    a `pickle_id` is given the automaton is cached in the pickle directory
+    next to the grammar's syntax table."""
+
+    def __init__(self, rules, pickle_id=None):
+        self.rules = list(rules)
+        self.patterns = None
+        self.dfa = None
+        self.examined = None    # last node examined by `match_tree`
+        if pickle_id:
+            self.dfa = self.load_dfa(pickle_id)
+        if self.dfa is None:
+            self.dfa = self.build_dfa()
+            if pickle_id:
+                self.save_dfa(pickle_id)
+
+    def get_patterns(self):
+        if self.patterns is None:
+            rp = RegexParser()
+            self.patterns = []
+            for name, rule in self.rules:
+                pattern = rp.compile(rule)
+                self.patterns.append((pattern, name))
+        return self.patterns
+
+    def __getstate__(self):
+        # the parsed patterns are only needed to build the automaton
+        state = self.__dict__.copy()
+        state["patterns"] = None
+        return state
+
+    def build_dfa(self):
+        from .dfa import DFABuilder
+        return DFABuilder(self.get_patterns()).build()
+
+    def pickle_filename(self, pickle_id):
+        return "".join([os.path.dirname(__file__), "/../pickle/", str(pickle_id), ".lexer.pcl"])
+
+    def load_dfa(self, pickle_id):
+        from .dfa import DFA
+        try:
+            with open(self.pickle_filename(pickle_id), "rb") as f:
+                version, rules, dfa = pickle.load(f)
+        except (IOError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+        if version != DFA.VERSION or rules != self.rules:
+            return None
+        return dfa
+
+    def save_dfa(self, pickle_id):
+        from .dfa import DFA
+        filename = self.pickle_filename(pickle_id)
+        # write to a temporary file first so concurrently running instances
+        # never read a partially written automaton
+        tmpname = "{}.{}.tmp".format(filename, os.getpid())
+        try:
+            with open(tmpname, "wb") as f:
+                pickle.dump((DFA.VERSION, self.rules, self.dfa), f)
+            os.replace(tmpname, filename)
+        except IOError:
+            try:
+                os.remove(tmpname)
+            except OSError:
+                pass
 
     def lex(self, text):
-        """Lexes a given string by trying all patterns. When a match is found a
-        token is created, and the lexing continues with the remainder of the
-        string. Lookahead is calculated by observing how far the patternmatcher
-        got before returning 'no match'. If a token was matched by a plus or
-        star rule (e.g. [a-z]+), then the generated token is not an exact match,
-        as it could potentially be longer. This means its lookahead is one
-        character longer (and at least 1), since the pattern matcher had to look
-        ahead one character to decide that the token is complete."""
-        pm = PatternMatcher()
-        self.pos = 0
+        """Lexes a given string by running the DFA from the current position
+        until it gets stuck, remembering the last accepting state (longest
+        match). When a match is found a token is created, and the lexing
+        continues with the remainder of the string. The lookahead of a token is
+        the number of characters the DFA had to look at beyond the end of the
+        token (including the end of the input) to decide that the token is
+        complete."""
+        dfa = self.dfa
+        transitions = dfa.transitions
+        accept = dfa.accept
+        final = dfa.final
+        classes = dfa.classes
         result = []
-        progress = 0
-        while True:
-            lookahead = 0
-            oldpos = self.pos
-            tmpresult = ("", None, None)
-            for p, n in self.patterns:
-                if pm.match(p, text[self.pos:]):
-                    lookahead = max(pm.la, lookahead)
-                    value = text[self.pos:self.pos + pm.pos]
-                    lookahead = lookahead - len(value)
-                    if len(value) > len(tmpresult[0]):
-                        tmpresult = (value, n, lookahead)
-                        progress = pm.pos
-                    lookahead = 0
-                else:
-                    lookahead = max(pm.la, lookahead)
-            if tmpresult[0]:
-                result.append(tmpresult)
-                self.pos += progress
-            if self.pos == oldpos:
+        pos = 0
+        length = len(text)
+        while pos < length:
+            state = dfa.start
+            i = pos
+            end = -1
+            rule = -1
+            while not final[state]:
+                i += 1
+                if i > length:
+                    break
+                state = transitions[state][classes.get(text[i-1], 0)]
+                if state < 0:
+                    break
+                if accept[state] >= 0:
+                    end = i
+                    rule = accept[state]
+            if end < 0:
                 # no more matches
-                if self.pos < len(text):
-                    result.append((text[self.pos:], None, 0))
+                result.append((text[pos:], None, 0))
                 break
+            result.append((text[pos:end], dfa.names[rule], i - end))
+            pos = end
         return result
 
     def treelex(self, node):
@@ -517,7 +580,7 @@ class Lexer(object):
             lookahead = 0
             oldpos = pos
             oldnode = node
-            for p, n in self.patterns:
+            for p, n in self.get_patterns():
                 token = pm.match(p, node)
                 if token:
                     lookahead = lookahead + (1 if not pm.exactmatch else 0)
@@ -533,14 +596,8 @@ class Lexer(object):
         return result
 
     def get_token_iter(self, node):
-        pm = TreePatternMatcher()
         pos = 0
-        progress = pos, node
         while True:
-            lookahead = 0
-            oldpos = pos
-            oldnode = node
-            result = ("", None, -1, None, 0)
             while type(node.symbol) is IndentationTerminal:
                 node = node.next_term
             if type(node) is MultiTextNode:
@@ -559,27 +616,110 @@ class Lexer(object):
                 else:
                     node = node.next_term
                 continue
-            for p, n in self.patterns:
-                token = pm.match(p, node, pos)
-                lookahead = max(pm.la, lookahead)
-                if token and self.tlen(token) > self.tlen(result[0]): # find longest match
-                    if pm.pos > 0 and pm.pos != len(pm.text.symbol.name):
-                        # Record when a node only produced a partial match
-                        split = pm.pos - len(pm.text.symbol.name)
-                    else:
-                        split = 0
-                    result = (token, n, lookahead - pm.scanned_chars, pm.read_nodes, split)
-                    progress = pm.pos, pm.text
-                    continue
-                else:
-                    pass
-            pos, node = progress
-            if oldnode is node and oldpos == pos:
-                # no progress means we failed to lex something
-                raise LexingError("Failed to lex node '{}' at position {})".format(node, pos))
+            result, pos, node = self.match_tree(node, pos)
             yield result
 
-    def tlen(self, token):
-        if type(token) is list:
-            return sum([len(t) for t in token])
-        return len(token)
+    def match_tree(self, node, pos):
+        """Runs the DFA over the characters of a node chain, starting at
+        position `pos` within `node`. Language boxes and indentation terminals
+        count as a single character that can only be matched by wildcards and
+        negated character ranges. Returns the longest matched token in the
+        format expected by the incremental lexer, i.e. (token, name, lookahead,
+        read_nodes, split), together with the node and position at which
+        lexing needs to continue."""
+        dfa = self.dfa
+        transitions = dfa.transitions
+        accept = dfa.accept
+        final = dfa.final
+        classes = dfa.classes
+
+        startpos = pos
+        if node.ismultichild():
+            read_nodes = [node.parent]
+        else:
+            read_nodes = [node]
+        chars = []
+        examined = 0
+        best = None
+        state = dfa.start
+        text = node
+        while not final[state]:
+            examined += 1
+            if type(text) is EOS:
+                break
+            symbol = text.symbol
+            if type(symbol) is MagicTerminal or type(symbol) is IndentationTerminal:
+                char = None
+                state = transitions[state][0]
+            else:
+                char = symbol.name[pos]
+                state = transitions[state][classes.get(char, 0)]
+            if state < 0:
+                break
+            if char is not None:
+                chars.append(char)
+            elif type(symbol) is MagicTerminal:
+                chars.append(None)
+            if text.ismultichild():
+                if read_nodes[-1] is not text.parent:
+                    read_nodes.append(text.parent)
+            elif read_nodes[-1] is not text:
+                read_nodes.append(text)
+            pos += 1
+            if char is None or pos >= len(symbol.name):
+                text = self.next_node(text)
+                pos = 0
+            if accept[state] >= 0:
+                best = (len(chars), accept[state], pos, text, len(read_nodes))
+        self.examined = text
+
+        if best is None:
+            # no progress means we failed to lex something
+            raise LexingError("Failed to lex node '{}' at position {})".format(node, startpos))
+
+        length, rule, pos, text, readlength = best
+        token, scanned = self.get_token(chars[:length])
+        if pos > 0:
+            # Record when a node only produced a partial match
+            split = pos - len(text.symbol.name)
+        else:
+            split = 0
+        result = (token, dfa.names[rule], examined - scanned, read_nodes[:readlength], split)
+        return result, pos, text
+
+    def next_node(self, node):
+        while True:
+            if node.next_term is None and node.ismultichild():
+                node = node.parent.next_term
+            else:
+                assert node.next_term is not None
+                node = node.next_term
+            if type(node) is MultiTextNode:
+                node = node.children[0]
+            if node.symbol.name != "":
+                return node
+
+    def get_token(self, chars):
+        """Rejoins all matched characters back to a single token string. If the
+        matched token contains newlines or language boxes, the token is split
+        into a list of subtokens. Also returns the number of scanned
+        characters."""
+        l = []
+        j = 0
+        for i in range(len(chars)):
+            if chars[i] is None:
+                if j < i:
+                    l.append("".join(chars[j:i]))
+                l.append(lbph)
+                j = i+1
+            elif chars[i] == "\r":
+                if j < i:
+                    l.append("".join(chars[j:i]))
+                l.append(chars[i])
+                j = i+1
+        if j < len(chars):
+            l.append("".join(chars[j:]))
+
+        if len(l) == 1:
+            return l[0], len(l[0])
+        return l, len(chars)
@@ -300,10 +300,11 @@ class Test_Lexer(object):
         assert l.lex("abcx") == [("abcx", "test", 0)]
 
         l = Lexer([("test", "abcde|abc")])
-        assert l.lex("abcx") == [("abc", "test", 0), ("x", None, 0)]
+        assert l.lex("abcx") == [("abc", "test", 1), ("x", None, 0)]
 
         l = Lexer([("test", "abc|abcde")])
-        assert l.lex("abcx") == [("abc", "test", 0), ("x", None, 0)]
+        assert l.lex("abcx") == [("abc", "test", 1), ("x", None, 0)]
+        assert l.lex("abcde") == [("abcde", "test", 0)]
 
     def test_nodes(self):
         root = TextNode(Nonterminal("Root"))
@@ -525,7 +526,8 @@ class Test_LuaComments(object):
         new = TextNode(Terminal('--[[testtest]]'))
         ast.parent.children[0].insert_after(new)
         it = self.lexer.get_token_iter(new)
-        assert next(it) == ('--[[testtest]]', "mcomment", 0, [TextNode(Terminal('--[[testtest]]'))], 0)
+        # scomment could still match a longer token
+        assert next(it) == ('--[[testtest]]', "mcomment", 1, [TextNode(Terminal('--[[testtest]]'))], 0)
 
     def test_lookahead(self):
         ast = AST()
@@ -542,3 +544,67 @@ class Test_LuaComments(object):
         ast.parent.children[0].insert_after(new)
         it = self.lexer.get_token_iter(new)
         assert next(it) == (['--[[test', '\r', 'test]]'], "mcomment", 0, [TextNode(Terminal('--[[test\rtest]]'))], 0)
+
+class Test_DFA(object):
+
+    def test_priority(self):
+        l = Lexer([("kw", "class"), ("name", "[a-z]+")])
+        assert l.lex("class") == [("class", "kw", 1)]
+        assert l.lex("classes") == [("classes", "name", 1)]
+
+    def test_nongreedy(self):
+        l = Lexer([("cmt", r"/\*.*?\*/"), ("mul", r"\*"), ("ws", " ")])
+        assert l.lex("/* a */ */") == [("/* a */", "cmt", 0), (" ", "ws", 0),
+                                       ("*", "mul", 0), ("/", None, 0)]
+
+    def test_minimised(self):
+        l = Lexer([("a", "(a|b)*c"), ("b", "[ab]*c")])
+        # both rules describe the same language, so the rule with the lower
+        # priority disappears completely
+        assert len(l.dfa.transitions) == 2
+        assert l.lex("abbac") == [("abbac", "a", 0)]
+
+    def test_lbox_wildcard(self):
+        l = Lexer([("any", "'.'"), ("string", "'[^']*'")])
+        ast = AST()
+        ast.init()
+        bos = ast.parent.children[0]
+        new1 = TextNode(Terminal("'"))
+        new2 = TextNode(MagicTerminal("<SQL>"))
+        new3 = TextNode(Terminal("'"))
+        bos.insert_after(new1)
+        new1.insert_after(new2)
+        new2.insert_after(new3)
+
+        it = l.get_token_iter(new1)
+        assert next(it) == (["'", lbph, "'"], "any", 0, [new1, new2, new3], 0)
+
+    def test_cache(self):
+        import os
+        rules = [("INT", "[0-9]+"), ("plus", "\\+")]
+        l = Lexer(rules, "test_dfa_cache")
+        filename = l.pickle_filename("test_dfa_cache")
+        try:
+            assert os.path.exists(filename)
+            l2 = Lexer(rules, "test_dfa_cache")
+            assert l2.patterns is None # loaded from cache
+            assert l2.lex("1+2") == l.lex("1+2")
+            # changed rules invalidate the cache
+            l3 = Lexer([("INT", "[0-9]")], "test_dfa_cache")
+            assert l3.patterns is not None
+            assert l3.lex("12") == [("1", "INT", 0), ("2", "INT", 0)]
+        finally:
+            os.remove(filename)
+
+    def test_cache_failure(self):
+        import os
+        rules = [("INT", "[0-9]+")]
+        l = Lexer(rules)
+        filename = l.pickle_filename("test_dfa_cache_failure")
+        # a directory in place of the cache can't be replaced
+        os.mkdir(filename)
+        try:
+            l.save_dfa("test_dfa_cache_failure")
+            assert not os.path.exists("{}.{}.tmp".format(filename, os.getpid()))
+        finally:
+            os.rmdir(filename)
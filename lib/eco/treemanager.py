@@ -22,24 +22,18 @@
 from incparser.incparser import IncParser
 from inclexer.inclexer import IncrementalLexer
 from treelexer.lexer import LexingError
-from incparser.astree import TextNode, BOS, EOS, MultiTextNode
+from incparser.astree import TextNode, BOS, EOS, MultiTextNode, FIELD_INDEX, compact_versions, find_version, VersionLog
 from grammar_parser.gparser import Terminal, MagicTerminal, IndentationTerminal, Nonterminal
-try:
-    import __pypy__
-except ImportError:
-    from PyQt5.QtWidgets import QApplication
-    from PyQt5.QtCore import QSettings
-    from export.jruby import JRubyExporter
-    from export.jruby_simple_language import JRubySimpleLanguageExporter
-    from export.jruby_javascript import JRubyJavaScriptExporter
-    from export.simple_language import SimpleLanguageExporter
-    from utils import arrow_keys, KEY_UP, KEY_DOWN, KEY_LEFT, KEY_RIGHT
 from grammars.grammars import lang_dict, Language, EcoFile
 from indentmanager import IndentationManager
+from lineindex import LineIndex, snapshot_size
+import config, stats
 from export import HTMLPythonSQL, PHPPython, ATerms
+from export.helper import export_text
 from export.cpython import CPythonExporter
 
-import math, os
+from bisect import bisect_left
+import math, os, sys
 
 def debug_trace():
   '''Set a tracepoint in the Python debugger that works with Qt'''
@@ -64,6 +58,10 @@ class NodeSize(object):
         self.w = w
         self.h = h
 
+PARENT = FIELD_INDEX["parent"]
+SYMBOL_NAME = FIELD_INDEX["symbol.name"]
+LOOKUP = FIELD_INDEX["lookup"]
+
 class Line(object):
     """Representation of a source code line.
 
@@ -76,6 +74,7 @@ class Line(object):
         self.width = 0          # line width
         self.indent = 0         # line indentation
         self.ws = 0
+        self.styles = None      # cached highlighting (see NodeEditor.paint_nodes)
 
     def __repr__(self):
         return "Line(%s, width=%s, height=%s)" % (self.node, self.width, self.height)
@@ -93,13 +92,13 @@ class Cursor(object):
         self.line = line
         self.lines = lines
         self.last_x = 0
-        self.log = {}
+        self.log = VersionLog()
 
     def save(self, version):
         self.log[version] = (self.node, self.pos, self.line)
 
     def load(self, version, lines):
-        (self.node, self.pos, self.line) = self.log[version]
+        (self.node, self.pos, self.line) = find_version(self.log, version)
         self.lines = lines
 
     def clean_versions(self, version):
@@ -381,14 +380,11 @@ class Cursor(object):
             self.pos = len(self.node.symbol.name)
 
     def get_line_from_node(self, node):
-        i = 0
-        for l in self.lines:
-            if l.node is node:
-                return i
-            i += 1
+        return self.lines.find(node)
 
     def get_nodesize_in_chars(self, node):
         """Calculate the size in characters of a non-textual node."""
+        from PyQt5.QtWidgets import QApplication
         gfont = QApplication.instance().gfont
         if node.image:
             w = math.ceil(node.image.width() * 1.0 / gfont.fontwt)
@@ -433,8 +429,16 @@ class Cursor(object):
 class TreeManager(object):
     version = 1
 
+    # maximum number of changed nodes remembered for the next analysis,
+    # before falling back to analysing everything
+    MAX_CHANGED_NODES = 10000
+
+    # maximum number of changed terminals remembered for `pop_changed_lines`,
+    # before falling back to treating all lines as changed
+    MAX_CHANGED_TERMINALS = 1000
+
     def __init__(self):
-        self.lines = []             # storage for line objects
+        self.lines = LineIndex()    # storage for line objects
         self.mainroot = None        # root node (main language)
         self.parsers = []           # stores all currently used parsers
         self.edit_rightnode = False # changes which node to select when inbetween two nodes
@@ -446,9 +450,20 @@ class TreeManager(object):
         self.last_saved_version = 1
         self.savenextparse = False
         self.saved_lines = {}
-        self.saved_parsers = {}
+        self.saved_parsers = VersionLog()
         self.undo_snapshots = []
         self.min_version = 1
+        # approximate size of the undo history in bytes, and its size after
+        # it was last compacted
+        self.history_bytes = 0
+        self.history_base = 0
+        # nodes with AST nodes that changed since the last analysis, or None
+        # if everything needs to be analysed again
+        self.changed_nodes = None
+        # nodes whose text, lookup or parent changed since the last call of
+        # `pop_changed_lines`, or None if all lines need to be treated as
+        # changed
+        self.changed_terminals = None
 
         self.tool_data_is_dirty = False
         self.autolboxdetector = None
@@ -472,6 +487,11 @@ class TreeManager(object):
         self.langs_with_debugger = {
             "Python 2.7.5"
         }
+        # the rolling profile of the program (see export.cpython.Profile) and
+        # the heat of its profiled nodes
+        self.profile = None
+        self.profile_map = {}
+        self.profile_data = {}
         self.input_log = []
 
     def can_profile(self):
@@ -578,6 +598,35 @@ class TreeManager(object):
         lbox = root.get_magicterminal()
         return lbox
 
+    def find_line(self, node):
+        """Returns the number of the line on which the terminal `node` is
+        displayed, or None if it isn't part of a line."""
+        prev = self.cursor.find_previous_visible(node)
+        while prev.symbol.name != "\r" and not isinstance(prev, BOS):
+            prev = self.cursor.find_previous_visible(prev)
+        if isinstance(prev, BOS):
+            return 0
+        return self.lines.find(prev)
+
+    def pop_changed_lines(self):
+        """Returns the lines that display terminals whose text, lookup or
+        parent changed since the last call, or None if that's unknown and all
+        lines need to be treated as changed."""
+        changed = self.changed_terminals
+        self.changed_terminals = set()
+        if changed is None:
+            return None
+        numbers = set()
+        for node in changed:
+            if node.deleted or isinstance(node, (BOS, EOS)) or \
+                    type(node.symbol) in (Nonterminal, MagicTerminal):
+                continue
+            i = self.find_line(node)
+            if i is None:
+                return None
+            numbers.add(i)
+        return [self.lines[i] for i in sorted(numbers)]
+
     def is_typeerror(self, node):
         for p in self.parsers:
             if p[3] and p[3].has_error(node):
@@ -639,13 +688,21 @@ class TreeManager(object):
 
         if lang in crossscope:
             analyser.analyse(parser.previous_version.parent, self.parsers)
+            self.changed_nodes = set()
             return
 
         # analyse all parsers individually
+        changed = self.changed_nodes
+        skipped = False
         for p in self.parsers:
             if p[0].last_status:
                 if p[3]:
-                    p[3].analyse(p[0].previous_version.parent)
+                    p[3].analyse(p[0].previous_version.parent, changed=changed)
+            else:
+                skipped = True
+        if not skipped:
+            # otherwise keep the changes for the skipped parsers' analysers
+            self.changed_nodes = set()
 
     def getCompletion(self):
         for p in self.parsers:
@@ -822,13 +879,12 @@ class TreeManager(object):
         self.last_search = text
 
     def jump_to_error(self, parser):
-        bos = parser.previous_version.parent.children[0]
-        eos = parser.previous_version.parent.children[-1]
-        node = bos
-        while node is not eos:
-            if node is parser.error_nodes[0]:
-                break
-            node = node.next_term
+        root = parser.previous_version.parent
+        eos = root.children[-1]
+        node = parser.error_nodes[0]
+        if node.get_root() is not root:
+            # error node is not part of the current tree anymore
+            node = eos
 
         # get linenode
         linenode = node
@@ -843,12 +899,10 @@ class TreeManager(object):
 
         # get line number
         linenr = 0
-        for line in self.lines:
-            if linenode is None:
-                break
-            if line.node is linenode:
-                break
-            linenr += 1
+        if linenode is not None:
+            linenr = self.lines.find(linenode)
+            if linenr is None:
+                linenr = len(self.lines)
 
         self.cursor.line = linenr
         self.cursor.node = node
@@ -884,10 +938,7 @@ class TreeManager(object):
 
     def get_max_version(self):
         root = self.get_bos().parent
-        maxversion = 0
-        for (key, version) in list(root.log.keys()):
-            maxversion = max(maxversion, version)
-        return maxversion
+        return root.log.max_version() or 0
 
     def key_ctrl_z(self):
         self.log_input("key_ctrl_z")
@@ -913,16 +964,39 @@ class TreeManager(object):
             self.cursor.load(self.version, self.lines)
 
     def recover_version(self, direction, _from):
+        self.changed_nodes = None
+        self.changed_terminals = None
         self.load_lines()
         self.load_parsers()
         for l in self.parsers:
             parser = l[0]
             parser.load_status(self.version)
+            if l[4]:
+                l[4].invalidate()
             root = parser.previous_version.parent
             if direction == "undo":
                 self.undo(root)
             elif direction == "redo":
                 self.redo(root, _from)
+        self.update_lbox_lengths()
+
+    def update_lbox_lengths(self):
+        """Adds changes to the length of the content of language boxes to the
+        `exportlen` of the boxes and their ancestors, which aren't saved again
+        if only the content of a box changed."""
+        for l in self.parsers:
+            root = l[0].previous_version.parent
+            lbox = root.get_magicterminal()
+            if lbox is None or lbox.deleted:
+                continue
+            delta = root.exportlen - lbox.exportlen
+            node = lbox
+            while delta and node is not None:
+                node.exportlen += delta
+                if node.parent is None:
+                    node = node.get_magicterminal()
+                else:
+                    node = node.parent
 
     def undo(self, node):
         if not node.log:
@@ -932,6 +1006,7 @@ class TreeManager(object):
             # changes. Requires rethinking the versioning system.
             for c in node.children:
                 self.undo(c)
+            node.calc_exportlen()
             return
         if node.version <= self.version and not node.has_unsaved_changes():
             # node is already at this or an even earlier version and has no
@@ -946,12 +1021,14 @@ class TreeManager(object):
             node.load(self.version)
             for c in node.children:
                 self.undo(c)
+        node.calc_exportlen()
 
     def redo(self, node, _from):
         node.load(self.version)
         if node.version > _from:
             for c in node.children:
                 self.redo(c, _from)
+        node.calc_exportlen()
 
     def pop_lookahead(self, la):
         while(la.right_sibling() is None):
@@ -990,28 +1067,20 @@ class TreeManager(object):
                     node = self.pop_lookahead(node)
 
     def delete_versions_from(self, node, version):
-        for (key, v) in list(node.log.keys()):
-            if v > version:
-                del node.log[(key, v)]
+        node.log.truncate(version)
 
     def save_lines(self):
-        # check if lines have changed
-        lines = self.get_lines_from_version(self.version)
-        if len(lines) != len(self.lines):
-            self.saved_lines[self.version] = list(self.lines)
-            return
-
-        # check if nodes are different (e.g. we could delete and reinsert a line between saves)
-        for i in range(len(lines)):
-            if lines[i] is not self.lines[i]:
-                self.saved_lines[self.version] = list(self.lines)
-                return
+        # check if lines have changed. Snapshots share their structure with
+        # each other, so any change results in a different snapshot
+        snapshot = self.lines.snapshot()
+        if snapshot is not self.get_lines_from_version(self.version):
+            self.saved_lines[self.version] = snapshot
 
     def get_lines_from_version(self, version):
         version = self.version
         while True:
             if version == -1:
-                return []
+                return None
             try:
                 l = self.saved_lines[version]
                 break
@@ -1029,13 +1098,13 @@ class TreeManager(object):
                 break
             except KeyError:
                 version -= 1
-        self.lines = list(l) # copy, otherwise saved list will be mutated
+        self.lines.load(l)
 
     def save_parsers(self):
         self.saved_parsers[self.version] = list(self.parsers)
 
     def load_parsers(self):
-        self.parsers = list(self.saved_parsers[self.version])
+        self.parsers = list(find_version(self.saved_parsers, self.version))
 
     def save(self, postparse=False):
         """Recursive version of save used to calculate textlength on the fly"""
@@ -1046,22 +1115,31 @@ class TreeManager(object):
             parser = l[0]
             parser.save_status(self.version)
             root = parser.previous_version.parent
-            root.save(self.version)
+            self.history_bytes += root.save(self.version)
             bos = root.children[0]
-            bos.save(self.version)
+            self.history_bytes += bos.save(self.version)
             eos = root.children[-1]
-            eos.save(self.version)
+            self.history_bytes += eos.save(self.version)
             self.save_and_textlen_rec(root, postparse)
+        self.update_lbox_lengths()
+        if self.changed_nodes is not None and len(self.changed_nodes) > self.MAX_CHANGED_NODES:
+            self.changed_nodes = None
+        if self.changed_terminals is not None and len(self.changed_terminals) > self.MAX_CHANGED_TERMINALS:
+            self.changed_terminals = None
 
     def save_and_textlen_rec(self, node, postparse):
         if node.has_changes() or node.new:
+            if node.alternate is not None and self.changed_nodes is not None:
+                self.changed_nodes.add(node)
+            if self.changed_terminals is not None:
+                self.remember_changed_terminals(node)
             if postparse:
                 node.changed = False
                 node.nested_changes = False
             for c in node.children:
                 self.save_and_textlen_rec(c, postparse)
             node.calc_textlength()
-            node.save(self.version)
+            self.history_bytes += node.save(self.version)
             # Make sure that all nodes are always marked as non-existent before
             # a new parse. This way only parsed subtrees are marked as exists,
             # and we avoid retaining not yet parsed subtrees. However, not yet
@@ -1070,6 +1148,27 @@ class TreeManager(object):
             # previous_version in pass1 this can happen.
             node.exists = False
 
+    def remember_changed_terminals(self, node):
+        """Adds `node` and its children to `changed_terminals` if their
+        highlighting might have changed since they were last saved, i.e. their
+        text, lookup or the symbol of their parent."""
+        for c in [node] + node.children:
+            if type(c.symbol) is Nonterminal:
+                continue
+            _, snapshot = c.log.find(c.version)
+            if snapshot is None or c.parent is None or snapshot[PARENT] is None or \
+                    snapshot[SYMBOL_NAME] != c.symbol.name or snapshot[LOOKUP] != c.lookup or \
+                    snapshot[PARENT].symbol.name != c.parent.symbol.name:
+                self.changed_terminals.add(c)
+
+    def calc_textlength_rec(self, node):
+        """Same as `save_and_textlen_rec` without saving the nodes."""
+        if node.has_changes() or node.new:
+            for c in node.children:
+                self.calc_textlength_rec(c)
+            node.calc_textlength()
+            node.exists = False
+
     def key_home(self, shift=False):
         self.log_input("key_home", str(shift))
         self.unselect()
@@ -1257,6 +1356,7 @@ class TreeManager(object):
             node.plain_mode = False
 
     def key_cursors(self, key, shift=False):
+        from utils import arrow_keys
         self.log_input("key_cursors", arrow_keys[key.key], str(shift))
         self.edit_rightnode = False
 
@@ -1312,6 +1412,7 @@ class TreeManager(object):
             self.cursor_movement(key)
 
     def ctrl_cursor(self, key, shift=False):
+        from utils import arrow_keys
         self.log_input("key_escape", arrow_keys[key.key])
 
         if shift and not self.hasSelection():
@@ -1897,15 +1998,21 @@ class TreeManager(object):
         lexer = self.parsers[0][1]
         # lex text into tokens
         bos = parser.previous_version.parent.children[0]
+        # A file imported into an empty document doesn't need the
+        # incremental machinery. Lexing and parsing it in bulk results in the
+        # same tree, unless it contains errors.
+        bulk = len(self.parsers) == 1 and type(bos.next_term) is EOS
         new = TextNode(Terminal(text))
         bos.insert_after(new)
         new.changed = True
-        self.relex(new)
+        if not (bulk and self.relex_import(new)):
+            self.relex(new)
         self.rescan_linebreaks(0)
         im = self.parsers[0][4]
         if im:
             im.repair_full()
-        self.reparse(bos)
+        if not (bulk and self.reparse_import(parser)):
+            self.reparse(bos)
         self.undo_snapshot()
         self.changed = True
         self.reparse(bos)
@@ -1927,8 +2034,7 @@ class TreeManager(object):
         def x():
             return bos
         self.get_bos = x
-        self.lines.append(X())
-        self.lines[0].node = bos
+        self.lines.append(Line(bos))
         return self.export(path, source=source)
 
     def load_file(self, language_boxes, reparse=True):
@@ -1972,7 +2078,7 @@ class TreeManager(object):
             print("Grammar Error: could not determine grammar type")
             return
 
-    def export(self, path=None, run=False, profile=False, source=None, debug=False):
+    def export(self, path=None, run=False, profile=False, source=None, debug=False, sourcemap=None):
         for p, _, _, _, _ in self.parsers:
             if p.last_status == False:
                 print("Cannot export a syntactically incorrect grammar")
@@ -1986,22 +2092,26 @@ class TreeManager(object):
             self.export_unipycation(path)
             return True
         elif lang == "HTML + Python + SQL":
-            self.export_html_python_sql(path)
+            self.export_html_python_sql(path, sourcemap)
             return True
         elif lang == "PHP + Python" or lang == "PHP":
-            return self.export_php_python(path, run, source=source)
+            return self.export_php_python(path, run, source=source, sourcemap=sourcemap)
         elif lang == "Python 2.7.5":
             return CPythonExporter(self).export(path=path, run=run, profile=profile, debug=debug)
         elif lang == "SimpleLanguage":
+            from export.simple_language import SimpleLanguageExporter
             return SimpleLanguageExporter(self).export(path=path, run=run)
         elif lang == "Ruby":
-            return JRubyExporter(self).export(path=path, run=run, profile=profile)
+            from export.jruby import JRubyExporter
+            return JRubyExporter(self, sourcemap).export(path=path, run=run, profile=profile)
         elif lang == "Ruby + SimpleLanguage":
-            return JRubySimpleLanguageExporter(self).export(path=path, run=run, profile=profile)
+            from export.jruby_simple_language import JRubySimpleLanguageExporter
+            return JRubySimpleLanguageExporter(self, sourcemap).export(path=path, run=run, profile=profile)
         elif lang == "Ruby + JavaScript":
-            return JRubyJavaScriptExporter(self).export(path=path, run=run, profile=profile)
+            from export.jruby_javascript import JRubyJavaScriptExporter
+            return JRubyJavaScriptExporter(self, sourcemap).export(path=path, run=run, profile=profile)
         else:
-            return self.export_as_text(path)
+            return self.export_as_text(path, sourcemap)
 
     def export_unipycation(self, path=None):
         import subprocess, sys
@@ -2036,6 +2146,7 @@ class TreeManager(object):
             os.write(f[0],"".join(output))
             os.close(f[0])
 
+            from PyQt5.QtCore import QSettings
             settings = QSettings("softdev", "Eco")
             unipath = str(settings.value("env_unipycation", "").toString())
             if unipath:
@@ -2043,11 +2154,11 @@ class TreeManager(object):
             else:
                 raise ExecutionError("Unipycation executable not set")
 
-    def export_html_python_sql(self, path):
+    def export_html_python_sql(self, path, sourcemap=None):
         with open(path, "w") as f:
-            f.write(HTMLPythonSQL.export(self.get_bos()))
+            f.write(HTMLPythonSQL.export(self.get_bos(), sourcemap))
 
-    def export_php_python(self, path, run=False, source=None):
+    def export_php_python(self, path, run=False, source=None, sourcemap=None):
         if run:
             import tempfile
             import sys, subprocess
@@ -2058,7 +2169,8 @@ class TreeManager(object):
             else:
                 f = tempfile.mkstemp(dir=d)
             with open(f[0], "w") as fw:
-                fw.write(PHPPython.export(self.get_bos(), os.path.basename(source)))
+                fw.write(PHPPython.export(self.get_bos(), os.path.basename(source), sourcemap))
+            from PyQt5.QtCore import QSettings
             settings = QSettings("softdev", "Eco")
             prefixpath = settings.value("env_pypyprefix", "")
             pyhyppath = settings.value("env_pyhyp", "")
@@ -2075,36 +2187,21 @@ class TreeManager(object):
             with open(path, "w") as f:
                 if source:
                     source = os.path.basename(str(source))
-                text = PHPPython.export(self.get_bos(), source)
+                text = PHPPython.export(self.get_bos(), source, sourcemap)
                 f.write(text)
                 return text
 
-    def export_as_text(self, path=None):
-        node = self.lines[0].node # first node
-        text = []
-        while True:
-            node = node.next_term
-            if isinstance(node.symbol, IndentationTerminal):
-                continue
-            if isinstance(node, EOS):
-                lbnode = self.get_languagebox(node)
-                if lbnode:
-                    node = lbnode
-                    continue
-                else:
-                    break
-            if isinstance(node.symbol, MagicTerminal):
-                node = node.symbol.ast.children[0]
-                continue
-            if node.symbol.name == "\r":
-                text.append("\n")
-            else:
-                text.append(node.symbol.name)
+    def export_as_text(self, path=None, sourcemap=None):
+        """Returns the text of the program and writes it to `path`. If a
+        `SourceMap` is given, the text is mapped to the terminals it was
+        generated from."""
+        root = self.lines[0].node.parent
+        text = export_text(root, sourcemap)
 
         if path:
             with open(path, "w") as f:
-                f.write("".join(text))
-        return "".join(text)
+                f.write(text)
+        return text
 
     def export_aterms(self, path):
         start = self.get_bos().parent
@@ -2127,12 +2224,51 @@ class TreeManager(object):
             #XXX show LexingError message somwhere in the UI
             return True
 
+    def relex_import(self, node):
+        self.cursor.store_last_x()
+        lexer = self.get_lexer(node.get_root())
+        if not hasattr(lexer, "relex_import"):
+            return False
+        with stats.timer("relex"):
+            if not lexer.relex_import(node):
+                return False
+        if stats.current:
+            stats.current.count("relexed_nodes", len(lexer.relexed))
+        return True
+
     def relex_node(self, node):
         # XXX start from top, only relex former lexingerror nodes
         # if there are changes within their lookahead
         root = node.get_root()
         lexer = self.get_lexer(root)
-        return lexer.relex(node)
+        with stats.timer("relex"):
+            result = lexer.relex(node)
+        if stats.current:
+            stats.current.count("relexed_nodes", len(getattr(lexer, "relexed", ())))
+        return result
+
+    def reparse_import(self, parser):
+        """Parses a freshly imported file from scratch. Apart from not saving
+        the unparsed tree, this is equivalent to `reparse`. Returns False if
+        the file contains syntax errors, which `reparse` needs to handle."""
+        if not hasattr(parser, "batch_parse"):
+            return False
+        self.calc_textlength_rec(parser.previous_version.parent)
+        self.changed_terminals = None
+        with stats.timer("inc_parse"):
+            if not parser.batch_parse():
+                return False
+        # `reparse` would have saved the tree before parsing it
+        self.global_version += 1
+        self.previous_version = parser.prev_version = self.global_version
+        parser.reference_version = self.reference_version
+        parser.option_autolbox_find = self.option_autolbox_find
+        self.save_current_version(postparse=True)
+        self.reference_version = self.version
+        TreeManager.version = self.version
+        if stats.current:
+            stats.current.end_edit()
+        return True
 
     def reparse(self, node, changed=True, skipautolbox=False):
         if self.version < self.global_version:
@@ -2155,8 +2291,10 @@ class TreeManager(object):
             parser.prev_version = self.version
             parser.reference_version = self.reference_version
             parser.option_autolbox_find = self.option_autolbox_find
-            parser.inc_parse()
-            parser.top_down_reuse()
+            with stats.timer("inc_parse"):
+                parser.inc_parse()
+            with stats.timer("top_down_reuse"):
+                parser.top_down_reuse()
             self.save_current_version(postparse=True) # save post parse tree
             if parser.last_status == True:
                 self.reference_version = self.version
@@ -2167,9 +2305,13 @@ class TreeManager(object):
         TreeManager.version = self.version
 
         # Now check for auto language boxes
-        if self.skipautolbox or skipautolbox or self.option_autolbox_insert is False:
-            return
+        if not (self.skipautolbox or skipautolbox or self.option_autolbox_insert is False):
+            with stats.timer("autolbox"):
+                self.apply_autolboxes()
+        if stats.current:
+            stats.current.end_edit()
 
+    def apply_autolboxes(self):
         parsers = list(self.parsers) # copy to avoid processing newly added parsers
         for temp in parsers:
             # remove language boxes that are not valid anymore
@@ -2283,8 +2425,8 @@ class TreeManager(object):
         return result
 
     def delete_version(self, version, node):
-        if ("parent", version) in node.log:
-            children = node.log["children", version]
+        if node.log.contains(version):
+            children = node.log.get("children", version)
             node.delete_version(version)
             for c in children:
                 self.delete_version(version, c)
@@ -2295,12 +2437,14 @@ class TreeManager(object):
             # undo_snapshot is called without any changes)
             return
         self.undo_snapshots.append(self.version)
+        self.limit_history()
 
     def save_current_version(self, postparse=False):
         self.log_input("save_current_version")
         self.global_version += 1
         self.version = self.global_version
-        self.save(postparse=postparse)
+        with stats.timer("save"):
+            self.save(postparse=postparse)
         TreeManager.version = self.version
 
     def full_reparse(self):
@@ -2310,6 +2454,8 @@ class TreeManager(object):
             p[0].reparse()
 
     def apply_inputlog(self, inputlog):
+        # input logs refer to keys by these names
+        from utils import KEY_UP, KEY_DOWN, KEY_LEFT, KEY_RIGHT
         for l in inputlog.split("\n"):
             l = l.replace("\r", "\\r")
             if l.startswith("#"):
@@ -2322,5 +2468,119 @@ class TreeManager(object):
     def get_langdef_from_string(self, lang):
         return lang_dict[lang]
 
+    # ============================ HISTORY ============================= #
+
+    def limit_history(self):
+        """Compacts the undo history if it exceeds the limits set in
+        `config.UNDO_MAX_SNAPSHOTS` and `config.UNDO_MAX_BYTES`. As compacting
+        walks the entire history, the limits may be exceeded by a quarter
+        before the history is cut back to them."""
+        if self.version != self.global_version:
+            # don't compact while there are versions that can be redone
+            return
+        n = len(self.undo_snapshots)
+        keep = None
+        max_snapshots = config.UNDO_MAX_SNAPSHOTS
+        if max_snapshots is not None and n > max_snapshots + max_snapshots // 4:
+            keep = max_snapshots
+        max_bytes = config.UNDO_MAX_BYTES
+        if max_bytes is not None and \
+                self.history_bytes > max(max_bytes, self.history_base) + max_bytes // 4:
+            # estimate how many snapshots fit into the limit
+            fit = n * max_bytes // self.history_bytes
+            keep = fit if keep is None else min(keep, fit)
+        elif keep is None:
+            return
+        self.compact_history(max(keep, 1))
+
+    def compact_history(self, keep=None):
+        """Drops all but the newest `keep` undo snapshots (all are kept if
+        `keep` is None) and merges the versions in between into the snapshot
+        following them, so that only the snapshots can be restored afterwards.
+        Versions before the oldest snapshot that is kept can't be undone
+        anymore and are removed from the node histories, lines and parser
+        states. The current version must be the latest version."""
+        limit = self.version
+        snapshots = [v for v in self.undo_snapshots if self.min_version <= v <= limit]
+        if keep is not None and len(snapshots) > keep:
+            snapshots = snapshots[len(snapshots) - keep:]
+            self.min_version = snapshots[0]
+        self.undo_snapshots = [v for v in self.undo_snapshots if v >= self.min_version]
+
+        # versions the parsers still refer to need to be kept as well
+        versions = set(snapshots)
+        versions.update([self.min_version, limit, self.reference_version,
+                         getattr(self, "previous_version", None)])
+        for parser in self.get_history_parsers():
+            versions.add(getattr(parser, "prev_version", None))
+            versions.add(getattr(parser, "reference_version", None))
+        keep = sorted(v for v in versions if v is not None and self.min_version <= v <= limit)
+
+        for node in self.get_history_nodes():
+            node.log.compact(keep, limit)
+            if node.log and node.version <= limit:
+                node.version = keep[bisect_left(keep, node.version)]
+        compact = lambda log: log.__class__(compact_versions(sorted(log.items()), keep, limit))
+        self.saved_lines = compact(self.saved_lines)
+        self.saved_parsers = compact(self.saved_parsers)
+        self.cursor.log = compact(self.cursor.log)
+        for parser in self.get_history_parsers():
+            if hasattr(parser, "status_by_version"):
+                parser.status_by_version = compact(parser.status_by_version)
+                parser.errornodes_by_version = compact(parser.errornodes_by_version)
+        self.history_base = self.measure_history()
+
+    def get_history_parsers(self):
+        """Returns the parsers used in any version of the history."""
+        parsers = {}
+        for l in [self.parsers] + list(self.saved_parsers.values()):
+            for p in l:
+                parsers[id(p[0])] = p[0]
+        return list(parsers.values())
+
+    def get_history_nodes(self):
+        """Iterates over all nodes that are part of any version of the
+        history. The children of a node are looked up after it has been
+        returned, so a node's history can be modified while iterating."""
+        seen = set()
+        todo = [p.previous_version.parent for p in self.get_history_parsers()]
+        while todo:
+            node = todo.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            yield node
+            todo.extend(node.children)
+            for children in node.log.children():
+                if id(children) not in seen:
+                    seen.add(id(children))
+                    todo.extend(children)
+
+    def measure_history(self):
+        """Returns the approximate number of bytes used by the undo history,
+        i.e. the saved versions of all nodes, lines, cursor positions and
+        parser states. Walks the entire history and updates the estimate in
+        `history_bytes`, which otherwise only grows with each save."""
+        seen = set()
+        size = 0
+        for node in self.get_history_nodes():
+            size += node.log.sizeof(seen)
+        size += sys.getsizeof(self.saved_lines)
+        for snapshot in self.saved_lines.values():
+            size += snapshot_size(snapshot, seen)
+        size += sys.getsizeof(self.saved_parsers) + sys.getsizeof(self.cursor.log)
+        for l in self.saved_parsers.values():
+            size += sys.getsizeof(l)
+        for entry in self.cursor.log.values():
+            size += sys.getsizeof(entry)
+        for parser in self.get_history_parsers():
+            if hasattr(parser, "status_by_version"):
+                size += sys.getsizeof(parser.status_by_version)
+                size += sys.getsizeof(parser.errornodes_by_version)
+                for errors in parser.errornodes_by_version.values():
+                    size += sys.getsizeof(errors)
+        self.history_bytes = size
+        return size
+
 class ExecutionError(Exception):
   pass
@@ -126,7 +126,10 @@ class Viewer(object):
 
         children = node.children
         if node.symbol.name == "Root":
-            children = node.log[("children", version)]
+            try:
+                children = node.get_attr("children", version)
+            except AttributeError:
+                pass
         for c in children:
             key = ""
             if isinstance(node, AstNode):